@@ -13,11 +13,13 @@ from flask import Flask, render_template, request, redirect, url_for, jsonify
 import stripe
 from dotenv import load_dotenv
 from utils.db import get_db_connection
+from utils.logging_config import configure_logging
 from services.spreadsheet_content_service import spreadsheet_content_service
 
 load_dotenv()
 
-# ロガーの設定
+# ロガーの設定（出力はキュー経由、レベルは LOG_LEVEL / LOG_LEVELS）
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Stripe設定
@@ -112,6 +114,14 @@ try:
 except Exception as e:
     logger.error(f"❌ Blueprint登録エラー: {e}")
 
+# リクエスト単位のSQL計測（クエリ数・時間・スローログ）
+from utils import db_metrics
+db_metrics.init_app(app)
+
+# Blueprintごとのステートメントタイムアウト（webhook / admin / batch）
+from utils import statement_timeout
+statement_timeout.init_app(app)
+
 # データベース初期化
 try:
     from app_database import init_db
@@ -120,6 +130,10 @@ try:
 except Exception as e:
     logger.error(f"❌ データベース初期化エラー: {e}")
 
+# Webhook受信箱の回収スイープ（前回の停止で残ったイベントを起動直後から取り戻す）
+from utils.webhook_inbox import webhook_inbox
+webhook_inbox.start_sweeper()
+
 # 基本的なルート
 @app.route('/')
 def root_redirect_to_main():
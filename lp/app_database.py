@@ -1,174 +1,216 @@
 import os
 import logging
-from utils.db import get_db_connection
+from utils.migrations import Migration, IndexMigration, ColumnMigration, run_migrations
+from utils.idempotency import create_processed_events_table
+from utils.webhook_inbox import create_webhook_inbox_table
+from utils.outbound_queue import create_line_push_dead_letters_table
+from utils.reply_token_ledger import create_used_reply_tokens_table
 
 logger = logging.getLogger(__name__)
 
-def init_db():
-    """データベースの初期化（企業ユーザー専用最小限設計）"""
-    logger.info("🔄 データベース初期化開始")
-    conn = None
-    c = None
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
+
+def _create_base_tables(c, dialect):
+    """基本テーブルの作成（企業ユーザー専用最小限設計）"""
+    db_type = dialect.name
+
+    if db_type == 'postgresql':
+        # 企業基本情報テーブル（最小限）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS companies (
+                id SERIAL PRIMARY KEY,
+                company_name VARCHAR(255) NOT NULL,
+                email VARCHAR(255) NOT NULL,
+                status VARCHAR(50) DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 月額基本サブスクリプション管理テーブル（企業単位）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS company_monthly_subscriptions (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                stripe_subscription_id VARCHAR(255),
+                subscription_status VARCHAR(50) DEFAULT 'active',
+                monthly_base_price INTEGER DEFAULT 3900,
+                current_period_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                current_period_end TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
+        
+        # 企業コンテンツ管理テーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS company_contents (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                content_name VARCHAR(255) NOT NULL,
+                content_type VARCHAR(100) NOT NULL,
+                status VARCHAR(50) DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
+        
+        # 企業LINEアカウント管理テーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS company_line_accounts (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                line_channel_id VARCHAR(255) UNIQUE,
+                line_channel_secret VARCHAR(255),
+                line_channel_access_token VARCHAR(255),
+                line_user_id VARCHAR(255),
+                line_display_name VARCHAR(255),
+                line_picture_url TEXT,
+                status VARCHAR(50) DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
+        
+        # 企業通知管理テーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS company_notifications (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                notification_type VARCHAR(100) NOT NULL,
+                notification_status VARCHAR(50) DEFAULT 'active',
+                notification_settings JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
+        
+        # 企業解約管理テーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS company_cancellations (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                content_type VARCHAR(100),
+                cancellation_reason TEXT,
+                cancellation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
         
-        # データベースタイプを確認
-        from utils.db import get_db_type
-        db_type = get_db_type()
+        # サブスクリプション期間管理テーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS subscription_periods (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                stripe_subscription_id VARCHAR(255),
+                period_start TIMESTAMP NOT NULL,
+                period_end TIMESTAMP NOT NULL,
+                status VARCHAR(50) DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
         
-        if db_type == 'postgresql':
-            # 企業基本情報テーブル（最小限）
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS companies (
-                    id SERIAL PRIMARY KEY,
-                    company_name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255) NOT NULL,
-                    status VARCHAR(50) DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 月額基本サブスクリプション管理テーブル（企業単位）
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS company_monthly_subscriptions (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    stripe_subscription_id VARCHAR(255),
-                    subscription_status VARCHAR(50) DEFAULT 'active',
-                    monthly_base_price INTEGER DEFAULT 3900,
-                    current_period_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    current_period_end TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # 企業コンテンツ管理テーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS company_contents (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    content_name VARCHAR(255) NOT NULL,
-                    content_type VARCHAR(100) NOT NULL,
-                    status VARCHAR(50) DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # 企業LINEアカウント管理テーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS company_line_accounts (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    line_channel_id VARCHAR(255) UNIQUE,
-                    line_channel_secret VARCHAR(255),
-                    line_channel_access_token VARCHAR(255),
-                    line_user_id VARCHAR(255),
-                    line_display_name VARCHAR(255),
-                    line_picture_url TEXT,
-                    status VARCHAR(50) DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # 企業通知管理テーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS company_notifications (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    notification_type VARCHAR(100) NOT NULL,
-                    notification_status VARCHAR(50) DEFAULT 'active',
-                    notification_settings JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # 企業解約管理テーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS company_cancellations (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    content_type VARCHAR(100),
-                    cancellation_reason TEXT,
-                    cancellation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # サブスクリプション期間管理テーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS subscription_periods (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    stripe_subscription_id VARCHAR(255),
-                    period_start TIMESTAMP NOT NULL,
-                    period_end TIMESTAMP NOT NULL,
-                    status VARCHAR(50) DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # 使用量ログテーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS usage_logs (
-                    id SERIAL PRIMARY KEY,
-                    company_id INTEGER NOT NULL,
-                    content_type VARCHAR(100),
-                    usage_count INTEGER DEFAULT 0,
-                    usage_date DATE DEFAULT CURRENT_DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (company_id) REFERENCES companies(id)
-                )
-            ''')
-            
-            # ユーザー状態管理テーブル
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS user_states (
-                    id SERIAL PRIMARY KEY,
-                    line_user_id VARCHAR(255) UNIQUE,
-                    state VARCHAR(100) DEFAULT 'initial',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            logger.info("✅ PostgreSQLテーブル作成完了")
-            
-        else:
-            # SQLite用のテーブル作成
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS companies (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    company_name TEXT NOT NULL,
-                    email TEXT NOT NULL,
-                    status TEXT DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # その他のSQLiteテーブルも同様に作成
-            # ... (省略)
-            
-            conn.commit()
-            logger.info("✅ SQLiteテーブル作成完了")
+        # 使用量ログテーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS usage_logs (
+                id SERIAL PRIMARY KEY,
+                company_id INTEGER NOT NULL,
+                content_type VARCHAR(100),
+                usage_count INTEGER DEFAULT 0,
+                usage_date DATE DEFAULT CURRENT_DATE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (company_id) REFERENCES companies(id)
+            )
+        ''')
         
-        conn.close()
-        logger.info("✅ データベース初期化完了")
+        # ユーザー状態管理テーブル
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS user_states (
+                id SERIAL PRIMARY KEY,
+                line_user_id VARCHAR(255) UNIQUE,
+                state VARCHAR(100) DEFAULT 'initial',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         
+        logger.info("✅ PostgreSQLテーブル作成完了")
+        
+    else:
+        # SQLite用のテーブル作成
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS companies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                status TEXT DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # その他のSQLiteテーブルも同様に作成
+        # ... (省略)
+        
+        logger.info("✅ SQLiteテーブル作成完了")
+
+
+# schema_migrationsで適用済みを管理するため、起動時に再実行されるのは未適用分のみ
+MIGRATIONS = [
+    Migration('0001', 'create base tables', _create_base_tables),
+    # LINEメッセージ毎の企業特定（get_company_info）
+    IndexMigration('0002', 'idx_companies_line_user_id', 'companies', ('line_user_id',)),
+    # メールアドレス連携
+    IndexMigration('0003', 'idx_companies_email', 'companies', ('email',)),
+    IndexMigration('0004', 'idx_company_monthly_subscriptions_company_id',
+                   'company_monthly_subscriptions', ('company_id',)),
+    IndexMigration('0005', 'idx_company_contents_company_status',
+                   'company_contents', ('company_id', 'status')),
+    IndexMigration('0006', 'idx_company_payments_stripe_customer_id',
+                   'company_payments', ('stripe_customer_id',)),
+    IndexMigration('0007', 'idx_login_attempts_user_attempted',
+                   'login_attempts', ('user_id', 'attempted_at')),
+    IndexMigration('0008', 'idx_audit_logs_created_at', 'audit_logs', ('created_at',)),
+    # handle_follow_event の未紐付け企業検索（line_user_id IS NULL ORDER BY created_at DESC）
+    IndexMigration('0009', 'idx_companies_unlinked_created_at', 'companies',
+                   ('created_at DESC',), where='line_user_id IS NULL', requires=('line_user_id',)),
+    # Webhook再送の重複排除（webhookEventId）と保持期間切れの削除
+    Migration('0010', 'create processed_webhook_events', create_processed_events_table),
+    IndexMigration('0011', 'idx_processed_webhook_events_received_at',
+                   'processed_webhook_events', ('received_at',)),
+    # Webhook受信箱（クラッシュ後の回収スイープ・リプレイの範囲検索）
+    Migration('0012', 'create webhook_inbox', create_webhook_inbox_table),
+    IndexMigration('0013', 'idx_webhook_inbox_status_received_at', 'webhook_inbox', ('status', 'received_at')),
+    IndexMigration('0014', 'idx_webhook_inbox_received_at', 'webhook_inbox', ('received_at',)),
+    # 会話状態の付随データ（add_confirm の選択番号など）
+    ColumnMigration('0015', 'user_states', 'state_data', 'TEXT'),
+    # LINEプッシュ送信キューのデッドレター（未再送の一覧・再送）
+    Migration('0016', 'create line_push_dead_letters', create_line_push_dead_letters_table),
+    IndexMigration('0017', 'idx_line_push_dead_letters_requeued_id',
+                   'line_push_dead_letters', ('requeued_at', 'id')),
+    # 返信トークンの使用済み台帳（全ワーカー共通）と期限切れバケットの削除
+    Migration('0018', 'create used_reply_tokens', create_used_reply_tokens_table),
+    IndexMigration('0019', 'idx_used_reply_tokens_bucket', 'used_reply_tokens', ('bucket',)),
+    # リマインダーの送信済み判定（企業・通知タイプ・期日ごとに1回）
+    ColumnMigration('0020', 'company_notifications', 'due_at', 'TIMESTAMP'),
+    IndexMigration('0021', 'idx_company_notifications_company_type_due',
+                   'company_notifications', ('company_id', 'notification_type', 'due_at')),
+]
+
+
+def init_db():
+    """データベースの初期化（未適用のマイグレーションのみ実行）"""
+    logger.info("🔄 データベース初期化開始")
+    try:
+        result = run_migrations(MIGRATIONS)
+        logger.info(
+            "✅ データベース初期化完了（適用: %s, 適用済み: %d, 保留: %s）",
+            result['applied'], result['skipped'], result['pending']
+        )
+        return result
     except Exception as e:
         logger.error(f"❌ データベース初期化エラー: {e}")
-        if conn:
-            conn.rollback()
-            conn.close()
         raise e
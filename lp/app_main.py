@@ -91,6 +91,10 @@ try:
 except Exception as e:
     logger.error(f"❌ データベース初期化エラー: {e}")
 
+# Webhook受信箱の回収スイープ（前回の停止で残ったイベントを起動直後から取り戻す）
+from utils.webhook_inbox import webhook_inbox
+webhook_inbox.start_sweeper()
+
 # 基本的なルート
 @app.route('/')
 def health_check_root():
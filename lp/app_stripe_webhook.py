@@ -7,6 +7,7 @@ import base64
 from flask import request, jsonify
 from utils.db import get_db_connection
 from app_company_registration import upsert_company_profile_with_subscription
+from utils.identity_cache import invalidate_company, invalidate_subscription
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,7 @@ def handle_company_subscription_cancelled(event):
             SET subscription_status = 'cancelled', updated_at = CURRENT_TIMESTAMP
             WHERE stripe_subscription_id = %s
         ''', (subscription_id,))
+        invalidate_subscription(subscription_id, c)
         
         # 企業の状態も更新
         c.execute('''
@@ -64,6 +66,7 @@ def handle_company_payment_failed(event):
             SET subscription_status = 'past_due', updated_at = CURRENT_TIMESTAMP
             WHERE stripe_subscription_id = %s
         ''', (subscription_id,))
+        invalidate_subscription(subscription_id, c)
         
         conn.commit()
         conn.close()
@@ -106,6 +109,7 @@ def handle_company_payment_succeeded(event):
             SET subscription_status = %s, current_period_start = %s, current_period_end = %s, updated_at = CURRENT_TIMESTAMP
             WHERE stripe_subscription_id = %s
         ''', (status, start_dt, end_dt, subscription_id))
+        invalidate_subscription(subscription_id, c)
         
         conn.commit()
         conn.close()
@@ -156,6 +160,7 @@ def process_stripe_webhook(event):
                     company_name, email, subscription_id
                 )
                 
+                invalidate_company(company_id)
                 logger.info(f"✅ 企業登録完了: {company_id}")
             
         elif event_type == 'customer.subscription.deleted':
@@ -0,0 +1,3 @@
+"""
+LINE Webhookのオフライン負荷試験（lp/scripts/loadtest_line_webhook.py から実行）
+"""
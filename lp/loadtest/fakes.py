@@ -0,0 +1,292 @@
+"""
+外部サービス（LINE Messaging API・Stripe・Google Sheets）のローカル代替
+
+requests のアダプター解決（Session.get_adapter）を差し替え、api.line.me と
+api.stripe.com 宛てのリクエストをプロセス内の偽サーバーで応答する。
+stripe SDK・gspread も requests を使うため同じ経路で捕捉できる。
+それ以外のホスト宛ては接続エラーにして、試験中に外部へ通信しないことを保証する。
+
+Google Sheets は spreadsheet_content_service のクライアント取得を偽の
+gspread クライアントに差し替え、シートの行をそのまま返す。
+"""
+
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+def _response(request, status, payload=None, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = 'OK' if status < 400 else 'Error'
+    response._content = json.dumps(payload if payload is not None else {}, ensure_ascii=False).encode('utf-8')
+    response.headers = CaseInsensitiveDict({'Content-Type': 'application/json'})
+    if headers:
+        response.headers.update(headers)
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def _json_body(request):
+    if not request.body:
+        return {}
+    body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {key: values[-1] for key, values in parse_qs(body).items()}
+
+
+class FakeLineAPI:
+    """LINE Messaging API（返信・プッシュ・マルチキャスト・プロフィール取得）"""
+
+    host = 'api.line.me'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.messages = Counter()
+        self.reply_tokens = set()
+        self.errors = Counter()
+
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        path = urlsplit(request.url).path
+        if not request.headers.get('Authorization', '').startswith('Bearer '):
+            return self._error(request, path, 401, 'Authentication failed')
+
+        if request.method == 'GET' and path.startswith('/v2/bot/profile/'):
+            user_id = path.rsplit('/', 1)[-1]
+            self._count(path, 0)
+            return _response(request, 200, {'userId': user_id, 'displayName': f'loadtest {user_id[-6:]}'})
+
+        if request.method == 'POST' and path.startswith('/v2/bot/message/'):
+            body = _json_body(request)
+            messages = body.get('messages') or []
+            if not 1 <= len(messages) <= 5:
+                return self._error(request, path, 400, 'The number of messages must be between 1 and 5')
+            if path.endswith('/reply'):
+                token = body.get('replyToken')
+                with self._lock:
+                    # 返信トークンは1回しか使えない
+                    if token in self.reply_tokens:
+                        self.errors['reused_reply_token'] += 1
+                        return _response(request, 400, {'message': 'Invalid reply token'})
+                    self.reply_tokens.add(token)
+            self._count(path, len(messages))
+            return _response(request, 200, {'sentMessages': [{'id': str(i)} for i in range(len(messages))]})
+
+        return self._error(request, path, 404, 'Not found')
+
+    def _count(self, path, message_count):
+        with self._lock:
+            self.calls[path if not path.startswith('/v2/bot/profile/') else '/v2/bot/profile'] += 1
+            self.messages[path] += message_count
+
+    def _error(self, request, path, status, message):
+        with self._lock:
+            self.errors[f'{status} {path}'] += 1
+        return _response(request, status, {'message': message})
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'messages': dict(self.messages), 'errors': dict(self.errors)}
+
+
+class FakeStripeAPI:
+    """Stripe API（サブスクリプション・サブスクリプションアイテム・価格）
+
+    サブスクリプションは最初に参照された時点で有効な状態として作られ、
+    アイテムの追加・削除は以降の取得結果に反映される。
+    """
+
+    host = 'api.stripe.com'
+
+    _PATH_RE = re.compile(r'^/v1/(?P<resource>[a-z_]+)(?:/(?P<id>[^/]+))?$')
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._ids = Counter()
+        self.subscriptions = {}
+        self.calls = Counter()
+
+    def _next_id(self, prefix):
+        self._ids[prefix] += 1
+        return f'{prefix}_loadtest{self._ids[prefix]}'
+
+    def _subscription(self, subscription_id):
+        subscription = self.subscriptions.get(subscription_id)
+        if subscription is None:
+            now = int(time.time())
+            subscription = self.subscriptions[subscription_id] = {
+                'id': subscription_id,
+                'object': 'subscription',
+                'status': 'active',
+                'cancel_at_period_end': False,
+                'current_period_start': now,
+                'current_period_end': now + 30 * 86400,
+                'items': {'object': 'list', 'data': [], 'has_more': False,
+                          'url': f'/v1/subscription_items?subscription={subscription_id}'},
+            }
+            self._add_item(subscription, {'id': 'price_loadtest_base', 'object': 'price',
+                                          'nickname': '月額基本料金', 'unit_amount': 3900}, 1)
+        return subscription
+
+    def _add_item(self, subscription, price, quantity):
+        item = {'id': self._next_id('si'), 'object': 'subscription_item', 'price': price,
+                'quantity': quantity, 'subscription': subscription['id']}
+        subscription['items']['data'].append(item)
+        return item
+
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        match = self._PATH_RE.match(urlsplit(request.url).path)
+        if not match:
+            return _response(request, 404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL'}})
+        resource, object_id = match.group('resource'), match.group('id')
+        params = _json_body(request)
+        with self._lock:
+            self.calls[f'{request.method} /v1/{resource}'] += 1
+            payload = self._dispatch(request.method, resource, object_id, params)
+        if payload is None:
+            return _response(request, 404, {'error': {'type': 'invalid_request_error', 'message': 'No such object'}})
+        return _response(request, 200, payload)
+
+    def _dispatch(self, method, resource, object_id, params):
+        if resource == 'subscriptions' and object_id:
+            subscription = self._subscription(object_id)
+            if method == 'DELETE':
+                subscription['status'] = 'canceled'
+            elif method == 'POST' and params.get('cancel_at_period_end') is not None:
+                subscription['cancel_at_period_end'] = params['cancel_at_period_end'] in ('true', True)
+            return subscription
+        if resource == 'prices' and method == 'POST':
+            return {'id': self._next_id('price'), 'object': 'price', 'nickname': params.get('nickname'),
+                    'unit_amount': int(params.get('unit_amount') or 0), 'currency': params.get('currency', 'jpy')}
+        if resource == 'subscription_items':
+            if method == 'POST' and not object_id:
+                subscription = self._subscription(params.get('subscription'))
+                price = {'id': params.get('price'), 'object': 'price', 'nickname': '追加コンテンツ料金'}
+                return self._add_item(subscription, price, int(params.get('quantity') or 1))
+            if method == 'DELETE' and object_id:
+                for subscription in self.subscriptions.values():
+                    items = subscription['items']['data']
+                    subscription['items']['data'] = [item for item in items if item['id'] != object_id]
+                return {'id': object_id, 'object': 'subscription_item', 'deleted': True}
+        if method == 'GET' and object_id:
+            # 参照系は最低限の形だけ返す（請求書・顧客など）
+            return {'id': object_id, 'object': resource.rstrip('s')}
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'subscriptions': len(self.subscriptions)}
+
+
+class FakeWorksheet:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def get_all_values(self):
+        return [list(row) for row in self._rows]
+
+
+class FakeSheetsClient:
+    """gspread クライアントの代替（open_by_key → get_worksheet → get_all_values）"""
+
+    HEADER = ['id', 'name', 'description', 'url', 'price', 'status', 'created_at', 'features']
+
+    DEFAULT_ROWS = [
+        ['ai_schedule', 'AI予定秘書', 'スケジュール管理をAIがサポート', 'https://example.com/schedule', '1500', 'active',
+         '2024-01-01', 'スケジュール管理,会議調整'],
+        ['ai_accounting', 'AI経理秘書', '経理作業をAIが効率化', 'https://example.com/accounting', '1500', 'active',
+         '2024-01-01', '自動仕訳,帳簿作成'],
+        ['ai_task', 'AIタスクコンシェルジュ', 'タスク管理をAIが最適化', 'https://example.com/task', '1500', 'active',
+         '2024-01-01', 'タスク管理,進捗追跡'],
+    ]
+
+    def __init__(self, rows=None, latency=0.0):
+        self.rows = [self.HEADER] + list(rows or self.DEFAULT_ROWS)
+        self.latency = latency
+        self.fetches = 0
+
+    def open_by_key(self, key):
+        return self
+
+    def get_worksheet(self, index):
+        if self.latency:
+            time.sleep(self.latency)
+        self.fetches += 1
+        return FakeWorksheet(self.rows)
+
+    def stats(self):
+        return {'fetches': self.fetches}
+
+
+class OfflineTransport(BaseAdapter):
+    """ホスト名で偽サーバーへ振り分けるアダプター（未登録のホストは接続エラー）"""
+
+    def __init__(self, services):
+        super().__init__()
+        self.services = {service.host: service for service in services}
+        self.blocked = Counter()
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname
+        service = self.services.get(host)
+        if service is None:
+            with self._lock:
+                self.blocked[host] += 1
+            raise requests.exceptions.ConnectionError(f'offline load test: outbound request to {host} blocked',
+                                                      request=request)
+        return service.handle(request)
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def offline_services(line_latency=0.0, stripe_latency=0.0, sheet_rows=None):
+    """LINE・Stripe・Google Sheets を偽サーバーに差し替える
+
+    yield する辞書は 'line' / 'stripe' / 'sheets' / 'transport' を持つ。
+    """
+    from services.spreadsheet_content_service import spreadsheet_content_service
+
+    line = FakeLineAPI(line_latency)
+    stripe_api = FakeStripeAPI(stripe_latency)
+    sheets = FakeSheetsClient(sheet_rows)
+    transport = OfflineTransport([line, stripe_api])
+
+    original_get_adapter = requests.Session.get_adapter
+    saved_sheet_state = spreadsheet_content_service.__dict__.copy()
+
+    def get_adapter(session, url):
+        return transport
+
+    requests.Session.get_adapter = get_adapter
+    spreadsheet_content_service._get_google_sheets_client = lambda: sheets
+    spreadsheet_content_service.spreadsheet_id = 'loadtest-sheet'
+    spreadsheet_content_service.cached_contents = {}
+    spreadsheet_content_service.last_cache_update = 0
+    try:
+        yield {'line': line, 'stripe': stripe_api, 'sheets': sheets, 'transport': transport}
+    finally:
+        requests.Session.get_adapter = original_get_adapter
+        spreadsheet_content_service.__dict__.clear()
+        spreadsheet_content_service.__dict__.update(saved_sheet_state)
@@ -0,0 +1,132 @@
+"""
+負荷試験用のスキーマと初期データ
+
+LINE Webhookの処理が参照するテーブルを、本番のPostgreSQLと同じ列構成で作る
+（app_database のSQLite用の基本テーブルは最小限のため）。残りのテーブル
+（webhook_inbox など）はアプリ起動時の init_db() のマイグレーションで作られる。
+"""
+
+from datetime import datetime, timedelta
+
+from utils.dialect import get_dialect
+from loadtest.payloads import VirtualUser
+
+EMAIL_DOMAIN = 'loadtest.example'
+
+
+def _tables(dialect):
+    pk = 'SERIAL PRIMARY KEY' if dialect.name == 'postgresql' else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+    return [
+        f'''CREATE TABLE IF NOT EXISTS companies (
+            id {pk},
+            company_name TEXT NOT NULL,
+            company_code TEXT,
+            email TEXT NOT NULL,
+            line_user_id TEXT,
+            stripe_subscription_id TEXT,
+            status TEXT DEFAULT 'active',
+            trial_end TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        f'''CREATE TABLE IF NOT EXISTS company_monthly_subscriptions (
+            id {pk},
+            company_id INTEGER NOT NULL,
+            stripe_subscription_id TEXT,
+            subscription_status TEXT DEFAULT 'active',
+            monthly_base_price INTEGER DEFAULT 3900,
+            current_period_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            current_period_end TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        f'''CREATE TABLE IF NOT EXISTS company_contents (
+            id {pk},
+            company_id INTEGER NOT NULL,
+            content_name TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            status TEXT DEFAULT 'active',
+            current_period_end TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        f'''CREATE TABLE IF NOT EXISTS company_content_additions (
+            id {pk},
+            company_id INTEGER NOT NULL,
+            content_type TEXT,
+            additional_price INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        f'''CREATE TABLE IF NOT EXISTS company_subscriptions (
+            id {pk},
+            company_id INTEGER NOT NULL,
+            content_type TEXT,
+            subscription_status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        f'''CREATE TABLE IF NOT EXISTS company_line_accounts (
+            id {pk},
+            company_id INTEGER NOT NULL,
+            line_channel_id TEXT UNIQUE,
+            line_channel_secret TEXT,
+            line_channel_access_token TEXT,
+            line_user_id TEXT,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        f'''CREATE TABLE IF NOT EXISTS user_states (
+            id {pk},
+            line_user_id TEXT UNIQUE,
+            state TEXT DEFAULT 'initial',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    ]
+
+
+def create_schema(conn):
+    """LINE Webhookの処理に必要なテーブルを作成"""
+    dialect = get_dialect()
+    c = conn.cursor()
+    for ddl in _tables(dialect):
+        c.execute(ddl)
+    conn.commit()
+
+
+def ensure_empty(conn):
+    """企業データが無いことを確認（使い捨てのDB以外で実行しないため）"""
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM companies')
+    count = c.fetchone()[0]
+    if count:
+        raise RuntimeError(f'companies already has {count} rows; the load test needs a throwaway database')
+
+
+def seed_companies(conn, count, prefix='loadtest'):
+    """未紐付けの企業と有効な月額サブスクリプションを作り、仮想ユーザーを返す
+
+    LINEユーザーとの紐付けは onboarding シナリオ（友だち追加・メールアドレス送信）で行う。
+    """
+    dialect = get_dialect()
+    c = conn.cursor()
+    period_end = dialect.timestamp(datetime.utcnow() + timedelta(days=30))
+    users = []
+    for i in range(count):
+        email = f'{prefix}{i:05d}@{EMAIL_DOMAIN}'
+        c.execute(dialect.sql('''
+            INSERT INTO companies (company_name, company_code, email, status)
+            VALUES (%s, %s, %s, 'active')
+            RETURNING id
+        '''), (f'負荷試験企業{i:05d}', f'LT{i:05d}', email))
+        company_id = c.fetchone()[0]
+        c.execute(dialect.sql('''
+            INSERT INTO company_monthly_subscriptions
+            (company_id, stripe_subscription_id, subscription_status, current_period_end)
+            VALUES (%s, %s, 'active', %s)
+        '''), (company_id, f'sub_{prefix}{i:05d}', period_end))
+        # LINEのユーザーIDと同じ 'U' + 32桁の16進数
+        users.append(VirtualUser(i, f'U{i:032x}', email))
+    conn.commit()
+    return users
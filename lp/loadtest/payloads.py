@@ -0,0 +1,172 @@
+"""
+LINE Webhookの署名付きペイロード生成
+
+本番のLINEプラットフォームと同じ形式（webhookEventId・replyToken・
+deliveryContext付き）のイベントを作り、チャネルシークレットで
+X-Line-Signature を付ける。会話シナリオはユーザーごとのイベント列として
+組み立て、同じユーザーのイベントは順番に送る。
+"""
+
+import hmac
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import itertools
+
+# 1ユーザー分の会話の流れ（テキストは routes/line.py のコマンド・会話状態に対応）
+SCENARIOS = {
+    # 友だち追加 → 決済時のメールアドレスで企業と紐付け → メニュー
+    'onboarding': lambda user: [
+        ('follow', None),
+        ('text', user.email),
+        ('text', 'メニュー'),
+    ],
+    # 追加 → 番号選択 → はい
+    'add_content': lambda user: [
+        ('text', '追加'),
+        ('text', '1'),
+        ('text', 'はい'),
+    ],
+    'status': lambda user: [
+        ('text', '状態'),
+    ],
+    # 解約メニュー → コンテンツ解約 → 番号選択 → 確認
+    'cancel_content': lambda user: [
+        ('text', '解約'),
+        ('text', 'コンテンツ解約'),
+        ('text', '1'),
+        ('text', '解約確認_1'),
+    ],
+    'postbacks': lambda user: [
+        ('postback', 'action=check_status'),
+        ('postback', 'action=help'),
+        ('postback', 'action=share'),
+        ('postback', 'company_confirm_add_2'),
+    ],
+    'unknown_text': lambda user: [
+        ('text', 'こんにちは'),
+    ],
+}
+
+# onboarding 以降に選ぶシナリオの既定の比率
+DEFAULT_MIX = {
+    'add_content': 3,
+    'status': 3,
+    'cancel_content': 1,
+    'postbacks': 2,
+    'unknown_text': 1,
+}
+
+
+def sign_body(body, channel_secret):
+    """リクエストボディのHMAC-SHA256署名（X-Line-Signature の値）"""
+    digest = hmac.new(channel_secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+class VirtualUser:
+    """負荷試験の仮想ユーザー（LINEユーザーIDと紐付け先企業のメールアドレス）"""
+
+    __slots__ = ('index', 'line_user_id', 'email')
+
+    def __init__(self, index, line_user_id, email):
+        self.index = index
+        self.line_user_id = line_user_id
+        self.email = email
+
+
+class LinePayloadFactory:
+    """LINE Webhookイベントと署名付きリクエストの生成"""
+
+    def __init__(self, channel_secret, destination='Uloadtestbot'):
+        self.channel_secret = channel_secret
+        self.destination = destination
+        self._sequence = itertools.count(1)
+
+    def _base(self, event_type, user_id):
+        return {
+            'type': event_type,
+            'mode': 'active',
+            'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': user_id},
+            'webhookEventId': f'01LOADTEST{next(self._sequence):016d}',
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': uuid.uuid4().hex,
+        }
+
+    def follow(self, user_id):
+        event = self._base('follow', user_id)
+        event['follow'] = {'isUnblocked': False}
+        return event
+
+    def unfollow(self, user_id):
+        event = self._base('unfollow', user_id)
+        del event['replyToken']
+        return event
+
+    def text(self, user_id, text):
+        event = self._base('message', user_id)
+        event['message'] = {'type': 'text', 'id': str(next(self._sequence)), 'text': text}
+        return event
+
+    def postback(self, user_id, data):
+        event = self._base('postback', user_id)
+        event['postback'] = {'data': data}
+        return event
+
+    def event(self, user_id, kind, value=None):
+        if kind == 'follow':
+            return self.follow(user_id)
+        if kind == 'unfollow':
+            return self.unfollow(user_id)
+        if kind == 'text':
+            return self.text(user_id, value)
+        if kind == 'postback':
+            return self.postback(user_id, value)
+        raise ValueError(f'unknown event kind: {kind}')
+
+    def request(self, events):
+        """(body, headers) を返す（body はJSONのバイト列）"""
+        body = json.dumps({'destination': self.destination, 'events': events}, ensure_ascii=False).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Line-Signature': sign_body(body, self.channel_secret),
+        }
+        return body, headers
+
+
+def build_conversations(users, flows_per_user, mix=None, seed=0):
+    """ユーザーごとのイベント列 [(kind, value, scenario), ...] を作る
+
+    各ユーザーは onboarding の後に mix の比率で選んだシナリオを flows_per_user 回行う。
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f'unknown scenarios: {sorted(unknown)}')
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    conversations = []
+    for user in users:
+        steps = [(kind, value, 'onboarding') for kind, value in SCENARIOS['onboarding'](user)]
+        for name in rng.choices(names, weights=weights, k=flows_per_user):
+            steps.extend((kind, value, name) for kind, value in SCENARIOS[name](user))
+        conversations.append(steps)
+    return conversations
+
+
+def parse_mix(text):
+    """'add_content=3,status=1' 形式の比率指定を辞書に変換"""
+    mix = {}
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight) if weight else 1.0
+    return mix
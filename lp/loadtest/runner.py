@@ -0,0 +1,267 @@
+"""
+LINE Webhookの負荷試験の実行と集計
+
+署名付きのイベントを Flask のテストクライアントで /line/webhook へ送り、
+1イベントごとの応答時間とクエリ数（db_metrics の X-DB-Query-Count）を記録する。
+
+同期モード（既定、LINE_WEBHOOK_ASYNC=0）ではリクエスト内でイベントを処理するため、
+応答時間がそのままイベントの処理時間になる。非同期モードでは応答時間は受付までの
+時間で、処理時間とクエリ数はワーカープールの統計から取る。
+
+環境変数はアプリの読み込み時に参照されるため、1プロセスにつき1回だけ実行できる。
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import redirect_stdout, redirect_stderr, ExitStack
+from collections import defaultdict
+
+from loadtest.payloads import LinePayloadFactory, build_conversations
+from loadtest.fakes import offline_services
+
+LOADTEST_CHANNEL_SECRET = 'loadtest-channel-secret'
+
+# 試験中は外部の本番設定を使わないよう上書きする環境変数
+_ENVIRONMENT = {
+    'LINE_CHANNEL_SECRET': LOADTEST_CHANNEL_SECRET,
+    'LINE_CHANNEL_ACCESS_TOKEN': 'loadtest-channel-access-token',
+    'STRIPE_SECRET_KEY': 'sk_test_loadtest',
+    'CONTENT_SPREADSHEET_ID': 'loadtest-sheet',
+}
+
+
+def percentile(sorted_values, pct):
+    """昇順の値から分位点を取得（nearest-rank）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _latency_summary(latencies):
+    values = sorted(latencies)
+    return {
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def prepare_environment(database_url, async_mode=False):
+    """アプリ読み込み前に接続先と外部サービスの設定を差し替える"""
+    if 'app' in sys.modules:
+        raise RuntimeError('the load test must configure the environment before the app is imported')
+    os.environ.pop('RAILWAY_DATABASE_URL', None)
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['LINE_WEBHOOK_ASYNC'] = '1' if async_mode else '0'
+    os.environ.update(_ENVIRONMENT)
+
+
+class _Recorder:
+    """イベントごとの計測結果（シナリオ別にも集計）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.queries = []
+        self.http_errors = defaultdict(int)
+        self.scenarios = defaultdict(lambda: {'latencies': [], 'queries': []})
+
+    def add(self, scenario, latency, queries, status):
+        with self._lock:
+            self.latencies.append(latency)
+            self.queries.append(queries)
+            entry = self.scenarios[scenario]
+            entry['latencies'].append(latency)
+            entry['queries'].append(queries)
+            if status != 200:
+                self.http_errors[status] += 1
+
+
+def _drive(client, factory, conversations, recorder):
+    """1スレッド分のユーザーの会話を交互に送る（同じユーザーのイベントは順番通り）"""
+    positions = [0] * len(conversations)
+    active = list(range(len(conversations)))
+    while active:
+        remaining = []
+        for index in active:
+            user_id, steps = conversations[index]
+            kind, value, scenario = steps[positions[index]]
+            body, headers = factory.request([factory.event(user_id, kind, value)])
+            started = time.perf_counter()
+            response = client.post('/line/webhook', data=body, headers=headers)
+            elapsed = time.perf_counter() - started
+            recorder.add(scenario, elapsed, int(response.headers.get('X-DB-Query-Count', 0)), response.status_code)
+            positions[index] += 1
+            if positions[index] < len(steps):
+                remaining.append(index)
+        active = remaining
+
+
+def run_load_test(users=50, flows_per_user=5, concurrency=4, database_url=None, async_mode=False, mix=None,
+                  seed=0, line_latency=0.0, stripe_latency=0.0, verbose=False, keep_database=False):
+    """負荷試験を実行して結果の辞書を返す
+
+    database_url を省略すると一時ディレクトリのSQLiteを使う。PostgreSQLを指定する場合は
+    companies が空の使い捨てのデータベースであること（そうでなければ RuntimeError）。
+    """
+    temp_dir = None
+    if not database_url:
+        temp_dir = tempfile.mkdtemp(prefix='line-loadtest-')
+        database_url = os.path.join(temp_dir, 'loadtest.db')
+    prepare_environment(database_url, async_mode)
+
+    try:
+        from utils.db import get_db_connection
+        from loadtest.fixtures import create_schema, ensure_empty, seed_companies
+
+        conn = get_db_connection()
+        try:
+            create_schema(conn)
+            ensure_empty(conn)
+            virtual_users = seed_companies(conn, users)
+        finally:
+            conn.close()
+
+        with ExitStack() as stack:
+            if not verbose:
+                # アプリのデバッグ出力（print）を捨てる
+                devnull = stack.enter_context(open(os.devnull, 'w'))
+                stack.enter_context(redirect_stdout(devnull))
+                stack.enter_context(redirect_stderr(devnull))
+            from app import app
+            from utils.db_metrics import get_query_metrics, reset_query_metrics
+            from utils.event_queue import drain_pools, get_event_queue_stats
+            from utils.outbound_queue import line_outbound
+            from utils.webhook_inbox import webhook_inbox
+
+            fakes = stack.enter_context(offline_services(line_latency, stripe_latency))
+            factory = LinePayloadFactory(LOADTEST_CHANNEL_SECRET)
+            steps = build_conversations(virtual_users, flows_per_user, mix, seed)
+            conversations = [(user.line_user_id, user_steps) for user, user_steps in zip(virtual_users, steps)]
+
+            recorder = _Recorder()
+            reset_query_metrics()
+            threads = []
+            for worker in range(max(1, concurrency)):
+                assigned = conversations[worker::max(1, concurrency)]
+                thread = threading.Thread(target=_drive, args=(app.test_client(), factory, assigned, recorder),
+                                          name=f'loadtest-client-{worker}', daemon=True)
+                threads.append(thread)
+
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            drained = drain_pools(timeout=300) if async_mode else True
+            # プッシュ送信はキュー経由のため、偽のLINE APIを外す前に送り切る
+            drained = line_outbound.drain(timeout=300) and drained
+            duration = time.perf_counter() - started
+
+            pool_stats = {stats['name']: stats for stats in get_event_queue_stats()}
+            inbox = webhook_inbox.stats()
+            query_metrics = get_query_metrics(top=10)
+
+        return _report(recorder, duration, drained, async_mode, pool_stats.get('line-webhook'), inbox,
+                       query_metrics, fakes, database_url if keep_database else None,
+                       {'users': users, 'flows_per_user': flows_per_user, 'concurrency': concurrency,
+                        'backend': 'postgresql' if database_url.startswith('postgresql://') else 'sqlite'})
+    finally:
+        if temp_dir and not keep_database:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _report(recorder, duration, drained, async_mode, pool_stats, inbox, query_metrics, fakes, database_path, config):
+    events = len(recorder.latencies)
+    request_queries = sum(recorder.queries)
+    if async_mode and pool_stats:
+        # 受付時のクエリに加えワーカーでの処理分を数える
+        total_queries = request_queries + pool_stats['queries_total']
+    else:
+        total_queries = request_queries
+
+    statuses = inbox.get('statuses', {})
+    failed_events = sum(count for status, count in statuses.items() if status in ('failed', 'dead'))
+    http_errors = sum(recorder.http_errors.values())
+
+    scenarios = {}
+    for name, entry in sorted(recorder.scenarios.items()):
+        count = len(entry['latencies'])
+        scenarios[name] = dict(
+            events=count,
+            queries_per_event=round(sum(entry['queries']) / count, 2) if count else 0.0,
+            **_latency_summary(entry['latencies']),
+        )
+
+    report = {
+        'config': dict(config, mode='async' if async_mode else 'sync'),
+        'events': events,
+        'duration_s': round(duration, 3),
+        'events_per_sec': round(events / duration, 1) if duration else 0.0,
+        'latency': _latency_summary(recorder.latencies),
+        'queries_per_event': round(total_queries / events, 2) if events else 0.0,
+        'max_queries_per_event': max(recorder.queries) if recorder.queries and not async_mode else None,
+        'errors': {
+            'http': dict(recorder.http_errors),
+            'failed_events': failed_events,
+            'error_rate': round((http_errors + failed_events) / events, 4) if events else 0.0,
+            'blocked_outbound': dict(fakes['transport'].blocked),
+        },
+        'drained': drained,
+        'scenarios': scenarios,
+        'inbox': statuses,
+        'worker_pool': pool_stats,
+        'line_api': fakes['line'].stats(),
+        'stripe_api': fakes['stripe'].stats(),
+        'sheets': fakes['sheets'].stats(),
+        'top_statements': query_metrics['top_statements'],
+    }
+    if database_path:
+        report['database'] = database_path
+    return report
+
+
+def format_report(report):
+    """結果を表形式のテキストにする"""
+    config = report['config']
+    latency = report['latency']
+    errors = report['errors']
+    lines = [
+        f"LINE Webhook負荷試験 ({config['backend']}, {config['mode']}, "
+        f"users={config['users']}, flows/user={config['flows_per_user']}, concurrency={config['concurrency']})",
+        '',
+        f"イベント数:      {report['events']}  ({report['duration_s']}s)",
+        f"スループット:    {report['events_per_sec']} events/sec",
+        f"レイテンシ:      p50={latency['p50_ms']}ms  p95={latency['p95_ms']}ms  "
+        f"p99={latency['p99_ms']}ms  max={latency['max_ms']}ms",
+        f"クエリ数/イベント: {report['queries_per_event']}"
+        + (f"  (max {report['max_queries_per_event']})" if report['max_queries_per_event'] is not None else ''),
+        f"エラー:          http={errors['http'] or 0}  failed_events={errors['failed_events']}  "
+        f"error_rate={errors['error_rate']}",
+    ]
+    if errors['blocked_outbound']:
+        lines.append(f"遮断した外部通信: {errors['blocked_outbound']}")
+    if config['mode'] == 'async' and report['worker_pool']:
+        pool = report['worker_pool']
+        lines.append(f"ワーカー処理:    avg={pool['avg_process_ms']}ms  wait p95={pool['p95_wait_ms']}ms")
+    lines += [
+        '',
+        f"{'シナリオ':<16}{'events':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'queries':>9}",
+    ]
+    for name, entry in report['scenarios'].items():
+        lines.append(f"{name:<16}{entry['events']:>8}{entry['p50_ms']:>10}{entry['p95_ms']:>10}"
+                     f"{entry['p99_ms']:>10}{entry['queries_per_event']:>9}")
+    lines += [
+        '',
+        f"LINE API: {report['line_api']['calls']}",
+        f"Stripe API: {report['stripe_api']['calls']}",
+    ]
+    if report['line_api']['errors']:
+        lines.append(f"LINE APIエラー: {report['line_api']['errors']}")
+    return '\n'.join(lines)
@@ -1,83 +1,199 @@
 #!/usr/bin/env python3
 """
 ユーザー状態管理モデル
+
+状態は名前（state）と付随データ（state_data、JSON）に分けて保存する。
+旧形式の 'add_confirm_3' のような連結文字列も読み込み時に変換する。
+
+読み込みはプロセス内のTTLキャッシュを優先し、書き込みはDBへ書いてから
+キャッシュを更新する（ライトスルー）。他プロセスのキャッシュはNOTIFYで
+無効化する（utils.local_cache）。会話途中の状態（add_confirm など）は
+一定時間更新が無ければ期限切れとして通常状態に戻す。
 """
 
 from utils.db import get_db_connection
+from utils.dialect import get_dialect
+from utils.prepared_statements import execute_hot, USER_STATE_GET, USER_STATE_UPSERT
+from utils.local_cache import TTLCache, register_cache, publish_invalidation
+from utils.unit_of_work import current_unit_of_work
 import datetime
+import json
+import logging
+import os
+import re
 
-def get_user_state(line_user_id):
-    """ユーザーの状態を取得"""
+logger = logging.getLogger(__name__)
+
+_DELETE_STATE_SQL = 'DELETE FROM user_states WHERE line_user_id = %s'
+
+# 通常状態（会話の途中ではない）
+IDLE_STATE = 'welcome_sent'
+
+# 会話途中の状態（一定時間更新が無ければ通常状態に戻す）
+PENDING_STATES = frozenset({'add_select', 'add_confirm', 'cancel_select', 'cancel_confirm'})
+USER_STATE_PENDING_TTL = int(os.getenv('USER_STATE_PENDING_TTL', '1800'))
+
+# キャッシュの保持秒数（0で無効）。他プロセスの変更はNOTIFYで反映され、TTLは取りこぼし時の上限
+USER_STATE_CACHE_TTL = float(os.getenv('USER_STATE_CACHE_TTL', '300'))
+USER_STATE_CACHE_SIZE = int(os.getenv('USER_STATE_CACHE_SIZE', '10000'))
+
+# 旧形式の連結文字列（例: add_confirm_3）
+_LEGACY_STATE_RE = re.compile(r'^(add_confirm)_(\d+)$')
+
+USER_STATE_CACHE_NAME = 'user_state'
+
+_state_cache = register_cache(TTLCache(USER_STATE_CACHE_NAME, USER_STATE_CACHE_TTL, USER_STATE_CACHE_SIZE))
+
+
+class ConversationState:
+    """会話状態（名前と付随データ）"""
+
+    __slots__ = ('name', 'data')
+
+    def __init__(self, name, data=None):
+        self.name = name
+        self.data = data or {}
+
+    @classmethod
+    def from_row(cls, state, state_data=None):
+        """DBの値から作成（状態が無ければNone）"""
+        if state is None:
+            return None
+        if state_data:
+            try:
+                return cls(state, json.loads(state_data))
+            except ValueError:
+                pass
+        legacy = _LEGACY_STATE_RE.match(state)
+        if legacy:
+            return cls(legacy.group(1), {'selection': int(legacy.group(2))})
+        return cls(state)
+
+    @property
+    def is_pending(self):
+        return self.name in PENDING_STATES
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __eq__(self, other):
+        if isinstance(other, ConversationState):
+            return self.name == other.name and self.data == other.data
+        return NotImplemented
+
+    def __repr__(self):
+        return f'ConversationState({self.name!r}, {self.data!r})'
+
+def _age_seconds(updated_at):
+    """updated_at（書き込み時の datetime.now()）からの経過秒数"""
+    if updated_at is None:
+        return None
+    if isinstance(updated_at, str):
+        try:
+            updated_at = datetime.datetime.fromisoformat(updated_at)
+        except ValueError:
+            return None
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.replace(tzinfo=None)
+    return (datetime.datetime.now() - updated_at).total_seconds()
+
+def conversation_state_from_row(state_name, state_data, updated_at):
+    """DBの行から ConversationState を作成（期限切れの会話途中の状態は通常状態に戻す）"""
+    state = ConversationState.from_row(state_name, state_data)
+    if state is not None and state.is_pending:
+        age = _age_seconds(updated_at)
+        if age is not None and age >= USER_STATE_PENDING_TTL:
+            # 放置された確認待ちなどは通常状態として扱う（次の書き込みで上書きされる）
+            logger.debug('会話状態の期限切れ: state=%s', state)
+            return ConversationState(IDLE_STATE)
+    return state
+
+def _cache_state(line_user_id, state, age=0):
+    """会話途中の状態は期限切れの時刻までしか保持しない"""
+    ttl = None
+    if state is not None and state.is_pending:
+        ttl = max(0, USER_STATE_PENDING_TTL - (age or 0))
+    _state_cache.set(line_user_id, state, ttl)
+
+def get_conversation_state(line_user_id):
+    """ユーザーの状態を ConversationState で取得（未設定・エラー時はNone）"""
+    # 会話途中の状態は期限切れの時刻にキャッシュからも消える（以降はDBで判定）
+    state = _state_cache.get(line_user_id)
+    if state is not TTLCache.MISSING:
+        return state
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        
-        # データベースタイプに応じて適切なプレースホルダーを使用
-        from utils.db import get_db_type
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
-        
-        c.execute(f'SELECT state FROM user_states WHERE line_user_id = {placeholder}', (line_user_id,))
+        execute_hot(c, USER_STATE_GET, (line_user_id,))
         result = c.fetchone()
         conn.close()
-        
-        if result:
-            return result[0]
-        else:
-            return None  # デフォルト状態
     except Exception as e:
-        print(f'[DEBUG] ユーザー状態取得エラー: {e}')
-        print(f'[DEBUG] エラーのためNoneを返します')
+        logger.debug('ユーザー状態取得エラー: %s', e)
+        return None
+
+    if not result:
+        _cache_state(line_user_id, None)
         return None
+    state_name, state_data, updated_at = result
+    state = conversation_state_from_row(state_name, state_data, updated_at)
+    _cache_state(line_user_id, state, _age_seconds(updated_at))
+    return state
+
+def get_user_state(line_user_id):
+    """ユーザーの状態名を取得"""
+    state = get_conversation_state(line_user_id)
+    return state.name if state else None
 
-def set_user_state(line_user_id, state):
-    """ユーザーの状態を設定"""
+def set_user_state(line_user_id, state, data=None):
+    """ユーザーの状態を設定（data は状態に付随する値の辞書）"""
     try:
         conn = get_db_connection()
         c = conn.cursor()
         
-        # データベースタイプに応じて適切なSQL構文を使用
-        from utils.db import get_db_type
-        db_type = get_db_type()
-        
-        if db_type == 'postgresql':
-            # PostgreSQL用のUPSERT構文（idカラムは自動生成）
-            c.execute('''
-                INSERT INTO user_states (line_user_id, state, updated_at) 
-                VALUES (%s, %s, %s)
-                ON CONFLICT (line_user_id) 
-                DO UPDATE SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at
-            ''', (line_user_id, state, datetime.datetime.now()))
-        else:
-            # SQLite用のREPLACE構文
-            c.execute('''
-                INSERT OR REPLACE INTO user_states (line_user_id, state, updated_at) 
-                VALUES (?, ?, ?)
-            ''', (line_user_id, state, datetime.datetime.now()))
+        # UPSERT構文（idカラムは自動生成）
+        state_data = json.dumps(data, ensure_ascii=False) if data else None
+        execute_hot(c, USER_STATE_UPSERT,
+                    (line_user_id, state, state_data, get_dialect().timestamp(datetime.datetime.now())))
+        publish_invalidation(c, _state_cache.name, line_user_id)
         
         conn.commit()
         conn.close()
-        print(f'[DEBUG] ユーザー状態設定: line_user_id={line_user_id}, state={state}')
+        _cache_state(line_user_id, ConversationState(state, data))
+        _discard_on_rollback(line_user_id)
+        logger.debug('ユーザー状態設定: line_user_id=%s, state=%s, data=%s', line_user_id, state, data)
     except Exception as e:
-        print(f'[DEBUG] ユーザー状態設定エラー: {e}')
+        _state_cache.invalidate(line_user_id)
+        logger.debug('ユーザー状態設定エラー: %s', e)
+
+def set_conversation_state(line_user_id, state):
+    """ConversationState を保存"""
+    set_user_state(line_user_id, state.name, state.data)
 
 def clear_user_state(line_user_id):
     """ユーザーの状態をクリア"""
     try:
         conn = get_db_connection()
         c = conn.cursor()
-        
-        # データベースタイプに応じて適切なプレースホルダーを使用
-        from utils.db import get_db_type
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
-        
-        c.execute(f'DELETE FROM user_states WHERE line_user_id = {placeholder}', (line_user_id,))
+        c.execute(get_dialect().sql(_DELETE_STATE_SQL), (line_user_id,))
+        publish_invalidation(c, _state_cache.name, line_user_id)
         conn.commit()
         conn.close()
-        print(f'[DEBUG] ユーザー状態クリア: line_user_id={line_user_id}')
+        _cache_state(line_user_id, None)
+        _discard_on_rollback(line_user_id)
+        logger.debug('ユーザー状態クリア: line_user_id=%s', line_user_id)
     except Exception as e:
-        print(f'[DEBUG] ユーザー状態クリアエラー: {e}')
+        _state_cache.invalidate(line_user_id)
+        logger.debug('ユーザー状態クリアエラー: %s', e)
+
+def _discard_on_rollback(line_user_id):
+    # ユニットオブワーク内の書き込みは、全体がrollbackされたらキャッシュからも取り消す
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.on_rollback(lambda: _state_cache.invalidate(line_user_id))
+
+def get_user_state_cache_stats():
+    """会話状態キャッシュの統計"""
+    return _state_cache.stats()
 
 def init_user_states_table():
     """user_statesテーブルを初期化"""
@@ -86,16 +202,14 @@ def init_user_states_table():
         c = conn.cursor()
         
         # データベースタイプに応じて適切なテーブル作成構文を使用
-        from utils.db import get_db_type
-        db_type = get_db_type()
-        
-        if db_type == 'postgresql':
+        if get_dialect().name == 'postgresql':
             # PostgreSQL用のテーブル作成構文
             c.execute('''
                 CREATE TABLE IF NOT EXISTS user_states (
                     id SERIAL PRIMARY KEY,
                     line_user_id VARCHAR(255) UNIQUE NOT NULL,
                     state VARCHAR(100) NOT NULL DEFAULT 'welcome_sent',
+                    state_data TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
@@ -107,6 +221,7 @@ def init_user_states_table():
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     line_user_id TEXT UNIQUE NOT NULL,
                     state TEXT NOT NULL DEFAULT 'welcome_sent',
+                    state_data TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
@@ -114,6 +229,6 @@ def init_user_states_table():
         
         conn.commit()
         conn.close()
-        print('[DEBUG] user_statesテーブル初期化完了')
+        logger.debug('user_statesテーブル初期化完了')
     except Exception as e:
-        print(f'[DEBUG] user_statesテーブル初期化エラー: {e}') 
\ No newline at end of file
+        logger.debug('user_statesテーブル初期化エラー: %s', e) 
\ No newline at end of file
@@ -4,16 +4,21 @@ import hmac
 import hashlib
 import base64
 import json
+import logging
 from utils.db import get_db_connection
+from utils.statement_timeout import declare_statement_timeout
+
+logger = logging.getLogger(__name__)
 
 ai_schedule_webhook_simple_bp = Blueprint('ai_schedule_webhook_simple', __name__)
+declare_statement_timeout(ai_schedule_webhook_simple_bp, 'webhook')
 
 @ai_schedule_webhook_simple_bp.route('/ai-schedule/webhook', methods=['POST'])
 def ai_schedule_webhook_simple():
     """AI予定秘書専用のシンプルなWebhookエンドポイント"""
-    print(f'[AI Schedule Webhook] リクエスト受信: {request.method}')
-    print(f'[AI Schedule Webhook] ヘッダー: {dict(request.headers)}')
-    print(f'[AI Schedule Webhook] ボディ: {request.data.decode("utf-8")}')
+    logger.debug('リクエスト受信: %s', request.method)
+    logger.debug('ヘッダー: %s', dict(request.headers))
+    logger.debug('ボディ: %s', request.data.decode("utf-8"))
     
     # LINE署名の検証
     signature = request.headers.get('X-Line-Signature', '')
@@ -27,25 +32,25 @@ def ai_schedule_webhook_simple():
             hash = hmac.new(LINE_CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
             expected_signature = base64.b64encode(hash).decode('utf-8')
             if not hmac.compare_digest(signature, expected_signature):
-                print(f'[AI Schedule Webhook] 署名検証失敗: expected={expected_signature}, received={signature}')
+                logger.warning('署名検証失敗')
                 return 'Invalid signature', 400
             else:
-                print(f'[AI Schedule Webhook] 署名検証成功')
+                logger.debug('署名検証成功')
         except Exception as e:
-            print(f'[AI Schedule Webhook] 署名検証エラー: {e}')
+            logger.exception('署名検証エラー: %s', e)
             return 'Signature verification error', 400
     
     try:
         events = json.loads(body).get('events', [])
-        print(f'[AI Schedule Webhook] イベント数: {len(events)}')
+        logger.debug('イベント数: %s', len(events))
         
         for event in events:
-            print(f'[AI Schedule Webhook] イベント処理開始: {event.get("type")}')
+            logger.debug('イベント処理開始: %s', event.get("type"))
             
             # 友達追加イベントの処理
             if event.get('type') == 'follow':
                 user_id = event['source']['userId']
-                print(f'[AI Schedule Webhook] 友達追加イベント: user_id={user_id}')
+                logger.debug('友達追加イベント: user_id=%s', user_id)
                 
                 # AI予定秘書用のウェルカムメッセージを送信
                 welcome_message = {
@@ -56,15 +61,15 @@ def ai_schedule_webhook_simple():
                 try:
                     from services.line_service import send_line_message
                     send_line_message(event['replyToken'], [welcome_message])
-                    print(f'[AI Schedule Webhook] AI予定秘書ウェルカムメッセージ送信完了: user_id={user_id}')
+                    logger.debug('AI予定秘書ウェルカムメッセージ送信完了: user_id=%s', user_id)
                 except Exception as e:
-                    print(f'[AI Schedule Webhook] ウェルカムメッセージ送信エラー: {e}')
+                    logger.exception('ウェルカムメッセージ送信エラー: %s', e)
             
             # メッセージイベントの処理
             elif event.get('type') == 'message':
                 user_id = event['source']['userId']
                 message_text = event['message'].get('text', '')
-                print(f'[AI Schedule Webhook] メッセージ受信: user_id={user_id}, text={message_text}')
+                logger.debug('メッセージ受信: user_id=%s, text=%s', user_id, message_text)
                 
                 # AI予定秘書の基本的な応答
                 if '予定' in message_text or 'スケジュール' in message_text:
@@ -91,14 +96,12 @@ def ai_schedule_webhook_simple():
                 try:
                     from services.line_service import send_line_message
                     send_line_message(event['replyToken'], [response_message])
-                    print(f'[AI Schedule Webhook] 応答メッセージ送信完了: user_id={user_id}')
+                    logger.debug('応答メッセージ送信完了: user_id=%s', user_id)
                 except Exception as e:
-                    print(f'[AI Schedule Webhook] 応答メッセージ送信エラー: {e}')
+                    logger.exception('応答メッセージ送信エラー: %s', e)
         
         return 'OK', 200
         
     except Exception as e:
-        print(f'[AI Schedule Webhook] エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('AI予定秘書Webhook処理エラー: %s', e)
         return 'Internal Server Error', 500 
\ No newline at end of file
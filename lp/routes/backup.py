@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify, send_file
 from services.backup_service import backup_service
 import os
+from utils.statement_timeout import declare_statement_timeout
 
 backup_bp = Blueprint('backup', __name__, url_prefix='/api/v1/backup')
+declare_statement_timeout(backup_bp, 'batch')
 
 @backup_bp.route('/companies/<int:company_id>/create', methods=['POST'])
 def create_company_backup(company_id):
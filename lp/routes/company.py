@@ -6,8 +6,10 @@ from flask import Blueprint, request, jsonify
 from services.company_service import CompanyService
 from services.company_line_service import CompanyLineService
 import json
+from utils.statement_timeout import declare_statement_timeout
 
 company_bp = Blueprint('company', __name__, url_prefix='/api/v1/companies')
+declare_statement_timeout(company_bp, 'admin')
 
 # サービスインスタンス
 company_service = CompanyService()
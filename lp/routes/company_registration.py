@@ -15,6 +15,7 @@ try:
 except Exception:
     AutomatedAIScheduleClone = None
 from utils.db import get_db_connection
+from utils.channel_credentials import invalidate_channel_credentials
 
 company_registration_bp = Blueprint('company_registration', __name__)
 
@@ -90,6 +91,7 @@ Webhook URL: {webhook_url or '未設定'}
                 company_id,
                 line_channel_id
             ))
+            invalidate_channel_credentials(company_id, c)
             print(f"✅ 企業設定を更新しました: 企業ID {company_id}")
         else:
             # 新規レコードを作成
@@ -110,6 +112,7 @@ Webhook URL: {webhook_url or '未設定'}
                 json.dumps(environment_variables),
                 settings_summary
             ))
+            invalidate_channel_credentials(company_id, c)
             print(f"✅ 企業設定を保存しました: 企業ID {company_id}")
         
         conn.commit()
@@ -7,8 +7,10 @@
 from flask import Blueprint, request, jsonify
 from services.spreadsheet_content_service import spreadsheet_content_service
 import os
+from utils.statement_timeout import declare_statement_timeout
 
 content_admin_bp = Blueprint('content_admin', __name__)
+declare_statement_timeout(content_admin_bp, 'admin')
 
 @content_admin_bp.route('/api/v1/content/refresh', methods=['POST'])
 def refresh_content_cache():
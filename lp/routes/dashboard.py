@@ -3,8 +3,10 @@ from services.dashboard_service import dashboard_service
 import json
 import os
 from datetime import datetime
+from utils.statement_timeout import declare_statement_timeout
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/api/v1/dashboard')
+declare_statement_timeout(dashboard_bp, 'admin')
 
 @dashboard_bp.route('/overview', methods=['GET'])
 def get_overview():
@@ -1,9 +1,8 @@
 from flask import Blueprint, request, jsonify
 import datetime
 import os, json, hmac, hashlib, base64
-import traceback
-import requests
 import stripe
+import time
 import unicodedata
 import logging
 from services.line_service import send_line_message
@@ -12,14 +11,38 @@ from services.line_service import (
     handle_add_content_company, handle_status_check_company, handle_cancel_menu_company,
     handle_content_confirmation_company, handle_cancel_request_company, 
     handle_cancel_selection_company, handle_subscription_cancel_company,
-    handle_cancel_confirmation_company
+    handle_cancel_confirmation_company, smart_number_extraction
 )
-from utils.message_templates import get_menu_message_company, get_help_message_company
+from utils.message_templates import get_menu_message_company, get_help_message_company, get_menu_navigation_hint
 from utils.db import get_db_connection
-from models.user_state import get_user_state, set_user_state, clear_user_state, init_user_states_table
+from utils.dialect import get_dialect
+from utils.prepared_statements import (
+    execute_hot, COMPANY_BY_LINE_USER, MONTHLY_SUBSCRIPTION_BY_COMPANY, COMPANY_BY_EMAIL
+)
+from utils.unit_of_work import unit_of_work
+from models.user_state import (
+    get_user_state, set_user_state, clear_user_state, init_user_states_table,
+    ConversationState, IDLE_STATE, get_conversation_state, set_conversation_state
+)
+from services.spreadsheet_content_service import spreadsheet_content_service
+from utils.command_router import CommandRouter, CommandContext
+from utils.local_cache import TTLCache
+from utils.identity_cache import (
+    identity_cache, invalidate_line_user, invalidate_company, VALID_SUBSCRIPTION_STATUSES
+)
 from services.user_service import is_paid_user_company_centric, get_restricted_message
+from utils.statement_timeout import declare_statement_timeout, statement_timeout_class
+from utils.event_queue import EventWorkerPool, EventQueueFull, register_pool
+from utils.idempotency import get_deduplicator
+from utils.webhook_inbox import webhook_inbox
+from utils.logging_config import log_trace, lazy_json
+from utils.db_metrics import query_stats_scope
+from utils.line_client import line_api
+
+logger = logging.getLogger(__name__)
 
 line_bp = Blueprint('line', __name__)
+declare_statement_timeout(line_bp, 'webhook')
 
 # 決済完了後の案内文送信待ちユーザーを管理
 pending_welcome_users = set()
@@ -58,13 +81,13 @@ def payment_completed_webhook_by_user_id(user_id):
         
         if line_user_id:
             # 既にLINE連携済みの場合、直接案内文を送信
-            print(f'[DEBUG] 既存LINE連携ユーザーへの自動案内文送信: line_user_id={line_user_id}')
+            logger.debug('既存LINE連携ユーザーへの自動案内文送信: line_user_id=%s', line_user_id)
             try:
                 success = send_welcome_with_buttons(line_user_id)
                 if success:
                     # 自動案内文送信後にユーザー状態を設定（重複防止）
                     set_user_state(line_user_id, 'welcome_sent')
-                    print(f'[DEBUG] 自動案内文送信完了、ユーザー状態を設定: line_user_id={line_user_id}')
+                    logger.debug('自動案内文送信完了、ユーザー状態を設定: line_user_id=%s', line_user_id)
                     return jsonify({
                         'success': True, 
                         'message': f'案内文を自動送信しました: {email}',
@@ -76,13 +99,13 @@ def payment_completed_webhook_by_user_id(user_id):
                         'error': '案内文送信に失敗しました'
                     })
             except Exception as e:
-                print(f'[DEBUG] 自動案内文送信エラー: {e}')
+                logger.debug('自動案内文送信エラー: %s', e)
                 return jsonify({'error': f'案内文送信エラー: {str(e)}'})
         else:
             # LINE連携未完了の場合、送信待ちリストに追加
             user_id_str = f"user_{user_id}"
             pending_welcome_users.add(user_id_str)
-            print(f'[DEBUG] LINE連携未完了ユーザーの案内文送信準備: user_id={user_id}, email={email}')
+            logger.debug('LINE連携未完了ユーザーの案内文送信準備: user_id=%s, email=%s', user_id, email)
             return jsonify({
                 'success': True, 
                 'message': f'LINE連携後に案内文を送信します: {email}',
@@ -97,7 +120,7 @@ def payment_completed_webhook(user_id):
     """決済完了後の案内文送信準備（LINEユーザーIDベース）"""
     try:
         pending_welcome_users.add(user_id)
-        print(f'[DEBUG] 決済完了後の案内文送信準備: user_id={user_id}')
+        logger.debug('決済完了後の案内文送信準備: user_id=%s', user_id)
         return jsonify({'success': True, 'message': f'案内文送信準備完了: {user_id}'})
     except Exception as e:
         return jsonify({'error': str(e)})
@@ -148,16 +171,7 @@ def debug_diagnose_user(user_id):
         # LINE連携済みの場合、LINE APIでユーザー情報を確認
         if user[2]:
             try:
-                LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
-                headers = {
-                    'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
-                    'Content-Type': 'application/json'
-                }
-                response = requests.get(
-                    f'https://api.line.me/v2/bot/profile/{user[2]}',
-                    headers=headers,
-                    timeout=10
-                )
+                response = line_api.get_profile(user[2])
                 
                 if response.status_code == 200:
                     line_profile = response.json()
@@ -220,7 +234,7 @@ def debug_update_line_user(user_id, line_user_id):
         conn.commit()
         conn.close()
         
-        print(f'[DEBUG] LINEユーザーID更新: user_id={user_id}, line_user_id={line_user_id}')
+        logger.debug('LINEユーザーID更新: user_id=%s, line_user_id=%s', user_id, line_user_id)
         
         return jsonify({
             'success': True,
@@ -240,24 +254,7 @@ def debug_send_welcome(user_id):
         }
         
         # LINE APIを使用してメッセージを送信（テスト用）
-        LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
-        
-        headers = {
-            'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            'to': user_id,
-            'messages': [test_message]
-        }
-        
-        response = requests.post(
-            'https://api.line.me/v2/bot/message/push',
-            headers=headers,
-            json=data,
-            timeout=10
-        )
+        response = line_api.push(user_id, [test_message])
         
         if response.status_code == 200:
             return jsonify({
@@ -373,7 +370,7 @@ def check_line_restriction(content_type):
         })
         
     except Exception as e:
-        print(f'[ERROR] 利用制限チェックエラー: {e}')
+        logger.error('利用制限チェックエラー: %s', e)
         return jsonify({
             'error': str(e),
             'restricted': False
@@ -438,7 +435,7 @@ def get_restriction_message(content_type):
             })
         
     except Exception as e:
-        print(f'[ERROR] 制限メッセージ取得エラー: {e}')
+        logger.error('制限メッセージ取得エラー: %s', e)
         return jsonify({
             'error': str(e)
         }), 500
@@ -460,29 +457,29 @@ def debug_cancellation_history(user_id):
 @line_bp.route('/line/debug/test_webhook', methods=['POST'])
 def debug_test_webhook():
     """デバッグ用LINE Webhookテスト"""
-    print(f'[DEBUG] デバッグWebhookテスト開始')
+    logger.debug('デバッグWebhookテスト開始')
     
     try:
         body = request.data.decode('utf-8')
         events = json.loads(body).get('events', [])
-        print(f'[DEBUG] イベント数: {len(events)}')
+        logger.debug('イベント数: %s', len(events))
         
         for event in events:
-            print(f'[DEBUG] イベント処理開始: {event.get("type")}')
-            print(f'[DEBUG] イベント詳細: {json.dumps(event, ensure_ascii=False, indent=2)}')
+            logger.debug('イベント処理開始: %s', event.get("type"))
+            logger.debug('イベント詳細: %s', lazy_json(event))
             
             if event.get('type') == 'message' and event['message'].get('type') == 'text':
                 user_id = event['source']['userId']
                 text = event['message']['text']
-                print(f'[DEBUG] テキストメッセージ受信: user_id={user_id}, text={text}')
+                logger.debug('テキストメッセージ受信: user_id=%s, text=%s', user_id, text)
                 
                 # 決済状況をチェック
-                print(f'[DEBUG] 決済チェック開始: user_id={user_id}')
+                logger.debug('決済チェック開始: user_id=%s', user_id)
                 payment_check = is_paid_user_company_centric(user_id)
-                print(f'[DEBUG] 決済チェック結果: {payment_check}')
+                logger.debug('決済チェック結果: %s', payment_check)
                 
                 if not payment_check['is_paid']:
-                    print(f'[DEBUG] 未決済ユーザー: user_id={user_id}')
+                    logger.debug('未決済ユーザー: user_id=%s', user_id)
                     return jsonify({
                         'status': 'restricted',
                         'user_id': user_id,
@@ -490,7 +487,7 @@ def debug_test_webhook():
                         'message': '制限メッセージが送信されます'
                     })
                 else:
-                    print(f'[DEBUG] 決済済みユーザー: user_id={user_id}')
+                    logger.debug('決済済みユーザー: user_id=%s', user_id)
                     return jsonify({
                         'status': 'allowed',
                         'user_id': user_id,
@@ -501,15 +498,17 @@ def debug_test_webhook():
         return jsonify({'status': 'no_events'})
         
     except Exception as e:
-        print(f'[ERROR] デバッグWebhookテストエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('デバッグWebhookテストエラー: %s', e)
         return jsonify({'error': str(e)}), 500
 
 @line_bp.route('/line/webhook', methods=['POST'])
 def line_webhook():
-    logger = logging.getLogger(__name__)
-    print(f'[DEBUG] LINE Webhook受信開始')
+    # 1リクエスト分のDEBUGをまとめて抽出する（同期処理のイベントも同じ判定を引き継ぐ）
+    with log_trace(webhook='line'):
+        return _handle_line_webhook()
+
+def _handle_line_webhook():
+    logger.debug('LINE Webhook受信開始')
 
     try:
         # 署名検証
@@ -522,19 +521,61 @@ def line_webhook():
                 hash_bytes = hmac.new(line_channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
                 expected_signature = base64.b64encode(hash_bytes).decode('utf-8')
                 if not hmac.compare_digest(signature, expected_signature):
-                    print('[ERROR] LINE Webhook署名検証失敗')
+                    logger.error('LINE Webhook署名検証失敗')
                     return jsonify({'error': 'invalid signature'}), 400
             except Exception as sig_e:
-                print(f'[ERROR] 署名検証エラー: {sig_e}')
+                logger.error('署名検証エラー: %s', sig_e)
                 return jsonify({'error': 'signature verification error'}), 400
 
         events = json.loads(body).get('events', [])
-        print(f'[DEBUG] イベント数: {len(events)}')
+        logger.debug('イベント数: %s', len(events))
 
-        for event in events:
+        # このプロセスで受け付け済みの再送はここで捨てる（DBでの判定は処理開始時にワーカーで行う）
+        new_events = line_event_deduplicator.filter_new(events)
+        if len(new_events) != len(events):
+            logger.debug('重複イベントを除外: %s件', len(events) - len(new_events))
+        events = new_events
+
+        # 受信箱へ記録してからワーカーへ渡し、処理完了を待たずに応答する
+        # （ワーカーが停止しても受信箱のスイープで再処理される）
+        entries = webhook_inbox.append('line', events)
+        for index, entry in enumerate(entries):
+            if not LINE_WEBHOOK_ASYNC:
+                webhook_inbox.process(entry)
+                continue
             try:
-                print(f'[DEBUG] イベント処理開始: {event.get("type")}')
+                line_event_pool.submit(entry)
+            except EventQueueFull:
+                # 同じ送信元の順序を崩さないよう、以降のイベントも受け付けずに再送を求める
+                rejected = entries[index:]
+                webhook_inbox.reject(rejected, 'event queue full (redelivery requested)')
+                for rejected_entry in rejected:
+                    line_event_deduplicator.forget(rejected_entry.event)
+                logger.warning('イベントキューが満杯のため再送を要求: %s件', len(rejected))
+                response = jsonify({'error': 'event queue full'})
+                response.status_code = 503
+                response.headers['Retry-After'] = '1'
+                return response
 
+    except Exception as e:
+        logger.exception('LINE Webhook処理エラー: %s', e)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        logger.debug('LINE Webhook処理完了')
+
+    return jsonify({'status': 'ok'})
+
+def process_line_event(event):
+    """1イベントを処理（失敗は受信箱に記録するため例外を送出する）"""
+    # ログにはイベントの識別子を付ける
+    with log_trace(event_type=event.get('type'), event_id=event.get('webhookEventId'),
+                   user_id=line_event_key(event)), query_stats_scope() as query_stats:
+        started = time.perf_counter()
+        try:
+            logger.debug('イベント処理開始: %s', event.get("type"))
+
+            # 1イベント = 1ユニットオブワーク（LINE・Stripeの呼び出し前にそれまでの変更を確定する）
+            with statement_timeout_class('webhook'), unit_of_work():
                 # イベントタイプに応じて処理を分岐
                 if event.get('type') == 'follow':
                     handle_follow_event(event)
@@ -545,29 +586,36 @@ def line_webhook():
                 elif event.get('type') == 'postback':
                     handle_postback_event(event)
                 else:
-                    print(f'[DEBUG] 未対応のイベントタイプ: {event.get("type")}')
-                    
-            except Exception as event_e:
-                print(f'[ERROR] 個別イベント処理エラー: {event_e}')
-                import traceback
-                traceback.print_exc()
-                # 個別イベントのエラーは全体の処理を停止させない
-                continue
+                    logger.debug('未対応のイベントタイプ: %s', event.get("type"))
 
-    except Exception as e:
-        print(f'[ERROR] LINE Webhook処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
-    finally:
-        logger.info(f'[DEBUG] LINE Webhook処理完了')
+        except Exception as event_e:
+            logger.exception('個別イベント処理エラー: %s', event_e)
+            raise
+        finally:
+            # イベントごとのDB負荷（N queries / X ms DB）
+            logger.info('イベント処理: %d queries / %.1fms DB (%.1fms)', query_stats.count,
+                        query_stats.total_time * 1000, (time.perf_counter() - started) * 1000)
 
-    return jsonify({'status': 'ok'})
+def line_event_key(event):
+    """イベントの順序付けキー（同じ送信元のイベントは到着順に処理する）"""
+    source = event.get('source') or {}
+    return source.get('userId') or source.get('groupId') or source.get('roomId')
+
+# LINE Webhookイベントの処理プール（LINE_WEBHOOK_ASYNC=0 でリクエスト内処理に戻す）
+# ユーザーごとの状態遷移（add_select → add_confirm_N）があるため送信元単位で順序を保つ
+LINE_WEBHOOK_ASYNC = os.getenv('LINE_WEBHOOK_ASYNC', '1') not in ('0', 'false', 'False', 'FALSE')
+# プールには受信箱のエントリを積み、処理状況は受信箱に記録する
+line_event_pool = register_pool(EventWorkerPool(
+    'line-webhook', webhook_inbox.process, key_func=lambda entry: line_event_key(entry.event)
+))
+line_event_deduplicator = get_deduplicator('line')
+webhook_inbox.register('line', lambda event, company_id: process_line_event(event),
+                       submit=line_event_pool.submit, deduplicator=line_event_deduplicator)
 
 def handle_follow_event(event):
     """フォローイベントの処理"""
     user_id = event['source']['userId']
-    print(f'[DEBUG] フォローイベント受信: user_id={user_id}')
+    logger.debug('フォローイベント受信: user_id=%s', user_id)
     
     try:
         conn = get_db_connection()
@@ -586,25 +634,24 @@ def handle_follow_event(event):
         
         if unlinked_company:
             company_id, company_name, email = unlinked_company
-            print(f'[DEBUG] 未紐付け企業データ発見: company_id={company_id}, company_name={company_name}')
+            logger.debug('未紐付け企業データ発見: company_id=%s, company_name=%s', company_id, company_name)
             
             # 企業データにLINEユーザーIDを設定
-            c.execute('UPDATE companies SET line_user_id = %s WHERE id = %s', (user_id, company_id))
+            c.execute(get_dialect().sql('UPDATE companies SET line_user_id = %s WHERE id = %s'), (user_id, company_id))
+            invalidate_line_user(user_id, c)
             conn.commit()
-            print(f'[DEBUG] 企業データとLINEユーザーIDを紐付け: user_id={user_id}, company_id={company_id}')
+            logger.debug('企業データとLINEユーザーIDを紐付け: user_id=%s, company_id=%s', user_id, company_id)
             
             # 企業向けの案内メッセージを送信
             try:
                 from services.line_service import send_company_welcome_message
                 send_company_welcome_message(user_id, company_name, email)
-                print(f'[DEBUG] 企業向け案内メッセージ送信完了: user_id={user_id}')
+                logger.debug('企業向け案内メッセージ送信完了: user_id=%s', user_id)
             except Exception as e:
-                print(f'[DEBUG] 企業向け案内メッセージ送信エラー: {e}')
-                import traceback
-                traceback.print_exc()
+                logger.exception('企業向け案内メッセージ送信エラー: %s', e)
                 
         else:
-            print(f'[DEBUG] 未紐付け企業データが見つかりません: user_id={user_id}')
+            logger.debug('未紐付け企業データが見つかりません: user_id=%s', user_id)
         
         # 2. 必ずメールアドレス連携を促す案内メッセージを送信（未紐付け企業の有無に関係なく）
         welcome_message = {
@@ -628,9 +675,7 @@ def handle_follow_event(event):
         conn.close()
         
     except Exception as e:
-        print(f'[DEBUG] フォローイベント処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('フォローイベント処理エラー: %s', e)
         welcome_message = {
             "type": "text",
             "text": (
@@ -646,28 +691,29 @@ def handle_follow_event(event):
 def handle_unfollow_event(event):
     """友達削除イベントの処理"""
     user_id = event['source']['userId']
-    print(f'[DEBUG] 友達削除イベント: user_id={user_id}')
+    logger.debug('友達削除イベント: user_id=%s', user_id)
     
     # line_user_idをクリア
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('UPDATE companies SET line_user_id = NULL WHERE line_user_id = %s', (user_id,))
+    c.execute(get_dialect().sql('UPDATE companies SET line_user_id = NULL WHERE line_user_id = %s'), (user_id,))
+    invalidate_line_user(user_id, c)
     conn.commit()
     conn.close()
     
     # ユーザー状態もクリア
     clear_user_state(user_id)
-    print(f'[DEBUG] 企業紐付け解除: user_id={user_id}')
+    logger.debug('企業紐付け解除: user_id=%s', user_id)
 
 def handle_text_message(event):
     """テキストメッセージの処理"""
     user_id = event['source']['userId']
     text = event['message']['text']
-    print(f'[DEBUG] テキストメッセージ受信: user_id={user_id}, text={text}')
+    logger.debug('テキストメッセージ受信: user_id=%s, text=%s', user_id, text)
     
     # メールアドレス連携処理
     if '@' in text and '.' in text and len(text) < 100:
-        print(f'[DEBUG] メールアドレス連携処理開始: user_id={user_id}, text={text}')
+        logger.debug('メールアドレス連携処理開始: user_id=%s, text=%s', user_id, text)
         
         def normalize_email(email):
             email = email.strip().lower()
@@ -675,51 +721,53 @@ def handle_text_message(event):
             return email
         
         normalized_email = normalize_email(text)
-        print(f'[DEBUG] 正規化後のメールアドレス: {normalized_email}')
+        logger.debug('正規化後のメールアドレス: %s', normalized_email)
         
         try:
             conn = get_db_connection()
             c = conn.cursor()
-            print(f'[DEBUG] データベース接続成功')
+            logger.debug('データベース接続成功')
             
             # メールアドレスで企業データを検索
-            c.execute('SELECT id, company_name, email FROM companies WHERE email = %s', (normalized_email,))
+            dialect = get_dialect()
+            execute_hot(c, COMPANY_BY_EMAIL, (normalized_email,))
             company = c.fetchone()
-            print(f'[DEBUG] 企業データ検索結果: {company}')
+            logger.debug('企業データ検索結果: %s', company)
             
             if company:
                 company_id, company_name, email = company
-                print(f'[DEBUG] 企業データ発見: company_id={company_id}, company_name={company_name}')
+                logger.debug('企業データ発見: company_id=%s, company_name=%s', company_id, company_name)
                 
                 # 企業データにLINEユーザーIDを設定
-                print(f'[DEBUG] 紐付け更新開始: user_id={user_id}, company_id={company_id}')
-                c.execute('UPDATE companies SET line_user_id = %s WHERE id = %s', (user_id, company_id))
+                logger.debug('紐付け更新開始: user_id=%s, company_id=%s', user_id, company_id)
+                c.execute(dialect.sql('UPDATE companies SET line_user_id = %s WHERE id = %s'), (user_id, company_id))
+                # 企業が別のLINEユーザーに紐付いていた場合に備え、企業単位でも無効化する
+                invalidate_line_user(user_id, c)
+                invalidate_company(company_id, c)
                 conn.commit()
-                print(f'[DEBUG] 企業データとLINEユーザーIDを紐付け完了: user_id={user_id}, company_id={company_id}')
+                logger.debug('企業データとLINEユーザーIDを紐付け完了: user_id=%s, company_id=%s', user_id, company_id)
                 
                 # 紐付け確認
-                c.execute('SELECT line_user_id FROM companies WHERE id = %s', (company_id,))
+                c.execute(dialect.sql('SELECT line_user_id FROM companies WHERE id = %s'), (company_id,))
                 verify_result = c.fetchone()
-                print(f'[DEBUG] 紐付け確認: {verify_result}')
+                logger.debug('紐付け確認: %s', verify_result)
                 
                 # 企業向けの案内メッセージを送信（push失敗時はreplyでフォールバック）
                 try:
                     from services.line_service import send_company_welcome_message
-                    print(f'[DEBUG] 企業向け案内メッセージ送信開始: user_id={user_id}, company_name={company_name}')
+                    logger.debug('企業向け案内メッセージ送信開始: user_id=%s, company_name=%s', user_id, company_name)
                     pushed = send_company_welcome_message(user_id, company_name, email)
                     if pushed:
-                        print(f'[DEBUG] 企業向け案内メッセージ送信完了(push): user_id={user_id}')
+                        logger.debug('企業向け案内メッセージ送信完了(push): user_id=%s', user_id)
                     else:
-                        print(f'[WARN] push送信に失敗。replyでフォールバック: user_id={user_id}')
+                        logger.warning('push送信に失敗。replyでフォールバック: user_id=%s', user_id)
                         from utils.message_templates import get_menu_navigation_hint
                         send_line_message(event['replyToken'], [
                             {"type": "text", "text": f"✅ 企業データとの紐付けが完了しました！\n\n企業名: {company_name}\nメールアドレス: {email}\n\n『メニュー』と入力して始めてください。"},
                             get_menu_navigation_hint()
                         ])
                 except Exception as e:
-                    print(f'[DEBUG] 企業向け案内メッセージ送信エラー: {e}')
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception('企業向け案内メッセージ送信エラー: %s', e)
                     # 例外時もreplyでフォールバック
                     from utils.message_templates import get_menu_navigation_hint
                     send_line_message(event['replyToken'], [
@@ -728,31 +776,29 @@ def handle_text_message(event):
                     ])
                     
             else:
-                print(f'[DEBUG] 企業データが見つかりません: email={normalized_email}')
+                logger.debug('企業データが見つかりません: email=%s', normalized_email)
                 lp_message = "❌ 企業データが見つかりません。\n\n💳 まず月額基本料金の決済を完了してください。\n\n🔗 LPからご登録ください：\nhttps://lp-production-9e2c.up.railway.app"
                 send_line_message(event['replyToken'], [
                     {"type": "text", "text": lp_message}
                 ])
             
             conn.close()
-            print(f'[DEBUG] メールアドレス連携処理完了')
+            logger.debug('メールアドレス連携処理完了')
             return
             
         except Exception as e:
-            print(f'[DEBUG] メールアドレス連携処理エラー: {e}')
-            import traceback
-            traceback.print_exc()
+            logger.exception('メールアドレス連携処理エラー: %s', e)
             send_line_message(event['replyToken'], [{"type": "text", "text": "メールアドレス連携処理中にエラーが発生しました。もう一度お試しください。"}])
             return
     
     # 企業情報を取得
-    print(f'[DEBUG] 企業情報取得開始: user_id={user_id}')
+    logger.debug('企業情報取得開始: user_id=%s', user_id)
     company_info = get_company_info(user_id)
-    print(f'[DEBUG] 企業情報取得結果: {company_info}')
+    logger.debug('企業情報取得結果: %s', company_info)
     
     if not company_info:
         # 企業が見つからない場合、メールアドレス連携を促す
-        print(f'[DEBUG] 企業情報が見つかりません: user_id={user_id}')
+        logger.debug('企業情報が見つかりません: user_id=%s', user_id)
         send_line_message(event['replyToken'], [{"type": "text", "text": "決済済みの方は、登録時のメールアドレスを送信してください。\n\n例: example@example.com\n\n※メールアドレスを送信すると、自動的に企業データと紐付けされます。"}])
         return
     
@@ -760,7 +806,7 @@ def handle_text_message(event):
     
     # stripe_subscription_idがNoneの場合の処理
     if not stripe_subscription_id:
-        print(f'[DEBUG] stripe_subscription_idがNone: company_id={company_id}')
+        logger.debug('stripe_subscription_idがNone: company_id=%s', company_id)
         send_line_message(event['replyToken'], [{"type": "text", "text": "決済情報が見つかりません。決済が完了しているかご確認ください。"}])
         return
     
@@ -778,347 +824,379 @@ def handle_text_message(event):
     handle_command(event, user_id, text, company_id, stripe_subscription_id)
 
 def get_company_info(user_id):
-    """企業情報を取得（月額基本料金システム対応）"""
-    print(f'[DEBUG] get_company_info開始: user_id={user_id}')
-    
+    """企業情報を取得（月額基本料金システム対応、特定結果はキャッシュする）"""
+    identity = identity_cache.get(user_id)
+    if identity is TTLCache.MISSING:
+        try:
+            identity = _load_company_identity(user_id)
+        except Exception as e:
+            logger.exception('get_company_infoエラー: %s', e)
+            return None
+        identity_cache.store(user_id, identity)
+
+    if not identity:
+        return None
+    company_id, stripe_subscription_id, subscription_status = identity
+
+    # トライアル中('trialing')も有効として扱う
+    if subscription_status not in VALID_SUBSCRIPTION_STATUSES:
+        logger.debug('月額サブスクリプションが有効ではありません: company_id=%s, status=%s', company_id, subscription_status)
+        return None
+    return (company_id, stripe_subscription_id)
+
+def _load_company_identity(user_id):
+    """DBから (company_id, stripe_subscription_id, subscription_status) を取得（企業が無ければNone）"""
+    logger.debug('企業情報をDBから取得: user_id=%s', user_id)
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         c = conn.cursor()
         
         # companiesテーブルから企業情報を取得
-        c.execute('SELECT id, company_name FROM companies WHERE line_user_id = %s', (user_id,))
+        execute_hot(c, COMPANY_BY_LINE_USER, (user_id,))
         company = c.fetchone()
-        print(f'[DEBUG] 企業データ検索結果: {company}')
-        
+        logger.debug('企業データ検索結果: %s', company)
         if not company:
-            conn.close()
             return None
-        
         company_id = company[0]
         
         # 月額基本サブスクリプションからstripe_subscription_idを取得
-        c.execute('SELECT stripe_subscription_id, subscription_status FROM company_monthly_subscriptions WHERE company_id = %s', (company_id,))
+        execute_hot(c, MONTHLY_SUBSCRIPTION_BY_COMPANY, (company_id,))
         monthly_subscription = c.fetchone()
-        
         if not monthly_subscription:
-            print(f'[DEBUG] 月額基本サブスクリプションが見つかりません: company_id={company_id}')
-            conn.close()
-            return None
+            logger.debug('月額基本サブスクリプションが見つかりません: company_id=%s', company_id)
+            return (company_id, None, None)
         
         stripe_subscription_id, subscription_status = monthly_subscription
-        print(f'[DEBUG] 月額基本サブスクリプション: stripe_subscription_id={stripe_subscription_id}, status={subscription_status}')
-        
-        # トライアル中('trialing')も有効として扱う
-        valid_statuses = ('active', 'trialing')
-        if subscription_status not in valid_statuses:
-            print(f'[DEBUG] 月額サブスクリプションが有効ではありません: status={subscription_status}')
-            conn.close()
-            return None
-        
+        logger.debug('月額基本サブスクリプション: stripe_subscription_id=%s, status=%s', stripe_subscription_id, subscription_status)
+        return (company_id, stripe_subscription_id, subscription_status)
+    finally:
         conn.close()
-        return (company_id, stripe_subscription_id)
-        
+
+def handle_command(event, user_id, text, company_id, stripe_subscription_id):
+    """コマンド処理（振り分けは line_command_router の表で行う）"""
+    state = get_conversation_state(user_id)
+    logger.debug('handle_command開始: user_id=%s, text="%s", state=%s', user_id, text, state)
+    logger.debug('企業情報: company_id=%s, stripe_subscription_id=%s', company_id, stripe_subscription_id)
+    ctx = CommandContext(event, user_id, text, company_id, stripe_subscription_id, state)
+    line_command_router.dispatch(ctx)
+
+# --- テキストコマンド・会話状態の処理 ---
+# 各処理関数は次の会話状態を返す（Noneなら状態を変えない）
+
+line_command_router = CommandRouter('line', save_state=set_conversation_state, idle_state=IDLE_STATE)
+
+MENU_FALLBACK_TEXT = "📱 メニュー\n\n• 「追加」：コンテンツを追加\n• 「状態」：利用状況を確認\n• 「解約」：解約メニューを表示\n• 「ヘルプ」：使い方を確認"
+
+def _idle():
+    return ConversationState(IDLE_STATE)
+
+def _available_contents_list():
+    """スプレッドシートの順序でコンテンツ一覧を取得"""
+    contents_result = spreadsheet_content_service.get_available_contents()
+    contents_dict = contents_result.get('contents', {})
+    return [content_info for _, content_info in contents_dict.items()]
+
+def _send_menu(ctx):
+    send_line_message(ctx.reply_token, [get_menu_message_company()])
+
+@line_command_router.command('追加', transitions=('add_select',))
+def command_add(ctx):
+    try:
+        handle_add_content_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id)
+        logger.debug('追加コマンド処理完了')
     except Exception as e:
-        print(f'[ERROR] get_company_infoエラー: {e}')
-        import traceback
-        traceback.print_exc()
-        try:
+        logger.error('追加コマンド処理エラー: %s', e)
+    return ConversationState('add_select')
+
+@line_command_router.command('メニュー')
+def command_menu(ctx):
+    try:
+        logger.debug('メニューコマンド受信: user_id=%s', ctx.user_id)
+        _send_menu(ctx)
+        logger.debug('メニューコマンド処理完了')
+    except Exception as e:
+        logger.exception('メニューコマンド処理エラー: %s', e)
+        # エラー時のフォールバックメッセージ
+        send_line_message(ctx.reply_token, [{"type": "text", "text": MENU_FALLBACK_TEXT}])
+
+@line_command_router.command('ヘルプ')
+def command_help(ctx):
+    try:
+        send_line_message(ctx.reply_token, get_help_message_company())
+        logger.debug('ヘルプコマンド処理完了')
+    except Exception as e:
+        logger.error('ヘルプコマンド処理エラー: %s', e)
+
+@line_command_router.command('状態')
+def command_status(ctx):
+    try:
+        handle_status_check_company(ctx.reply_token, ctx.company_id)
+        logger.debug('状態コマンド処理完了')
+    except Exception as e:
+        logger.error('状態コマンド処理エラー: %s', e)
+
+@line_command_router.command('解約')
+def command_cancel_menu(ctx):
+    try:
+        logger.debug('解約コマンド受信: user_id=%s', ctx.user_id)
+        handle_cancel_menu_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id)
+        logger.debug('解約コマンド処理完了')
+    except Exception as e:
+        logger.exception('解約コマンド処理エラー: %s', e)
+
+@line_command_router.command('サブスクリプション解約')
+def command_subscription_cancel(ctx):
+    try:
+        handle_subscription_cancel_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id)
+        logger.debug('サブスクリプション解約コマンド処理完了')
+    except Exception as e:
+        logger.error('サブスクリプション解約コマンド処理エラー: %s', e)
+
+@line_command_router.command('コンテンツ解約', transitions=('cancel_select',))
+def command_content_cancel(ctx):
+    try:
+        handle_cancel_request_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id)
+        logger.debug('コンテンツ解約コマンド処理完了')
+    except Exception as e:
+        logger.error('コンテンツ解約コマンド処理エラー: %s', e)
+    return ConversationState('cancel_select')
+
+@line_command_router.state('add_select', transitions=('add_confirm', IDLE_STATE))
+def state_add_select(ctx):
+    logger.debug('コンテンツ選択処理: user_id=%s, state=%s, text=%s', ctx.user_id, ctx.state, ctx.text)
+
+    # 数字入力を受け付け、スプレッドシートの順序で解釈
+    try:
+        selection_index = int(ctx.text)
+    except ValueError:
+        selection_index = None
+
+    if selection_index is not None and selection_index >= 1:
+        contents_list = _available_contents_list()
+        if 1 <= selection_index <= len(contents_list):
+            selected = contents_list[selection_index - 1]
+            content_name = selected.get('name', f'コンテンツ{selection_index}')
+
+            # 既存のコンテンツ数を確認して料金を決定
+            conn = get_db_connection()
+            c = conn.cursor()
+            c.execute(get_dialect().sql('SELECT COUNT(*) FROM company_contents WHERE company_id = %s AND status = %s'), (ctx.company_id, 'active'))
+            existing_count = c.fetchone()[0]
             conn.close()
-        except:
-            pass
-        return None
 
-def handle_command(event, user_id, text, company_id, stripe_subscription_id):
-    """コマンド処理"""
-    state = get_user_state(user_id)
-    print(f'[DEBUG] handle_command開始: user_id={user_id}, text="{text}", state="{state}"')
-    print(f'[DEBUG] 企業情報: company_id={company_id}, stripe_subscription_id={stripe_subscription_id}')
-    
-    # 基本的なコマンド処理
-    if text == '追加':
-        try:
-            set_user_state(user_id, 'add_select')
-            handle_add_content_company(event['replyToken'], company_id, stripe_subscription_id)
-            print(f'[DEBUG] 追加コマンド処理完了')
-        except Exception as e:
-            print(f'[ERROR] 追加コマンド処理エラー: {e}')
-    elif text == 'メニュー':
-        try:
-            print(f'[DEBUG] メニューコマンド受信: user_id={user_id}')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            print(f'[DEBUG] メニューコマンド処理完了')
-        except Exception as e:
-            print(f'[ERROR] メニューコマンド処理エラー: {e}')
-            import traceback
-            traceback.print_exc()
-            # エラー時のフォールバックメッセージ
-            send_line_message(event['replyToken'], [{"type": "text", "text": "📱 メニュー\n\n• 「追加」：コンテンツを追加\n• 「状態」：利用状況を確認\n• 「解約」：解約メニューを表示\n• 「ヘルプ」：使い方を確認"}])
-    elif text == 'ヘルプ':
-        try:
-            send_line_message(event['replyToken'], get_help_message_company())
-            print(f'[DEBUG] ヘルプコマンド処理完了')
-        except Exception as e:
-            print(f'[ERROR] ヘルプコマンド処理エラー: {e}')
-    elif text == '状態':
-        try:
-            handle_status_check_company(event['replyToken'], company_id)
-            print(f'[DEBUG] 状態コマンド処理完了')
-        except Exception as e:
-            print(f'[ERROR] 状態コマンド処理エラー: {e}')
-    elif text == '解約':
+            # 1個目は無料、2個目以降は有料
+            if existing_count == 0:
+                price_short = " 料金:無料（初回コンテンツ）"
+            else:
+                price = selected.get('price')
+                price_short = f" 料金:{price:,}円/月" if isinstance(price, int) else ""
+
+            # 確認は大きいテンプレートボタン（はい/いいえ）
+            confirm_text = f"{price_short}\n\n追加しますか？"
+            send_line_message(
+                ctx.reply_token,
+                [{
+                    "type": "template",
+                    "altText": "コンテンツ追加確認",
+                    "template": {
+                        "type": "buttons",
+                        "title": f"{content_name}を追加",
+                        "text": confirm_text,
+                        "actions": [
+                            {"type": "message", "label": "はい", "text": "はい"},
+                            {"type": "message", "label": "いいえ", "text": "いいえ"}
+                        ]
+                    }
+                }]
+            )
+            return ConversationState('add_confirm', {'selection': selection_index})
+
+    # 無効な入力の場合、メインメニューを表示
+    _send_menu(ctx)
+    return _idle()
+
+ADD_CONFIRM_YES_WORDS = frozenset({'はい', 'yes', 'y'})
+ADD_CONFIRM_NO_WORDS = frozenset({'いいえ', 'no', 'n'})
+
+@line_command_router.state('add_confirm', transitions=(IDLE_STATE,))
+def state_add_confirm(ctx):
+    # ユーザーの「はい/いいえ」テキストで追加を確定
+    selection_index = ctx.state.get('selection')
+    normalized = str(ctx.text).strip().lower()
+    if not isinstance(selection_index, int):
+        _send_menu(ctx)
+        return _idle()
+
+    if normalized in ADD_CONFIRM_YES_WORDS:
+        contents_list = _available_contents_list()
+        if 1 <= selection_index <= len(contents_list):
+            content_name = contents_list[selection_index - 1].get('name')
+        else:
+            content_name = None
+        if not content_name:
+            send_line_message(ctx.reply_token, [{"type": "text", "text": "無効な選択です。"}])
+            return _idle()
         try:
-            print(f'[DEBUG] 解約コマンド受信: user_id={user_id}')
-            handle_cancel_menu_company(event['replyToken'], company_id, stripe_subscription_id)
-            print(f'[DEBUG] 解約コマンド処理完了')
+            result = handle_content_confirmation_company(ctx.company_id, content_name)
+            if result.get('success'):
+                # テキストメッセージで追加完了を通知
+                content_url = result.get('url', 'https://lp-production-9e2c.up.railway.app')
+                message_text = f"🎉 {content_name}を追加しました\n\nアクセスはこちら\n{content_url}"
+            else:
+                message_text = result.get('error', f"❌ {content_name}の追加に失敗しました。")
         except Exception as e:
-            print(f'[ERROR] 解約コマンド処理エラー: {e}')
-            import traceback
-            traceback.print_exc()
-    elif text == 'サブスクリプション解約':
+            logger.exception("add_confirm 処理エラー: %s", e)
+            message_text = "❌ 追加処理でエラーが発生しました。"
+        send_line_message(ctx.reply_token, [
+            {"type": "text", "text": message_text},
+            get_menu_navigation_hint()
+        ])
+        return _idle()
+
+    if normalized in ADD_CONFIRM_NO_WORDS:
+        _send_menu(ctx)
+        return _idle()
+
+    # 再確認
+    send_line_message(ctx.reply_token, [{"type": "text", "text": "『はい』または『いいえ』と返信してください。"}])
+
+@line_command_router.state('cancel_select', transitions=('cancel_confirm',))
+def state_cancel_select(ctx):
+    logger.debug('解約選択処理開始: user_id=%s, state=%s, text=%s', ctx.user_id, ctx.state, ctx.text)
+
+    # 数字入力（全角/漢数字/英語数詞/ローマ数字含む）はそのまま解約選択処理へ委譲
+    try:
+        extracted = smart_number_extraction(str(ctx.text))
+    except Exception:
+        extracted = []
+
+    if extracted:
         try:
-            handle_subscription_cancel_company(event['replyToken'], company_id, stripe_subscription_id)
-            print(f'[DEBUG] サブスクリプション解約コマンド処理完了')
+            handle_cancel_selection_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id, str(ctx.text))
+            # 選択後は確認ボタンの返信を待つ
+            return ConversationState('cancel_confirm')
         except Exception as e:
-            print(f'[ERROR] サブスクリプション解約コマンド処理エラー: {e}')
-    elif text == 'コンテンツ解約':
+            logger.exception('解約選択委譲エラー: %s', e)
+            send_line_message(ctx.reply_token, [
+                {"type": "text", "text": "解約処理に失敗しました。もう一度お試しください。"},
+                get_menu_navigation_hint()
+            ])
+            return None
+
+    # 無効な入力の場合、再案内
+    logger.debug('無効な入力: user_id=%s, text=%s', ctx.user_id, ctx.text)
+    send_line_message(ctx.reply_token, [{"type": "text", "text": "番号で解約対象を指定してください。例: 1\nメニューに戻る場合は『メニュー』と送信してください。"}])
+
+@line_command_router.state('cancel_confirm', transitions=(IDLE_STATE,))
+def state_cancel_confirm(ctx):
+    logger.debug('解約確認状態での処理: user_id=%s, state=%s, text=%s', ctx.user_id, ctx.state, ctx.text)
+
+    # 解約確認処理
+    if ctx.text.startswith('解約確認_'):
+        logger.debug('解約確認処理開始: text=%s', ctx.text)
         try:
-            set_user_state(user_id, 'cancel_select')
-            handle_cancel_request_company(event['replyToken'], company_id, stripe_subscription_id)
-            print(f'[DEBUG] コンテンツ解約コマンド処理完了')
+            handle_cancel_confirmation_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id, ctx.text)
+            logger.debug('ユーザー状態をリセット: user_id=%s', ctx.user_id)
+            return _idle()
         except Exception as e:
-            print(f'[ERROR] コンテンツ解約コマンド処理エラー: {e}')
-    elif state == 'add_select':
-        print(f'[DEBUG] コンテンツ選択処理: user_id={user_id}, state={state}, text={text}')
-        
-        # 「メニュー」コマンドの場合は状態をリセットしてメニューを表示
-        if text == 'メニュー':
-            set_user_state(user_id, 'welcome_sent')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            return
+            logger.exception('解約確認処理エラー: %s', e)
+            send_line_message(ctx.reply_token, [
+                {"type": "text", "text": "解約処理中にエラーが発生しました。もう一度お試しください。"},
+                get_menu_navigation_hint()
+            ])
+            return None
 
-        # 数字入力を受け付け、スプレッドシートの順序で解釈
-        try:
-            selection_index = int(text)
-        except ValueError:
-            selection_index = None
-
-        if selection_index is not None and selection_index >= 1:
-            from services.spreadsheet_content_service import spreadsheet_content_service
-            contents_result = spreadsheet_content_service.get_available_contents()
-            contents_dict = contents_result.get('contents', {})
-            contents_list = [content_info for _, content_info in contents_dict.items()]
-            if 1 <= selection_index <= len(contents_list):
-                selected = contents_list[selection_index - 1]
-                content_name = selected.get('name', f'コンテンツ{selection_index}')
-                description = selected.get('description') or 'このコンテンツを追加しますか？'
-                description = ' '.join(str(description).split())
-                
-                # 既存のコンテンツ数を確認して料金を決定
-                from utils.db import get_db_connection
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT COUNT(*) FROM company_contents WHERE company_id = %s AND status = %s', (company_id, 'active'))
-                existing_count = c.fetchone()[0]
-                conn.close()
-                
-                # 1個目は無料、2個目以降は有料
-                if existing_count == 0:
-                    price_short = " 料金:無料（初回コンテンツ）"
-                else:
-                    price = selected.get('price')
-                    price_short = f" 料金:{price:,}円/月" if isinstance(price, int) else ""
-
-                # 確認は大きいテンプレートボタン（はい/いいえ）
-                confirm_text = f"{price_short}\n\n追加しますか？"
-                set_user_state(user_id, f'add_confirm_{selection_index}')
-                send_line_message(
-                    event['replyToken'],
-                    [{
-                        "type": "template",
-                        "altText": "コンテンツ追加確認",
-                        "template": {
-                            "type": "buttons",
-                            "title": f"{content_name}を追加",
-                            "text": confirm_text,
-                            "actions": [
-                                {"type": "message", "label": "はい", "text": "はい"},
-                                {"type": "message", "label": "いいえ", "text": "いいえ"}
-                            ]
-                        }
-                    }]
-                )
-                return
-
-        # 無効な入力の場合、メインメニューを表示
-        set_user_state(user_id, 'welcome_sent')
-        from utils.message_templates import get_menu_message_company
-        send_line_message(event['replyToken'], [get_menu_message_company()])
-        return
-    elif state and str(state).startswith('add_confirm_'):
-        # ユーザーの「はい/いいえ」テキストで追加を確定
-        try:
-            num_str = str(state).replace('add_confirm_', '')
-            selection_index = int(num_str)
-        except Exception:
-            selection_index = None
-        normalized = str(text).strip().lower()
-        yes_words = {'はい', 'yes', 'y'}
-        no_words = {'いいえ', 'no', 'n'}
-        if selection_index is None:
-            set_user_state(user_id, 'welcome_sent')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            return
-        if normalized in yes_words:
-            from services.spreadsheet_content_service import spreadsheet_content_service
-            contents_result = spreadsheet_content_service.get_available_contents()
-            contents_dict = contents_result.get('contents', {})
-            contents_list = [content_info for _, content_info in contents_dict.items()]
-            if 1 <= selection_index <= len(contents_list):
-                content_name = contents_list[selection_index - 1].get('name')
-            else:
-                content_name = None
-            if not content_name:
-                set_user_state(user_id, 'welcome_sent')
-                send_line_message(event['replyToken'], [{"type": "text", "text": "無効な選択です。"}])
-                return
-            try:
-                result = handle_content_confirmation_company(company_id, content_name)
-                set_user_state(user_id, 'welcome_sent')
-                if result.get('success'):
-                    # テキストメッセージで追加完了を通知
-                    content_url = result.get('url', 'https://lp-production-9e2c.up.railway.app')
-                    success_message = f"🎉 {content_name}を追加しました\n\nアクセスはこちら\n{content_url}"
-                    from utils.message_templates import get_menu_navigation_hint
-                    send_line_message(event['replyToken'], [
-                        {"type": "text", "text": success_message},
-                        get_menu_navigation_hint()
-                    ])
-                else:
-                    error_message = result.get('error', f"❌ {content_name}の追加に失敗しました。")
-                    from utils.message_templates import get_menu_navigation_hint
-                    send_line_message(event['replyToken'], [
-                        {"type": "text", "text": error_message},
-                        get_menu_navigation_hint()
-                    ])
-                return
-            except Exception as e:
-                print(f"[ERROR] add_confirm 処理エラー: {e}")
-                import traceback; traceback.print_exc()
-                set_user_state(user_id, 'welcome_sent')
-                from utils.message_templates import get_menu_navigation_hint
-                send_line_message(event['replyToken'], [
-                    {"type": "text", "text": "❌ 追加処理でエラーが発生しました。"},
-                    get_menu_navigation_hint()
-                ])
-                return
-        elif normalized in no_words:
-            set_user_state(user_id, 'welcome_sent')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            return
-        else:
-            # 再確認
-            send_line_message(event['replyToken'], [{"type": "text", "text": "『はい』または『いいえ』と返信してください。"}])
-            return
+    # 無効な入力の場合、メインメニューを表示
+    logger.debug('無効な入力（解約確認状態）: user_id=%s, text=%s', ctx.user_id, ctx.text)
+    _send_menu(ctx)
+    return _idle()
 
-    elif state == 'cancel_select':
-        print(f'[DEBUG] 解約選択処理開始: user_id={user_id}, state={state}, text={text}')
-        
-        # 数字入力（全角/漢数字/英語数詞/ローマ数字含む）はそのまま解約選択処理へ委譲
-        try:
-            from services.line_service import smart_number_extraction
-            extracted = smart_number_extraction(str(text))
-        except Exception:
-            extracted = []
+def unknown_message(ctx):
+    # 登録されていないメッセージの場合、メニューを表示
+    logger.debug('登録されていないメッセージ: user_id=%s, text="%s", state=%s', ctx.user_id, ctx.text, ctx.state)
+    try:
+        _send_menu(ctx)
+        logger.debug('メニュー表示完了: text="%s"', ctx.text)
+    except Exception as e:
+        logger.exception('メニュー表示エラー: %s', e)
+        # フォールバックメッセージ
+        send_line_message(ctx.reply_token, [{"type": "text", "text": "📱 メニューから選択してください。\n\n• 「追加」：コンテンツを追加\n• 「状態」：利用状況を確認\n• 「解約」：解約メニューを表示\n• 「ヘルプ」：使い方を確認"}])
 
-        if extracted:
-            try:
-                handle_cancel_selection_company(event['replyToken'], company_id, stripe_subscription_id, str(text))
-                # 状態は選択後も cancel_select のままにし、確認ボタンの返信に備える
-                set_user_state(user_id, 'cancel_confirm')
-                return
-            except Exception as e:
-                print(f'[ERROR] 解約選択委譲エラー: {e}')
-                import traceback; traceback.print_exc()
-                from utils.message_templates import get_menu_navigation_hint
-                send_line_message(event['replyToken'], [
-                    {"type": "text", "text": "解約処理に失敗しました。もう一度お試しください。"},
-                    get_menu_navigation_hint()
-                ])
-                return
-
-        # 「メニュー」コマンドの場合は状態をリセットしてメニューを表示
-        if text == 'メニュー':
-            print(f'[DEBUG] メニューコマンド処理: user_id={user_id}')
-            set_user_state(user_id, 'welcome_sent')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            return
-        
-        # 無効な入力の場合、再案内
-        print(f'[DEBUG] 無効な入力: user_id={user_id}, text={text}')
-        send_line_message(event['replyToken'], [{"type": "text", "text": "番号で解約対象を指定してください。例: 1\nメニューに戻る場合は『メニュー』と送信してください。"}])
+line_command_router.fallback(unknown_message)
+
+# --- postbackの処理 ---
+
+SHARE_MESSAGE = """📢 友達に紹介
+
+AIコレクションズをご利用いただき、ありがとうございます！
+
+🤝 友達にもおすすめしませんか？
+• 基本料金月額3,900円
+• 追加コンテンツ1件1,500円
+• 企業向けAIツールを効率的に利用
+
+🔗 紹介URL：
+https://lp-production-9e2c.up.railway.app
+
+友達が登録すると、あなたにも特典があります！"""
+
+@line_command_router.postback('action=add_content')
+def postback_add_content(ctx):
+    handle_add_content_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id)
+
+@line_command_router.postback('action=check_status')
+def postback_check_status(ctx):
+    handle_status_check_company(ctx.reply_token, ctx.company_id)
+
+@line_command_router.postback('action=cancel_content')
+def postback_cancel_content(ctx):
+    handle_cancel_menu_company(ctx.reply_token, ctx.company_id, ctx.stripe_subscription_id)
+
+@line_command_router.postback('action=help')
+def postback_help(ctx):
+    send_line_message(ctx.reply_token, get_help_message_company())
+
+@line_command_router.postback('action=share')
+def postback_share(ctx):
+    send_line_message(ctx.reply_token, [{"type": "text", "text": SHARE_MESSAGE}])
+
+@line_command_router.postback_prefix('company_confirm_add_')
+def postback_confirm_add(ctx):
+    num_str = ctx.text.replace('company_confirm_add_', '')
+    try:
+        index = int(num_str)
+    except ValueError:
+        index = None
+    if not index or index < 1:
+        send_line_message(ctx.reply_token, [{"type": "text", "text": "無効な選択です。"}])
         return
-    elif state == 'cancel_confirm':
-        print(f'[DEBUG] 解約確認状態での処理: user_id={user_id}, state={state}, text={text}')
-        
-        # 解約確認処理
-        if text.startswith('解約確認_'):
-            print(f'[DEBUG] 解約確認処理開始: text={text}')
-            
-            try:
-                # 解約確認処理を実行
-                handle_cancel_confirmation_company(event['replyToken'], company_id, stripe_subscription_id, text)
-                
-                # 状態をリセット
-                set_user_state(user_id, 'welcome_sent')
-                print(f'[DEBUG] ユーザー状態をリセット: user_id={user_id}')
-                return
-                
-            except Exception as e:
-                print(f'[ERROR] 解約確認処理エラー: {e}')
-                import traceback
-                traceback.print_exc()
-                from utils.message_templates import get_menu_navigation_hint
-                send_line_message(event['replyToken'], [
-                    {"type": "text", "text": "解約処理中にエラーが発生しました。もう一度お試しください。"},
-                    get_menu_navigation_hint()
-                ])
-                return
-                
-        # 「メニュー」コマンドの場合は状態をリセットしてメニューを表示
-        elif text == 'メニュー':
-            print(f'[DEBUG] メニューコマンド処理: user_id={user_id}')
-            set_user_state(user_id, 'welcome_sent')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            return
+    # スプレッドシートの順序でコンテンツ名を取得
+    contents_list = _available_contents_list()
+    if index > len(contents_list):
+        send_line_message(ctx.reply_token, [{"type": "text", "text": "無効な選択です。"}])
+        return
+    content_name = contents_list[index - 1].get('name')
+    if not content_name:
+        send_line_message(ctx.reply_token, [{"type": "text", "text": "無効な選択です。"}])
+        return
+    try:
+        result = handle_content_confirmation_company(ctx.company_id, content_name)
+        if result['success']:
+            content_url = result.get('url', 'https://lp-production-9e2c.up.railway.app')
+            success_message = f"🎉 {content_name}を追加しました\n\nアクセスはこちら\n{content_url}"
+            send_line_message(ctx.reply_token, [{"type": "text", "text": success_message}])
         else:
-            print(f'[DEBUG] 無効な入力（解約確認状態）: user_id={user_id}, text={text}')
-            # 無効な入力の場合、メインメニューを表示
-            set_user_state(user_id, 'welcome_sent')
-            from utils.message_templates import get_menu_message_company
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            return
-    else:
-        # 登録されていないメッセージの場合、メニューを表示
-        print(f'[DEBUG] 登録されていないメッセージ: user_id={user_id}, text="{text}", state="{state}"')
-        print(f'[DEBUG] 状態の詳細: state_type={type(state)}, state_value="{state}"')
-        print(f'[DEBUG] 条件チェック: text=="追加"={text=="追加"}, text=="1"={text=="1"}, state=="add_select"={state=="add_select"}')
-        try:
-            from utils.message_templates import get_menu_message_company
-            print(f'[DEBUG] メニューメッセージ送信開始: reply_token={event["replyToken"][:20]}...')
-            send_line_message(event['replyToken'], [get_menu_message_company()])
-            print(f'[DEBUG] メニュー表示完了: text="{text}"')
-        except Exception as e:
-            print(f'[ERROR] メニュー表示エラー: {e}')
-            import traceback
-            traceback.print_exc()
-            # フォールバックメッセージ
-            send_line_message(event['replyToken'], [{"type": "text", "text": "📱 メニューから選択してください。\n\n• 「追加」：コンテンツを追加\n• 「状態」：利用状況を確認\n• 「解約」：解約メニューを表示\n• 「ヘルプ」：使い方を確認"}])
+            error_message = result.get('error', f"❌ {content_name}の追加に失敗しました。")
+            send_line_message(ctx.reply_token, [{"type": "text", "text": error_message}])
+    except Exception as e:
+        logger.exception("company_confirm_add 処理エラー: %s", e)
+        send_line_message(ctx.reply_token, [{"type": "text", "text": "❌ 追加処理でエラーが発生しました。"}])
+
+@line_command_router.postback('company_cancel_add')
+def postback_cancel_add(ctx):
+    _send_menu(ctx)
+
+line_command_router.compile()
 
 def handle_postback_event(event):
     """postbackイベントの処理"""
@@ -1134,71 +1212,15 @@ def handle_postback_event(event):
     company_id, stripe_subscription_id = company_info
     
     # postbackデータに基づいて処理
-    if postback_data == 'action=add_content':
-        handle_add_content_company(event['replyToken'], company_id, stripe_subscription_id)
-    elif postback_data == 'action=check_status':
-        handle_status_check_company(event['replyToken'], company_id)
-    elif postback_data == 'action=cancel_content':
-        handle_cancel_menu_company(event['replyToken'], company_id, stripe_subscription_id)
-    elif postback_data == 'action=help':
-        send_line_message(event['replyToken'], get_help_message_company())
-    elif postback_data == 'action=share':
-        share_message = """📢 友達に紹介
-
-AIコレクションズをご利用いただき、ありがとうございます！
-
-🤝 友達にもおすすめしませんか？
-• 基本料金月額3,900円
-• 追加コンテンツ1件1,500円
-• 企業向けAIツールを効率的に利用
-
-🔗 紹介URL：
-https://lp-production-9e2c.up.railway.app
-
-友達が登録すると、あなたにも特典があります！"""
-        send_line_message(event['replyToken'], [{"type": "text", "text": share_message}]) 
-    elif postback_data.startswith('company_confirm_add_'):
-        num_str = postback_data.replace('company_confirm_add_', '')
-        try:
-            index = int(num_str)
-        except ValueError:
-            index = None
-        if not index or index < 1:
-            send_line_message(event['replyToken'], [{"type": "text", "text": "無効な選択です。"}])
-            return
-        # スプレッドシートの順序でコンテンツ名を取得
-        from services.spreadsheet_content_service import spreadsheet_content_service
-        contents_result = spreadsheet_content_service.get_available_contents()
-        contents_dict = contents_result.get('contents', {})
-        contents_list = [content_info for _, content_info in contents_dict.items()]
-        if index > len(contents_list):
-            send_line_message(event['replyToken'], [{"type": "text", "text": "無効な選択です。"}])
-            return
-        content_name = contents_list[index - 1].get('name')
-        if not content_name:
-            send_line_message(event['replyToken'], [{"type": "text", "text": "無効な選択です。"}])
-            return
-        try:
-            result = handle_content_confirmation_company(company_id, content_name)
-            if result['success']:
-                content_url = result.get('url', 'https://lp-production-9e2c.up.railway.app')
-                success_message = f"🎉 {content_type}を追加しました\n\nアクセスはこちら\n{content_url}"
-                send_line_message(event['replyToken'], [{"type": "text", "text": success_message}])
-            else:
-                error_message = result.get('error', f"❌ {content_type}の追加に失敗しました。")
-                send_line_message(event['replyToken'], [{"type": "text", "text": error_message}])
-        except Exception as e:
-            print(f"[ERROR] company_confirm_add 処理エラー: {e}")
-            import traceback; traceback.print_exc()
-            send_line_message(event['replyToken'], [{"type": "text", "text": "❌ 追加処理でエラーが発生しました。"}])
-    elif postback_data == 'company_cancel_add':
-        send_line_message(event['replyToken'], [get_menu_message_company()])
+    ctx = CommandContext(event, user_id, postback_data, company_id, stripe_subscription_id)
+    if not line_command_router.dispatch_postback(ctx, postback_data):
+        logger.debug('未対応のpostback: %s', postback_data)
 
 @line_bp.route('/line/debug/test_email_linking/<email>')
 def debug_test_email_linking(email):
     """デバッグ用：メールアドレス連携処理のテスト"""
     try:
-        print(f'[DEBUG] メールアドレス連携テスト開始: email={email}')
+        logger.debug('メールアドレス連携テスト開始: email=%s', email)
         
         def normalize_email(email):
             email = email.strip().lower()
@@ -1206,7 +1228,7 @@ def debug_test_email_linking(email):
             return email
         
         normalized_email = normalize_email(email)
-        print(f'[DEBUG] 正規化後のメールアドレス: {normalized_email}')
+        logger.debug('正規化後のメールアドレス: %s', normalized_email)
         
         conn = get_db_connection()
         c = conn.cursor()
@@ -1214,11 +1236,11 @@ def debug_test_email_linking(email):
         # メールアドレスで企業データを検索
         c.execute('SELECT id, company_name, email FROM companies WHERE email = %s', (normalized_email,))
         company = c.fetchone()
-        print(f'[DEBUG] 企業データ検索結果: {company}')
+        logger.debug('企業データ検索結果: %s', company)
         
         if company:
             company_id, company_name, email = company
-            print(f'[DEBUG] 企業データ発見: company_id={company_id}, company_name={company_name}')
+            logger.debug('企業データ発見: company_id=%s, company_name=%s', company_id, company_name)
             
             return jsonify({
                 'success': True,
@@ -1228,7 +1250,7 @@ def debug_test_email_linking(email):
                 'message': f'企業データが見つかりました: {company_name}'
             })
         else:
-            print(f'[DEBUG] 企業データが見つかりません: email={normalized_email}')
+            logger.debug('企業データが見つかりません: email=%s', normalized_email)
             return jsonify({
                 'success': False,
                 'message': f'企業データが見つかりません: {normalized_email}'
@@ -1237,9 +1259,7 @@ def debug_test_email_linking(email):
         conn.close()
         
     except Exception as e:
-        print(f'[DEBUG] メールアドレス連携テストエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('メールアドレス連携テストエラー: %s', e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -9,6 +9,7 @@ from services.line_api_service import line_api_service
 from services.company_service import CompanyService
 from utils.db import get_db_connection
 from services.line_service import send_company_welcome_message
+from utils.identity_cache import invalidate_line_user, invalidate_company
 
 # インスタンスを作成
 company_service = CompanyService()
@@ -295,6 +296,8 @@ def link_company_user():
 
         # 他のユーザーIDが入っている場合でも上書き（重複登録防止のため最新を採用）
         c.execute('UPDATE companies SET line_user_id = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s', (line_user_id, company_id))
+        invalidate_line_user(line_user_id, c)
+        invalidate_company(company_id, c)
         conn.commit()
         conn.close()
 
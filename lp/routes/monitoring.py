@@ -1,10 +1,13 @@
 from flask import Blueprint, request, jsonify
 from services.monitoring_service import monitoring_service
+from services.security_service import require_admin
 import json
 import os
 from datetime import datetime, timedelta
+from utils.statement_timeout import declare_statement_timeout
 
 monitoring_bp = Blueprint('monitoring', __name__, url_prefix='/api/v1/monitoring')
+declare_statement_timeout(monitoring_bp, 'admin')
 
 @monitoring_bp.route('/health', methods=['GET'])
 def get_system_health():
@@ -144,6 +147,194 @@ def get_database_health():
             'error': f'データベース健全性取得エラー: {str(e)}'
         }), 500
 
+@monitoring_bp.route('/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """DBコネクションプール統計を取得"""
+    try:
+        from utils.db import get_pool_stats, get_replica_stats
+        return jsonify({
+            'success': True,
+            'pools': get_pool_stats(),
+            'replica': get_replica_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'DBプール統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/webhook-queue', methods=['GET'])
+def get_webhook_queue_stats():
+    """Webhookイベント処理キューの統計（深さ・待ち時間・処理件数・重複排除）を取得"""
+    try:
+        from utils.event_queue import get_event_queue_stats
+        from utils.idempotency import get_dedup_stats
+        return jsonify({
+            'success': True,
+            'queues': get_event_queue_stats(),
+            'dedup': get_dedup_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Webhookキュー統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/webhook-inbox', methods=['GET'])
+def get_webhook_inbox_stats():
+    """Webhook受信箱の状態別件数と回収・リプレイ件数を取得"""
+    try:
+        from utils.webhook_inbox import webhook_inbox
+        return jsonify({
+            'success': True,
+            'inbox': webhook_inbox.stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Webhook受信箱統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/webhook-inbox/replay', methods=['POST'])
+@require_admin
+def replay_webhook_inbox():
+    """受信日時の範囲を指定してWebhookイベントを再実行"""
+    try:
+        from utils.webhook_inbox import webhook_inbox, parse_time
+        data = request.get_json() or {}
+        if not data.get('since') or not data.get('until'):
+            return jsonify({
+                'success': False,
+                'error': 'since と until を指定してください'
+            }), 400
+
+        count = webhook_inbox.replay(
+            parse_time(data['since']),
+            parse_time(data['until']),
+            source=data.get('source'),
+            statuses=data.get('statuses'),
+            dry_run=bool(data.get('dry_run', False))
+        )
+        return jsonify({
+            'success': True,
+            'dry_run': bool(data.get('dry_run', False)),
+            'count': count
+        }), 200
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'日時の形式が不正です: {str(e)}'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Webhookリプレイエラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/caches', methods=['GET'])
+def get_local_cache_stats():
+    """プロセス内キャッシュ（会話状態など）のヒット率と無効化件数を取得"""
+    try:
+        from utils.local_cache import get_cache_stats
+        from utils.channel_credentials import get_channel_credentials_stats
+        from utils.reply_token_ledger import get_reply_token_stats
+        return jsonify({
+            'success': True,
+            **get_cache_stats(),
+            'channel_credentials': get_channel_credentials_stats(),
+            'reply_tokens': get_reply_token_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'キャッシュ統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/line-api', methods=['GET'])
+def get_line_api_metrics():
+    """LINE API呼び出しのエンドポイント別レイテンシ・ステータス・再試行数を取得"""
+    try:
+        from utils.line_client import get_line_api_stats
+        return jsonify({
+            'success': True,
+            'line_api': get_line_api_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'LINE API統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/line-outbound', methods=['GET'])
+def get_line_outbound_status():
+    """LINEプッシュ送信キューの件数・レート制限の状態と未再送のデッドレターを取得"""
+    try:
+        from utils.outbound_queue import line_outbound
+        return jsonify({
+            'success': True,
+            'queue': line_outbound.stats(),
+            'dead_letters': line_outbound.dead_letters(limit=request.args.get('limit', 50, type=int))
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'LINE送信キュー統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/line-outbound/requeue', methods=['POST'])
+@require_admin
+def requeue_line_outbound():
+    """デッドレターを送信キューに積み直す（ids を省略すると古い順に limit 件）"""
+    try:
+        from utils.outbound_queue import line_outbound
+        data = request.get_json() or {}
+        count = line_outbound.requeue_dead_letters(
+            ids=data.get('ids'),
+            limit=int(data.get('limit', 100))
+        )
+        return jsonify({
+            'success': True,
+            'count': count
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'デッドレター再送エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/logging', methods=['GET'])
+def get_logging_status():
+    """ログ出力キューの深さ・破棄件数とモジュール別レベルを取得"""
+    try:
+        from utils.logging_config import get_logging_stats
+        return jsonify({
+            'success': True,
+            'logging': get_logging_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'ログ統計取得エラー: {str(e)}'
+        }), 500
+
+@monitoring_bp.route('/db-queries', methods=['GET'])
+def get_db_query_metrics():
+    """SQL計測結果（クエリ数・時間・上位ステートメント）を取得"""
+    try:
+        from utils.db_metrics import get_query_metrics
+        from utils.prepared_statements import get_prepared_statement_stats
+        top = request.args.get('top', 20, type=int)
+        return jsonify({
+            'success': True,
+            'metrics': get_query_metrics(top),
+            'prepared_statements': get_prepared_statement_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'SQL計測結果取得エラー: {str(e)}'
+        }), 500
+
 @monitoring_bp.route('/system', methods=['GET'])
 def get_system_resources():
     """システムリソースを取得"""
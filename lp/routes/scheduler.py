@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
 from services.scheduler_service import scheduler_service
 import json
+from utils.statement_timeout import declare_statement_timeout
 
 scheduler_bp = Blueprint('scheduler', __name__, url_prefix='/api/v1/scheduler')
+declare_statement_timeout(scheduler_bp, 'batch')
 
 @scheduler_bp.route('/start', methods=['POST'])
 def start_scheduler():
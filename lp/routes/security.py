@@ -2,8 +2,10 @@ from flask import Blueprint, request, jsonify
 from services.security_service import security_service, require_auth, require_admin
 import json
 from datetime import datetime
+from utils.statement_timeout import declare_statement_timeout
 
 security_bp = Blueprint('security', __name__, url_prefix='/api/v1/security')
+declare_statement_timeout(security_bp, 'admin')
 
 @security_bp.route('/login', methods=['POST'])
 def login():
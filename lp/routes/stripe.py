@@ -5,8 +5,10 @@ import traceback
 from datetime import datetime, timedelta
 from utils.db import get_db_connection
 from services.stripe_payment_service import stripe_payment_service
+from utils.statement_timeout import declare_statement_timeout
 
 stripe_bp = Blueprint('stripe', __name__)
+declare_statement_timeout(stripe_bp, 'webhook')
 
 @stripe_bp.route('/webhook', methods=['POST'])
 def stripe_webhook():
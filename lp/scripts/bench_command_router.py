@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+コマンドルーターの振り分けコストを計測するマイクロベンチマーク。
+
+実行内容:
+1) LINE Webhookのルーター（routes/line.py の line_command_router）で、
+   代表的なテキスト・会話状態の組み合わせを振り分ける1メッセージあたりの時間
+2) 登録コマンド数を増やした場合の比較（表引き と 従来の if/elif 相当の線形探索）
+
+処理関数は実行せず、振り分け（resolve）だけを計測します。
+
+使用例:
+  python lp/scripts/bench_command_router.py
+  python lp/scripts/bench_command_router.py --iterations 500000
+"""
+
+import os
+import sys
+import timeit
+import argparse
+
+# パッケージパスを追加（scripts/ の親である lp/ を sys.path に入れる）
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(CURRENT_DIR)
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from utils.command_router import CommandRouter  # noqa: E402
+
+# (テキスト, 現在の状態名)
+SAMPLE_MESSAGES = [
+    ('メニュー', 'welcome_sent'),
+    ('追加', 'welcome_sent'),
+    ('2', 'add_select'),
+    ('はい', 'add_confirm'),
+    ('解約確認_1', 'cancel_confirm'),
+    ('こんにちは', 'welcome_sent'),
+]
+
+
+def per_call_ns(func, iterations):
+    return timeit.timeit(func, number=iterations) / iterations * 1e9
+
+
+def bench_line_router(iterations):
+    from routes.line import line_command_router
+    messages = SAMPLE_MESSAGES
+    resolve = line_command_router.resolve
+
+    def run():
+        for text, state in messages:
+            resolve(text, state)
+
+    return per_call_ns(run, iterations // len(messages)) / len(messages)
+
+
+def build_router(size):
+    router = CommandRouter(f'bench-{size}', save_state=lambda user_id, state: None, idle_state='idle')
+    for i in range(size):
+        router.command(f'command-{i}')(lambda ctx: None)
+    router.fallback(lambda ctx: None)
+    return router.compile()
+
+
+def linear_chain(size):
+    # if/elif を上から順に比較する従来の方式と同じ計算量
+    commands = [f'command-{i}' for i in range(size)]
+
+    def resolve(text):
+        for command in commands:
+            if text == command:
+                return command
+        return None
+
+    return resolve
+
+
+def bench_scaling(iterations, sizes):
+    rows = []
+    for size in sizes:
+        router = build_router(size)
+        chain = linear_chain(size)
+        # 最後に登録したコマンド（if/elif では最悪ケース）
+        text = f'command-{size - 1}'
+        table_ns = per_call_ns(lambda: router.resolve(text, 'idle'), iterations)
+        chain_ns = per_call_ns(lambda: chain(text), max(1, iterations // max(1, size // 10)))
+        rows.append((size, table_ns, chain_ns))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コマンドルーターのマイクロベンチマーク')
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--sizes', default='10,100,1000,10000', help='登録コマンド数（カンマ区切り）')
+    args = parser.parse_args()
+
+    print(f'LINEルーター: {bench_line_router(args.iterations):.0f} ns/メッセージ '
+          f'({len(SAMPLE_MESSAGES)}種類のテキスト・状態の平均)')
+    print()
+    print(f'{"コマンド数":>10} {"表引き(ns)":>12} {"線形探索(ns)":>14}')
+    for size, table_ns, chain_ns in bench_scaling(args.iterations, [int(s) for s in args.sizes.split(',')]):
+        print(f'{size:>10} {table_ns:>12.0f} {chain_ns:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
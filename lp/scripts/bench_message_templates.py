@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+「メニュー」「ヘルプ」返信の送信ボディ作成コストを計測するマイクロベンチマーク。
+
+実行内容:
+  メッセージの取得から送信ボディ（JSONのバイト列）の作成までを、
+  - 登録済みテンプレート（utils/template_registry.py）のバイト列を継ぎ足す方式
+  - 従来の方式（毎回辞書を作り、検証して requests と同じ json.dumps でボディを作る）
+  で比較し、1返信あたりの時間と一時的に確保したメモリ量を表示する。
+  HTTP送信は行わない。
+
+使用例:
+  python lp/scripts/bench_message_templates.py
+  python lp/scripts/bench_message_templates.py --iterations 200000
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+import tracemalloc
+
+# パッケージパスを追加（scripts/ の親である lp/ を sys.path に入れる）
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(CURRENT_DIR)
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from utils.template_registry import template_registry, validate_message  # noqa: E402
+import utils.message_templates  # noqa: E402,F401  テンプレートを登録する
+
+REPLY_TOKEN = 'nHuyWiB7yP5Zw52FIkcQobQuGDXCTA'
+SERVICES_TEXT = '📅 AI予定秘書：スケジュール管理・会議調整\n💰 AI経理秘書：見積書・請求書作成\n'
+
+
+def prepared_body(messages):
+    # line_api.reply_encoded と同じ組み立て
+    return b''.join((b'{"replyToken":', json.dumps(REPLY_TOKEN).encode('ascii'),
+                     b',"messages":[', b','.join(msg.encoded for msg in messages), b']}'))
+
+
+def legacy_body(messages):
+    for msg in messages:
+        validate_message(msg)
+    return json.dumps({'replyToken': REPLY_TOKEN, 'messages': messages}).encode('utf-8')
+
+
+def legacy_menu():
+    # 従来の get_menu_message_company() と同じ辞書を毎回作る
+    return {
+        "type": "template",
+        "altText": "メニュー",
+        "template": {
+            "type": "buttons",
+            "title": "メニュー",
+            "text": "ご希望の機能を選択してください。",
+            "actions": [
+                {"type": "message", "label": "コンテンツ追加", "text": "追加"},
+                {"type": "message", "label": "利用状況確認", "text": "状態"},
+                {"type": "message", "label": "解約", "text": "解約"},
+                {"type": "message", "label": "ヘルプ", "text": "ヘルプ"}
+            ]
+        }
+    }
+
+
+HELP_TEXT = template_registry.compiled('help_company').message['text']
+
+
+def legacy_help(services_text):
+    # 従来の get_help_message_company() と同じく f文字列で本文を作る
+    return [{"type": "text", "text": HELP_TEXT.replace('{services_text}', services_text)}, legacy_menu()]
+
+
+def cases():
+    return {
+        'メニュー': (
+            lambda: prepared_body([template_registry.get('menu')]),
+            lambda: legacy_body([legacy_menu()]),
+        ),
+        'ヘルプ': (
+            lambda: prepared_body([template_registry.render('help_company', services_text=SERVICES_TEXT),
+                                   template_registry.get('menu')]),
+            lambda: legacy_body(legacy_help(SERVICES_TEXT)),
+        ),
+    }
+
+
+def per_call_ns(func, iterations):
+    return timeit.timeit(func, number=iterations) / iterations * 1e9
+
+
+def peak_bytes(func):
+    """1回の作成で一時的に確保したメモリの最大量（送信ボディ自体を含む）"""
+    func()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+def main():
+    parser = argparse.ArgumentParser(description='返信ボディ作成のマイクロベンチマーク')
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, (prepared, legacy) in cases().items():
+        assert json.loads(prepared()) == json.loads(legacy()), name
+        prepared_ns = per_call_ns(prepared, args.iterations)
+        legacy_ns = per_call_ns(legacy, args.iterations)
+        print(f'{name}: 登録済み {prepared_ns:,.0f} ns / 従来 {legacy_ns:,.0f} ns '
+              f'({legacy_ns / prepared_ns:.1f}倍)')
+        print(f'    一時メモリ: 登録済み {peak_bytes(prepared):,} bytes / 従来 {peak_bytes(legacy):,} bytes, '
+              f'ボディ {len(prepared())} bytes（従来 {len(legacy())} bytes、ASCIIエスケープあり）')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+返信トークン台帳（utils/reply_token_ledger.py）の1メッセージあたりのコストを計測するベンチマーク。
+
+実行内容:
+1) メッセージ流量（件/秒）ごとに、保持期間内のトークンが溜まった定常状態での
+   1メッセージあたりの判定・記録時間を比較
+   - 時間バケット方式（TimeBucketedSet）
+   - 従来の方式（送信のたびに全トークンの時刻を走査して期限切れを消す）
+   時刻は仮想時計で進めるため、実時間を待たずに高い流量を再現できる。
+2) 既定のバックエンド（db）の ReplyTokenLedger.claim() の時間
+   返信ごとの共有テーブル（used_reply_tokens）への自動コミットの INSERT と、
+   バケットが変わるたびの期限切れの行の DELETE を含む。こちらも仮想時計で
+   --db-rate の流量を再現し、保持期間分の行が溜まった定常状態で計測する。
+   接続先は DATABASE_URL（未設定なら一時ディレクトリのSQLite）。
+
+--backend memory で 1) のみ、--backend db で 2) のみを実行する（既定は両方）。
+
+使用例:
+  python lp/scripts/bench_reply_token_ledger.py
+  python lp/scripts/bench_reply_token_ledger.py --backend memory --rates 10,100,1000,10000 --messages 20000
+  DATABASE_URL=postgresql://... python lp/scripts/bench_reply_token_ledger.py --backend db --db-rate 100
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+
+# パッケージパスを追加（scripts/ の親である lp/ を sys.path に入れる）
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(CURRENT_DIR)
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from utils.reply_token_ledger import (  # noqa: E402
+    TimeBucketedSet, ReplyTokenLedger, REPLY_TOKEN_TTL, create_used_reply_tokens_table,
+)
+from utils.db import get_db_connection  # noqa: E402
+from utils.dialect import get_dialect, reset_dialect  # noqa: E402
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LegacyTokenSet:
+    """従来の send_line_message の関数属性による管理と同じ処理"""
+
+    def __init__(self, ttl, clock):
+        self.ttl = ttl
+        self.clock = clock
+        self.used_tokens = set()
+        self.token_times = {}
+
+    def add(self, token):
+        if token in self.used_tokens:
+            return False
+        self.used_tokens.add(token)
+        current_time = self.clock()
+        expired_tokens = [t for t, timestamp in self.token_times.items() if current_time - timestamp > self.ttl]
+        for t in expired_tokens:
+            self.used_tokens.discard(t)
+            del self.token_times[t]
+        self.token_times[token] = current_time
+        return True
+
+    def preload(self, tokens, clock, step):
+        # 定常状態の作成（add() を使うと保持件数の2乗に比例するため直接入れる）
+        for token in tokens:
+            clock.now += step
+            self.used_tokens.add(token)
+            self.token_times[token] = clock.now
+
+    def __len__(self):
+        return len(self.token_times)
+
+
+def make_tokens(count):
+    return [uuid.uuid4().hex for _ in range(count)]
+
+
+def run_at_rate(make_set, rate, ttl, messages):
+    """流量 rate で ttl 秒分を流して定常状態にしてから messages 件を計測（ns/件）"""
+    clock = VirtualClock()
+    token_set = make_set(clock)
+    step = 1.0 / rate
+    warmup = make_tokens(int(rate * ttl))
+    if hasattr(token_set, 'preload'):
+        token_set.preload(warmup, clock, step)
+    else:
+        for token in warmup:
+            clock.now += step
+            token_set.add(token)
+    tokens = make_tokens(messages)
+    started = time.perf_counter()
+    for token in tokens:
+        clock.now += step
+        token_set.add(token)
+    return (time.perf_counter() - started) / messages * 1e9, len(token_set)
+
+
+def bench_rates(rates, ttl, messages, legacy_limit):
+    rows = []
+    for rate in rates:
+        bucketed_ns, live = run_at_rate(lambda clock: TimeBucketedSet(ttl, 5, clock=clock), rate, ttl, messages)
+        legacy_ns = None
+        if live <= legacy_limit:
+            # 従来方式は1件ごとに保持件数分を走査するため、走査の合計が legacy_limit 程度になるよう件数を絞る
+            legacy_ns, _ = run_at_rate(lambda clock: LegacyTokenSet(ttl, clock), rate, ttl,
+                                       max(20, min(messages, legacy_limit // max(1, live))))
+        rows.append((rate, live, bucketed_ns, legacy_ns))
+    return rows
+
+
+def _latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'count': 0, 'avg_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0}
+    return {
+        'count': len(latencies),
+        'avg_ms': sum(latencies) * 1000 / len(latencies),
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000,
+    }
+
+
+def prepare_db():
+    """計測用の接続先を用意（DATABASE_URL が無ければ一時SQLite）。一時ディレクトリを返す"""
+    temp_dir = None
+    if not (os.getenv('RAILWAY_DATABASE_URL') or os.getenv('DATABASE_URL')):
+        temp_dir = tempfile.mkdtemp(prefix='reply-token-bench-')
+        os.environ['DATABASE_URL'] = os.path.join(temp_dir, 'bench.db')
+    reset_dialect()
+    conn = get_db_connection()
+    try:
+        create_used_reply_tokens_table(conn.cursor(), get_dialect())
+        conn.commit()
+    finally:
+        conn.close()
+    return temp_dir
+
+
+def bench_db(messages, rate, ttl):
+    """流量 rate で ttl 秒分を記録して定常状態にしてから messages 件の claim() を計測"""
+    clock = VirtualClock()
+    ledger = ReplyTokenLedger(backend='db', ttl=ttl, clock=clock)
+    step = 1.0 / rate
+    for token in make_tokens(int(rate * ttl)):
+        clock.now += step
+        ledger.claim(token)
+
+    tokens = make_tokens(messages)
+    inserts, with_cleanup = [], []
+    for token in tokens:
+        clock.now += step
+        cleaned_bucket = ledger._cleaned_bucket
+        started = time.perf_counter()
+        ledger.claim(token)
+        elapsed = time.perf_counter() - started
+        # バケットが変わった回は期限切れの行の DELETE も実行している
+        (inserts if ledger._cleaned_bucket == cleaned_bucket else with_cleanup).append(elapsed)
+
+    # 別ワーカー相当のインスタンス（プロセス内の集合が空）では共有テーブルで再利用を検出する
+    other = ReplyTokenLedger(backend='db', ttl=ttl, clock=clock)
+    duplicate_started = time.perf_counter()
+    duplicates = sum(1 for token in tokens[-100:] if not other.claim(token))
+    duplicate_ms = (time.perf_counter() - duplicate_started) * 1000 / 100
+    return {
+        'dialect': get_dialect().name,
+        'all': _latency_summary(inserts + with_cleanup),
+        'insert': _latency_summary(inserts),
+        'cleanup': _latency_summary(with_cleanup),
+        'cross_worker_duplicates': duplicates,
+        'duplicate_check_ms': duplicate_ms,
+        'stats': ledger.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='返信トークン台帳のベンチマーク')
+    parser.add_argument('--rates', default='10,100,1000,10000', help='メッセージ流量（件/秒、カンマ区切り）')
+    parser.add_argument('--ttl', type=float, default=REPLY_TOKEN_TTL, help='保持期間（秒）')
+    parser.add_argument('--messages', type=int, default=50000, help='計測するメッセージ数')
+    parser.add_argument('--legacy-limit', type=int, default=5_000_000,
+                        help='従来方式の計測で走査するトークン数の目安（保持件数がこれを超える流量は省略）')
+    parser.add_argument('--backend', choices=('all', 'memory', 'db'), default='all',
+                        help='計測するバックエンド（memory: プロセス内の集合のみ、db: 共有テーブル込みの claim()）')
+    parser.add_argument('--db-messages', type=int, default=2000, help='db で計測する返信数')
+    parser.add_argument('--db-rate', type=float, default=50, help='db で再現する流量（件/秒）')
+    args = parser.parse_args()
+
+    if args.backend in ('all', 'memory'):
+        print(f'保持期間 {args.ttl:.0f} 秒、定常状態での1メッセージあたりの時間')
+        print(f'{"流量(件/秒)":>12} {"保持件数":>10} {"時間バケット(ns)":>18} {"従来方式(ns)":>14}')
+        for rate, live, bucketed_ns, legacy_ns in bench_rates(
+                [int(r) for r in args.rates.split(',')], args.ttl, args.messages, args.legacy_limit):
+            legacy = f'{legacy_ns:>14.0f}' if legacy_ns is not None else f'{"(省略)":>14}'
+            print(f'{rate:>12} {live:>10} {bucketed_ns:>18.0f} {legacy}')
+
+    if args.backend in ('all', 'db'):
+        temp_dir = prepare_db()
+        try:
+            result = bench_db(args.db_messages, args.db_rate, args.ttl)
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        print()
+        print(f'共有テーブル込みの claim() ({result["dialect"]}, {args.db_rate:g} 件/秒, '
+              f'保持 {result["stats"]["local_size"]} 件)')
+        for label, key in (('全体', 'all'), ('INSERTのみ', 'insert'), ('DELETEを含む回', 'cleanup')):
+            summary = result[key]
+            print(f'  {label}: {summary["count"]} 件, 平均 {summary["avg_ms"]:.3f} ms, '
+                  f'p50 {summary["p50_ms"]:.3f} ms, p95 {summary["p95_ms"]:.3f} ms')
+        print(f'別ワーカー相当のインスタンスで検出した再利用: {result["cross_worker_duplicates"]}/100 '
+              f'({result["duplicate_check_ms"]:.3f} ms/件)')
+        print(f'統計: {result["stats"]}')
+
+
+if __name__ == '__main__':
+    main()
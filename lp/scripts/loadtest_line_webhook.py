@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+LINE Webhookのオフライン負荷試験・ベンチマーク。
+
+実行内容:
+1) 一時SQLite（または使い捨てのPostgreSQL）に企業・月額サブスクリプションを作成
+2) 仮想ユーザーごとに 友だち追加 → メールアドレス連携 → 追加/状態/解約/postback の会話を
+   署名付きWebhookとして /line/webhook へ送信（Flaskテストクライアント）
+3) LINE API・Stripe・Google Sheets はプロセス内の偽サーバーで応答し、外部へは通信しない
+4) events/sec、p50/p95/p99 レイテンシ、1イベントあたりのクエリ数を表示
+
+使用例:
+  python lp/scripts/loadtest_line_webhook.py
+  python lp/scripts/loadtest_line_webhook.py --users 200 --flows-per-user 10 --concurrency 8
+  python lp/scripts/loadtest_line_webhook.py --database postgresql://postgres@localhost/lp_loadtest
+  python lp/scripts/loadtest_line_webhook.py --mix add_content=1,status=4 --json result.json
+  # CIでの回帰検知（閾値を超えたら終了コード1）
+  python lp/scripts/loadtest_line_webhook.py --max-error-rate 0 --max-queries-per-event 12
+
+注意:
+ - PostgreSQLを指定する場合は companies が空の使い捨てのデータベースを使ってください。
+ - SQLiteではPostgreSQL専用のSQL（NOW()、RETURNING付きUPDATEなど）を使う処理は失敗し、
+   その分は各処理のエラー応答として計測されます。本番相当の数値はPostgreSQLで取ってください。
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# パッケージパスを追加（scripts/ の親である lp/ を sys.path に入れる）
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(CURRENT_DIR)
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from loadtest.payloads import SCENARIOS, parse_mix  # noqa: E402
+from loadtest.runner import run_load_test, format_report  # noqa: E402
+
+
+def check_thresholds(report, args):
+    """閾値を超えた項目のメッセージ一覧"""
+    violations = []
+    if args.max_error_rate is not None and report['errors']['error_rate'] > args.max_error_rate:
+        violations.append(f"error_rate {report['errors']['error_rate']} > {args.max_error_rate}")
+    if args.max_queries_per_event is not None and report['queries_per_event'] > args.max_queries_per_event:
+        violations.append(f"queries_per_event {report['queries_per_event']} > {args.max_queries_per_event}")
+    if args.max_p95_ms is not None and report['latency']['p95_ms'] > args.max_p95_ms:
+        violations.append(f"p95 {report['latency']['p95_ms']}ms > {args.max_p95_ms}ms")
+    if args.min_events_per_sec is not None and report['events_per_sec'] < args.min_events_per_sec:
+        violations.append(f"events_per_sec {report['events_per_sec']} < {args.min_events_per_sec}")
+    if report['errors']['blocked_outbound']:
+        violations.append(f"unexpected outbound requests: {report['errors']['blocked_outbound']}")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LINE Webhookのオフライン負荷試験')
+    parser.add_argument('--users', type=int, default=50, help='仮想ユーザー数（=企業数）')
+    parser.add_argument('--flows-per-user', type=int, default=5, help='onboarding 後に行うシナリオ数')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時に送信するクライアント数')
+    parser.add_argument('--database', help='接続先（省略時は一時SQLite、postgresql://... も可）')
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='ワーカープールで処理（応答時間は受付までの時間になる）')
+    parser.add_argument('--mix', help=f'シナリオの比率（例: add_content=3,status=1）。'
+                                      f'シナリオ: {", ".join(name for name in SCENARIOS if name != "onboarding")}')
+    parser.add_argument('--seed', type=int, default=0, help='シナリオ選択の乱数シード')
+    parser.add_argument('--line-latency-ms', type=float, default=0.0, help='偽LINE APIの応答遅延')
+    parser.add_argument('--stripe-latency-ms', type=float, default=0.0, help='偽Stripe APIの応答遅延')
+    parser.add_argument('--json', metavar='FILE', help='結果をJSONで書き出し')
+    parser.add_argument('--keep-database', action='store_true', help='一時SQLiteを削除しない')
+    parser.add_argument('--verbose', action='store_true', help='アプリのデバッグ出力を表示')
+    parser.add_argument('--max-error-rate', type=float)
+    parser.add_argument('--max-queries-per-event', type=float)
+    parser.add_argument('--max-p95-ms', type=float)
+    parser.add_argument('--min-events-per-sec', type=float)
+    args = parser.parse_args()
+
+    report = run_load_test(
+        users=args.users,
+        flows_per_user=args.flows_per_user,
+        concurrency=args.concurrency,
+        database_url=args.database,
+        async_mode=args.async_mode,
+        mix=parse_mix(args.mix) if args.mix else None,
+        seed=args.seed,
+        line_latency=args.line_latency_ms / 1000.0,
+        stripe_latency=args.stripe_latency_ms / 1000.0,
+        verbose=args.verbose,
+        keep_database=args.keep_database,
+    )
+    print(format_report(report))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+
+    violations = check_thresholds(report, args)
+    if violations:
+        print()
+        for violation in violations:
+            print(f'閾値超過: {violation}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Webhook受信箱のイベントを再実行・書き出しするユーティリティ。
+
+実行内容:
+1) webhook_inbox テーブルから受信日時の範囲（since 以上 until 未満）のイベントを取得
+2) 現在のコードで再実行（受信箱には新しい行として追記される）
+   または --export でJSONに書き出し（負荷試験・回帰確認用のコーパス）
+
+使用例:
+  python lp/scripts/replay_webhook_inbox.py --since 2025-01-01T09:00 --until 2025-01-01T10:00 --dry-run
+  python lp/scripts/replay_webhook_inbox.py --since 2025-01-01T09:00 --until 2025-01-01T10:00 --source line --status failed --status dead
+  python lp/scripts/replay_webhook_inbox.py --since 2025-01-01 --until 2025-01-02 --export corpus.json
+
+注意:
+ - 日時はDBの received_at と同じ基準（SQLiteはUTC）で指定します。
+ - 返信トークンは受信から時間が経つと失効するため、返信を伴うイベントは再実行しても返信できません。
+ - 接続情報は環境変数 RAILWAY_DATABASE_URL または DATABASE_URL を使用します。
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# パッケージパスを追加（scripts/ の親である lp/ を sys.path に入れる）
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(CURRENT_DIR)
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from utils.webhook_inbox import webhook_inbox, parse_time, STATUSES  # noqa: E402
+
+
+def register_handlers():
+    """送信元ごとの処理関数を登録（各ルートの読み込み時に登録される）"""
+    import routes.line  # noqa: F401
+    import routes.ai_schedule_webhook  # noqa: F401
+
+
+def export_events(entries, path):
+    corpus = [
+        {'id': entry.id, 'source': entry.source, 'company_id': entry.company_id, 'event': entry.event}
+        for entry in entries
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2)
+    return len(corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook受信箱のリプレイ')
+    parser.add_argument('--since', required=True, help='開始日時（ISO形式、この時刻を含む）')
+    parser.add_argument('--until', required=True, help='終了日時（ISO形式、この時刻を含まない）')
+    parser.add_argument('--source', help='送信元（line / ai_schedule）')
+    parser.add_argument('--status', action='append', choices=STATUSES, help='対象の処理状態（複数指定可）')
+    parser.add_argument('--dry-run', action='store_true', help='対象件数のみ表示')
+    parser.add_argument('--export', metavar='FILE', help='再実行せずにJSONへ書き出し')
+    args = parser.parse_args()
+
+    since = parse_time(args.since)
+    until = parse_time(args.until)
+
+    if args.export:
+        entries = webhook_inbox.find(since, until, args.source, args.status)
+        count = export_events(entries, args.export)
+        print(f'書き出し完了: {count}件 -> {args.export}')
+        return
+
+    register_handlers()
+    count = webhook_inbox.replay(since, until, args.source, args.status, dry_run=args.dry_run)
+    if args.dry_run:
+        print(f'対象イベント: {count}件（dry-run）')
+        return
+
+    # ワーカープールに積んだイベントの処理完了を待つ
+    from utils.event_queue import drain_pools
+    drain_pools(timeout=60)
+    print(f'再実行完了: {count}件')
+
+
+if __name__ == '__main__':
+    main()
@@ -231,7 +231,7 @@ class AnalyticsService:
     def _get_historical_data(self, metric_type, company_id=None):
         """過去データを取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             if metric_type == 'revenue':
@@ -534,7 +534,7 @@ class AnalyticsService:
     def _get_customer_data(self, company_id=None):
         """顧客データを取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             if company_id:
@@ -4,9 +4,14 @@ import zipfile
 import shutil
 from datetime import datetime, timedelta
 from utils.db import get_db_connection
+from utils.bulk import bulk_insert, copy_rows
 from services.company_service import CompanyService
 from services.cancellation_service import cancellation_service
 
+def _parse_datetime(value):
+    """バックアップ内のISO形式日時を変換（未設定はNone）"""
+    return datetime.fromisoformat(value) if value else None
+
 class BackupService:
     """データバックアップサービス"""
     
@@ -48,8 +53,8 @@ class BackupService:
                 }
             }
             
-            # 企業関連データを取得
-            conn = get_db_connection()
+            # 企業関連データを取得（レポート系の読み取りはレプリカへ）
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             # LINEアカウント情報
@@ -285,101 +290,81 @@ class BackupService:
                         ))
                         print(f"✅ 企業「{company_name}」を作成しました")
                     
+                    # 以降は1行ずつではなくテーブル単位でまとめて書き込む
+                    now = datetime.now()
+                    
                     # LINEアカウント情報を復元
-                    for line_account in backup_data.get('line_accounts', []):
-                        c.execute('''
-                            INSERT INTO company_line_accounts (
-                                company_id, line_account_id, line_account_name, created_at
-                            ) VALUES (%s, %s, %s, %s)
-                            ON CONFLICT (company_id, line_account_id) DO NOTHING
-                        ''', (
+                    bulk_insert(c, 'company_line_accounts',
+                        ('company_id', 'line_account_id', 'line_account_name', 'created_at'),
+                        [(
                             company_id,
                             line_account['line_account_id'],
                             line_account['line_account_name'],
-                            datetime.now()
-                        ))
+                            now
+                        ) for line_account in backup_data.get('line_accounts', [])],
+                        conflict_columns=('company_id', 'line_account_id'))
                     
                     # 支払い情報を復元
-                    for payment in backup_data.get('payments', []):
-                        c.execute('''
-                            INSERT INTO company_payments (
-                                company_id, stripe_customer_id, stripe_subscription_id,
-                                subscription_status, current_period_start, current_period_end,
-                                trial_start, trial_end, created_at, updated_at
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (company_id) DO UPDATE SET
-                                stripe_customer_id = EXCLUDED.stripe_customer_id,
-                                stripe_subscription_id = EXCLUDED.stripe_subscription_id,
-                                subscription_status = EXCLUDED.subscription_status,
-                                current_period_start = EXCLUDED.current_period_start,
-                                current_period_end = EXCLUDED.current_period_end,
-                                trial_start = EXCLUDED.trial_start,
-                                trial_end = EXCLUDED.trial_end,
-                                updated_at = EXCLUDED.updated_at
-                        ''', (
+                    bulk_insert(c, 'company_payments',
+                        ('company_id', 'stripe_customer_id', 'stripe_subscription_id',
+                         'subscription_status', 'current_period_start', 'current_period_end',
+                         'trial_start', 'trial_end', 'created_at', 'updated_at'),
+                        [(
                             company_id,
                             payment['stripe_customer_id'],
                             payment['stripe_subscription_id'],
                             payment['subscription_status'],
-                            datetime.fromisoformat(payment['current_period_start']) if payment['current_period_start'] else None,
-                            datetime.fromisoformat(payment['current_period_end']) if payment['current_period_end'] else None,
-                            datetime.fromisoformat(payment['trial_start']) if payment['trial_start'] else None,
-                            datetime.fromisoformat(payment['trial_end']) if payment['trial_end'] else None,
-                            datetime.now(),
-                            datetime.now()
-                        ))
+                            _parse_datetime(payment['current_period_start']),
+                            _parse_datetime(payment['current_period_end']),
+                            _parse_datetime(payment['trial_start']),
+                            _parse_datetime(payment['trial_end']),
+                            now,
+                            now
+                        ) for payment in backup_data.get('payments', [])],
+                        conflict_columns=('company_id',),
+                        update_columns=('stripe_customer_id', 'stripe_subscription_id',
+                                        'subscription_status', 'current_period_start', 'current_period_end',
+                                        'trial_start', 'trial_end', 'updated_at'))
                     
                     # コンテンツ情報を復元
-                    for content in backup_data.get('contents', []):
-                        c.execute('''
-                            INSERT INTO company_contents (
-                                company_id, content_type, content_name, content_url,
-                                is_active, created_at, updated_at
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (company_id, content_type) DO UPDATE SET
-                                content_name = EXCLUDED.content_name,
-                                content_url = EXCLUDED.content_url,
-                                is_active = EXCLUDED.is_active,
-                                updated_at = EXCLUDED.updated_at
-                        ''', (
+                    bulk_insert(c, 'company_contents',
+                        ('company_id', 'content_type', 'content_name', 'content_url',
+                         'is_active', 'created_at', 'updated_at'),
+                        [(
                             company_id,
                             content['content_type'],
                             content['content_name'],
                             content['content_url'],
                             content['is_active'],
-                            datetime.now(),
-                            datetime.now()
-                        ))
+                            now,
+                            now
+                        ) for content in backup_data.get('contents', [])],
+                        conflict_columns=('company_id', 'content_type'),
+                        update_columns=('content_name', 'content_url', 'is_active', 'updated_at'))
                     
                     # 通知履歴を復元（最新100件のみ）
-                    for notification in backup_data.get('notifications', [])[:100]:
-                        c.execute('''
-                            INSERT INTO company_notifications (
-                                company_id, notification_type, notification_data, sent_at
-                            ) VALUES (%s, %s, %s, %s)
-                            ON CONFLICT DO NOTHING
-                        ''', (
+                    # 一意制約はidのみで競合しないため、追記はCOPYで行う
+                    copy_rows(c, 'company_notifications',
+                        ('company_id', 'notification_type', 'notification_data', 'sent_at'),
+                        [(
                             company_id,
                             notification['notification_type'],
                             json.dumps(notification['notification_data'], ensure_ascii=False),
-                            datetime.fromisoformat(notification['sent_at']) if notification['sent_at'] else datetime.now()
-                        ))
+                            _parse_datetime(notification['sent_at']) or now
+                        ) for notification in backup_data.get('notifications', [])[:100]])
                     
                     # 解約履歴を復元
-                    for cancellation in backup_data.get('cancellations', []):
-                        c.execute('''
-                            INSERT INTO company_cancellations (
-                                company_id, cancellation_reason, cancellation_notes,
-                                scheduled_deletion_date, cancelled_at
-                            ) VALUES (%s, %s, %s, %s, %s)
-                            ON CONFLICT DO NOTHING
-                        ''', (
+                    bulk_insert(c, 'company_cancellations',
+                        ('company_id', 'cancellation_reason', 'cancellation_notes',
+                         'scheduled_deletion_date', 'cancelled_at'),
+                        [(
                             company_id,
                             cancellation['cancellation_reason'],
                             cancellation['cancellation_notes'],
-                            datetime.fromisoformat(cancellation['scheduled_deletion_date']) if cancellation['scheduled_deletion_date'] else None,
-                            datetime.fromisoformat(cancellation['cancelled_at']) if cancellation['cancelled_at'] else datetime.now()
-                        ))
+                            _parse_datetime(cancellation['scheduled_deletion_date']),
+                            _parse_datetime(cancellation['cancelled_at']) or now
+                        ) for cancellation in backup_data.get('cancellations', [])],
+                        conflict_columns=())
                     
                     conn.commit()
                     conn.close()
@@ -2,6 +2,7 @@ import os
 import stripe
 from datetime import datetime
 from utils.db import get_db_connection, get_db_type
+from utils.unit_of_work import release_for_external_call
 
 class BillingPeriodSyncService:
     """請求期間同期サービス"""
@@ -19,6 +20,7 @@ class BillingPeriodSyncService:
             print(f"[DEBUG] 使用量レコード期間同期開始: subscription_id={stripe_subscription_id}")
             
             # Stripeサブスクリプションを取得
+            release_for_external_call()
             subscription = stripe.Subscription.retrieve(stripe_subscription_id)
             
             # 従量課金アイテムを取得（複数の条件で検索）
@@ -70,6 +72,7 @@ class BillingPeriodSyncService:
                 active_content_count = 1  # フォールバック
             
             # 月額サブスクリプションの期間に合わせて使用量レコードを作成
+            release_for_external_call()
             stripe.UsageRecord.create(
                 subscription_item=usage_item['id'],
                 quantity=active_content_count,  # 実際のアクティブコンテンツ数
@@ -91,6 +94,7 @@ class BillingPeriodSyncService:
         サブスクリプションの請求期間を取得
         """
         try:
+            release_for_external_call()
             subscription = stripe.Subscription.retrieve(stripe_subscription_id)
             
             # UTCタイムスタンプをJSTに変換
@@ -125,6 +129,7 @@ class BillingPeriodSyncService:
                 return None
             
             # 請求書を作成
+            release_for_external_call()
             invoice = stripe.Invoice.create(
                 subscription=stripe_subscription_id,
                 auto_advance=False
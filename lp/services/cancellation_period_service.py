@@ -2,6 +2,7 @@ import os
 import stripe
 from datetime import datetime
 from utils.db import get_db_connection, get_db_type
+from utils.unit_of_work import release_for_external_call
 
 class CancellationPeriodService:
     """cancellation_historyテーブルを使用した契約期間管理サービス"""
@@ -16,6 +17,7 @@ class CancellationPeriodService:
         """
         try:
             # Stripe APIでサブスクリプション情報を取得
+            release_for_external_call()
             subscription = stripe.Subscription.retrieve(stripe_subscription_id)
             
             conn = get_db_connection()
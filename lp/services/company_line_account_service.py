@@ -6,11 +6,12 @@
 """
 
 import os
-import requests
 import json
 import time
 from datetime import datetime
 from utils.db import get_db_connection
+from utils.channel_credentials import invalidate_channel_credentials
+from utils.line_client import line_api
 
 class CompanyLineAccountService:
     """企業別LINEアカウント管理サービス"""
@@ -89,6 +90,7 @@ class CompanyLineAccountService:
             ))
             
             account_id = c.fetchone()[0]
+            invalidate_channel_credentials(company_id, c)
             
             # 8. 企業情報を更新
             c.execute('''
@@ -213,6 +215,7 @@ class CompanyLineAccountService:
                     'error': '更新対象のLINEアカウントが見つかりません'
                 }
             
+            invalidate_channel_credentials(company_id, c)
             conn.commit()
             conn.close()
             
@@ -257,6 +260,7 @@ class CompanyLineAccountService:
                 SET status = 'inactive', updated_at = CURRENT_TIMESTAMP
                 WHERE company_id = %s
             ''', (company_id,))
+            invalidate_channel_credentials(company_id, c)
             
             conn.commit()
             conn.close()
@@ -334,26 +338,15 @@ class CompanyLineAccountService:
             account = account_result['account']
             
             # LINE Messaging APIを使用してメッセージを送信
-            headers = {
-                'Authorization': f'Bearer {account["access_token"]}',
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                'to': account['channel_id'],
-                'messages': [
+            response = line_api.push(
+                account['channel_id'],
+                [
                     {
                         'type': 'text',
                         'text': message
                     }
-                ]
-            }
-            
-            response = requests.post(
-                'https://api.line.me/v2/bot/message/push',
-                headers=headers,
-                json=data,
-                timeout=10
+                ],
+                access_token=account['access_token']
             )
             
             if response.status_code == 200:
@@ -3,10 +3,11 @@
 """
 
 import os
-import requests
 import json
 from datetime import datetime
 from utils.db import get_db_connection
+from utils.channel_credentials import invalidate_channel_credentials
+from utils.line_client import line_api
 
 class CompanyLineService:
     """企業用LINEアカウント管理サービス"""
@@ -82,6 +83,7 @@ class CompanyLineService:
                 line_data['webhookUrl'],
                 'active'
             ))
+            invalidate_channel_credentials(company_id, c)
             
             conn.commit()
             conn.close()
@@ -167,6 +169,7 @@ class CompanyLineService:
             if c.rowcount == 0:
                 return {'success': False, 'error': 'LINEアカウントが見つかりません'}
             
+            invalidate_channel_credentials(company_id, c)
             conn.commit()
             conn.close()
             
@@ -235,11 +238,6 @@ class CompanyLineService:
             line_account = line_account_result['line_account']
             
             # LINE Messaging APIでメッセージ送信
-            headers = {
-                'Authorization': f'Bearer {line_account["channel_access_token"]}',
-                'Content-Type': 'application/json'
-            }
-            
             # メッセージデータの構築
             if isinstance(message_data, str):
                 # テキストメッセージの場合
@@ -260,9 +258,10 @@ class CompanyLineService:
                 }
             
             # LINE Messaging APIに送信
-            response = requests.post(
+            response = line_api.post(
                 f"{self.line_api_base}/bot/message/push",
-                headers=headers,
+                access_token=line_account["channel_access_token"],
+                retry_key=True,
                 json=payload
             )
             
@@ -289,15 +288,10 @@ class CompanyLineService:
             line_account = line_account_result['line_account']
             
             # LINE Messaging APIで統計情報を取得
-            headers = {
-                'Authorization': f'Bearer {line_account["channel_access_token"]}',
-                'Content-Type': 'application/json'
-            }
-            
             # 友達数取得
-            friends_response = requests.get(
+            friends_response = line_api.get(
                 f"{self.line_api_base}/bot/profile",
-                headers=headers
+                access_token=line_account["channel_access_token"]
             )
             
             # 実際の実装では、LINE APIから統計情報を取得
@@ -329,18 +323,14 @@ class CompanyLineService:
             line_account = line_account_result['line_account']
             
             # LINE Messaging APIでWebhook URLを設定
-            headers = {
-                'Authorization': f'Bearer {line_account["channel_access_token"]}',
-                'Content-Type': 'application/json'
-            }
-            
             webhook_data = {
                 'endpoint': webhook_url
             }
             
-            response = requests.put(
+            response = line_api.request(
+                'PUT',
                 f"{self.line_api_base}/bot/channel/webhook/endpoint",
-                headers=headers,
+                access_token=line_account["channel_access_token"],
                 json=webhook_data
             )
             
@@ -378,6 +368,7 @@ class CompanyLineService:
             if c.rowcount == 0:
                 return {'success': False, 'error': 'LINEアカウントが見つかりません'}
             
+            invalidate_channel_credentials(company_id, c)
             conn.commit()
             conn.close()
             
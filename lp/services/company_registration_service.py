@@ -13,6 +13,8 @@ import hashlib
 import subprocess
 from datetime import datetime
 from utils.db import get_db_connection
+from utils.channel_credentials import invalidate_channel_credentials
+from utils.line_client import line_api
 from services.company_line_account_service import company_line_service
 
 class CompanyRegistrationService:
@@ -733,6 +735,7 @@ jobs:
             ))
             
             line_account_id = c.fetchone()[0]
+            invalidate_channel_credentials(company_id, c)
             
             # 4. サブスクリプション情報を保存（決済完了後の場合）
             if data.get('subscription_id'):
@@ -929,6 +932,7 @@ jobs:
                 datetime.now(),
                 company_id
             ))
+            invalidate_channel_credentials(company_id, c)
             
             conn.commit()
             conn.close()
@@ -1121,12 +1125,8 @@ jobs:
         """LINE認証情報を検証"""
         try:
             # LINE APIでプロフィール取得をテスト
-            headers = {
-                'Authorization': f'Bearer {line_credentials["line_channel_access_token"]}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.get('https://api.line.me/v2/bot/profile/U1234567890abcdef', headers=headers, timeout=10)
+            response = line_api.get_profile('U1234567890abcdef',
+                                            access_token=line_credentials["line_channel_access_token"])
             
             if response.status_code == 200:
                 return {
@@ -1271,6 +1271,7 @@ jobs:
                     datetime.now(),
                     company_id
                 ))
+                invalidate_channel_credentials(company_id, c)
                 
             else:
                 # 新規企業を作成
@@ -1326,6 +1327,7 @@ jobs:
                 ))
                 
                 line_account_id = c.fetchone()[0]
+                invalidate_channel_credentials(company_id, c)
             
             # Railwayプロジェクトの自動複製（無効化）
             railway_result = None
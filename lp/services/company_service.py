@@ -8,6 +8,7 @@ import uuid
 import json
 from datetime import datetime, timedelta
 from utils.db import get_db_connection
+from utils.bulk import bulk_insert
 from services.stripe_service import check_subscription_status
 
 def check_company_restriction(line_channel_id, content_type):
@@ -340,17 +341,10 @@ class CompanyService:
                 'content_removed'
             ]
             
-            for notification_type in notification_types:
-                c.execute('''
-                    INSERT INTO company_notifications (
-                        company_id, notification_type, is_enabled, recipients
-                    ) VALUES (%s, %s, %s, %s)
-                ''', (
-                    company_id,
-                    notification_type,
-                    True,
-                    json.dumps({'email': True, 'line': True})
-                ))
+            recipients = json.dumps({'email': True, 'line': True})
+            bulk_insert(c, 'company_notifications',
+                ('company_id', 'notification_type', 'is_enabled', 'recipients'),
+                [(company_id, notification_type, True, recipients) for notification_type in notification_types])
             
             conn.commit()
             conn.close()
@@ -262,7 +262,7 @@ class ContentManagementService:
     def get_all_company_contents(self):
         """全企業のコンテンツ一覧を取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             c.execute('''
@@ -15,7 +15,7 @@ class DashboardService:
     def get_overview_statistics(self):
         """概要統計を取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             # 企業統計
@@ -101,7 +101,7 @@ class DashboardService:
     def get_cancellation_statistics(self):
         """解約統計を取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             # 解約理由別統計
@@ -181,7 +181,7 @@ class DashboardService:
             if not notification_stats['success']:
                 return notification_stats
             
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             # 通知タイプ別統計（詳細）
@@ -263,7 +263,7 @@ class DashboardService:
     def get_company_analytics(self, company_id=None):
         """企業分析データを取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             if company_id:
@@ -405,7 +405,7 @@ class DashboardService:
     def get_revenue_analytics(self):
         """収益分析データを取得"""
         try:
-            conn = get_db_connection()
+            conn = get_db_connection(readonly=True)
             c = conn.cursor()
             
             # 月別収益統計（過去12ヶ月）
@@ -12,6 +12,7 @@ import random
 import string
 from datetime import datetime
 from utils.db import get_db_connection
+from utils.channel_credentials import invalidate_channel_credentials
 
 class LineAPIService:
     """LINE API連携サービス"""
@@ -64,6 +65,7 @@ class LineAPIService:
             ))
             
             line_account_id = c.fetchone()[0]
+            invalidate_channel_credentials(company_id, c)
             conn.commit()
             conn.close()
             
@@ -298,6 +300,7 @@ class LineAPIService:
                 DELETE FROM company_line_accounts
                 WHERE company_id = %s
             ''', (company_id,))
+            invalidate_channel_credentials(company_id, c)
             
             conn.commit()
             conn.close()
@@ -2,125 +2,78 @@ import requests
 import psycopg2
 import os
 import stripe
-import traceback
-import time
+import logging
 from datetime import datetime, timedelta
-from utils.db import get_db_connection, get_db_type
+from utils.db import get_db_connection
+from utils.dialect import get_dialect
+from utils.identity_cache import invalidate_company
+from utils.logging_config import lazy_json, redact
+from utils.line_client import line_api
+from utils.outbound_queue import enqueue_push
+from utils.reply_token_ledger import claim_reply_token
+from utils.template_registry import validate_message, encode_message
+from utils.unit_of_work import release_for_external_call
 from services.stripe_service import check_subscription_status
 import re
 from services.subscription_period_service import SubscriptionPeriodService
-import json
+
+logger = logging.getLogger(__name__)
 
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 
 def send_line_message(reply_token, messages):
     """LINEメッセージ送信（複数メッセージ対応）"""
-    print(f'[DEBUG] send_line_message開始: reply_token={reply_token[:20]}...')
+    logger.debug('send_line_message開始: reply_token=%s...', reply_token[:20])
     
     if not LINE_CHANNEL_ACCESS_TOKEN:
-        print('❌ LINE_CHANNEL_ACCESS_TOKENが設定されていません')
+        logger.error('❌ LINE_CHANNEL_ACCESS_TOKENが設定されていません')
         return
     
-    print(f'[DEBUG] LINE_CHANNEL_ACCESS_TOKEN確認: {LINE_CHANNEL_ACCESS_TOKEN[:20]}...')
-    
-    # replyTokenの重複使用チェック
-    if hasattr(send_line_message, 'used_tokens'):
-        if reply_token in send_line_message.used_tokens:
-            print(f'[WARN] replyTokenが既に使用済みです: {reply_token}')
-            return
-    else:
-        send_line_message.used_tokens = set()
-    
-    # replyTokenを記録
-    send_line_message.used_tokens.add(reply_token)
-    
-    # 古いトークンをクリア（30秒以上前のもの）
-    current_time = time.time()
-    if hasattr(send_line_message, 'token_times'):
-        expired_tokens = [token for token, timestamp in send_line_message.token_times.items() 
-                         if current_time - timestamp > 30]
-        for token in expired_tokens:
-            send_line_message.used_tokens.discard(token)
-            del send_line_message.token_times[token]
-    else:
-        send_line_message.token_times = {}
-    
-    send_line_message.token_times[reply_token] = current_time
-    
-    headers = {
-        'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
+    logger.debug('LINE_CHANNEL_ACCESS_TOKEN確認: %s', redact(LINE_CHANNEL_ACCESS_TOKEN))
     
-    # Authorizationはログ出力しない（機密値保護）
+    # replyTokenの重複使用チェック（全ワーカー共通の台帳に記録）
+    if not claim_reply_token(reply_token):
+        logger.warning('replyTokenが既に使用済みです: %s', reply_token)
+        return
     
     # 単一メッセージの場合はリスト化
     if not isinstance(messages, list):
         messages = [messages]
     
-    print(f'[DEBUG] メッセージ数: {len(messages)}')
+    logger.debug('メッセージ数: %s', len(messages))
     
-    # メッセージの検証と修正
-    validated_messages = []
+    # メッセージの検証と修正（登録済みテンプレートは検証・JSON化済みのものをそのまま使う）
+    encoded_messages = []
     for msg in messages:
-        if msg.get('type') == 'text':
-            # テキストメッセージの文字数制限（2000文字）
-            text = msg.get('text', '')
-            if len(text) > 2000:
-                print(f'[WARN] テキストが長すぎます（{len(text)}文字）。2000文字に制限します。')
-                msg['text'] = text[:1997] + '...'
-        elif msg.get('type') == 'template' and 'template' in msg:
-            tmpl = msg['template']
-            if tmpl.get('type') == 'buttons':
-                # actionsが5つ以上のボタンテンプレートがあれば4つまでに制限
-                if 'actions' in tmpl and len(tmpl['actions']) > 4:
-                    print('[WARN] actionsが5つ以上のため4つまでに自動制限します')
-                    tmpl['actions'] = tmpl['actions'][:4]
-                # テキストの文字数制限（120文字）
-                if 'text' in tmpl and len(tmpl['text']) > 120:
-                    print(f'[WARN] ボタンテンプレートのテキストが長すぎます（{len(tmpl["text"])}文字）。120文字に制限します。')
-                    tmpl['text'] = tmpl['text'][:117] + '...'
-        
-        validated_messages.append(msg)
+        encoded = getattr(msg, 'encoded', None)
+        if encoded is None:
+            validate_message(msg)
+            encoded = encode_message(msg)
+        encoded_messages.append(encoded)
     
-    data = {
-        'replyToken': reply_token,
-        'messages': validated_messages
-    }
-    
-    print('[DEBUG] LINE送信内容:', data)
-    print('[DEBUG] LINE API送信開始')
+    logger.debug('LINE送信内容: %s', lazy_json(messages))
     
     try:
-        print(f'[DEBUG] LINE APIリクエスト送信: URL=https://api.line.me/v2/bot/message/reply')
-        response = requests.post('https://api.line.me/v2/bot/message/reply', headers=headers, json=data, timeout=10)
-        print(f'[DEBUG] LINE APIレスポンス受信: status_code={response.status_code}')
+        # 共有セッションで送信（keep-alive・タイムアウト・再試行は line_api が扱う）
+        response = line_api.reply_encoded(reply_token, encoded_messages, access_token=LINE_CHANNEL_ACCESS_TOKEN)
+        logger.debug('LINE APIレスポンス受信: status_code=%s', response.status_code)
         
         if response.status_code == 200:
-            print('[DEBUG] LINE送信成功')
+            logger.debug('LINE送信成功')
             return True
         else:
-            print(f'[ERROR] LINE送信失敗: status_code={response.status_code}, response={response.text}')
+            logger.error('LINE送信失敗: status_code=%s, response=%s', response.status_code, response.text)
             return False
             
     except requests.exceptions.Timeout:
-        print('[ERROR] LINE API送信タイムアウト')
-        # エラーログに記録
-        with open('error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now().isoformat()} - LINE API送信タイムアウト\n')
+        # error.log への記録はログの出力スレッドが行う（utils.logging_config）
+        logger.error('LINE API送信タイムアウト')
         return False
     except requests.exceptions.RequestException as e:
-        print(f'[ERROR] LINE API送信エラー: {e}')
-        # エラーログに記録
-        with open('error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now().isoformat()} - LINE API送信エラー: {str(e)}\n')
+        logger.error('LINE API送信エラー: %s', e)
         return False
     except Exception as e:
-        print(f'[ERROR] LINE送信予期しないエラー: {e}')
-        # エラーログに記録
-        with open('error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now().isoformat()} - LINE送信予期しないエラー: {str(e)}\n')
-            f.write(traceback.format_exc() + '\n')
+        logger.exception('LINE送信予期しないエラー: %s', e)
         return False
 
 def send_welcome_with_buttons(reply_token):
@@ -192,29 +145,10 @@ def send_welcome_with_buttons_push(user_id):
         }
     }
     
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}'
-    }
-    
-    push_data = {
-        'to': user_id,
-        'messages': [welcome_message]
-    }
-    
-    try:
-        response = requests.post(
-            'https://api.line.me/v2/bot/message/push',
-            headers=headers,
-            data=json.dumps(push_data)
-        )
-        
-        if response.status_code == 200:
-            print(f'[DEBUG] プッシュメッセージ送信成功: {user_id}')
-        else:
-            print(f'[DEBUG] プッシュメッセージ送信失敗: {response.status_code}, {response.text}')
-    except Exception as e:
-        print(f'[DEBUG] プッシュメッセージ送信エラー: {e}')
+    if enqueue_push(user_id, [welcome_message], source='welcome_buttons'):
+        logger.debug('プッシュメッセージ送信予約: %s', user_id)
+    else:
+        logger.debug('プッシュメッセージ送信予約失敗: %s', user_id)
 
 def handle_add_content(reply_token, user_id_db, stripe_subscription_id):
     """コンテンツ追加メニュー表示"""
@@ -249,8 +183,9 @@ def handle_add_content(reply_token, user_id_db, stripe_subscription_id):
         c = conn.cursor()
         
         # データベースタイプに応じて適切なプレースホルダーを使用
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         # 使用量ログを確認
         c.execute(f'SELECT COUNT(*) FROM usage_logs WHERE user_id = {placeholder}', (user_id_db,))
@@ -259,17 +194,17 @@ def handle_add_content(reply_token, user_id_db, stripe_subscription_id):
         # デバッグ用：実際のusage_logsを確認
         c.execute(f'SELECT id, content_type, created_at FROM usage_logs WHERE user_id = {placeholder} ORDER BY created_at', (user_id_db,))
         all_logs = c.fetchall()
-        print(f'[DEBUG] 全usage_logs: {all_logs}')
+        logger.debug('全usage_logs: %s', all_logs)
         
         # 同じコンテンツの追加回数を確認
         for content in available_contents:
             c.execute(f'SELECT COUNT(*) FROM usage_logs WHERE user_id = {placeholder} AND content_type = {placeholder}', (user_id_db, content['name']))
             same_content_count = c.fetchone()[0]
-            print(f'[DEBUG] {content["name"]}の追加回数: {same_content_count}')
+            logger.debug('%sの追加回数: %s', content["name"], same_content_count)
         
         conn.close()
         
-        print(f'[DEBUG] total_usage_count: {total_usage_count}')
+        logger.debug('total_usage_count: %s', total_usage_count)
         
         # コンテンツ選択メニューを作成
         actions = []
@@ -301,17 +236,16 @@ def handle_add_content(reply_token, user_id_db, stripe_subscription_id):
         send_line_message(reply_token, [message])
         
     except Exception as e:
-        print(f'[DEBUG] コンテンツ追加エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('コンテンツ追加エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "コンテンツ追加処理でエラーが発生しました。"}])
 
 def handle_content_selection(reply_token, user_id_db, stripe_subscription_id, content_id):
     """コンテンツ選択処理"""
     try:
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         # スプレッドシートからコンテンツ情報を取得
         from services.spreadsheet_content_service import spreadsheet_content_service
@@ -380,14 +314,13 @@ def handle_content_selection(reply_token, user_id_db, stripe_subscription_id, co
         conn.close()
         
     except Exception as e:
-        print(f'[ERROR] コンテンツ選択処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('コンテンツ選択処理エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "コンテンツ選択処理でエラーが発生しました。"}])
 
 def handle_cancel_request(reply_token, user_id_db, stripe_subscription_id):
     """解約リクエスト処理"""
     try:
+        release_for_external_call()
         subscription = stripe.Subscription.retrieve(stripe_subscription_id)
         items = subscription['items']['data']
         
@@ -399,18 +332,18 @@ def handle_cancel_request(reply_token, user_id_db, stripe_subscription_id):
         c = conn.cursor()
         
         # データベースタイプに応じて適切なプレースホルダーを使用
-        from utils.db import get_db_type
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         # 実際に追加されたコンテンツを取得
         c.execute(f'SELECT content_type, is_free FROM usage_logs WHERE user_id = {placeholder} ORDER BY created_at', (user_id_db,))
         added_contents = c.fetchall()
         conn.close()
         
-        print(f'[DEBUG] 解約対象コンテンツ取得: user_id={user_id_db}, count={len(added_contents)}')
+        logger.debug('解約対象コンテンツ取得: user_id=%s, count=%s', user_id_db, len(added_contents))
         for content in added_contents:
-            print(f'[DEBUG] コンテンツ: {content}')
+            logger.debug('コンテンツ: %s', content)
         
         content_choices = []
         choice_index = 1
@@ -481,9 +414,7 @@ def handle_cancel_request(reply_token, user_id_db, stripe_subscription_id):
         send_line_message(reply_token, [cancel_menu_message])
         
     except Exception as e:
-        print(f'[ERROR] 解約リクエスト処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('解約リクエスト処理エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "❌ エラーが発生しました。しばらく時間をおいて再度お試しください。"}])
 
 def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, selection_text):
@@ -491,6 +422,7 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
     try:
         # Stripeの設定は既にapp.pyで行われているため、ここでは不要
         
+        release_for_external_call()
         subscription = stripe.Subscription.retrieve(stripe_subscription_id)
         items = subscription['items']['data']
         
@@ -499,8 +431,9 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
         c = conn.cursor()
         
         # データベースタイプに応じて適切なプレースホルダーを使用
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         c.execute(f'SELECT id, content_type, is_free FROM usage_logs WHERE user_id = {placeholder} ORDER BY created_at', (user_id_db,))
         added_contents = c.fetchall()
@@ -510,15 +443,15 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
         valid_numbers, invalid_reasons, duplicates = validate_selection_numbers(numbers, len(added_contents))
         selected_indices = valid_numbers
         
-        print(f'[DEBUG] 選択テキスト: {selection_text}')
-        print(f'[DEBUG] 抽出された数字: {numbers}')
-        print(f'[DEBUG] 有効な選択インデックス: {selected_indices}')
-        print(f'[DEBUG] 最大選択可能数: {len(added_contents)}')
+        logger.debug('選択テキスト: %s', selection_text)
+        logger.debug('抽出された数字: %s', numbers)
+        logger.debug('有効な選択インデックス: %s', selected_indices)
+        logger.debug('最大選択可能数: %s', len(added_contents))
         
         if invalid_reasons:
-            print(f'[DEBUG] 無効な入力: {invalid_reasons}')
+            logger.debug('無効な入力: %s', invalid_reasons)
         if duplicates:
-            print(f'[DEBUG] 重複除去: {duplicates}')
+            logger.debug('重複除去: %s', duplicates)
         
         # LINEユーザーIDを事前に取得
         line_user_id = None
@@ -533,7 +466,7 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
         # 実際に追加されたコンテンツの処理
         for usage_id, content_type, is_free in added_contents:
             if content_type in ['AI予定秘書', 'AI経理秘書', 'AIタスクコンシェルジュ']:
-                print(f'[DEBUG] 処理中: choice_index={choice_index}, content_type={content_type}, usage_id={usage_id}')
+                logger.debug('処理中: choice_index=%s, content_type=%s, usage_id=%s', choice_index, content_type, usage_id)
                 if choice_index in selected_indices:
                     # まずstripe_usage_record_idを取得（削除前に）
                     stripe_usage_record_id = None
@@ -546,25 +479,26 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
                     # データベースからusage_logsを削除
                     c.execute('DELETE FROM usage_logs WHERE id = %s', (usage_id,))
                     cancelled.append(content_type)
-                    print(f'[DEBUG] 解約処理: content_type={content_type}, usage_id={usage_id}')
+                    logger.debug('解約処理: content_type=%s, usage_id=%s', content_type, usage_id)
                     
                     # StripeのInvoice Itemを削除（有料コンテンツの場合）
                     if stripe_usage_record_id:
                         try:
-                            print(f'[DEBUG] Stripe InvoiceItem削除開始: {stripe_usage_record_id}')
+                            logger.debug('Stripe InvoiceItem削除開始: %s', stripe_usage_record_id)
                             
                             # StripeのInvoice Itemを削除
+                            release_for_external_call()
                             invoice_item = stripe.InvoiceItem.retrieve(stripe_usage_record_id)
                             invoice_item.delete()
-                            print(f'[DEBUG] Stripe InvoiceItem削除成功: {stripe_usage_record_id}')
+                            logger.debug('Stripe InvoiceItem削除成功: %s', stripe_usage_record_id)
                         
                         except Exception as e:
-                            print(f'[DEBUG] Stripe InvoiceItem削除エラー: {e}')
+                            logger.debug('Stripe InvoiceItem削除エラー: %s', e)
                             # エラーが発生しても処理は続行
                 choice_index += 1
         
-        print(f'[DEBUG] 解約対象コンテンツ数: {len(cancelled)}')
-        print(f'[DEBUG] 解約対象: {cancelled}')
+        logger.debug('解約対象コンテンツ数: %s', len(cancelled))
+        logger.debug('解約対象: %s', cancelled)
         
         # データベースの変更をコミット
         conn.commit()
@@ -611,26 +545,10 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
             
             # push_messageで2通目のメッセージを送信
             if line_user_id:
-                headers = {
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}'
-                }
-                
-                push_data = {
-                    'to': line_user_id,
-                    'messages': [line_restriction_message]
-                }
-                
-                response = requests.post(
-                    'https://api.line.me/v2/bot/message/push',
-                    headers=headers,
-                    data=json.dumps(push_data)
-                )
-                
-                if response.status_code == 200:
-                    print(f'[DEBUG] 2通目の公式LINE制限メッセージ送信成功: {line_user_id}')
+                if enqueue_push(line_user_id, [line_restriction_message], source='cancel_content'):
+                    logger.debug('2通目の公式LINE制限メッセージ送信予約: %s', line_user_id)
                 else:
-                    print(f'[DEBUG] 2通目の公式LINE制限メッセージ送信失敗: {response.status_code}, {response.text}')
+                    logger.debug('2通目の公式LINE制限メッセージ送信予約失敗: %s', line_user_id)
             
             # 3通目: アクションボタン（push_messageで送信）
             cancel_buttons_message = {
@@ -662,23 +580,12 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
             
             # push_messageで3通目のボタンメッセージを送信
             if line_user_id:
-                push_data = {
-                    'to': line_user_id,
-                    'messages': [cancel_buttons_message]
-                }
-                
-                response = requests.post(
-                    'https://api.line.me/v2/bot/message/push',
-                    headers=headers,
-                    data=json.dumps(push_data)
-                )
-                
-                if response.status_code == 200:
-                    print(f'[DEBUG] 3通目のボタンメッセージ送信成功: {line_user_id}')
+                if enqueue_push(line_user_id, [cancel_buttons_message], source='cancel_content'):
+                    logger.debug('3通目のボタンメッセージ送信予約: %s', line_user_id)
                 else:
-                    print(f'[DEBUG] 3通目のボタンメッセージ送信失敗: {response.status_code}, {response.text}')
+                    logger.debug('3通目のボタンメッセージ送信予約失敗: %s', line_user_id)
             else:
-                print(f'[DEBUG] LINEユーザーIDが見つかりません: user_id_db={user_id_db}')
+                logger.debug('LINEユーザーIDが見つかりません: user_id_db=%s', user_id_db)
             
             # 請求期間についての説明を別メッセージで送信（push_messageで送信）
             if is_trial_period:
@@ -694,34 +601,21 @@ def handle_cancel_selection(reply_token, user_id_db, stripe_subscription_id, sel
             
             # push_messageで3通目のメッセージを送信
             if line_user_id:
-                push_data = {
-                    'to': line_user_id,
-                    'messages': [period_message]
-                }
-                
-                response = requests.post(
-                    'https://api.line.me/v2/bot/message/push',
-                    headers=headers,
-                    data=json.dumps(push_data)
-                )
-                
-                if response.status_code == 200:
-                    print(f'[DEBUG] 3通目の期間説明メッセージ送信成功: {line_user_id}')
+                if enqueue_push(line_user_id, [period_message], source='cancel_content'):
+                    logger.debug('3通目の期間説明メッセージ送信予約: %s', line_user_id)
                 else:
-                    print(f'[DEBUG] 3通目の期間説明メッセージ送信失敗: {response.status_code}, {response.text}')
+                    logger.debug('3通目の期間説明メッセージ送信予約失敗: %s', line_user_id)
             
             # ユーザー状態をリセット
             from models.user_state import clear_user_state
             if line_user_id:
                 clear_user_state(line_user_id)
-                print(f'[DEBUG] ユーザー状態リセット: {line_user_id}')
+                logger.debug('ユーザー状態リセット: %s', line_user_id)
         else:
             send_line_message(reply_token, [{"type": "text", "text": "有効な番号が選択されませんでした。もう一度お試しください。"}])
     
     except Exception as e:
-        print(f'[ERROR] 解約選択処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('解約選択処理エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "❌ エラーが発生しました。しばらく時間をおいて再度お試しください。"}])
 
 def handle_subscription_cancel(reply_token, user_id_db, stripe_subscription_id):
@@ -734,6 +628,7 @@ def handle_subscription_cancel(reply_token, user_id_db, stripe_subscription_id):
         if is_trial_period:
             # トライアル期間中の場合は、期間終了時に解約
             try:
+                release_for_external_call()
                 stripe.Subscription.modify(
                     stripe_subscription_id,
                     cancel_at_period_end=True
@@ -756,7 +651,7 @@ def handle_subscription_cancel(reply_token, user_id_db, stripe_subscription_id):
                 }
                 send_line_message(reply_token, [cancel_message])
             except Exception as e:
-                print(f'[DEBUG] Stripe解約エラー: {e}')
+                logger.debug('Stripe解約エラー: %s', e)
                 error_message = {
                     "type": "text",
                     "text": "❌ 解約処理中にエラーが発生しました。しばらく時間をおいて再度お試しください。"
@@ -765,6 +660,7 @@ def handle_subscription_cancel(reply_token, user_id_db, stripe_subscription_id):
         else:
             # 通常期間の場合は、即座に解約
             try:
+                release_for_external_call()
                 stripe.Subscription.delete(stripe_subscription_id)
                 cancel_message = {
                     "type": "template",
@@ -784,7 +680,7 @@ def handle_subscription_cancel(reply_token, user_id_db, stripe_subscription_id):
                 }
                 send_line_message(reply_token, [cancel_message])
             except Exception as e:
-                print(f'[DEBUG] Stripe解約エラー: {e}')
+                logger.debug('Stripe解約エラー: %s', e)
                 error_message = {
                     "type": "text",
                     "text": "❌ 解約処理中にエラーが発生しました。しばらく時間をおいて再度お試しください。"
@@ -792,9 +688,7 @@ def handle_subscription_cancel(reply_token, user_id_db, stripe_subscription_id):
                 send_line_message(reply_token, [error_message])
     
     except Exception as e:
-        print(f'[ERROR] サブスクリプション解約処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('サブスクリプション解約処理エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "❌ エラーが発生しました。しばらく時間をおいて再度お試しください。"}])
 
 def handle_cancel_menu(reply_token, user_id_db, stripe_subscription_id):
@@ -834,9 +728,7 @@ def handle_cancel_menu(reply_token, user_id_db, stripe_subscription_id):
         send_line_message(reply_token, [cancel_menu_message])
         
     except Exception as e:
-        print(f'[ERROR] 解約メニュー表示エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('解約メニュー表示エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "❌ 解約メニューの表示に失敗しました。しばらく時間をおいて再度お試しください。"}])
 
 def handle_cancel_confirmation(user_id, content_number):
@@ -860,9 +752,9 @@ def handle_cancel_confirmation(user_id, content_number):
             }
         
         # データベースタイプに応じて適切なプレースホルダーを使用
-        from utils.db import get_db_type
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         # 解約対象のコンテンツを取得
         c.execute(f'''
@@ -889,15 +781,16 @@ def handle_cancel_confirmation(user_id, content_number):
         # 2. StripeのUsage Recordを削除（課金済みの場合）
         if stripe_usage_record_id and not is_free:
             try:
+                release_for_external_call()
                 stripe.UsageRecord.delete(stripe_usage_record_id)
-                print(f'[DEBUG] Stripe Usage Record削除: {stripe_usage_record_id}')
+                logger.debug('Stripe Usage Record削除: %s', stripe_usage_record_id)
             except Exception as e:
-                print(f'[DEBUG] Stripe Usage Record削除エラー: {e}')
+                logger.debug('Stripe Usage Record削除エラー: %s', e)
         
         conn.commit()
         conn.close()
         
-        print(f'[DEBUG] 解約処理完了: user_id={user_id}, content_type={content_type}')
+        logger.debug('解約処理完了: user_id=%s, content_type=%s', user_id, content_type)
         
         return {
             'success': True,
@@ -905,9 +798,7 @@ def handle_cancel_confirmation(user_id, content_number):
         }
         
     except Exception as e:
-        print(f'[ERROR] 解約確認処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('解約確認処理エラー: %s', e)
         return {
             'success': False,
             'error': str(e)
@@ -917,15 +808,16 @@ def handle_content_confirmation(user_id_db, content_type, stripe_subscription_id
     """コンテンツ確認処理"""
     try:
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         conn = get_db_connection()
         c = conn.cursor()
         
         # サブスクリプション状態をチェック
         subscription_status = check_subscription_status(stripe_subscription_id)
-        print(f'[DEBUG] サブスクリプション状態: {subscription_status}')
+        logger.debug('サブスクリプション状態: %s', subscription_status)
         
         # 利用可能なコンテンツを定義
         content_info = {
@@ -953,7 +845,7 @@ def handle_content_confirmation(user_id_db, content_type, stripe_subscription_id
         }
         
         if content_type not in content_info:
-            print(f'[ERROR] 無効なコンテンツタイプ: {content_type}')
+            logger.error('無効なコンテンツタイプ: %s', content_type)
             return {'success': False, 'error': f'無効なコンテンツタイプ: {content_type}'}
         
         content = content_info[content_type]
@@ -963,7 +855,7 @@ def handle_content_confirmation(user_id_db, content_type, stripe_subscription_id
         existing_count = c.fetchone()[0]
         
         if existing_count > 0:
-            print(f'[DEBUG] 既に追加済みのコンテンツ: {content_type}')
+            logger.debug('既に追加済みのコンテンツ: %s', content_type)
             return {'success': False, 'error': f'コンテンツ {content_type} は既に追加されています'}
         
         # サブスクリプション状態に基づく処理
@@ -971,12 +863,12 @@ def handle_content_confirmation(user_id_db, content_type, stripe_subscription_id
         is_free = is_trial_period or is_first_content  # トライアル期間中または初回コンテンツは無料
         
         if is_free:
-            print(f'[DEBUG] トライアル期間中または初回コンテンツのため無料で追加')
+            logger.debug('トライアル期間中または初回コンテンツのため無料で追加')
             # トライアル期間中または初回コンテンツは無料で追加
             c.execute(f'INSERT INTO usage_logs (user_id, content_type, price, status, created_at) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, NOW())', 
                      (user_id_db, content_type, 0, 'active'))
         else:
-            print(f'[DEBUG] 有料コンテンツ追加')
+            logger.debug('有料コンテンツ追加')
             # 有料コンテンツの場合はStripe処理を実行
             c.execute(f'INSERT INTO usage_logs (user_id, content_type, price, status, created_at) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, NOW())', 
                      (user_id_db, content_type, content['price'], 'active'))
@@ -994,17 +886,16 @@ def handle_content_confirmation(user_id_db, content_type, stripe_subscription_id
         }
         
     except Exception as e:
-        print(f'[ERROR] コンテンツ確認処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('コンテンツ確認処理エラー: %s', e)
         return {'success': False, 'error': str(e)}
 
 def handle_status_check(reply_token, user_id_db):
     """利用状況確認"""
     try:
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         conn = get_db_connection()
         c = conn.cursor()
@@ -1038,9 +929,7 @@ def handle_status_check(reply_token, user_id_db):
         send_line_message(reply_token, [{"type": "text", "text": status_message}])
         
     except Exception as e:
-        print(f'[ERROR] 利用状況確認エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('利用状況確認エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "❌ エラーが発生しました。しばらく時間をおいて再度お試しください。"}])
 
 def extract_numbers_from_text(text):
@@ -1143,7 +1032,7 @@ def smart_number_extraction(text):
 def handle_add_content_company(reply_token, company_id, stripe_subscription_id):
     """企業ユーザー専用：コンテンツ追加メニュー表示"""
     try:
-        print(f'[DEBUG] handle_add_content_company開始: company_id={company_id}, stripe_subscription_id={stripe_subscription_id}')
+        logger.debug('handle_add_content_company開始: company_id=%s, stripe_subscription_id=%s', company_id, stripe_subscription_id)
         # サブスクリプション状態をチェック
         subscription_status = check_subscription_status(stripe_subscription_id)
         is_trial_period = subscription_status.get('subscription', {}).get('status') == 'trialing'
@@ -1160,8 +1049,9 @@ def handle_add_content_company(reply_token, company_id, stripe_subscription_id):
         c = conn.cursor()
         
         # データベースタイプに応じて適切なプレースホルダーを使用
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         # 企業のサブスクリプション数を確認
         c.execute(f'SELECT COUNT(*) FROM company_subscriptions WHERE company_id = {placeholder} AND subscription_status = {placeholder}', (company_id, 'active'))
@@ -1173,7 +1063,7 @@ def handle_add_content_company(reply_token, company_id, stripe_subscription_id):
         
         conn.close()
         
-        print(f'[DEBUG] 企業コンテンツ追加: company_id={company_id}, total_subscription_count={total_subscription_count}, total_line_account_count={total_line_account_count}')
+        logger.debug('企業コンテンツ追加: company_id=%s, total_subscription_count=%s, total_line_account_count=%s', company_id, total_subscription_count, total_line_account_count)
         
         # テキストのみの番号選択メニューを作成
         lines = []
@@ -1187,26 +1077,25 @@ def handle_add_content_company(reply_token, company_id, stripe_subscription_id):
 
         menu_text = "\n".join(lines)
 
-        print(f'[DEBUG] テキストメニュー送信開始: reply_token={reply_token[:20]}...')
+        logger.debug('テキストメニュー送信開始: reply_token=%s...', reply_token[:20])
         send_line_message(reply_token, [{"type": "text", "text": menu_text}])
-        print(f'[DEBUG] テキストメニュー送信完了')
+        logger.debug('テキストメニュー送信完了')
         
     except Exception as e:
-        print(f'[DEBUG] 企業コンテンツ追加エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('企業コンテンツ追加エラー: %s', e)
         send_line_message(reply_token, [{"type": "text", "text": "コンテンツ追加処理でエラーが発生しました。"}])
 
 def handle_status_check_company(reply_token, company_id):
     """企業ユーザー専用：利用状況確認（company_line_accountsベース）"""
     try:
-        print(f'[DEBUG] 企業利用状況確認開始: company_id={company_id}')
-        print(f'[DEBUG] LINEボット状態確認処理が実行されました')
+        logger.debug('企業利用状況確認開始: company_id=%s', company_id)
+        logger.debug('LINEボット状態確認処理が実行されました')
         
         conn = get_db_connection()
         c = conn.cursor()
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         # 企業名を取得
         c.execute(f'SELECT company_name FROM companies WHERE id = {placeholder}', (company_id,))
@@ -1266,8 +1155,8 @@ def handle_status_check_company(reply_token, company_id):
             current_time = datetime.now(jst)
             
             # デバッグ情報を出力
-            print(f'[DEBUG] 現在時刻: {current_time}')
-            print(f'[DEBUG] トライアル終了日: {trial_end}')
+            logger.debug('現在時刻: %s', current_time)
+            logger.debug('トライアル終了日: %s', trial_end)
             
             # タイムゾーン情報を統一（trial_endをawareに変換）
             if trial_end.tzinfo is None:
@@ -1279,7 +1168,7 @@ def handle_status_check_company(reply_token, company_id):
                 trial_end_date = trial_end.date()
                 current_date = current_time.date()
                 trial_days_remaining = (trial_end_date - current_date).days
-                print(f'[DEBUG] 残り日数計算: {trial_end_date} - {current_date} = {trial_days_remaining}日')
+                logger.debug('残り日数計算: %s - %s = %s日', trial_end_date, current_date, trial_days_remaining)
                 status_message += f"🎉 トライアル期間中（残り{trial_days_remaining}日間）\n"
                 status_message += f"📅 トライアル終了日: {trial_end.strftime('%Y年%m月%d日')}\n\n"
         
@@ -1361,9 +1250,7 @@ def handle_status_check_company(reply_token, company_id):
         send_line_message(reply_token, [{"type": "text", "text": status_message}])
         
     except Exception as e:
-        print(f'[ERROR] 企業利用状況確認エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('企業利用状況確認エラー: %s', e)
         from utils.message_templates import get_menu_navigation_hint
         send_line_message(reply_token, [
             {"type": "text", "text": "❌ エラーが発生しました。しばらく時間をおいて再度お試しください。"},
@@ -1373,7 +1260,7 @@ def handle_status_check_company(reply_token, company_id):
 def handle_cancel_menu_company(reply_token, company_id, stripe_subscription_id):
     """企業ユーザー専用：解約メニュー表示"""
     try:
-        print(f'[DEBUG] handle_cancel_menu_company開始: company_id={company_id}, stripe_subscription_id={stripe_subscription_id}')
+        logger.debug('handle_cancel_menu_company開始: company_id=%s, stripe_subscription_id=%s', company_id, stripe_subscription_id)
         # 固定選択肢のためボタンテンプレートで表示
         message = {
             "type": "template",
@@ -1389,14 +1276,12 @@ def handle_cancel_menu_company(reply_token, company_id, stripe_subscription_id):
                 ]
             }
         }
-        print(f'[DEBUG] 解約メニューメッセージ送信開始: reply_token={reply_token[:20]}...')
+        logger.debug('解約メニューメッセージ送信開始: reply_token=%s...', reply_token[:20])
         send_line_message(reply_token, [message])
-        print(f'[DEBUG] 解約メニューメッセージ送信完了')
+        logger.debug('解約メニューメッセージ送信完了')
         
     except Exception as e:
-        print(f'[DEBUG] 解約メニューエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('解約メニューエラー: %s', e)
         from utils.message_templates import get_menu_navigation_hint
         send_line_message(reply_token, [
             {"type": "text", "text": "解約メニューでエラーが発生しました。"},
@@ -1407,8 +1292,9 @@ def handle_cancel_request_company(reply_token, company_id, stripe_subscription_i
     """企業ユーザー専用：個別コンテンツ解約メニュー表示"""
     try:
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         conn = get_db_connection()
         c = conn.cursor()
@@ -1422,7 +1308,7 @@ def handle_cancel_request_company(reply_token, company_id, stripe_subscription_i
         ''', (company_id,))
 
         active_contents = c.fetchall()
-        print(f'[DEBUG] 企業解約対象コンテンツ取得: company_id={company_id}, count={len(active_contents)}')
+        logger.debug('企業解約対象コンテンツ取得: company_id=%s, count=%s', company_id, len(active_contents))
         
         if not active_contents:
             from utils.message_templates import get_menu_navigation_hint
@@ -1450,19 +1336,17 @@ def handle_cancel_request_company(reply_token, company_id, stripe_subscription_i
                 display_name = 'AIタスクコンシェルジュ'
             else:
                 display_name = content_type
-            print(f'[DEBUG] コンテンツ: ({content_name}, {content_type}, {created_at})')
+            logger.debug('コンテンツ: (%s, %s, %s)', content_name, content_type, created_at)
             lines.append(f"{i}. {display_name}")
         lines.append("")
         lines.append("戻る場合は『メニュー』と送信してください。")
 
         menu_text = "\n".join(lines)
         send_line_message(reply_token, [{"type": "text", "text": menu_text}])
-        print(f'[DEBUG] コンテンツ解約コマンド処理完了（テキスト）')
+        logger.debug('コンテンツ解約コマンド処理完了（テキスト）')
         
     except Exception as e:
-        print(f'[DEBUG] コンテンツ解約メニューエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('コンテンツ解約メニューエラー: %s', e)
         from utils.message_templates import get_menu_navigation_hint
         send_line_message(reply_token, [
             {"type": "text", "text": "コンテンツ解約メニューでエラーが発生しました。"},
@@ -1476,23 +1360,24 @@ def handle_cancel_selection_company(reply_token, company_id, stripe_subscription
     """企業ユーザー専用：解約選択処理（確認ステップ追加）"""
     conn = None
     try:
-        print(f'[DEBUG] === handle_cancel_selection_company 開始 ===')
-        print(f'[DEBUG] 企業解約選択処理開始: company_id={company_id}, selection_text={selection_text}')
-        print(f'[DEBUG] reply_token={reply_token[:20] if reply_token else "None"}..., stripe_subscription_id={stripe_subscription_id}')
+        logger.debug('=== handle_cancel_selection_company 開始 ===')
+        logger.debug('企業解約選択処理開始: company_id=%s, selection_text=%s', company_id, selection_text)
+        logger.debug('reply_token=%s..., stripe_subscription_id=%s', reply_token[:20] if reply_token else "None", stripe_subscription_id)
         
         # データベースタイプを取得
-        print(f'[DEBUG] データベースタイプ取得開始')
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
-        print(f'[DEBUG] データベースタイプ: {db_type}, placeholder: {placeholder}')
+        logger.debug('データベースタイプ取得開始')
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
+        logger.debug('データベースタイプ: %s, placeholder: %s', db_type, placeholder)
         
-        print(f'[DEBUG] データベース接続開始')
+        logger.debug('データベース接続開始')
         conn = get_db_connection()
         c = conn.cursor()
-        print(f'[DEBUG] データベース接続成功')
+        logger.debug('データベース接続成功')
         
         # 企業のアクティブなコンテンツを取得
-        print(f'[DEBUG] SQLクエリ実行開始: company_id={company_id}')
+        logger.debug('SQLクエリ実行開始: company_id=%s', company_id)
         c.execute(f'''
             SELECT id, content_name, content_type, created_at 
             FROM company_contents 
@@ -1500,27 +1385,27 @@ def handle_cancel_selection_company(reply_token, company_id, stripe_subscription
             ORDER BY created_at DESC
         ''', (company_id,))
         
-        print(f'[DEBUG] SQLクエリ実行完了、結果取得開始')
+        logger.debug('SQLクエリ実行完了、結果取得開始')
         active_contents = c.fetchall()
-        print(f'[DEBUG] アクティブコンテンツ取得結果: {active_contents}')
+        logger.debug('アクティブコンテンツ取得結果: %s', active_contents)
         
         # 選択された番号を解析
         numbers = smart_number_extraction(selection_text)
         valid_numbers, invalid_reasons, duplicates = validate_selection_numbers(numbers, len(active_contents))
         selected_indices = valid_numbers
         
-        print(f'[DEBUG] 選択テキスト: {selection_text}')
-        print(f'[DEBUG] 抽出された数字: {numbers}')
-        print(f'[DEBUG] 有効な選択インデックス: {selected_indices}')
-        print(f'[DEBUG] 最大選択可能数: {len(active_contents)}')
-        print(f'[DEBUG] アクティブコンテンツ詳細:')
+        logger.debug('選択テキスト: %s', selection_text)
+        logger.debug('抽出された数字: %s', numbers)
+        logger.debug('有効な選択インデックス: %s', selected_indices)
+        logger.debug('最大選択可能数: %s', len(active_contents))
+        logger.debug('アクティブコンテンツ詳細:')
         for i, content in enumerate(active_contents, 1):
-            print(f'[DEBUG]   {i}. {content}')
+            logger.debug('%s. %s', i, content)
         
         if invalid_reasons:
-            print(f'[DEBUG] 無効な入力: {invalid_reasons}')
+            logger.debug('無効な入力: %s', invalid_reasons)
         if duplicates:
-            print(f'[DEBUG] 重複除去: {duplicates}')
+            logger.debug('重複除去: %s', duplicates)
         
         # 選択されたコンテンツを特定
         selected_contents = []
@@ -1547,10 +1432,10 @@ def handle_cancel_selection_company(reply_token, company_id, stripe_subscription
                 })
         
         if not selected_contents:
-            print(f'[DEBUG] selected_contents が空です')
-            print(f'[DEBUG] 企業ID: {company_id}, 選択: {selection_text}')
-            print(f'[DEBUG] アクティブコンテンツ: {len(active_contents)}件')
-            print(f'[DEBUG] 抽出数字: {numbers}, 有効選択: {selected_indices}')
+            logger.debug('selected_contents が空です')
+            logger.debug('企業ID: %s, 選択: %s', company_id, selection_text)
+            logger.debug('アクティブコンテンツ: %s件', len(active_contents))
+            logger.debug('抽出数字: %s, 有効選択: %s', numbers, selected_indices)
             
             # 簡潔なエラーメッセージ
             error_message = f"❌ 解約対象が見つかりません\n\n企業ID: {company_id}\n選択: {selection_text}\nアクティブ: {len(active_contents)}件\n\n「メニュー」でメイン画面に戻れます。"
@@ -1580,7 +1465,7 @@ def handle_cancel_selection_company(reply_token, company_id, stripe_subscription
                     billing_period_info = f"\n📅 次回請求日: {period_end.strftime('%Y年%m月%d日')}"
                     
             except Exception as e:
-                print(f'[DEBUG] 請求期間情報取得エラー: {e}')
+                logger.debug('請求期間情報取得エラー: %s', e)
         
         # 詳細はテキストで送信（制限回避）
         details_text = f"解約対象:\n{content_list}{price_info}{billing_period_info}"
@@ -1618,17 +1503,15 @@ def handle_cancel_selection_company(reply_token, company_id, stripe_subscription
             }
         }
 
-        print(f"[DEBUG] LINE API呼び出し開始: details_text={details_text}, template={message_template}")
+        logger.debug("LINE API呼び出し開始: details_text=%s, template=%s", details_text, message_template)
         result = send_line_message(reply_token, [
             {"type": "text", "text": details_text},
             message_template
         ])
-        print(f'[DEBUG] 解約確認メッセージ送信完了: result={result}')
+        logger.debug('解約確認メッセージ送信完了: result=%s', result)
         
     except Exception as e:
-        print(f'[ERROR] 企業解約選択処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('企業解約選択処理エラー: %s', e)
         from utils.message_templates import get_menu_navigation_hint
         send_line_message(reply_token, [
             {"type": "text", "text": "❌ 解約処理に失敗しました。しばらく時間をおいて再度お試しください。"},
@@ -1641,7 +1524,7 @@ def handle_cancel_selection_company(reply_token, company_id, stripe_subscription
 def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscription_id, confirmation_text):
     """企業ユーザー専用：解約確認処理（実際の解約実行）"""
     try:
-        print(f'[DEBUG] 企業解約確認処理開始: company_id={company_id}, confirmation_text={confirmation_text}')
+        logger.debug('企業解約確認処理開始: company_id=%s, confirmation_text=%s', company_id, confirmation_text)
         
         # 確認テキストから選択インデックスを抽出
         if not confirmation_text.startswith('解約確認_'):
@@ -1651,11 +1534,12 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
         selected_indices_str = confirmation_text.replace('解約確認_', '')
         selected_indices = [int(idx) for idx in selected_indices_str.split(',')]
         
-        print(f'[DEBUG] 解約対象インデックス: {selected_indices}')
+        logger.debug('解約対象インデックス: %s', selected_indices)
         
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         conn = get_db_connection()
         c = conn.cursor()
@@ -1675,7 +1559,7 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
         # 選択されたコンテンツを解約
         for i, (content_id, content_name, content_type, created_at) in enumerate(active_contents, 1):
             if i in selected_indices:
-                print(f'[DEBUG] 解約処理開始: content_type={content_type}, content_id={content_id}')
+                logger.debug('解約処理開始: content_type=%s, content_id=%s', content_type, content_id)
                 
                 # 追加料金が必要なコンテンツかチェック（1個目は無料、2個目以降は有料）
                 additional_price = 0 if i == 1 else 1500
@@ -1691,7 +1575,7 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                     ''', (content_id,))
                     result = c.fetchone()
                     affected = 1 if result else 0
-                    print(f'[DEBUG] company_contents更新: content_id={content_id}, affected={affected}')
+                    logger.debug('company_contents更新: content_id=%s, affected=%s', content_id, affected)
 
                     # もし更新0件なら、念のため company_id + content_type でも更新を試行
                     if affected == 0:
@@ -1702,7 +1586,7 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                             RETURNING id
                         ''', (company_id, content_type))
                         alt = c.fetchone()
-                        print(f'[DEBUG] 代替更新 company_id+content_type: affected={1 if alt else 0}')
+                        logger.debug('代替更新 company_id+content_type: affected=%s', 1 if alt else 0)
 
                     # company_content_additions があれば同時にinactiveへ（存在しない環境では無視）
                     try:
@@ -1714,21 +1598,21 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                                 SET status = 'inactive'
                                 WHERE company_id = {placeholder} AND content_type = {placeholder} AND status = 'active'
                             ''', (company_id, content_type))
-                            print(f'[DEBUG] company_content_additions更新: affected={c.rowcount}')
+                            logger.debug('company_content_additions更新: affected=%s', c.rowcount)
                         else:
-                            print('[DEBUG] company_content_additionsテーブル未作成')
+                            logger.debug('company_content_additionsテーブル未作成')
                     except Exception as _ignore:
-                        print('[DEBUG] company_content_additions更新スキップ: 例外発生')
+                        logger.debug('company_content_additions更新スキップ: 例外発生')
 
                     # トランザクションをコミット
                     conn.commit()
-                    print(f'[DEBUG] データベーストランザクションコミット成功')
+                    logger.debug('データベーストランザクションコミット成功')
 
                     # 反映確認ログ
                     try:
                         c.execute(f'SELECT status FROM company_contents WHERE id = {placeholder}', (content_id,))
                         row = c.fetchone()
-                        print(f"[DEBUG] 反映確認 company_contents.id={content_id} → status={row[0] if row else 'N/A'}")
+                        logger.debug("反映確認 company_contents.id=%s → status=%s", content_id, row[0] if row else 'N/A')
                         if not row or row[0] != 'inactive':
                             # 最終フォールバック：company_id + content_type を強制inactive
                             c.execute(f'''
@@ -1739,25 +1623,23 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                             conn.commit()
                             c.execute(f"SELECT count(*) FROM company_contents WHERE company_id = {placeholder} AND content_type = {placeholder} AND status = 'inactive'", (company_id, content_type))
                             cnt = c.fetchone()[0]
-                            print(f'[DEBUG] フォールバック更新実施: inactive count for {content_type} = {cnt}')
+                            logger.debug('フォールバック更新実施: inactive count for %s = %s', content_type, cnt)
                     except Exception as _e:
-                        print(f'[DEBUG] 反映確認クエリエラー: {_e}')
+                        logger.debug('反映確認クエリエラー: %s', _e)
 
                 except Exception as e:
-                    print(f'[DEBUG] データベース更新エラー: {e}')
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception('データベース更新エラー: %s', e)
                     
                     # トランザクションをロールバック
                     try:
                         conn.rollback()
-                        print(f'[DEBUG] データベーストランザクションロールバック成功')
+                        logger.debug('データベーストランザクションロールバック成功')
                     except Exception as rollback_error:
-                        print(f'[DEBUG] ロールバックエラー: {rollback_error}')
+                        logger.debug('ロールバックエラー: %s', rollback_error)
                     continue  # エラーの場合は次のループへ
                 
                 # Stripe更新は解約処理完了後に統一で行うため、ここではスキップ
-                print(f'[DEBUG] 解約処理: Stripe更新は解約完了後に統一で実行されるためスキップ')
+                logger.debug('解約処理: Stripe更新は解約完了後に統一で実行されるためスキップ')
                 
                 # content_nameを使用、なければ適切な表示名に変換
                 if content_name:
@@ -1771,10 +1653,10 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                 else:
                     display_name = content_type
                 cancelled.append(display_name)
-                print(f'[DEBUG] 企業コンテンツ解約処理完了: content_type={content_type}, content_id={content_id}')
+                logger.debug('企業コンテンツ解約処理完了: content_type=%s, content_id=%s', content_type, content_id)
         
-        print(f'[DEBUG] 解約対象コンテンツ数: {len(cancelled)}')
-        print(f'[DEBUG] 解約対象: {cancelled}')
+        logger.debug('解約対象コンテンツ数: %s', len(cancelled))
+        logger.debug('解約対象: %s', cancelled)
         
         # 解約処理完了後、統一Stripe更新処理を実行
         if cancelled and stripe_subscription_id:
@@ -1792,9 +1674,10 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                 remaining_total_count = c.fetchone()[0]
                 # 1個目は無料なので、課金対象は総数-1（ただし0未満にはならない）
                 new_billing_count = max(0, remaining_total_count - 1)
-                print(f'[DEBUG] 解約処理後統一更新: 残り総数={remaining_total_count}, 課金対象={new_billing_count}')
+                logger.debug('解約処理後統一更新: 残り総数=%s, 課金対象=%s', remaining_total_count, new_billing_count)
                 
                 # Stripeサブスクリプションを取得
+                release_for_external_call()
                 subscription = stripe.Subscription.retrieve(stripe_subscription_id)
                 
                 # 既存の追加料金アイテムを全て削除
@@ -1808,7 +1691,7 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                         ("metered" in price_nickname.lower()) or
                         (price_id == 'price_1Rog1nIxg6C5hAVdnqB5MJiT')):
                         
-                        print(f'[DEBUG] 解約処理後統一更新: 削除対象アイテム発見: {item["id"]}, Price={price_id}, Nickname={price_nickname}')
+                        logger.debug('解約処理後統一更新: 削除対象アイテム発見: %s, Price=%s, Nickname=%s', item["id"], price_id, price_nickname)
                         items_to_delete.append(item['id'])
                 
                 # 既存の追加料金アイテムを削除
@@ -1816,13 +1699,14 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                     try:
                         # meteredタイプの場合はclear_usage=trueを設定
                         item = next((item for item in subscription['items']['data'] if item['id'] == item_id), None)
+                        release_for_external_call()
                         if item and item['price']['recurring']['usage_type'] == 'metered':
                             stripe.SubscriptionItem.delete(item_id, clear_usage=True)
                         else:
                             stripe.SubscriptionItem.delete(item_id)
-                        print(f'[DEBUG] 解約処理後統一更新: 追加料金アイテム削除完了: {item_id}')
+                        logger.debug('解約処理後統一更新: 追加料金アイテム削除完了: %s', item_id)
                     except Exception as delete_error:
-                        print(f'[WARN] 解約処理後統一更新: アイテム削除エラー: {delete_error}')
+                        logger.warning('解約処理後統一更新: アイテム削除エラー: %s', delete_error)
                 
                 # 追加料金が必要な場合のみ新しいアイテムを作成
                 if new_billing_count > 0:
@@ -1831,9 +1715,10 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                         # 解約処理では、残りのコンテンツの価格を取得する必要がある
                         # ここではデフォルト価格を使用（実際の運用では、残りコンテンツの価格を動的に取得すべき）
                         additional_price_value = 1500  # デフォルト価格
-                        print(f'[DEBUG] 解約処理後統一更新: デフォルト価格を使用: {additional_price_value}円')
+                        logger.debug('解約処理後統一更新: デフォルト価格を使用: %s円', additional_price_value)
                         
                         # 新しいlicensedタイプのPriceを作成
+                        release_for_external_call()
                         new_price = stripe.Price.create(
                             unit_amount=additional_price_value,
                             currency='jpy',
@@ -1849,18 +1734,16 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                             quantity=new_billing_count
                         )
                         
-                        print(f'[DEBUG] 解約処理後統一更新: 追加料金アイテム作成完了: new_item={new_item.id}, quantity={new_billing_count}, 総額={additional_price_value * new_billing_count}円')
+                        logger.debug('解約処理後統一更新: 追加料金アイテム作成完了: new_item=%s, quantity=%s, 総額=%s円', new_item.id, new_billing_count, additional_price_value * new_billing_count)
                         
                     except Exception as create_error:
-                        print(f'[ERROR] 解約処理後統一更新: 追加料金アイテム作成エラー: {create_error}')
-                        import traceback
-                        traceback.print_exc()
+                        logger.exception('解約処理後統一更新: 追加料金アイテム作成エラー: %s', create_error)
                 else:
-                    print(f'[DEBUG] 解約処理後統一更新: 追加料金対象なし（数量=0）のためアイテム作成スキップ')
+                    logger.debug('解約処理後統一更新: 追加料金対象なし（数量=0）のためアイテム作成スキップ')
                 
                 # Stripeの請求期間を正しく同期
                 stripe_current_period_end = subscription.current_period_end
-                print(f'[DEBUG] 解約処理後Stripe請求期間同期: current_period_end={stripe_current_period_end}')
+                logger.debug('解約処理後Stripe請求期間同期: current_period_end=%s', stripe_current_period_end)
                 
                 # データベースの請求期間をStripeと同期
                 if stripe_current_period_end:
@@ -1878,12 +1761,10 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                     ''', (stripe_period_end_jst, company_id))
                     
                     conn.commit()
-                    print(f'[DEBUG] 解約処理後データベース請求期間同期完了: {stripe_period_end_jst}')
+                    logger.debug('解約処理後データベース請求期間同期完了: %s', stripe_period_end_jst)
                     
             except Exception as e:
-                print(f'[DEBUG] 解約処理後統一Stripe更新エラー: {e}')
-                import traceback
-                traceback.print_exc()
+                logger.exception('解約処理後統一Stripe更新エラー: %s', e)
                 # 同期エラーが発生しても処理を続行
         
         if cancelled:
@@ -1901,7 +1782,7 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
                         billing_period_info = f"\n📅 次回請求日: {period_end.strftime('%Y年%m月%d日')}"
                         
                 except Exception as e:
-                    print(f'[DEBUG] 請求期間情報取得エラー: {e}')
+                    logger.debug('請求期間情報取得エラー: %s', e)
                     # エラーが発生しても処理を続行
             
             # 解約完了メッセージを送信
@@ -1921,9 +1802,7 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
             ])
     
     except Exception as e:
-        print(f'[ERROR] 企業解約確認処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('企業解約確認処理エラー: %s', e)
         from utils.message_templates import get_menu_navigation_hint
         send_line_message(reply_token, [
             {"type": "text", "text": "❌ 解約処理に失敗しました。しばらく時間をおいて再度お試しください。"},
@@ -1936,11 +1815,12 @@ def handle_cancel_confirmation_company(reply_token, company_id, stripe_subscript
 def handle_subscription_cancel_company(reply_token, company_id, stripe_subscription_id):
     """企業ユーザー専用：月額基本サブスクリプション解約処理（月額基本料金システム対応）"""
     try:
-        print(f'[DEBUG] 月額基本サブスクリプション解約処理開始: company_id={company_id}, stripe_subscription_id={stripe_subscription_id}')
+        logger.debug('月額基本サブスクリプション解約処理開始: company_id=%s, stripe_subscription_id=%s', company_id, stripe_subscription_id)
         
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         conn = get_db_connection()
         c = conn.cursor()
@@ -1969,21 +1849,22 @@ def handle_subscription_cancel_company(reply_token, company_id, stripe_subscript
         # Stripeサブスクリプションの解約処理
         try:
             if stripe_subscription_id:
+                release_for_external_call()
                 if subscription_status == 'trialing':
                     # トライアル中は即時解約
                     stripe.Subscription.delete(stripe_subscription_id)
-                    print(f'[DEBUG] Stripeサブスクリプション即時解約完了(Trial): {stripe_subscription_id}')
+                    logger.debug('Stripeサブスクリプション即時解約完了(Trial): %s', stripe_subscription_id)
                 else:
                     # 通常は期間終了時に解約
                     stripe.Subscription.modify(
                         stripe_subscription_id,
                         cancel_at_period_end=True
                     )
-                    print(f'[DEBUG] Stripeサブスクリプション解約設定完了(PeriodEnd): {stripe_subscription_id}')
+                    logger.debug('Stripeサブスクリプション解約設定完了(PeriodEnd): %s', stripe_subscription_id)
             else:
-                print(f'[DEBUG] StripeサブスクリプションIDが存在しません')
+                logger.debug('StripeサブスクリプションIDが存在しません')
         except Exception as e:
-            print(f'[DEBUG] Stripe解約エラー: {e}')
+            logger.debug('Stripe解約エラー: %s', e)
             # Stripeエラーが発生しても、データベースは更新する
         
         # データベースの更新
@@ -2010,12 +1891,13 @@ def handle_subscription_cancel_company(reply_token, company_id, stripe_subscript
             ''', (company_id,))
             # 企業マスタのステータスも非アクティブへ
             c.execute(f"UPDATE companies SET status = 'inactive' WHERE id = {placeholder}", (company_id,))
+            invalidate_company(company_id, c)
             
             conn.commit()
-            print(f'[DEBUG] データベース更新完了: company_id={company_id}')
+            logger.debug('データベース更新完了: company_id=%s', company_id)
             
         except Exception as e:
-            print(f'[DEBUG] データベース更新エラー: {e}')
+            logger.debug('データベース更新エラー: %s', e)
             conn.rollback()
             raise e
         
@@ -2056,12 +1938,10 @@ def handle_subscription_cancel_company(reply_token, company_id, stripe_subscript
             {"type": "text", "text": details_text},
             get_menu_navigation_hint()
         ])
-        print(f'[DEBUG] 月額基本サブスクリプション解約処理完了')
+        logger.debug('月額基本サブスクリプション解約処理完了')
         
     except Exception as e:
-        print(f'[ERROR] 月額基本サブスクリプション解約処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('月額基本サブスクリプション解約処理エラー: %s', e)
         from utils.message_templates import get_menu_navigation_hint
         send_line_message(reply_token, [
             {"type": "text", "text": f"❌ 解約処理に失敗しました。エラー: {type(e).__name__}"},
@@ -2078,11 +1958,12 @@ def handle_content_confirmation_company(company_id, content_type):
     """企業ユーザー専用：コンテンツ追加確認処理（月額基本料金システム対応・Stripe請求期間同期）"""
     conn = None
     try:
-        print(f'[DEBUG] 企業コンテンツ確認処理開始: company_id={company_id}, content_type={content_type}')
+        logger.debug('企業コンテンツ確認処理開始: company_id=%s, content_type=%s', company_id, content_type)
         
         # データベースタイプを取得
-        db_type = get_db_type()
-        placeholder = '%s' if db_type == 'postgresql' else '?'
+        dialect = get_dialect()
+        db_type = dialect.name
+        placeholder = dialect.placeholder
         
         conn = get_db_connection()
         c = conn.cursor()
@@ -2117,7 +1998,7 @@ def handle_content_confirmation_company(company_id, content_type):
                 'error': '❌ 月額基本サブスクリプションが非アクティブです。\n\n💳 月額基本料金の決済を完了してからコンテンツを追加してください。'
             }
         
-        print(f'[DEBUG] 月額基本サブスクリプション確認: status={subscription_status}, stripe_id={stripe_subscription_id}')
+        logger.debug('月額基本サブスクリプション確認: status=%s, stripe_id=%s', subscription_status, stripe_subscription_id)
         
         # Stripeサブスクリプションの請求期間を取得（日本時間で計算）
         stripe_period_end = None
@@ -2126,6 +2007,7 @@ def handle_content_confirmation_company(company_id, content_type):
                 import stripe
                 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
                 
+                release_for_external_call()
                 subscription = stripe.Subscription.retrieve(stripe_subscription_id)
                 stripe_period_end = subscription.current_period_end
                 
@@ -2134,12 +2016,12 @@ def handle_content_confirmation_company(company_id, content_type):
                 jst = timezone(timedelta(hours=9))
                 if stripe_period_end:
                     stripe_period_end_jst = datetime.fromtimestamp(stripe_period_end, tz=jst)
-                    print(f'[DEBUG] Stripe請求期間終了: {stripe_period_end} (UTC) → {stripe_period_end_jst} (JST)')
+                    logger.debug('Stripe請求期間終了: %s (UTC) → %s (JST)', stripe_period_end, stripe_period_end_jst)
                 else:
-                    print(f'[DEBUG] Stripe請求期間終了: {stripe_period_end}')
+                    logger.debug('Stripe請求期間終了: %s', stripe_period_end)
                 
             except Exception as e:
-                print(f'[DEBUG] Stripe請求期間取得エラー: {e}')
+                logger.debug('Stripe請求期間取得エラー: %s', e)
                 # Stripeエラーが発生しても処理を続行
         
         # スプレッドシートからコンテンツ情報を取得（名称ベースで一致させる）
@@ -2167,7 +2049,7 @@ def handle_content_confirmation_company(company_id, content_type):
         existing_content = c.fetchone()
         if existing_content:
             content_id, existing_content_type, status = existing_content
-            print(f'[DEBUG] 既存コンテンツ発見: content_id={content_id}, content_type={existing_content_type}, status={status}')
+            logger.debug('既存コンテンツ発見: content_id=%s, content_type=%s, status=%s', content_id, existing_content_type, status)
             
             if status == 'active':
                 return {
@@ -2182,7 +2064,7 @@ def handle_content_confirmation_company(company_id, content_type):
                     WHERE id = {placeholder}
                 ''', (content_id,))
                 conn.commit()
-                print(f'[DEBUG] 非アクティブコンテンツを再アクティブ化: content_id={content_id}')
+                logger.debug('非アクティブコンテンツを再アクティブ化: content_id=%s', content_id)
                 # 再アクティブ化時にも請求期間を保存
                 try:
                     from datetime import datetime as _dt
@@ -2201,9 +2083,9 @@ def handle_content_confirmation_company(company_id, content_type):
                             except Exception:
                                 pass
                         conn.commit()
-                        print(f"[DEBUG] current_period_end 更新(reactivate): id={content_id}, end={billing_end_value}")
+                        logger.debug("current_period_end 更新(reactivate): id=%s, end=%s", content_id, billing_end_value)
                 except Exception as _e:
-                    print(f"[DEBUG] current_period_end更新スキップ(reactivate): {_e}")
+                    logger.debug("current_period_end更新スキップ(reactivate): %s", _e)
                 
                 # 再アクティブ化後のアクティブコンテンツ数を取得（1個目は無料なので-1）
                 c.execute(f'''
@@ -2221,13 +2103,13 @@ def handle_content_confirmation_company(company_id, content_type):
                     additional_price = 0  # コンテンツが0個の場合
                     additional_content_count = 0
                     
-                print(f'[DEBUG] 再アクティブ化: 総数={total_content_count}, 課金対象={additional_content_count}, 料金={additional_price}')
+                logger.debug('再アクティブ化: 総数=%s, 課金対象=%s, 料金=%s', total_content_count, additional_content_count, additional_price)
                 
                 # スプレッドシートの価格（未設定時は1500円）
                 additional_price_value = int(spreadsheet_content.get('price', 1500))
 
                 # Stripe更新は統一処理で行うため、ここではスキップ
-                print(f'[DEBUG] 再アクティブ化: Stripe更新は統一処理で実行されるためスキップ')
+                logger.debug('再アクティブ化: Stripe更新は統一処理で実行されるためスキップ')
                 
                 return {
                     'success': True,
@@ -2253,15 +2135,15 @@ def handle_content_confirmation_company(company_id, content_type):
         ''', (company_id,))
         
         existing_count = c.fetchone()[0]
-        print(f'[DEBUG] 既存アクティブコンテンツ数: {existing_count}')
+        logger.debug('既存アクティブコンテンツ数: %s', existing_count)
         
         # 1個目は無料、2個目以降は有料
         if existing_count == 0:
             additional_price = 0  # 初回コンテンツは無料
-            print(f'[DEBUG] 初回コンテンツのため無料: {content_type}')
+            logger.debug('初回コンテンツのため無料: %s', content_type)
         else:
             additional_price = content['additional_price']  # 2個目以降は有料（シートの価格）
-            print(f'[DEBUG] 追加コンテンツのため有料: {content_type}, 料金={additional_price}円')
+            logger.debug('追加コンテンツのため有料: %s, 料金=%s円', content_type, additional_price)
         
         # 請求期間を月額サブスクリプションに合わせる（日本時間で計算）
         billing_end_date = stripe_period_end if stripe_period_end else current_period_end
@@ -2270,11 +2152,11 @@ def handle_content_confirmation_company(company_id, content_type):
             jst = timezone(timedelta(hours=9))
             if isinstance(billing_end_date, (int, float)):
                 billing_end_date_jst = datetime.fromtimestamp(billing_end_date, tz=jst)
-                print(f'[DEBUG] 請求期間同期: billing_end_date={billing_end_date} (UTC) → {billing_end_date_jst} (JST)')
+                logger.debug('請求期間同期: billing_end_date=%s (UTC) → %s (JST)', billing_end_date, billing_end_date_jst)
             else:
-                print(f'[DEBUG] 請求期間同期: billing_end_date={billing_end_date}')
+                logger.debug('請求期間同期: billing_end_date=%s', billing_end_date)
         else:
-            print(f'[DEBUG] 請求期間同期: billing_end_date={billing_end_date}')
+            logger.debug('請求期間同期: billing_end_date=%s', billing_end_date)
         
         # 新しいコンテンツを登録
         c.execute(f'''
@@ -2284,7 +2166,7 @@ def handle_content_confirmation_company(company_id, content_type):
         ''', (company_id, content_type, content_type, 'active'))
         
         conn.commit()
-        print(f'[DEBUG] コンテンツ登録完了: company_id={company_id}, content_type={content_type}')
+        logger.debug('コンテンツ登録完了: company_id=%s, content_type=%s', company_id, content_type)
 
         # 新規追加後、Stripeの請求項目を更新（統一処理で実行されるため削除）
 
@@ -2307,11 +2189,11 @@ def handle_content_confirmation_company(company_id, content_type):
                             # 文字列の場合は日本時間として保存
                             c.execute(f"UPDATE company_contents SET current_period_end = TO_TIMESTAMP({placeholder}) AT TIME ZONE 'JST' WHERE id = {placeholder}", (str(billing_end_date), row[0]))
                         conn.commit()
-                        print(f"[DEBUG] current_period_end 更新: id={row[0]}, end={billing_end_date}")
+                        logger.debug("current_period_end 更新: id=%s, end=%s", row[0], billing_end_date)
                     except Exception as _e:
-                        print(f"[DEBUG] current_period_end更新スキップ: {_e}")
+                        logger.debug("current_period_end更新スキップ: %s", _e)
         except Exception as e:
-            print(f"[DEBUG] 請求期間保存エラー: {e}")
+            logger.debug("請求期間保存エラー: %s", e)
         
         # Stripeの請求項目を更新（統一処理 - 新規追加と再アクティブ化の両方に対応）
         if stripe_subscription_id:
@@ -2320,7 +2202,7 @@ def handle_content_confirmation_company(company_id, content_type):
                 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
                 
                 if not stripe.api_key:
-                    print(f'[ERROR] STRIPE_SECRET_KEYが設定されていません')
+                    logger.error('STRIPE_SECRET_KEYが設定されていません')
                     return {
                         'success': False,
                         'error': '❌ Stripe設定エラー: 環境変数が設定されていません'
@@ -2335,7 +2217,7 @@ def handle_content_confirmation_company(company_id, content_type):
                 
                 total_content_count = c.fetchone()[0]
                 additional_content_count = max(0, total_content_count - 1)  # 1個目は無料なので-1
-                print(f'[DEBUG] 統一処理: 総コンテンツ数: {total_content_count}, 追加料金対象: {additional_content_count}')
+                logger.debug('統一処理: 総コンテンツ数: %s, 追加料金対象: %s', total_content_count, additional_content_count)
                 
                 # デバッグ用：実際のコンテンツ一覧を表示
                 c.execute(f'''
@@ -2346,21 +2228,22 @@ def handle_content_confirmation_company(company_id, content_type):
                 ''', (company_id,))
                 
                 contents = c.fetchall()
-                print(f'[DEBUG] 統一処理: アクティブコンテンツ一覧:')
+                logger.debug('統一処理: アクティブコンテンツ一覧:')
                 for i, row in enumerate(contents, 1):
-                    print(f'  {i}. {row[1]} ({row[0]}) - {row[2]}')
+                    logger.info('  %s. %s (%s) - %s', i, row[1], row[0], row[2])
                 
                 # Stripeサブスクリプションを取得
+                release_for_external_call()
                 subscription = stripe.Subscription.retrieve(stripe_subscription_id)
-                print(f'[DEBUG] 統一処理: Stripeサブスクリプション取得: {subscription.id}')
+                logger.debug('統一処理: Stripeサブスクリプション取得: %s', subscription.id)
                 
                 # サブスクリプションアイテムを詳細にログ出力
-                print(f"[DEBUG] 統一処理: サブスクリプションアイテム数: {len(subscription['items']['data'])}")
+                logger.debug("統一処理: サブスクリプションアイテム数: %s", len(subscription['items']['data']))
                 for i, item in enumerate(subscription['items']['data']):
                     price_nickname = item.price.nickname or ""
                     price_id = item.price.id
                     quantity = getattr(item, 'quantity', 0)
-                    print(f'[DEBUG] 統一処理: アイテム{i+1}: ID={item.id}, Price={price_id}, Nickname={price_nickname}, Quantity={quantity}')
+                    logger.debug('統一処理: アイテム%s: ID=%s, Price=%s, Nickname=%s, Quantity=%s', i+1, item.id, price_id, price_nickname, quantity)
                 
                 # 既存の追加料金アイテムを全て削除（重複を防ぐため）
                 items_to_delete = []
@@ -2374,25 +2257,27 @@ def handle_content_confirmation_company(company_id, content_type):
                         ("metered" in price_nickname.lower()) or
                         (price_id == 'price_1Rog1nIxg6C5hAVdnqB5MJiT')):
                         
-                        print(f'[DEBUG] 統一処理: 削除対象アイテム発見: {item.id}, Price={price_id}, Nickname={price_nickname}')
+                        logger.debug('統一処理: 削除対象アイテム発見: %s, Price=%s, Nickname=%s', item.id, price_id, price_nickname)
                         items_to_delete.append(item.id)
                 
                 # 既存の追加料金アイテムを削除
                 for item_id in items_to_delete:
                     try:
+                        release_for_external_call()
                         stripe.SubscriptionItem.delete(item_id)
-                        print(f'[DEBUG] 統一処理: 追加料金アイテム削除完了: {item_id}')
+                        logger.debug('統一処理: 追加料金アイテム削除完了: %s', item_id)
                     except Exception as delete_error:
-                        print(f'[WARN] 統一処理: アイテム削除エラー: {delete_error}')
+                        logger.warning('統一処理: アイテム削除エラー: %s', delete_error)
                 
                 # 追加料金が必要な場合のみ新しいアイテムを作成
                 if additional_content_count > 0:
                     try:
                         # スプレッドシートから価格を取得（未設定時は1500円）
                         additional_price_value = int(spreadsheet_content.get('price', 1500))
-                        print(f'[DEBUG] 統一処理: スプレッドシート価格を使用: {additional_price_value}円')
+                        logger.debug('統一処理: スプレッドシート価格を使用: %s円', additional_price_value)
                         
                         # 追加料金用の価格を作成（スプレッドシートの価格を使用）
+                        release_for_external_call()
                         additional_price_obj = stripe.Price.create(
                             unit_amount=additional_price_value,  # スプレッドシートの価格を使用
                             currency='jpy',
@@ -2402,7 +2287,7 @@ def handle_content_confirmation_company(company_id, content_type):
                             },
                             nickname=f'追加コンテンツ料金({additional_price_value}円)'
                         )
-                        print(f'[DEBUG] 統一処理: 追加料金用価格を作成: {additional_price_obj.id}, 単価={additional_price_value}円')
+                        logger.debug('統一処理: 追加料金用価格を作成: %s, 単価=%s円', additional_price_obj.id, additional_price_value)
                         
                         # サブスクリプションに追加料金アイテムを追加
                         additional_item = stripe.SubscriptionItem.create(
@@ -2410,22 +2295,18 @@ def handle_content_confirmation_company(company_id, content_type):
                             price=additional_price_obj.id,
                             quantity=additional_content_count
                         )
-                        print(f'[DEBUG] 統一処理: 追加料金アイテムを作成: {additional_item.id}, 数量={additional_content_count}, 総額={additional_price_value * additional_content_count}円')
+                        logger.debug('統一処理: 追加料金アイテムを作成: %s, 数量=%s, 総額=%s円', additional_item.id, additional_content_count, additional_price_value * additional_content_count)
                         
                     except Exception as create_error:
-                        print(f'[ERROR] 統一処理: 追加料金アイテム作成エラー: {create_error}')
-                        import traceback
-                        traceback.print_exc()
+                        logger.exception('統一処理: 追加料金アイテム作成エラー: %s', create_error)
                 else:
-                    print(f'[DEBUG] 統一処理: 追加料金対象なし（数量=0）のためアイテム作成スキップ')
+                    logger.debug('統一処理: 追加料金対象なし（数量=0）のためアイテム作成スキップ')
                         
             except Exception as e:
-                print(f'[ERROR] 統一処理: Stripe請求項目更新エラー: {e}')
-                import traceback
-                traceback.print_exc()
+                logger.exception('統一処理: Stripe請求項目更新エラー: %s', e)
                 # Stripeエラーが発生しても処理を続行
                 # ただし、エラー内容をログに記録
-                print(f'[ERROR] Stripe更新処理でエラーが発生しましたが、処理を続行します: {e}')
+                logger.error('Stripe更新処理でエラーが発生しましたが、処理を続行します: %s', e)
         
         # Stripeの請求期間を正しく同期
         if stripe_subscription_id:
@@ -2434,10 +2315,11 @@ def handle_content_confirmation_company(company_id, content_type):
                 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
                 
                 # Stripeサブスクリプションの現在の期間を取得
+                release_for_external_call()
                 subscription = stripe.Subscription.retrieve(stripe_subscription_id)
                 stripe_current_period_end = subscription.current_period_end
                 
-                print(f'[DEBUG] Stripe請求期間同期: current_period_end={stripe_current_period_end}')
+                logger.debug('Stripe請求期間同期: current_period_end=%s', stripe_current_period_end)
                 
                 # データベースの請求期間をStripeと同期
                 if stripe_current_period_end:
@@ -2455,10 +2337,10 @@ def handle_content_confirmation_company(company_id, content_type):
                     ''', (stripe_period_end_jst, company_id))
                     
                     conn.commit()
-                    print(f'[DEBUG] データベース請求期間同期完了: {stripe_period_end_jst}')
+                    logger.debug('データベース請求期間同期完了: %s', stripe_period_end_jst)
                     
             except Exception as e:
-                print(f'[DEBUG] Stripe請求期間同期エラー: {e}')
+                logger.debug('Stripe請求期間同期エラー: %s', e)
                 # 同期エラーが発生しても処理を続行
         
         return {
@@ -2471,9 +2353,7 @@ def handle_content_confirmation_company(company_id, content_type):
         }
         
     except Exception as e:
-        print(f'[ERROR] 企業コンテンツ確認処理エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('企業コンテンツ確認処理エラー: %s', e)
         return {'success': False, 'error': str(e), 'error_type': type(e).__name__}
     finally:
         if conn:
@@ -2499,7 +2379,7 @@ def get_help_message_company():
 def send_company_welcome_message(line_user_id, company_name, email):
     """企業向けのLINE案内メッセージを送信"""
     try:
-        print(f'[DEBUG] 企業向け案内メッセージ送信開始: line_user_id={line_user_id}, company_name={company_name}')
+        logger.debug('企業向け案内メッセージ送信開始: line_user_id=%s, company_name=%s', line_user_id, company_name)
         
         # 60文字制限対応：詳細はテキスト、ボタンは短文
         details_text = f"✅ 企業登録が完了しました\n企業名: {company_name}\nメール: {email}"
@@ -2520,66 +2400,40 @@ def send_company_welcome_message(line_user_id, company_name, email):
             }
         }
 
-        print(f'[DEBUG] 案内メッセージ作成完了: details_text, buttons')
+        logger.debug('案内メッセージ作成完了: details_text, buttons')
 
         # プッシュメッセージとして送信（2通）
         success = send_line_message_push(line_user_id, [
             {"type": "text", "text": details_text},
             welcome_buttons
-        ])
+        ], source='company_welcome')
         
         if success:
-            print(f'[DEBUG] 企業向け案内メッセージ送信成功: line_user_id={line_user_id}')
+            logger.debug('企業向け案内メッセージ送信成功: line_user_id=%s', line_user_id)
             return True
         else:
-            print(f'[DEBUG] 企業向け案内メッセージ送信失敗: line_user_id={line_user_id}')
+            logger.debug('企業向け案内メッセージ送信失敗: line_user_id=%s', line_user_id)
             return False
             
     except Exception as e:
-        print(f'[DEBUG] 企業向け案内メッセージ送信エラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('企業向け案内メッセージ送信エラー: %s', e)
         return False
 
-def send_line_message_push(user_id, messages):
-    """プッシュメッセージとしてLINEメッセージを送信"""
+def send_line_message_push(user_id, messages, source='push'):
+    """プッシュメッセージとしてLINEメッセージを送信（送信キューに積めた場合True）
+
+    送信はキューのワーカーが行い、失敗したものはデッドレターに残る（utils.outbound_queue）。
+    """
     try:
-        LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
-        print(f'[DEBUG] LINE_CHANNEL_ACCESS_TOKEN確認: {LINE_CHANNEL_ACCESS_TOKEN[:20]}...')
+        logger.debug('メッセージ数: %s', len(messages))
+        logger.debug('LINE送信内容: %s', lazy_json(messages))
         
-        headers = {
-            'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        print(f'[DEBUG] ヘッダー設定完了: Authorization=Bearer {LINE_CHANNEL_ACCESS_TOKEN[:20]}...')
-        
-        data = {
-            'to': user_id,
-            'messages': messages
-        }
-        
-        print(f'[DEBUG] メッセージ数: {len(messages)}')
-        print(f'[DEBUG] LINE送信内容: {data}')
-        
-        response = requests.post(
-            'https://api.line.me/v2/bot/message/push',
-            headers=headers,
-            json=data
-        )
-        
-        print(f'[DEBUG] LINE API送信開始')
-        print(f'[DEBUG] LINE APIリクエスト送信: URL=https://api.line.me/v2/bot/message/push')
-        print(f'[DEBUG] LINE APIレスポンス受信: status_code={response.status_code}')
-        
-        if response.status_code == 200:
-            print(f'[DEBUG] LINE API送信成功: status_code={response.status_code}')
-            print(f'[DEBUG] LINE API送信処理完了')
+        if enqueue_push(user_id, messages, source=source):
+            logger.debug('LINEプッシュ送信予約: user_id=%s', user_id)
             return True
-        else:
-            print(f'[DEBUG] LINE API送信失敗: status_code={response.status_code}, response={response.text}')
-            return False
+        logger.debug('LINEプッシュ送信予約失敗（キュー上限）: user_id=%s', user_id)
+        return False
             
     except Exception as e:
-        print(f'[DEBUG] LINE送信エラー: {e}')
-        return False
+        logger.debug('LINE送信エラー: %s', e)
         return False
\ No newline at end of file
@@ -3,6 +3,7 @@ import json
 import logging
 from datetime import datetime, timedelta
 from utils.db import get_db_connection
+from utils.logging_config import configure_logging
 from services.dashboard_service import dashboard_service
 
 # psutilの条件付きインポート
@@ -28,17 +29,9 @@ class MonitoringService:
         self.setup_logging()
     
     def setup_logging(self):
-        """ログ設定"""
+        """ログ設定（ファイルへの書き込みはキューの出力スレッドで行う）"""
         log_file = os.path.join(self.monitoring_dir, 'system_monitoring.log')
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        configure_logging(log_file=log_file)
     
     def get_system_health(self):
         """システム全体の健全性を取得"""
@@ -289,12 +282,9 @@ class MonitoringService:
             try:
                 line_channel_access_token = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
                 if line_channel_access_token:
-                    import requests
-                    response = requests.get(
-                        'https://api.line.me/v2/bot/profile/U1b9d0d75b0c770dc1107dde349d572f7',
-                        headers={'Authorization': f'Bearer {line_channel_access_token}'},
-                        timeout=5
-                    )
+                    from utils.line_client import line_api
+                    response = line_api.get_profile('U1b9d0d75b0c770dc1107dde349d572f7',
+                                                    access_token=line_channel_access_token)
                     external_services['line_api'] = {
                         'status': 'healthy' if response.status_code == 200 else 'error',
                         'response_code': response.status_code
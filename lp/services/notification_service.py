@@ -2,10 +2,26 @@ import os
 import json
 from datetime import datetime, timedelta
 from utils.db import get_db_connection
+from utils.bulk import bulk_insert
+from utils.dialect import get_dialect
+from utils.outbound_queue import enqueue_push
+from utils.line_fanout import LineFanout
 from services.line_api_service import line_api_service
 from services.stripe_payment_service import stripe_payment_service
 from services.company_service import CompanyService
 
+# 通知・リマインダーを企業に紐付いたLINEユーザーへ送信キュー経由でプッシュする
+# （既定は従来どおり line_api_service.send_notification_to_company で送る）
+NOTIFICATION_LINE_PUSH = os.getenv('NOTIFICATION_LINE_PUSH', '0') in ('1', 'true', 'TRUE', 'True')
+
+def _to_datetime(value):
+    """DBの日時値（SQLiteでは文字列）をローカル時刻の naive な datetime にする"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
 class NotificationService:
     """通知・アラート機能サービス"""
     
@@ -61,22 +77,8 @@ class NotificationService:
             
             template_info = self.notification_types[notification_type]
             
-            # テンプレート変数を設定
-            template_vars = {
-                'company_name': company['company_name'],
-                'next_billing_date': payment_data.get('next_billing_date', '未設定'),
-                'amount': payment_data.get('amount', 0),
-                'retry_date': payment_data.get('retry_date', '未設定'),
-                'renewal_date': payment_data.get('renewal_date', '未設定'),
-                'trial_end_date': payment_data.get('trial_end_date', '未設定'),
-                'cancellation_date': payment_data.get('cancellation_date', '未設定'),
-                'reason': payment_data.get('reason', '未設定'),
-                'deletion_days': payment_data.get('deletion_days', 30),
-                'deletion_date': payment_data.get('deletion_date', '未設定')
-            }
-            
             # メッセージを生成
-            message = template_info['template'].format(**template_vars)
+            message = self._render_message(notification_type, company['company_name'], payment_data)
             
             # LINE通知を送信
             notification_data = {
@@ -86,9 +88,20 @@ class NotificationService:
                 'sent_at': datetime.now().isoformat()
             }
             
-            line_result = line_api_service.send_notification_to_company(
-                company_id, notification_type, notification_data
-            )
+            if NOTIFICATION_LINE_PUSH:
+                # 送信キューに積んで即座に戻る（送信・再試行はキューのワーカーが行う）
+                line_user_id = self._get_line_user_id(company_id)
+                if line_user_id:
+                    notification_data['queued'] = enqueue_push(
+                        line_user_id, [{'type': 'text', 'text': message}],
+                        source=f'notification:{notification_type}'
+                    )
+                else:
+                    notification_data['queued'] = False
+            else:
+                line_api_service.send_notification_to_company(
+                    company_id, notification_type, notification_data
+                )
             
             # 通知履歴を記録
             self._record_notification(company_id, notification_type, notification_data)
@@ -105,6 +118,22 @@ class NotificationService:
                 'error': f'通知送信エラー: {str(e)}'
             }
     
+    def _render_message(self, notification_type, company_name, payment_data):
+        """通知テンプレートにテンプレート変数を当てはめる"""
+        template_vars = {
+            'company_name': company_name,
+            'next_billing_date': payment_data.get('next_billing_date', '未設定'),
+            'amount': payment_data.get('amount', 0),
+            'retry_date': payment_data.get('retry_date', '未設定'),
+            'renewal_date': payment_data.get('renewal_date', '未設定'),
+            'trial_end_date': payment_data.get('trial_end_date', '未設定'),
+            'cancellation_date': payment_data.get('cancellation_date', '未設定'),
+            'reason': payment_data.get('reason', '未設定'),
+            'deletion_days': payment_data.get('deletion_days', 30),
+            'deletion_date': payment_data.get('deletion_date', '未設定')
+        }
+        return self.notification_types[notification_type]['template'].format(**template_vars)
+    
     def send_trial_ending_reminder(self, company_id, days_before=3):
         """トライアル終了前のリマインダーを送信"""
         try:
@@ -283,6 +312,177 @@ class NotificationService:
                 'error': f'データ削除リマインダーエラー: {str(e)}'
             }
     
+    def send_trial_ending_reminders(self, days_before=3):
+        """トライアル終了前のリマインダーを対象の全企業へまとめて送信"""
+        try:
+            rows = self._fetch_reminder_targets('''
+                SELECT c.id, c.company_name, c.line_user_id, cp.trial_end
+                FROM companies c
+                JOIN company_payments cp ON cp.company_id = c.id
+                WHERE cp.trial_end IS NOT NULL AND cp.trial_end >= %s AND cp.trial_end <= %s
+                AND NOT EXISTS (
+                    SELECT 1 FROM company_notifications cn
+                    WHERE cn.company_id = c.id AND cn.notification_type = %s AND cn.due_at = cp.trial_end
+                )
+            ''', 'trial_ending', days_before)
+            targets = [
+                (company_id, company_name, line_user_id, {
+                    'trial_end_date': trial_end.strftime('%Y年%m月%d日'),
+                    'amount': 3900  # 基本料金
+                }, due_at)
+                for company_id, company_name, line_user_id, trial_end, due_at in rows
+            ]
+            return self._fan_out_notifications('trial_ending', targets)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'トライアル終了リマインダーエラー: {str(e)}'
+            }
+    
+    def send_renewal_reminders(self, days_before=7):
+        """契約更新前のリマインダーを対象の全企業へまとめて送信"""
+        try:
+            rows = self._fetch_reminder_targets('''
+                SELECT c.id, c.company_name, c.line_user_id, cp.current_period_end
+                FROM companies c
+                JOIN company_payments cp ON cp.company_id = c.id
+                WHERE cp.subscription_status = 'active'
+                AND cp.current_period_end IS NOT NULL
+                AND cp.current_period_end >= %s AND cp.current_period_end <= %s
+                AND NOT EXISTS (
+                    SELECT 1 FROM company_notifications cn
+                    WHERE cn.company_id = c.id AND cn.notification_type = %s
+                    AND cn.due_at = cp.current_period_end
+                )
+            ''', 'subscription_renewal', days_before)
+            targets = [
+                (company_id, company_name, line_user_id, {
+                    'renewal_date': renewal_date.strftime('%Y年%m月%d日'),
+                    'amount': 3900  # 基本料金
+                }, due_at)
+                for company_id, company_name, line_user_id, renewal_date, due_at in rows
+            ]
+            return self._fan_out_notifications('subscription_renewal', targets)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'契約更新リマインダーエラー: {str(e)}'
+            }
+    
+    def send_deletion_reminders(self, days_before=7):
+        """データ削除前のリマインダーを削除予定の全企業へまとめて送信"""
+        try:
+            # 企業ごとの最新の解約の削除予定日（未削除の企業のみ）
+            rows = self._fetch_reminder_targets('''
+                SELECT c.id, c.company_name, c.line_user_id, cc.scheduled_deletion_date
+                FROM companies c
+                JOIN company_cancellations cc ON cc.company_id = c.id
+                WHERE c.deleted_at IS NULL
+                AND cc.scheduled_deletion_date IS NOT NULL
+                AND cc.scheduled_deletion_date >= %s AND cc.scheduled_deletion_date <= %s
+                AND cc.cancelled_at = (
+                    SELECT MAX(cc2.cancelled_at) FROM company_cancellations cc2
+                    WHERE cc2.company_id = c.id AND cc2.scheduled_deletion_date IS NOT NULL
+                )
+                AND NOT EXISTS (
+                    SELECT 1 FROM company_notifications cn
+                    WHERE cn.company_id = c.id AND cn.notification_type = %s
+                    AND cn.due_at = cc.scheduled_deletion_date
+                )
+            ''', 'deletion_scheduled', days_before)
+            targets = [
+                (company_id, company_name, line_user_id, {
+                    'deletion_date': deletion_date.strftime('%Y年%m月%d日')
+                }, due_at)
+                for company_id, company_name, line_user_id, deletion_date, due_at in rows
+            ]
+            return self._fan_out_notifications('deletion_scheduled', targets)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'データ削除リマインダーエラー: {str(e)}'
+            }
+    
+    def _fetch_reminder_targets(self, query, notification_type, days_before):
+        """(企業ID, 企業名, LINEユーザーID, 期日, DBの期日の値) を取得
+        
+        期日が今から days_before 日後までで、同じ通知タイプ・期日のリマインダーを
+        まだ送っていない企業が対象。query のプレースホルダーは (下限, 上限, 通知タイプ) の順。
+        DBの期日の値は送信済みの記録（company_notifications.due_at）にそのまま使う。
+        """
+        dialect = get_dialect()
+        now = datetime.now()
+        # 日数の判定は取得後に行うため、境界を含むよう1日広く取る
+        until = now + timedelta(days=days_before + 1)
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute(dialect.sql(query), (dialect.timestamp(now), dialect.timestamp(until), notification_type))
+            rows = c.fetchall()
+        finally:
+            conn.close()
+        targets = []
+        for company_id, company_name, line_user_id, due in rows:
+            due_date = _to_datetime(due)
+            if (due_date - now).days <= days_before:
+                targets.append((company_id, company_name, line_user_id, due_date, due))
+        return targets
+    
+    def _fan_out_notifications(self, notification_type, targets):
+        """(企業ID, 企業名, LINEユーザーID, テンプレート変数, 期日) の一覧へ通知を送信
+        
+        同じ文面になる企業はマルチキャストでまとめて送り、通知履歴は1回の接続で記録する。
+        NOTIFICATION_LINE_PUSH が無効なら従来どおり企業ごとに line_api_service で送る。
+        通知履歴（期日つき）は送信を受け付けた企業の分だけ記録し、次回以降の送信済み判定に使う。
+        """
+        fanout = LineFanout(source=f'notification:{notification_type}')
+        sent_at = datetime.now().isoformat()
+        pending = []
+        records = []
+        for company_id, company_name, line_user_id, payment_data, due_at in targets:
+            message = self._render_message(notification_type, company_name, payment_data)
+            notification_data = {
+                'company_name': company_name,
+                'notification_type': notification_type,
+                'message': message,
+                'sent_at': sent_at
+            }
+            if NOTIFICATION_LINE_PUSH:
+                if line_user_id:
+                    fanout.add(line_user_id, [{'type': 'text', 'text': message}])
+                    notification_data['queued'] = True
+                    pending.append((company_id, notification_data, due_at, line_user_id))
+            else:
+                result = line_api_service.send_notification_to_company(company_id, notification_type, notification_data)
+                if result.get('success'):
+                    records.append((company_id, notification_data, due_at))
+        summary = fanout.flush()
+        failed = set(summary['failed_recipients'])
+        records.extend((company_id, notification_data, due_at)
+                       for company_id, notification_data, due_at, line_user_id in pending
+                       if line_user_id not in failed)
+        self._record_notifications(notification_type, records)
+        return {
+            'success': True,
+            'sent_count': len(records),
+            'recipients': summary['recipients'],
+            'api_calls': summary['calls'],
+            'message_groups': summary['groups'],
+            'no_line_user': sum(1 for target in targets if not target[2]),
+            'failed': summary['failed']
+        }
+    
+    def _get_line_user_id(self, company_id):
+        """通知先（企業に紐付いたLINEユーザー）を取得"""
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT line_user_id FROM companies WHERE id = %s', (company_id,))
+            row = c.fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+    
     def _record_notification(self, company_id, notification_type, notification_data):
         """通知履歴を記録"""
         try:
@@ -305,6 +505,27 @@ class NotificationService:
         except Exception as e:
             print(f"通知履歴記録エラー: {e}")
     
+    def _record_notifications(self, notification_type, records):
+        """(企業ID, 通知データ, 期日) の一覧を通知履歴にまとめて記録"""
+        if not records:
+            return
+        try:
+            dialect = get_dialect()
+            now = dialect.timestamp(datetime.now())
+            conn = get_db_connection()
+            try:
+                c = conn.cursor()
+                bulk_insert(c, 'company_notifications',
+                            ('company_id', 'notification_type', 'notification_data', 'sent_at', 'due_at'),
+                            [(company_id, notification_type,
+                              json.dumps(notification_data, ensure_ascii=False), now, due_at)
+                             for company_id, notification_data, due_at in records])
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"通知履歴記録エラー: {e}")
+    
     def get_notification_history(self, company_id=None, notification_type=None, limit=50):
         """通知履歴を取得"""
         try:
@@ -172,101 +172,55 @@ class SchedulerService:
             print(f"❌ 削除チェックエラー: {e}")
     
     def _send_trial_ending_reminders(self):
-        """トライアル終了リマインダーを送信"""
+        """トライアル終了リマインダーを送信（同じ文面の企業はまとめて送信）"""
         try:
             print("⏰ トライアル終了リマインダーを送信中...")
             
-            # アクティブな企業を取得
-            companies_result = self.company_service.list_companies()
+            reminder_result = notification_service.send_trial_ending_reminders()
             
-            if not companies_result['success']:
-                print(f"❌ 企業一覧取得エラー: {companies_result['error']}")
+            if not reminder_result['success']:
+                print(f"❌ トライアルリマインダーエラー: {reminder_result['error']}")
                 return
             
-            sent_count = 0
-            for company in companies_result['companies']:
-                company_id = company['id']
-                
-                # トライアル終了リマインダーを送信
-                reminder_result = notification_service.send_trial_ending_reminder(company_id)
-                
-                if reminder_result['success']:
-                    sent_count += 1
-                    print(f"✅ トライアルリマインダー送信: {company['company_name']}")
-                elif 'トライアル終了まで' in reminder_result.get('message', ''):
-                    # リマインダー送信時期ではない場合
-                    pass
-                else:
-                    print(f"⚠️ トライアルリマインダー送信失敗: {company['company_name']} - {reminder_result.get('error', '')}")
-            
-            print(f"✅ トライアル終了リマインダー送信完了: {sent_count}件")
+            print(f"✅ トライアル終了リマインダー送信完了: {reminder_result['sent_count']}件 "
+                  f"(LINE送信 {reminder_result['recipients']}人 / API呼び出し {reminder_result['api_calls']}回, "
+                  f"LINE未連携 {reminder_result['no_line_user']}件)")
             
         except Exception as e:
             print(f"❌ トライアルリマインダーエラー: {e}")
     
     def _send_renewal_reminders(self):
-        """契約更新リマインダーを送信"""
+        """契約更新リマインダーを送信（同じ文面の企業はまとめて送信）"""
         try:
             print("🔄 契約更新リマインダーを送信中...")
             
-            # アクティブな企業を取得
-            companies_result = self.company_service.list_companies()
+            reminder_result = notification_service.send_renewal_reminders()
             
-            if not companies_result['success']:
-                print(f"❌ 企業一覧取得エラー: {companies_result['error']}")
+            if not reminder_result['success']:
+                print(f"❌ 契約更新リマインダーエラー: {reminder_result['error']}")
                 return
             
-            sent_count = 0
-            for company in companies_result['companies']:
-                company_id = company['id']
-                
-                # 契約更新リマインダーを送信
-                reminder_result = notification_service.send_renewal_reminder(company_id)
-                
-                if reminder_result['success']:
-                    sent_count += 1
-                    print(f"✅ 契約更新リマインダー送信: {company['company_name']}")
-                elif '契約更新まで' in reminder_result.get('message', ''):
-                    # リマインダー送信時期ではない場合
-                    pass
-                else:
-                    print(f"⚠️ 契約更新リマインダー送信失敗: {company['company_name']} - {reminder_result.get('error', '')}")
-            
-            print(f"✅ 契約更新リマインダー送信完了: {sent_count}件")
+            print(f"✅ 契約更新リマインダー送信完了: {reminder_result['sent_count']}件 "
+                  f"(LINE送信 {reminder_result['recipients']}人 / API呼び出し {reminder_result['api_calls']}回, "
+                  f"LINE未連携 {reminder_result['no_line_user']}件)")
             
         except Exception as e:
             print(f"❌ 契約更新リマインダーエラー: {e}")
     
     def _send_deletion_reminders(self):
-        """データ削除リマインダーを送信"""
+        """データ削除リマインダーを送信（同じ文面の企業はまとめて送信）"""
         try:
             print("🗑️ データ削除リマインダーを送信中...")
             
-            # 削除予定の企業を取得
-            pending_result = cancellation_service.get_pending_deletions()
+            reminder_result = notification_service.send_deletion_reminders()
             
-            if not pending_result['success']:
-                print(f"❌ 削除予定取得エラー: {pending_result['error']}")
+            if not reminder_result['success']:
+                print(f"❌ データ削除リマインダーエラー: {reminder_result['error']}")
                 return
             
-            sent_count = 0
-            for pending in pending_result['pending_deletions']:
-                company_id = pending['company_id']
-                company_name = pending['company_name']
-                
-                # データ削除リマインダーを送信
-                reminder_result = notification_service.send_deletion_reminder(company_id)
-                
-                if reminder_result['success']:
-                    sent_count += 1
-                    print(f"✅ データ削除リマインダー送信: {company_name}")
-                elif 'データ削除まで' in reminder_result.get('message', ''):
-                    # リマインダー送信時期ではない場合
-                    pass
-                else:
-                    print(f"⚠️ データ削除リマインダー送信失敗: {company_name} - {reminder_result.get('error', '')}")
-            
-            print(f"✅ データ削除リマインダー送信完了: {sent_count}件")
+            print(f"✅ データ削除リマインダー送信完了: {reminder_result['sent_count']}件 "
+                  f"(LINE送信 {reminder_result['recipients']}人 / API呼び出し {reminder_result['api_calls']}回, "
+                  f"LINE未連携 {reminder_result['no_line_user']}件)")
             
         except Exception as e:
             print(f"❌ データ削除リマインダーエラー: {e}")
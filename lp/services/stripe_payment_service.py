@@ -11,6 +11,7 @@ import time
 from datetime import datetime, timedelta
 from utils.db import get_db_connection
 from services.line_api_service import line_api_service
+from utils.identity_cache import invalidate_company
 
 class StripePaymentService:
     """Stripe決済連携サービス"""
@@ -256,18 +257,22 @@ class StripePaymentService:
             
             # イベントタイプに応じて処理
             if event['type'] == 'invoice.payment_succeeded':
-                return self._handle_payment_succeeded(event)
+                result = self._handle_payment_succeeded(event)
             elif event['type'] == 'invoice.payment_failed':
-                return self._handle_payment_failed(event)
+                result = self._handle_payment_failed(event)
             elif event['type'] == 'customer.subscription.updated':
-                return self._handle_subscription_updated(event)
+                result = self._handle_subscription_updated(event)
             elif event['type'] == 'customer.subscription.deleted':
-                return self._handle_subscription_deleted(event)
+                result = self._handle_subscription_deleted(event)
             else:
                 return {
                     'success': True,
                     'message': f'未処理のイベント: {event["type"]}'
                 }
+            
+            # 契約状態が変わった企業のLINEユーザー特定結果を無効化
+            invalidate_company(result.get('company_id'))
+            return result
                 
         except Exception as e:
             return {
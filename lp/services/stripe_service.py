@@ -2,6 +2,7 @@
 
 import stripe
 import os
+from utils.unit_of_work import release_for_external_call
 
 def create_subscription(customer_id, price_ids, trial_days=0):
     """サブスクリプション作成（実装はapp.pyから移動予定）"""
@@ -22,6 +23,7 @@ def grant_referral_free_content(user_id):
 def check_subscription_status(stripe_subscription_id):
     """サブスクリプションの状態をチェック"""
     try:
+        release_for_external_call()
         subscription = stripe.Subscription.retrieve(stripe_subscription_id)
         status = subscription['status']
         cancel_at_period_end = subscription.get('cancel_at_period_end', False) if subscription else False
@@ -56,6 +58,7 @@ def add_metered_price_to_subscription(subscription_id, price_id=None):
             price_id = 'price_1Rog1nIxg6C5hAVdnqB5MJiT'  # 実際のサブスクリプションに含まれているPrice ID
         
         # サブスクリプションを取得
+        release_for_external_call()
         subscription = stripe.Subscription.retrieve(subscription_id)
         
         # 既に同じPriceが追加されているかチェック
@@ -72,6 +75,7 @@ def add_metered_price_to_subscription(subscription_id, price_id=None):
                 }
         
         # 従量課金Priceを追加（quantityは設定しない）
+        release_for_external_call()
         subscription_item = stripe.SubscriptionItem.create(
             subscription=subscription_id,
             price=price_id
@@ -116,6 +120,7 @@ def ensure_metered_price_in_subscription(subscription_id, price_id=None):
             price_id = 'price_1Rog1nIxg6C5hAVdnqB5MJiT'  # 実際のサブスクリプションに含まれているPrice ID
         
         # サブスクリプションを取得
+        release_for_external_call()
         subscription = stripe.Subscription.retrieve(subscription_id)
         
         # 既に同じPriceが追加されているかチェック
@@ -132,6 +137,7 @@ def ensure_metered_price_in_subscription(subscription_id, price_id=None):
                 }
         
         # 従量課金Priceを追加（quantityは設定しない）
+        release_for_external_call()
         subscription_item = stripe.SubscriptionItem.create(
             subscription=subscription_id,
             price=price_id
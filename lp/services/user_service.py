@@ -1,10 +1,13 @@
 # ユーザー関連のサービス層
 import stripe
 import os
+import logging
 from dotenv import load_dotenv
 from utils.db import get_db_connection
 from services.stripe_service import check_subscription_status
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
@@ -21,7 +24,7 @@ def register_user(line_user_id, stripe_customer_id, stripe_subscription_id):
         conn.close()
         return True
     except Exception as e:
-        print(f'ユーザー登録エラー: {e}')
+        logger.exception('ユーザー登録エラー: %s', e)
         return False
 
 def get_user_by_line_id(line_user_id):
@@ -39,7 +42,7 @@ def get_user_by_line_id(line_user_id):
             return dict(zip(columns, user))
         return None
     except Exception as e:
-        print(f'ユーザー取得エラー: {e}')
+        logger.exception('ユーザー取得エラー: %s', e)
         return None
 
 # 永続的な状態管理を使用するため、メモリベースの状態管理は削除
@@ -75,7 +78,7 @@ def is_paid_user(line_user_id):
             'redirect_url': str
         }
     """
-    print(f'[DEBUG] is_paid_user開始: line_user_id={line_user_id}')
+    logger.debug('is_paid_user開始: line_user_id=%s', line_user_id)
     try:
         conn = get_db_connection()
         c = conn.cursor()
@@ -88,11 +91,11 @@ def is_paid_user(line_user_id):
         ''', (line_user_id,))
         
         result = c.fetchone()
-        print(f'[DEBUG] データベース検索結果: line_user_id={line_user_id}, result={result}')
+        logger.debug('データベース検索結果: line_user_id=%s, result=%s', line_user_id, result)
         conn.close()
         
         if not result:
-            print(f'[DEBUG] ユーザーが見つかりません: line_user_id={line_user_id}')
+            logger.debug('ユーザーが見つかりません: line_user_id=%s', line_user_id)
             return {
                 'is_paid': False,
                 'subscription_status': 'not_registered',
@@ -101,14 +104,14 @@ def is_paid_user(line_user_id):
             }
         
         user_id, stripe_subscription_id = result
-        print(f'[DEBUG] ユーザー情報取得: user_id={user_id}, stripe_subscription_id={stripe_subscription_id}')
+        logger.debug('ユーザー情報取得: user_id=%s, stripe_subscription_id=%s', user_id, stripe_subscription_id)
         
         # Stripeサブスクリプションの状態をチェック
         subscription_status = check_subscription_status(stripe_subscription_id)
-        print(f'[DEBUG] Stripeサブスクリプション状態: stripe_subscription_id={stripe_subscription_id}, status={subscription_status}')
+        logger.debug('Stripeサブスクリプション状態: stripe_subscription_id=%s, status=%s', stripe_subscription_id, subscription_status)
         
         if not subscription_status.get('is_active'):
-            print(f'[DEBUG] サブスクリプションが無効: stripe_subscription_id={stripe_subscription_id}, status={subscription_status.get("status")}')
+            logger.debug('サブスクリプションが無効: stripe_subscription_id=%s, status=%s', stripe_subscription_id, subscription_status.get("status"))
             return {
                 'is_paid': False,
                 'subscription_status': subscription_status.get('status', 'inactive'),
@@ -117,7 +120,7 @@ def is_paid_user(line_user_id):
             }
         
         # 有効なサブスクリプション
-        print(f'[DEBUG] 有効なサブスクリプション: line_user_id={line_user_id}, status={subscription_status.get("status")}')
+        logger.debug('有効なサブスクリプション: line_user_id=%s, status=%s', line_user_id, subscription_status.get("status"))
         return {
             'is_paid': True,
             'subscription_status': subscription_status.get('status', 'active'),
@@ -126,9 +129,7 @@ def is_paid_user(line_user_id):
         }
             
     except Exception as e:
-        print(f'[ERROR] 決済状況チェックエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('決済状況チェックエラー: %s', e)
         return {
             'is_paid': False,
             'subscription_status': 'error',
@@ -152,7 +153,7 @@ def is_paid_user_company_centric(line_user_id):
             'trial_days_remaining': int
         }
     """
-    print(f'[DEBUG] is_paid_user_company_centric開始: line_user_id={line_user_id}')
+    logger.debug('is_paid_user_company_centric開始: line_user_id=%s', line_user_id)
     try:
         # PostgreSQL接続を使用
         import psycopg2
@@ -164,14 +165,14 @@ def is_paid_user_company_centric(line_user_id):
         if not database_url:
             raise RuntimeError("DATABASE_URL/RAILWAY_DATABASE_URL is not set")
         
-        print(f'[DEBUG] PostgreSQL接続開始: {database_url[:50]}...')
+        logger.debug('PostgreSQL接続開始: %s...', database_url[:50])
         
         conn = psycopg2.connect(database_url)
         c = conn.cursor()
-        print(f'[DEBUG] PostgreSQL接続成功')
+        logger.debug('PostgreSQL接続成功')
         
         # 企業情報を取得（LINEユーザーIDで検索）
-        print(f'[DEBUG] 検索用LINEユーザーID: line_user_id={line_user_id}')
+        logger.debug('検索用LINEユーザーID: line_user_id=%s', line_user_id)
         
         c.execute('''
             SELECT id, company_name, email, status
@@ -180,10 +181,10 @@ def is_paid_user_company_centric(line_user_id):
         ''', (line_user_id,))
         
         result = c.fetchone()
-        print(f'[DEBUG] 企業データベース検索結果: line_user_id={line_user_id}, result={result}')
+        logger.debug('企業データベース検索結果: line_user_id=%s, result=%s', line_user_id, result)
         
         if not result:
-            print(f'[DEBUG] 企業が見つかりません: line_user_id={line_user_id}')
+            logger.debug('企業が見つかりません: line_user_id=%s', line_user_id)
             conn.close()
             return {
                 'is_paid': False,
@@ -194,7 +195,7 @@ def is_paid_user_company_centric(line_user_id):
             }
         
         company_id, company_name, email, status = result
-        print(f'[DEBUG] 企業情報取得: company_id={company_id}, company_name={company_name}, email={email}, status={status}')
+        logger.debug('企業情報取得: company_id=%s, company_name=%s, email=%s, status=%s', company_id, company_name, email, status)
         
         # トライアル期間の確認
         c.execute('''
@@ -205,7 +206,7 @@ def is_paid_user_company_centric(line_user_id):
         
         trial_result = c.fetchone()
         trial_end = trial_result[0] if trial_result else None
-        print(f'[DEBUG] トライアル期間確認: company_id={company_id}, trial_end={trial_end}')
+        logger.debug('トライアル期間確認: company_id=%s, trial_end=%s', company_id, trial_end)
         
         # 新しい請求システム：月額基本サブスクリプションの決済状況をチェック
         c.execute('''
@@ -215,10 +216,10 @@ def is_paid_user_company_centric(line_user_id):
         ''', (company_id,))
         
         payment_result = c.fetchone()
-        print(f'[DEBUG] 月額基本サブスクリプション検索結果: company_id={company_id}, payment_result={payment_result}')
+        logger.debug('月額基本サブスクリプション検索結果: company_id=%s, payment_result=%s', company_id, payment_result)
         
         conn.close()
-        print(f'[DEBUG] データベース接続終了')
+        logger.debug('データベース接続終了')
         
         # トライアル期間の判定
         trial_days_remaining = 0
@@ -236,13 +237,13 @@ def is_paid_user_company_centric(line_user_id):
             if current_time < trial_end:
                 is_trial_active = True
                 trial_days_remaining = (trial_end - current_time).days
-                print(f'[DEBUG] トライアル期間中: company_id={company_id}, days_remaining={trial_days_remaining}')
+                logger.debug('トライアル期間中: company_id=%s, days_remaining=%s', company_id, trial_days_remaining)
             else:
-                print(f'[DEBUG] トライアル期間終了: company_id={company_id}, trial_end={trial_end}')
+                logger.debug('トライアル期間終了: company_id=%s, trial_end=%s', company_id, trial_end)
         
         # 決済状況の判定
         if is_trial_active:
-            print(f'[DEBUG] トライアル期間中: company_id={company_id}, days_remaining={trial_days_remaining}')
+            logger.debug('トライアル期間中: company_id=%s, days_remaining=%s', company_id, trial_days_remaining)
             return {
                 'is_paid': True,
                 'subscription_status': 'trialing',
@@ -252,7 +253,7 @@ def is_paid_user_company_centric(line_user_id):
             }
         # company_monthly_subscriptions が trialing の場合も有効扱い
         elif payment_result and payment_result[0] == 'trialing':
-            print(f"[DEBUG] company_monthly_subscriptions が 'trialing' を示しています: company_id={company_id}")
+            logger.debug("company_monthly_subscriptions が 'trialing' を示しています: company_id=%s", company_id)
             trial_days_remaining = 0
             try:
                 # companies.trial_end が無い場合はStripeから取得（可能なら）
@@ -270,7 +271,7 @@ def is_paid_user_company_centric(line_user_id):
                         if now < trial_end_jst:
                             trial_days_remaining = max(0, (trial_end_jst - now).days)
             except Exception as e:
-                print(f"[WARN] Stripeからtrial_end取得に失敗: {e}")
+                logger.warning('Stripeからtrial_end取得に失敗: %s', e)
             return {
                 'is_paid': True,
                 'subscription_status': 'trialing',
@@ -281,7 +282,7 @@ def is_paid_user_company_centric(line_user_id):
         elif payment_result and payment_result[0] == 'active':
             current_period_end = payment_result[1]
             monthly_base_price = payment_result[2]
-            print(f'[DEBUG] 有効な月額基本サブスクリプション: company_id={company_id}, status=active, period_end={current_period_end}, base_price={monthly_base_price}')
+            logger.debug('有効な月額基本サブスクリプション: company_id=%s, status=active, period_end=%s, base_price=%s', company_id, current_period_end, monthly_base_price)
             
             # 期限切れチェック
             if current_period_end:
@@ -294,7 +295,7 @@ def is_paid_user_company_centric(line_user_id):
                     current_period_end = current_period_end.replace(tzinfo=jst)
                 
                 if current_time > current_period_end:
-                    print(f'[DEBUG] 期限切れ: current_time={current_time}, period_end={current_period_end}')
+                    logger.debug('期限切れ: current_time=%s, period_end=%s', current_time, current_period_end)
                     return {
                         'is_paid': False,
                         'subscription_status': 'expired',
@@ -303,7 +304,7 @@ def is_paid_user_company_centric(line_user_id):
                         'trial_days_remaining': 0
                     }
             
-            print(f'[DEBUG] 有効な決済確認: company_id={company_id}')
+            logger.debug('有効な決済確認: company_id=%s', company_id)
             return {
                 'is_paid': True,
                 'subscription_status': 'active',
@@ -312,7 +313,7 @@ def is_paid_user_company_centric(line_user_id):
                 'trial_days_remaining': 0
             }
         else:
-            print(f'[DEBUG] 無効な決済: company_id={company_id}, payment_result={payment_result}')
+            logger.debug('無効な決済: company_id=%s, payment_result=%s', company_id, payment_result)
             return {
                 'is_paid': False,
                 'subscription_status': 'not_paid',
@@ -322,9 +323,7 @@ def is_paid_user_company_centric(line_user_id):
             }
             
     except Exception as e:
-        print(f'[ERROR] is_paid_user_company_centricエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('is_paid_user_company_centricエラー: %s', e)
         return {
             'is_paid': False,
             'subscription_status': 'error',
@@ -422,7 +421,7 @@ def find_company_by_email(email):
         return None
         
     except Exception as e:
-        print(f'[ERROR] メールアドレスベース企業検索エラー: {e}')
+        logger.exception('メールアドレスベース企業検索エラー: %s', e)
         return None
 
 def update_line_user_id_for_company(company_id, new_line_user_id):
@@ -467,11 +466,11 @@ def update_line_user_id_for_company(company_id, new_line_user_id):
         conn.commit()
         conn.close()
         
-        print(f'[DEBUG] LINEユーザーID更新完了: company_id={company_id}, new_line_user_id={new_line_user_id}')
+        logger.debug('LINEユーザーID更新完了: company_id=%s, new_line_user_id=%s', company_id, new_line_user_id)
         return True
         
     except Exception as e:
-        print(f'[ERROR] LINEユーザーID更新エラー: {e}')
+        logger.exception('LINEユーザーID更新エラー: %s', e)
         return False
 
 def update_line_user_id_for_email(email, new_line_user_id):
@@ -486,7 +485,7 @@ def update_line_user_id_for_email(email, new_line_user_id):
         bool: 更新成功時True
     """
     try:
-        print(f'[DEBUG] LINEユーザーID更新開始: email={email}, new_line_user_id={new_line_user_id}')
+        logger.debug('LINEユーザーID更新開始: email=%s, new_line_user_id=%s', email, new_line_user_id)
         
         # PostgreSQL接続
         import psycopg2
@@ -512,14 +511,14 @@ def update_line_user_id_for_email(email, new_line_user_id):
         conn.close()
         
         if updated_count > 0:
-            print(f'[DEBUG] LINEユーザーID更新成功: email={email}, new_line_user_id={new_line_user_id}')
+            logger.debug('LINEユーザーID更新成功: email=%s, new_line_user_id=%s', email, new_line_user_id)
             return True
         else:
-            print(f'[DEBUG] 更新対象が見つかりません: email={email}')
+            logger.debug('更新対象が見つかりません: email=%s', email)
             return False
             
     except Exception as e:
-        print(f'[ERROR] LINEユーザーID更新エラー: {e}')
+        logger.exception('LINEユーザーID更新エラー: %s', e)
         return False
 
 def is_paid_user_by_email(email):
@@ -537,7 +536,7 @@ def is_paid_user_by_email(email):
             'redirect_url': str
         }
     """
-    print(f'[DEBUG] is_paid_user_by_email開始: email={email}')
+    logger.debug('is_paid_user_by_email開始: email=%s', email)
     try:
         # PostgreSQL接続を使用
         import psycopg2
@@ -549,11 +548,11 @@ def is_paid_user_by_email(email):
         if not database_url:
             raise RuntimeError("DATABASE_URL/RAILWAY_DATABASE_URL is not set")
         
-        print(f'[DEBUG] PostgreSQL接続開始: {database_url[:50]}...')
+        logger.debug('PostgreSQL接続開始: %s...', database_url[:50])
         
         conn = psycopg2.connect(database_url)
         c = conn.cursor()
-        print(f'[DEBUG] PostgreSQL接続成功')
+        logger.debug('PostgreSQL接続成功')
         
         # メールアドレスで企業データを検索
         c.execute('''
@@ -563,10 +562,10 @@ def is_paid_user_by_email(email):
         ''', (email,))
         
         result = c.fetchone()
-        print(f'[DEBUG] 企業データベース検索結果: email={email}, result={result}')
+        logger.debug('企業データベース検索結果: email=%s, result=%s', email, result)
         
         if not result:
-            print(f'[DEBUG] 企業が見つかりません: email={email}')
+            logger.debug('企業が見つかりません: email=%s', email)
             conn.close()
             return {
                 'is_paid': False,
@@ -576,7 +575,7 @@ def is_paid_user_by_email(email):
             }
         
         company_id, company_name, stripe_subscription_id, status = result
-        print(f'[DEBUG] 企業情報取得: company_id={company_id}, company_name={company_name}, stripe_subscription_id={stripe_subscription_id}, status={status}')
+        logger.debug('企業情報取得: company_id=%s, company_name=%s, stripe_subscription_id=%s, status=%s', company_id, company_name, stripe_subscription_id, status)
         
         # 企業の決済状況をチェック
         c.execute('''
@@ -588,15 +587,15 @@ def is_paid_user_by_email(email):
         ''', (company_id,))
         
         payment_result = c.fetchone()
-        print(f'[DEBUG] 決済状況検索結果: company_id={company_id}, payment_result={payment_result}')
+        logger.debug('決済状況検索結果: company_id=%s, payment_result=%s', company_id, payment_result)
         
         conn.close()
-        print(f'[DEBUG] データベース接続終了')
+        logger.debug('データベース接続終了')
         
         # 決済状況の判定
         if payment_result and payment_result[0] == 'active':
             current_period_end = payment_result[1]
-            print(f'[DEBUG] 有効な決済: company_id={company_id}, status=active, period_end={current_period_end}')
+            logger.debug('有効な決済: company_id=%s, status=active, period_end=%s', company_id, current_period_end)
             
             # 期限切れチェック
             if current_period_end:
@@ -609,7 +608,7 @@ def is_paid_user_by_email(email):
                     current_period_end = current_period_end.replace(tzinfo=jst)
                 
                 if current_period_end > current_time:
-                    print(f'[DEBUG] 有効期限内: company_id={company_id}')
+                    logger.debug('有効期限内: company_id=%s', company_id)
                     return {
                         'is_paid': True,
                         'subscription_status': 'active',
@@ -617,7 +616,7 @@ def is_paid_user_by_email(email):
                         'redirect_url': None
                     }
                 else:
-                    print(f'[DEBUG] 期限切れ: company_id={company_id}, period_end={current_period_end}, current_time={current_time}')
+                    logger.debug('期限切れ: company_id=%s, period_end=%s, current_time=%s', company_id, current_period_end, current_time)
                     return {
                         'is_paid': False,
                         'subscription_status': 'expired',
@@ -625,7 +624,7 @@ def is_paid_user_by_email(email):
                         'redirect_url': 'https://line.me/R/ti/p/@ai_collections'
                     }
             else:
-                print(f'[DEBUG] 期限未設定: company_id={company_id}')
+                logger.debug('期限未設定: company_id=%s', company_id)
                 return {
                     'is_paid': True,
                     'subscription_status': 'active',
@@ -633,7 +632,7 @@ def is_paid_user_by_email(email):
                     'redirect_url': None
                 }
         else:
-            print(f'[DEBUG] 無効な決済または未決済: company_id={company_id}, payment_status={payment_result[0] if payment_result else "none"}')
+            logger.debug('無効な決済または未決済: company_id=%s, payment_status=%s', company_id, payment_result[0] if payment_result else "none")
             return {
                 'is_paid': False,
                 'subscription_status': payment_result[0] if payment_result else 'not_paid',
@@ -642,9 +641,7 @@ def is_paid_user_by_email(email):
             }
             
     except Exception as e:
-        print(f'[ERROR] メールアドレス中心決済状況チェックエラー: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception('メールアドレス中心決済状況チェックエラー: %s', e)
         return {
             'is_paid': False,
             'subscription_status': 'error',
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Webhook受信箱の回収スイープのテスト
+
+- アプリの起動だけで（リクエストを待たずに）前回の停止で残ったイベントを取り戻す
+  （アプリはモジュールの読み込み時に初期化されるため、別プロセスで起動する）
+- 取り戻したイベントの重複排除は、以前に処理を開始していない pending の行だけで行う
+"""
+
+import os
+import sys
+import json
+import subprocess
+import textwrap
+
+LP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = textwrap.dedent('''
+    import sys
+    import json
+    import time
+
+    sys.path.insert(0, {lp_dir!r})
+    from loadtest.runner import prepare_environment
+    prepare_environment({database_url!r})
+
+    from utils.db import get_db_connection
+    from utils.dialect import get_dialect
+    from utils.webhook_inbox import create_webhook_inbox_table
+
+    # 停止したワーカーが残した pending の行（受信から十分に時間が経っている）
+    event = {{'type': 'unsend', 'webhookEventId': 'stale-event-1', 'timestamp': 0,
+              'source': {{'type': 'user', 'userId': 'U' + '0' * 32}}}}
+    conn = get_db_connection()
+    c = conn.cursor()
+    create_webhook_inbox_table(c, get_dialect())
+    c.execute("INSERT INTO webhook_inbox (source, event_id, event_type, payload, status, received_at) "
+              "VALUES ('line', ?, 'unsend', ?, 'pending', '2000-01-01 00:00:00')",
+              (event['webhookEventId'], json.dumps(event)))
+    conn.commit()
+    conn.close()
+
+    import app  # noqa: F401  起動するだけでリクエストは送らない
+
+    deadline = time.monotonic() + 20
+    status = attempts = None
+    while time.monotonic() < deadline:
+        conn = get_db_connection()
+        row = conn.cursor().execute("SELECT status, attempts FROM webhook_inbox WHERE event_id = 'stale-event-1'").fetchone()
+        conn.close()
+        status, attempts = row
+        if status == 'done':
+            break
+        time.sleep(0.1)
+    print(json.dumps({{'status': status, 'attempts': attempts}}))
+''')
+
+
+def test_stale_inbox_row_is_recovered_on_startup(tmp_path):
+    script = _CHILD.format(lp_dir=LP_DIR, database_url=str(tmp_path / 'inbox.db'))
+    env = dict(os.environ, LINE_WEBHOOK_ASYNC='0', LOG_FILE='', ERROR_LOG_FILE='')
+    env.pop('RAILWAY_DATABASE_URL', None)
+    result = subprocess.run([sys.executable, '-c', script], cwd=str(tmp_path), env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    outcome = json.loads(result.stdout.strip().splitlines()[-1])
+    assert outcome == {'status': 'done', 'attempts': 1}
+
+
+class _ClaimedIds:
+    """他のプロセスが受け付け済みのイベントIDを持つ重複排除の代わり"""
+
+    def __init__(self, claimed):
+        self.claimed = set(claimed)
+
+    def claim(self, event):
+        event_id = event.get('webhookEventId')
+        if event_id in self.claimed:
+            return False
+        self.claimed.add(event_id)
+        return True
+
+
+def test_recovered_rows_are_deduplicated_unless_already_started(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', str(tmp_path / 'inbox.db'))
+    monkeypatch.delenv('RAILWAY_DATABASE_URL', raising=False)
+    sys.path.insert(0, LP_DIR)
+    from utils.db import get_db_connection
+    from utils.dialect import get_dialect
+    from utils.webhook_inbox import WebhookInbox, create_webhook_inbox_table
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    create_webhook_inbox_table(c, get_dialect())
+    rows = [
+        # 一度も処理を開始していない（その間に再送を他のプロセスが処理した）
+        ('pending-redelivered', 'pending', 0),
+        # 処理開始時に重複排除を済ませてから停止した
+        ('processing-started', 'processing', 1),
+    ]
+    for event_id, status, attempts in rows:
+        c.execute("INSERT INTO webhook_inbox (source, event_id, event_type, payload, status, attempts, received_at) "
+                  "VALUES ('test', ?, 'message', ?, ?, ?, '2000-01-01 00:00:00')",
+                  (event_id, json.dumps({'webhookEventId': event_id}), status, attempts))
+    conn.commit()
+    conn.close()
+
+    handled = []
+    inbox = WebhookInbox()
+    inbox.register('test', lambda event, company_id: handled.append(event['webhookEventId']),
+                   deduplicator=_ClaimedIds(['pending-redelivered', 'processing-started']))
+    assert inbox.recover() == 2
+
+    conn = get_db_connection()
+    statuses = dict(conn.cursor().execute('SELECT event_id, status FROM webhook_inbox').fetchall())
+    conn.close()
+    assert handled == ['processing-started']
+    assert statuses == {'pending-redelivered': 'duplicate', 'processing-started': 'done'}
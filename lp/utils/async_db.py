@@ -0,0 +1,368 @@
+"""
+asyncio用データアクセス層
+
+Webhook処理のホットパス（企業検索・契約状態の確認・ユーザー状態の取得/設定・
+メールアドレス連携）を非同期で実行する。スレッド数に縛られずに
+1プロセスで多数のイベントを並行処理するための経路。
+
+ユーザー状態は models/user_state.py と同じく ConversationState で返し（旧形式の変換・
+会話途中の状態の期限切れを含む）、書き込み時は同期版と同じキャッシュ（会話状態・
+LINEユーザーの特定結果）を自プロセスで破棄し、他プロセスへNOTIFYで無効化を伝える。
+
+  - AsyncPgDataAccess: asyncpg の専用プールを使用（文はコネクションごとに自動で準備される）
+  - SQLiteAsyncDataAccess: テスト・ローカル用の代替（:memory: も可）
+"""
+
+import os
+import re
+import abc
+import json
+import asyncio
+import sqlite3
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+from utils.db import resolve_backend
+from utils.local_cache import INVALIDATION_CHANNEL, invalidation_payload, invalidate_local
+from utils.identity_cache import identity_cache, company_cache_key
+from models.user_state import USER_STATE_CACHE_NAME, conversation_state_from_row
+
+ASYNC_DB_POOL_MIN_SIZE = int(os.getenv('ASYNC_DB_POOL_MIN_SIZE', '1'))
+ASYNC_DB_POOL_MAX_SIZE = int(os.getenv('ASYNC_DB_POOL_MAX_SIZE', '20'))
+ASYNC_DB_COMMAND_TIMEOUT = float(os.getenv('ASYNC_DB_COMMAND_TIMEOUT', '2'))
+
+# 契約が有効とみなすステータス（トライアル中を含む）
+VALID_SUBSCRIPTION_STATUSES = ('active', 'trialing')
+
+# %s形式で記述し、バックエンドごとにプレースホルダーを変換する
+COMPANY_BY_LINE_USER_SQL = 'SELECT id, company_name FROM companies WHERE line_user_id = %s'
+COMPANY_INFO_SQL = '''
+    SELECT c.id, s.stripe_subscription_id, s.subscription_status
+    FROM companies c
+    LEFT JOIN company_monthly_subscriptions s ON s.company_id = c.id
+    WHERE c.line_user_id = %s
+'''
+SUBSCRIPTION_BY_COMPANY_SQL = (
+    'SELECT stripe_subscription_id, subscription_status FROM company_monthly_subscriptions WHERE company_id = %s'
+)
+COMPANY_BY_EMAIL_SQL = 'SELECT id, company_name, email FROM companies WHERE email = %s'
+LINK_LINE_USER_SQL = 'UPDATE companies SET line_user_id = %s WHERE id = %s'
+UNLINK_LINE_USER_SQL = 'UPDATE companies SET line_user_id = NULL WHERE line_user_id = %s'
+STATE_GET_SQL = 'SELECT state, state_data, updated_at FROM user_states WHERE line_user_id = %s'
+STATE_UPSERT_SQL = (
+    'INSERT INTO user_states (line_user_id, state, state_data, updated_at) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT (line_user_id) DO UPDATE SET state = excluded.state, state_data = excluded.state_data, '
+    'updated_at = excluded.updated_at'
+)
+STATE_DELETE_SQL = 'DELETE FROM user_states WHERE line_user_id = %s'
+NOTIFY_SQL = 'SELECT pg_notify(%s, %s)'
+
+_PARAM_RE = re.compile(r'%s')
+
+
+def _numbered(sql):
+    """%s を asyncpg の $1, $2 ... に変換"""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return _PARAM_RE.sub(lambda m: f'${next(counter)}', sql)
+
+
+def _entitled(row):
+    """(company_id, stripe_subscription_id, status) の行から企業情報を返す（契約無効ならNone）"""
+    if not row:
+        return None
+    company_id, stripe_subscription_id, subscription_status = row
+    if subscription_status not in VALID_SUBSCRIPTION_STATUSES:
+        return None
+    return (company_id, stripe_subscription_id)
+
+
+def _state_data(data):
+    return json.dumps(data, ensure_ascii=False) if data else None
+
+
+def _conversation_state(row):
+    return conversation_state_from_row(*row) if row else None
+
+
+def _state_invalidations(line_user_id):
+    return [(USER_STATE_CACHE_NAME, line_user_id)]
+
+
+def _identity_invalidations(line_user_id, company_id=None):
+    # 企業が別のLINEユーザーに紐付いていた場合に備え、企業単位でも無効化する（routes/line.py と同じ）
+    keys = [line_user_id] if company_id is None else [line_user_id, company_cache_key(company_id)]
+    return [(identity_cache.name, key) for key in keys]
+
+
+def _invalidate_local(invalidations):
+    """自プロセスのキャッシュを破棄（他プロセスへは書き込みと同じトランザクションで通知済み）"""
+    for cache_name, key in invalidations:
+        invalidate_local(cache_name, key)
+
+
+class AsyncDataAccess(abc.ABC):
+    """非同期データアクセスの共通インターフェース"""
+
+    @abc.abstractmethod
+    async def get_company_by_line_user(self, line_user_id):
+        """LINEユーザーIDに紐づく企業 (id, company_name) を取得"""
+
+    @abc.abstractmethod
+    async def get_company_info(self, line_user_id):
+        """契約が有効な企業の (company_id, stripe_subscription_id) を取得（get_company_info互換）"""
+
+    @abc.abstractmethod
+    async def get_subscription(self, company_id):
+        """月額基本サブスクリプションの (stripe_subscription_id, subscription_status) を取得"""
+
+    @abc.abstractmethod
+    async def get_conversation_state(self, line_user_id):
+        """ユーザー状態を ConversationState で取得（未設定ならNone、期限切れの会話途中の状態は通常状態）"""
+
+    async def get_user_state(self, line_user_id):
+        """ユーザーの状態名を取得"""
+        state = await self.get_conversation_state(line_user_id)
+        return state.name if state else None
+
+    @abc.abstractmethod
+    async def set_user_state(self, line_user_id, state, data=None):
+        """ユーザー状態を設定（data は状態に付随する値の辞書）"""
+
+    @abc.abstractmethod
+    async def clear_user_state(self, line_user_id):
+        """ユーザー状態をクリア"""
+
+    @abc.abstractmethod
+    async def link_company_by_email(self, line_user_id, email):
+        """メールアドレスで企業を検索してLINEユーザーIDを紐付け、(id, company_name, email) を返す"""
+
+    @abc.abstractmethod
+    async def unlink_line_user(self, line_user_id):
+        """企業との紐付けを解除"""
+
+    async def close(self):
+        """プール・接続を閉じる"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+
+class AsyncPgDataAccess(AsyncDataAccess):
+    """asyncpgによる実装（プールは初回利用時に作成）"""
+
+    def __init__(self, dsn, min_size=ASYNC_DB_POOL_MIN_SIZE, max_size=ASYNC_DB_POOL_MAX_SIZE,
+                 command_timeout=ASYNC_DB_COMMAND_TIMEOUT):
+        if not ASYNCPG_AVAILABLE:
+            raise RuntimeError('asyncpg がインストールされていません')
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def pool(self):
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        command_timeout=self.command_timeout,
+                    )
+        return self._pool
+
+    async def _fetchrow(self, sql, *args):
+        pool = await self.pool()
+        row = await pool.fetchrow(_numbered(sql), *args)
+        return tuple(row) if row is not None else None
+
+    async def _execute(self, sql, *args, invalidations=()):
+        """更新と無効化の通知を同じトランザクションで実行し、確定後に自プロセスのキャッシュを破棄"""
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(_numbered(sql), *args)
+                await self._notify(conn, invalidations)
+        _invalidate_local(invalidations)
+
+    @staticmethod
+    async def _notify(conn, invalidations):
+        for cache_name, key in invalidations:
+            await conn.execute(_numbered(NOTIFY_SQL), INVALIDATION_CHANNEL, invalidation_payload(cache_name, key))
+
+    async def get_company_by_line_user(self, line_user_id):
+        return await self._fetchrow(COMPANY_BY_LINE_USER_SQL, line_user_id)
+
+    async def get_company_info(self, line_user_id):
+        return _entitled(await self._fetchrow(COMPANY_INFO_SQL, line_user_id))
+
+    async def get_subscription(self, company_id):
+        return await self._fetchrow(SUBSCRIPTION_BY_COMPANY_SQL, company_id)
+
+    async def get_conversation_state(self, line_user_id):
+        return _conversation_state(await self._fetchrow(STATE_GET_SQL, line_user_id))
+
+    async def set_user_state(self, line_user_id, state, data=None):
+        await self._execute(STATE_UPSERT_SQL, line_user_id, state, _state_data(data), datetime.datetime.now(),
+                            invalidations=_state_invalidations(line_user_id))
+
+    async def clear_user_state(self, line_user_id):
+        await self._execute(STATE_DELETE_SQL, line_user_id, invalidations=_state_invalidations(line_user_id))
+
+    async def link_company_by_email(self, line_user_id, email):
+        pool = await self.pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(_numbered(COMPANY_BY_EMAIL_SQL), email)
+                if row is None:
+                    return None
+                await conn.execute(_numbered(LINK_LINE_USER_SQL), line_user_id, row['id'])
+                invalidations = _identity_invalidations(line_user_id, row['id'])
+                await self._notify(conn, invalidations)
+        _invalidate_local(invalidations)
+        return tuple(row)
+
+    async def unlink_line_user(self, line_user_id):
+        await self._execute(UNLINK_LINE_USER_SQL, line_user_id,
+                            invalidations=_identity_invalidations(line_user_id))
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class SQLiteAsyncDataAccess(AsyncDataAccess):
+    """SQLiteによる代替実装（1本の接続を専用スレッドで直列に実行）"""
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._conn = None
+        # sqlite3接続はスレッド間で共有できないため、実行スレッドを1本に固定する
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-sqlite')
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _fetchrow_sync(self, sql, params):
+        cursor = self._connection().execute(sql.replace('%s', '?'), params)
+        row = cursor.fetchone()
+        cursor.close()
+        return tuple(row) if row is not None else None
+
+    def _execute_sync(self, sql, params):
+        conn = self._connection()
+        conn.execute(sql.replace('%s', '?'), params)
+        conn.commit()
+
+    def _link_sync(self, line_user_id, email):
+        conn = self._connection()
+        try:
+            row = conn.execute(COMPANY_BY_EMAIL_SQL.replace('%s', '?'), (email,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(LINK_LINE_USER_SQL.replace('%s', '?'), (line_user_id, row[0]))
+            conn.commit()
+            return tuple(row)
+        except Exception:
+            conn.rollback()
+            raise
+
+    def create_schema_sync(self):
+        conn = self._connection()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS companies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_name TEXT NOT NULL,
+                email TEXT,
+                line_user_id TEXT
+            );
+            CREATE TABLE IF NOT EXISTS company_monthly_subscriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_id INTEGER NOT NULL,
+                stripe_subscription_id TEXT,
+                subscription_status TEXT
+            );
+            CREATE TABLE IF NOT EXISTS user_states (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                line_user_id TEXT UNIQUE NOT NULL,
+                state TEXT NOT NULL,
+                state_data TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        conn.commit()
+
+    async def create_schema(self):
+        """ホットパスで使うテーブルを作成（テスト用）"""
+        await self._run(self.create_schema_sync)
+
+    async def get_company_by_line_user(self, line_user_id):
+        return await self._run(self._fetchrow_sync, COMPANY_BY_LINE_USER_SQL, (line_user_id,))
+
+    async def get_company_info(self, line_user_id):
+        return _entitled(await self._run(self._fetchrow_sync, COMPANY_INFO_SQL, (line_user_id,)))
+
+    async def get_subscription(self, company_id):
+        return await self._run(self._fetchrow_sync, SUBSCRIPTION_BY_COMPANY_SQL, (company_id,))
+
+    async def get_conversation_state(self, line_user_id):
+        return _conversation_state(await self._run(self._fetchrow_sync, STATE_GET_SQL, (line_user_id,)))
+
+    # SQLiteは単一プロセスのため、通知は行わず自プロセスのキャッシュだけ破棄する（local_cache と同じ）
+    async def set_user_state(self, line_user_id, state, data=None):
+        now = datetime.datetime.now().isoformat(sep=' ')
+        await self._run(self._execute_sync, STATE_UPSERT_SQL, (line_user_id, state, _state_data(data), now))
+        _invalidate_local(_state_invalidations(line_user_id))
+
+    async def clear_user_state(self, line_user_id):
+        await self._run(self._execute_sync, STATE_DELETE_SQL, (line_user_id,))
+        _invalidate_local(_state_invalidations(line_user_id))
+
+    async def link_company_by_email(self, line_user_id, email):
+        row = await self._run(self._link_sync, line_user_id, email)
+        if row is not None:
+            _invalidate_local(_identity_invalidations(line_user_id, row[0]))
+        return row
+
+    async def unlink_line_user(self, line_user_id):
+        await self._run(self._execute_sync, UNLINK_LINE_USER_SQL, (line_user_id,))
+        _invalidate_local(_identity_invalidations(line_user_id))
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self._run(conn.close)
+        self._executor.shutdown(wait=False)
+
+
+def create_async_data_access(database_url=None):
+    """環境に応じた非同期データアクセスを作成（呼び出し元のイベントループで使用・close()する）"""
+    database_url = database_url or os.getenv('RAILWAY_DATABASE_URL') or os.getenv('DATABASE_URL')
+    if database_url and database_url.startswith('postgresql://'):
+        return AsyncPgDataAccess(database_url)
+    if database_url:
+        return SQLiteAsyncDataAccess(database_url.replace('sqlite://', ''))
+    if resolve_backend() == 'postgresql':
+        from utils.db import LOCAL_POSTGRES_DSN
+        return AsyncPgDataAccess(LOCAL_POSTGRES_DSN)
+    return SQLiteAsyncDataAccess('database.db')
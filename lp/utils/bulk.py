@@ -0,0 +1,114 @@
+"""
+一括書き込みヘルパー
+
+1行ずつ execute する代わりに、まとめて書き込むための共通処理。
+  - PostgreSQL: execute_values による複数行INSERT、COPY FROM STDIN
+  - SQLite: executemany（同一接続内で文は1回だけ解析される）
+"""
+
+import io
+import time
+
+from psycopg2.extras import execute_values
+
+from utils.db_metrics import record_query
+from utils.dialect import get_dialect
+
+# 1ステートメントあたりの行数
+DEFAULT_PAGE_SIZE = 500
+
+
+def _insert_prefix(table, columns):
+    return f'INSERT INTO {table} ({", ".join(columns)}) VALUES '
+
+
+def _on_conflict(conflict_columns, update_columns):
+    if conflict_columns is None:
+        return ''
+    target = f' ({", ".join(conflict_columns)})' if conflict_columns else ''
+    if update_columns:
+        action = 'DO UPDATE SET ' + ', '.join(f'{col} = excluded.{col}' for col in update_columns)
+    else:
+        action = 'DO NOTHING'
+    return f' ON CONFLICT{target} {action}'
+
+
+def _dedupe_last(rows, columns, conflict_columns):
+    """競合キーが重複する行は最後の行だけ残す（1文内での二重更新エラーを避ける）"""
+    indexes = [columns.index(col) for col in conflict_columns]
+    latest = {}
+    for row in rows:
+        latest[tuple(row[i] for i in indexes)] = row
+    return list(latest.values())
+
+
+def bulk_insert(cursor, table, columns, rows, conflict_columns=None, update_columns=None,
+                page_size=DEFAULT_PAGE_SIZE):
+    """複数行をまとめてINSERTし、処理した行数を返す
+
+    conflict_columns を指定すると ON CONFLICT 句を付ける（空のタプルなら対象指定なし）。
+    update_columns を指定すると DO UPDATE、未指定なら DO NOTHING になる。
+    """
+    columns = tuple(columns)
+    rows = [tuple(row) for row in rows]
+    if not rows:
+        return 0
+    if conflict_columns and update_columns:
+        rows = _dedupe_last(rows, columns, conflict_columns)
+
+    dialect = get_dialect()
+    suffix = _on_conflict(conflict_columns, update_columns)
+    if dialect.name == 'postgresql':
+        execute_values(cursor, _insert_prefix(table, columns) + '%s' + suffix, rows, page_size=page_size)
+    else:
+        sql = _insert_prefix(table, columns) + f'({dialect.placeholders(len(columns))})' + suffix
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value):
+    """COPYのテキスト形式用に値を変換（NULLは \\N）"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def _copy_buffer(rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(value) for value in row))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+def copy_rows(cursor, table, columns, rows):
+    """大量の追記をCOPY FROM STDINで書き込み、行数を返す（競合処理なし）
+
+    SQLiteでは executemany で代替する。
+    """
+    columns = tuple(columns)
+    rows = [tuple(row) for row in rows]
+    if not rows:
+        return 0
+
+    dialect = get_dialect()
+    if dialect.name != 'postgresql':
+        cursor.executemany(_insert_prefix(table, columns) + f'({dialect.placeholders(len(columns))})', rows)
+        return len(rows)
+
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    started = time.perf_counter()
+    try:
+        cursor.copy_expert(sql, _copy_buffer(rows))
+    finally:
+        # copy_expertは計測カーソルを経由しないため個別に記録する
+        record_query(sql, time.perf_counter() - started, len(rows))
+    return len(rows)
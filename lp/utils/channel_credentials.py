@@ -0,0 +1,149 @@
+"""
+企業ごとのLINEチャネル認証情報のキャッシュ
+
+/webhook/<company_id> の署名検証のたびに company_line_accounts を読まないよう、
+チャネルシークレットから作ったHMAC（鍵の前処理済み）とアクセストークンを
+プロセス内に保持する。検証時はHMACを copy() してボディを与えるだけで済む。
+
+company_line_accounts の認証情報を変更する処理から invalidate_channel_credentials()
+で明示的に無効化する（他プロセスへはNOTIFYで伝える、utils.local_cache）。
+無効化が漏れた変更に備え、署名が一致しない場合はDBから読み直して再検証する
+（偽の署名によるDB負荷を抑えるため、読み直しは企業ごとに一定間隔まで）。
+"""
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+import threading
+
+from utils.db import get_db_connection
+from utils.dialect import get_dialect
+from utils.local_cache import TTLCache, register_cache, publish_invalidation, broadcast_invalidation
+from utils.unit_of_work import current_unit_of_work
+
+CHANNEL_CREDENTIALS_TTL = float(os.getenv('CHANNEL_CREDENTIALS_TTL', '300'))
+# LINEアカウントが無い企業IDの保持時間（不正なURLへのリクエストでDBを読まないため）
+CHANNEL_CREDENTIALS_NEGATIVE_TTL = float(os.getenv('CHANNEL_CREDENTIALS_NEGATIVE_TTL', '30'))
+CHANNEL_CREDENTIALS_CACHE_SIZE = int(os.getenv('CHANNEL_CREDENTIALS_CACHE_SIZE', '5000'))
+# 署名不一致時にDBから読み直す最小間隔（秒、企業ごと）
+CHANNEL_CREDENTIALS_REFRESH_INTERVAL = float(os.getenv('CHANNEL_CREDENTIALS_REFRESH_INTERVAL', '5'))
+
+_CREDENTIALS_SQL = '''
+    SELECT cla.line_channel_secret, cla.line_channel_access_token
+    FROM company_line_accounts cla
+    WHERE cla.company_id = %s
+'''
+
+
+class ChannelCredentials:
+    """1企業分のチャネル認証情報（シークレット自体は保持しない）"""
+
+    __slots__ = ('company_id', 'access_token', '_mac')
+
+    def __init__(self, company_id, channel_secret, access_token):
+        self.company_id = company_id
+        self.access_token = access_token
+        self._mac = hmac.new(channel_secret.encode('utf-8'), digestmod=hashlib.sha256) if channel_secret else None
+
+    @property
+    def has_secret(self):
+        return self._mac is not None
+
+    def signature(self, body):
+        """ボディ（bytes）の署名（X-Line-Signature の値）"""
+        mac = self._mac.copy()
+        mac.update(body)
+        return base64.b64encode(mac.digest()).decode('utf-8')
+
+    def verify(self, body, signature):
+        """署名を検証（シークレット未設定の企業は検証しない）"""
+        if self._mac is None:
+            return True
+        return hmac.compare_digest(signature or '', self.signature(body))
+
+
+_credentials_cache = register_cache(TTLCache('channel_credentials', CHANNEL_CREDENTIALS_TTL,
+                                             CHANNEL_CREDENTIALS_CACHE_SIZE))
+_last_refresh = {}
+_refresh_lock = threading.Lock()
+_stats = {'loads': 0, 'refreshes': 0, 'refresh_skipped': 0}
+
+
+def _load(company_id):
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute(get_dialect().sql(_CREDENTIALS_SQL), (company_id,))
+        row = c.fetchone()
+    finally:
+        conn.close()
+    _stats['loads'] += 1
+    if not row:
+        _credentials_cache.set(company_id, None, CHANNEL_CREDENTIALS_NEGATIVE_TTL)
+        return None
+    credentials = ChannelCredentials(company_id, row[0], row[1])
+    _credentials_cache.set(company_id, credentials)
+    return credentials
+
+
+def get_channel_credentials(company_id):
+    """企業のチャネル認証情報を取得（LINEアカウントが無ければNone）"""
+    credentials = _credentials_cache.get(company_id)
+    if credentials is TTLCache.MISSING:
+        credentials = _load(company_id)
+    return credentials
+
+
+def _may_refresh(company_id):
+    now = time.monotonic()
+    with _refresh_lock:
+        last = _last_refresh.get(company_id)
+        if last is not None and now - last < CHANNEL_CREDENTIALS_REFRESH_INTERVAL:
+            _stats['refresh_skipped'] += 1
+            return False
+        if len(_last_refresh) >= CHANNEL_CREDENTIALS_CACHE_SIZE:
+            _last_refresh.clear()
+        _last_refresh[company_id] = now
+        _stats['refreshes'] += 1
+        return True
+
+
+def verify_company_signature(company_id, body, signature):
+    """署名を検証して (credentials, 検証結果) を返す（LINEアカウントが無ければ (None, False)）
+
+    キャッシュの認証情報で一致しない場合のみDBから読み直して再検証する。
+    """
+    credentials = get_channel_credentials(company_id)
+    if credentials is None:
+        return None, False
+    if credentials.verify(body, signature):
+        return credentials, True
+    if not _may_refresh(company_id):
+        return credentials, False
+    credentials = _load(company_id)
+    if credentials is None:
+        return None, False
+    return credentials, credentials.verify(body, signature)
+
+
+def invalidate_channel_credentials(company_id, cursor=None):
+    """企業のチャネル認証情報を無効化（cursor を渡すとその変更と同じトランザクションで通知）"""
+    if company_id is None:
+        return
+    _credentials_cache.invalidate(company_id)
+    if cursor is not None:
+        publish_invalidation(cursor, _credentials_cache.name, company_id)
+    else:
+        broadcast_invalidation(_credentials_cache.name, company_id)
+    # ユニットオブワーク内では確定前に古い値を読み直した可能性があるため確定後にも消す
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.on_commit(lambda: _credentials_cache.invalidate(company_id))
+
+
+def get_channel_credentials_stats():
+    stats = _credentials_cache.stats()
+    stats.update(_stats)
+    return stats
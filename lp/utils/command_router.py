@@ -0,0 +1,200 @@
+"""
+LINEメッセージのコマンドルーター
+
+テキスト・postbackの完全一致／前方一致と、会話状態ごとの処理関数を
+デコレーターで登録し、1メッセージあたり辞書の参照だけで処理関数を決める。
+コマンドを増やしても振り分けのコストは変わらない（前方一致は登録された
+接頭辞の長さの種類数だけ参照する）。
+
+処理関数は次の会話状態（ConversationState）を返し、ルーターが遷移表で
+許可された遷移かを確認して保存する。Noneを返した場合は状態を変えない。
+遷移表はモジュール読み込み時の compile() で検証する。
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CommandContext:
+    """1メッセージの処理に必要な情報"""
+
+    __slots__ = ('event', 'user_id', 'text', 'company_id', 'stripe_subscription_id', 'state')
+
+    def __init__(self, event, user_id, text, company_id=None, stripe_subscription_id=None, state=None):
+        self.event = event
+        self.user_id = user_id
+        self.text = text
+        self.company_id = company_id
+        self.stripe_subscription_id = stripe_subscription_id
+        self.state = state
+
+    @property
+    def reply_token(self):
+        return self.event.get('replyToken')
+
+
+class _Route:
+    __slots__ = ('handler', 'transitions')
+
+    def __init__(self, handler, transitions):
+        self.handler = handler
+        self.transitions = frozenset(transitions)
+
+
+class _MatchTable:
+    """完全一致と前方一致の表"""
+
+    def __init__(self):
+        self.exact = {}
+        self.prefix = {}
+        self._prefix_lengths = ()
+
+    def add(self, key, route, prefix=False):
+        table = self.prefix if prefix else self.exact
+        if key in table:
+            raise ValueError(f'duplicate route: {key!r}')
+        table[key] = route
+
+    def compile(self):
+        # 長い接頭辞を優先する
+        self._prefix_lengths = tuple(sorted({len(key) for key in self.prefix}, reverse=True))
+
+    def lookup(self, key):
+        route = self.exact.get(key)
+        if route is not None:
+            return route
+        for length in self._prefix_lengths:
+            route = self.prefix.get(key[:length])
+            if route is not None:
+                return route
+        return None
+
+    def __len__(self):
+        return len(self.exact) + len(self.prefix)
+
+
+class CommandRouter:
+    """テキスト・postback・会話状態による振り分け
+
+    テキストは「コマンド → 現在の状態の処理 → fallback」の順で処理関数を決める。
+    save_state(user_id, state) は処理関数が返した次の状態の保存に使う。
+    """
+
+    def __init__(self, name, save_state, idle_state):
+        self.name = name
+        self.save_state = save_state
+        self.idle_state = idle_state
+        self._commands = _MatchTable()
+        self._postbacks = _MatchTable()
+        self._states = {}
+        self._fallback = None
+        self._compiled = False
+
+    def _register(self, table, keys, transitions, prefix=False):
+        def decorator(handler):
+            route = _Route(handler, transitions)
+            for key in keys:
+                table.add(key, route, prefix)
+            self._compiled = False
+            return handler
+        return decorator
+
+    def command(self, *texts, transitions=()):
+        """テキストの完全一致で処理関数を登録"""
+        return self._register(self._commands, texts, transitions)
+
+    def command_prefix(self, prefix, transitions=()):
+        """テキストの前方一致で処理関数を登録"""
+        return self._register(self._commands, (prefix,), transitions, prefix=True)
+
+    def postback(self, *data, transitions=()):
+        """postbackデータの完全一致で処理関数を登録"""
+        return self._register(self._postbacks, data, transitions)
+
+    def postback_prefix(self, prefix, transitions=()):
+        """postbackデータの前方一致で処理関数を登録"""
+        return self._register(self._postbacks, (prefix,), transitions, prefix=True)
+
+    def state(self, name, transitions=()):
+        """会話状態での処理関数を登録（transitions は遷移先の状態名）"""
+        def decorator(handler):
+            if name in self._states:
+                raise ValueError(f'duplicate state: {name!r}')
+            self._states[name] = _Route(handler, transitions)
+            self._compiled = False
+            return handler
+        return decorator
+
+    def fallback(self, handler, transitions=()):
+        """どれにも一致しないテキストの処理関数を登録"""
+        self._fallback = _Route(handler, transitions)
+        return handler
+
+    def compile(self):
+        """前方一致表を作り、遷移先が登録済みの状態かを検証"""
+        known = set(self._states) | {self.idle_state}
+        routes = list(self._commands.exact.values()) + list(self._commands.prefix.values())
+        routes += list(self._postbacks.exact.values()) + list(self._postbacks.prefix.values())
+        routes += list(self._states.values())
+        if self._fallback is not None:
+            routes.append(self._fallback)
+        for route in routes:
+            unknown = route.transitions - known
+            if unknown:
+                raise ValueError(f'{route.handler.__name__}: unknown transition {sorted(unknown)}')
+        self._commands.compile()
+        self._postbacks.compile()
+        self._compiled = True
+        return self
+
+    def _ensure_compiled(self):
+        if not self._compiled:
+            self.compile()
+
+    def resolve(self, text, state_name=None):
+        """テキストと現在の状態から処理を決める（見つからなければNone）"""
+        self._ensure_compiled()
+        route = self._commands.lookup(text)
+        if route is None and state_name is not None:
+            route = self._states.get(state_name)
+        return route or self._fallback
+
+    def resolve_postback(self, data):
+        self._ensure_compiled()
+        return self._postbacks.lookup(data)
+
+    def _run(self, route, ctx):
+        next_state = route.handler(ctx)
+        if next_state is None:
+            return None
+        if next_state.name not in route.transitions:
+            # 遷移表に無い遷移は保存するが、定義漏れとして記録する
+            logger.warning('%s: undeclared transition %s -> %s in %s', self.name,
+                           ctx.state.name if ctx.state else None, next_state.name, route.handler.__name__)
+        self.save_state(ctx.user_id, next_state)
+        return next_state
+
+    def dispatch(self, ctx):
+        """テキストメッセージを処理（処理関数が無ければFalse）"""
+        route = self.resolve(ctx.text, ctx.state.name if ctx.state else None)
+        if route is None:
+            return False
+        self._run(route, ctx)
+        return True
+
+    def dispatch_postback(self, ctx, data):
+        """postbackを処理（処理関数が無ければFalse）"""
+        route = self.resolve_postback(data)
+        if route is None:
+            return False
+        self._run(route, ctx)
+        return True
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'commands': len(self._commands),
+            'postbacks': len(self._postbacks),
+            'states': sorted(self._states),
+        }
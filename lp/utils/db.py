@@ -1,14 +1,475 @@
 import os
+import time
 import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
 import psycopg2
 import sqlite3
+import psycopg2.pool
+from contextlib import contextmanager
+from psycopg2 import extensions as pg_extensions
 from psycopg2.extras import RealDictCursor
+from utils.db_metrics import InstrumentedPgConnection, InstrumentedSQLiteConnection
+from utils.statement_timeout import apply_statement_timeout
 
 DATABASE_URL = os.getenv('DATABASE_URL', 'database.db')
 
+# ローカル開発用PostgreSQLの接続先
+LOCAL_POSTGRES_DSN = "host=localhost dbname=ai_collections user=postgres password=password"
 
-def get_db_connection():
-    """データベース接続を取得（改善版）"""
+# コネクションプール設定（環境変数で上書き可能）
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '5'))
+DB_POOL_VALIDATE_AFTER = float(os.getenv('DB_POOL_VALIDATE_AFTER', '30'))
+DB_POOL_ENABLED = os.getenv('DB_POOL_ENABLED', '1') not in ('0', 'false', 'False', 'FALSE')
+
+# 読み取り専用レプリカ設定（未設定ならプライマリを使用）
+DB_REPLICA_MAX_STALENESS = float(os.getenv('DB_REPLICA_MAX_STALENESS', '30'))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '5'))
+
+
+class PooledConnection:
+    """プールから貸し出された接続のラッパー（close()でプールへ返却）"""
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+        self._returned = False
+
+    @property
+    def raw(self):
+        """ラップしているpsycopg2接続"""
+        return self._conn
+
+    def close(self):
+        """接続を閉じる代わりにプールへ返却"""
+        if not self._returned:
+            self._returned = True
+            self._pool.putconn(self._conn)
+
+    @property
+    def closed(self):
+        return self._returned or self._conn.closed
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if not self._conn.closed:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # close()し忘れた呼び出し元でも接続がプールから失われないようにする
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """スレッドセーフなPostgreSQLコネクションプール"""
+
+    def __init__(self, dsn, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT, validate_after=DB_POOL_VALIDATE_AFTER,
+                 readonly=False):
+        self.dsn = dsn
+        self.readonly = readonly
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.checkout_timeout = checkout_timeout
+        self.validate_after = validate_after
+        # __del__経由の返却が同一スレッドで再入してもデッドロックしないようRLockを使う
+        self._cond = threading.Condition(threading.RLock())
+        self._idle = deque()  # (conn, 返却時刻)
+        self._in_use = 0
+        self._pid = os.getpid()
+        self._stats = {
+            'created': 0,
+            'discarded': 0,
+            'checkouts': 0,
+            'validations': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'timeouts': 0,
+        }
+        for _ in range(self.min_size):
+            try:
+                self._idle.append((self._connect(), time.monotonic()))
+                self._stats['created'] += 1
+            except Exception as e:
+                logging.getLogger(__name__).warning("DBプール初期接続に失敗: %s", e)
+                break
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=InstrumentedPgConnection)
+        if self.readonly:
+            conn.set_session(readonly=True)
+        return conn
+
+    def _reset_after_fork(self):
+        """gunicornのfork後は親プロセスの接続を共有しない"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._in_use = 0
+
+    def _discard(self, conn):
+        self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, idle_since):
+        """貸し出し前の接続検証（長時間アイドルの接続のみ往復確認）"""
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.validate_after:
+            return True
+        self._stats['validations'] += 1
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """接続を取得（上限到達時はcheckout_timeout秒まで待機）"""
+        deadline = None
+        while True:
+            candidate = None
+            with self._cond:
+                self._reset_after_fork()
+                if self._idle:
+                    candidate = self._idle.pop()
+                    self._in_use += 1
+                elif self._in_use < self.max_size:
+                    # 接続確立中も枠を確保しておく
+                    self._in_use += 1
+                else:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.checkout_timeout
+                        self._stats['waits'] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise psycopg2.pool.PoolError(
+                            f'DBプールの接続待ちがタイムアウトしました（max_size={self.max_size}）'
+                        )
+                    started = time.monotonic()
+                    self._cond.wait(remaining)
+                    self._stats['wait_time_total'] += time.monotonic() - started
+                    continue
+
+            # 検証・接続確立はロック外で行う
+            if candidate is not None:
+                conn, idle_since = candidate
+                if self._is_usable(conn, idle_since):
+                    with self._cond:
+                        self._stats['checkouts'] += 1
+                    return PooledConnection(self, conn)
+                with self._cond:
+                    self._in_use -= 1
+                    self._discard(conn)
+                continue
+
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+                self._stats['checkouts'] += 1
+            return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        """接続をプールへ返却（未コミットのトランザクションは破棄）"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._in_use = max(0, self._in_use - 1)
+            usable = not conn.closed
+            if usable and conn.autocommit:
+                try:
+                    conn.autocommit = False
+                except Exception:
+                    usable = False
+            if usable and conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    usable = False
+            if usable and len(self._idle) < self.max_size:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        """アイドル接続をすべて閉じる"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        """プール統計を取得"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+            })
+        stats['wait_time_total'] = round(stats['wait_time_total'], 4)
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn, readonly=False):
+    """DSNと読み取り専用指定ごとのプロセス共有プールを取得
+
+    レプリカとプライマリが同じDSNでも、読み取り専用の接続と書き込み可能な接続を
+    同じプールで共有しないよう (dsn, readonly) をキーにする。
+    """
+    key = (dsn, bool(readonly))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(dsn, readonly=readonly)
+                _pools[key] = pool
+    return pool
+
+
+def _connect_postgres(dsn, readonly=False):
+    """PostgreSQL接続を取得（プール有効時はプールから貸し出し、現在のタイムアウトクラスを適用）"""
+    if DB_POOL_ENABLED:
+        return apply_statement_timeout(get_pool(dsn, readonly=readonly).getconn())
+    conn = psycopg2.connect(dsn, connection_factory=InstrumentedPgConnection)
+    if readonly:
+        conn.set_session(readonly=True)
+    return apply_statement_timeout(conn)
+
+
+class ReplicaRouter:
+    """読み取り専用レプリカへのルーティング（遅延が大きい・接続不可ならプライマリへ）"""
+
+    LAG_SQL = '''
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    '''
+
+    def __init__(self, max_staleness=DB_REPLICA_MAX_STALENESS, check_interval=DB_REPLICA_CHECK_INTERVAL):
+        self.max_staleness = max_staleness
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._usable = True
+        self._last_lag = None
+        self._stats = {'checkouts': 0, 'fallback_unavailable': 0, 'fallback_stale': 0}
+
+    @staticmethod
+    def replica_url():
+        return os.getenv('RAILWAY_DATABASE_REPLICA_URL') or os.getenv('DATABASE_REPLICA_URL')
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _measure_lag(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(self.LAG_SQL)
+            lag = float(cur.fetchone()[0] or 0)
+        finally:
+            cur.close()
+        conn.rollback()
+        return lag
+
+    def acquire(self):
+        """レプリカ接続を取得（使えない場合はNone）"""
+        url = self.replica_url()
+        if not url or not url.startswith('postgresql://'):
+            return None
+
+        now = time.monotonic()
+        due = now - self._checked_at >= self.check_interval
+        if not due and not self._usable:
+            # 直近の判定で使えなかった場合は次の確認時刻までプライマリを使う
+            self._count('fallback_stale' if self._last_lag is not None else 'fallback_unavailable')
+            return None
+
+        try:
+            conn = _connect_postgres(url, readonly=True)
+        except Exception as e:
+            logging.getLogger(__name__).warning("レプリカ接続に失敗、プライマリを使用: %s", e)
+            with self._lock:
+                self._checked_at, self._usable, self._last_lag = now, False, None
+                self._stats['fallback_unavailable'] += 1
+            return None
+
+        if due:
+            try:
+                lag = self._measure_lag(conn)
+            except Exception:
+                lag = None
+            usable = lag is not None and lag <= self.max_staleness
+            with self._lock:
+                self._checked_at, self._usable, self._last_lag = now, usable, lag
+            if not usable:
+                conn.close()
+                self._count('fallback_stale' if lag is not None else 'fallback_unavailable')
+                return None
+
+        self._count('checkouts')
+        return conn
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'configured': bool(self.replica_url()),
+                'usable': self._usable,
+                'last_lag_seconds': self._last_lag,
+                'max_staleness_seconds': self.max_staleness,
+            })
+        return stats
+
+
+replica_router = ReplicaRouter()
+
+# read_replica() ブロック内では readonly 指定なしの取得もレプリカへ振り分ける
+_prefer_replica = ContextVar('prefer_replica', default=False)
+
+
+@contextmanager
+def read_replica():
+    """ブロック内の読み取りをレプリカへ振り分けるルーティングコンテキスト"""
+    token = _prefer_replica.set(True)
+    try:
+        yield
+    finally:
+        _prefer_replica.reset(token)
+
+
+def get_replica_stats():
+    """レプリカルーティングの統計を取得"""
+    return replica_router.stats()
+
+
+def get_pool_stats():
+    """全プールの統計を取得（DSNの認証情報は含めない）"""
+    stats = []
+    for (dsn, _), pool in list(_pools.items()):
+        entry = pool.stats()
+        if dsn == LOCAL_POSTGRES_DSN:
+            entry['backend'] = 'local'
+        else:
+            entry['backend'] = 'replica' if pool.readonly else 'remote'
+        stats.append(entry)
+    return stats
+
+
+def close_all_pools():
+    """全プールのアイドル接続を閉じる"""
+    for pool in list(_pools.values()):
+        pool.closeall()
+
+
+# ローカル・検証環境を本番に近い性能特性にするためのSQLite設定
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+def _connect_sqlite(path):
+    """チューニング済みのSQLite接続を取得"""
+    conn = sqlite3.connect(path, factory=InstrumentedSQLiteConnection)
+    for pragma in SQLITE_PRAGMAS:
+        try:
+            # 接続設定はSQL計測の対象外にする
+            sqlite3.Connection.execute(conn, pragma)
+        except sqlite3.DatabaseError:
+            pass
+    return conn
+
+
+@contextmanager
+def db_connection():
+    """接続を取得し、終了時にcommit/rollbackしてプールへ返却するコンテキストマネージャー"""
+    conn = get_db_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# 実行中のユニットオブワーク（utils.unit_of_work参照）
+_current_uow = ContextVar('current_unit_of_work', default=None)
+
+
+def get_db_connection(readonly=False):
+    """データベース接続を取得（PostgreSQLはプールから貸し出し、close()で返却）
+
+    ユニットオブワーク内では共有接続のハンドルを返す（未コミットの変更を読めるように
+    readonly指定より優先）。readonly=True または read_replica() ブロック内では
+    レプリカを使い、未設定・遅延超過・接続不可の場合はプライマリへフォールバックする。
+    PostgreSQLの接続にはリクエストのタイムアウトクラスの statement_timeout を設定する
+    （utils.statement_timeout.apply_statement_timeout）。
+    """
+    uow = _current_uow.get()
+    if uow is not None:
+        return uow.borrow()
+    if readonly or _prefer_replica.get():
+        conn = replica_router.acquire()
+        if conn is not None:
+            return conn
+    return _acquire_connection()
+
+
+def _acquire_connection():
+    """実接続を取得"""
     # 機密情報をログに出さないよう、存在フラグのみ出力
     railway_url_env = os.getenv('RAILWAY_DATABASE_URL')
     database_url_env = os.getenv('DATABASE_URL')
@@ -23,43 +484,41 @@ def get_db_connection():
     if database_url and database_url.startswith('postgresql://'):
         # PostgreSQL接続
         try:
-            return psycopg2.connect(database_url)
+            return _connect_postgres(database_url)
+        except psycopg2.pool.PoolError:
+            # プール枯渇時は別DBへフォールバックせずに呼び出し元へ通知
+            raise
         except Exception as e:
             print(f'[ERROR] PostgreSQL接続エラー: {e}')
             # フォールバック: ローカルPostgreSQL
             try:
-                return psycopg2.connect(
-                    host="localhost",
-                    database="ai_collections",
-                    user="postgres",
-                    password="password"
-                )
+                return _connect_postgres(LOCAL_POSTGRES_DSN)
             except Exception:
                 # 最終フォールバック: SQLite
-                return sqlite3.connect('database.db')
+                return _connect_sqlite('database.db')
     elif database_url and database_url.startswith('sqlite://'):
         # SQLite接続（URL形式）
         db_path = database_url.replace('sqlite://', '')
-        return sqlite3.connect(db_path)
+        return _connect_sqlite(db_path)
     elif database_url and not database_url.startswith(('postgresql://', 'sqlite://')):
         # SQLite接続（ファイルパス形式）
-        return sqlite3.connect(database_url)
+        return _connect_sqlite(database_url)
     else:
-        # ローカル開発用（PostgreSQL）
+        # ローカル開発用（PostgreSQL）: 判定済みでSQLiteなら再接続を試みない
+        if _backend == 'sqlite':
+            return _connect_sqlite('database.db')
         try:
-            return psycopg2.connect(
-                host="localhost",
-                database="ai_collections",
-                user="postgres",
-                password="password"
-            )
+            return _connect_postgres(LOCAL_POSTGRES_DSN)
         except Exception:
             # PostgreSQL接続に失敗した場合はSQLiteを使用
-            return sqlite3.connect('database.db')
+            return _connect_sqlite('database.db')
 
 
-def get_db_type():
-    """データベースタイプを取得（postgresql または sqlite）"""
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _detect_backend():
     database_url = os.getenv('RAILWAY_DATABASE_URL') or os.getenv('DATABASE_URL')
     if database_url and database_url.startswith('postgresql://'):
         return 'postgresql'
@@ -68,18 +527,35 @@ def get_db_type():
     elif database_url and not database_url.startswith(('postgresql://', 'sqlite://')):
         return 'sqlite'
     else:
-        # ローカル開発用（PostgreSQL）
+        # ローカル開発用（PostgreSQL）: 接続確認後はプールへ返却する
         try:
-            psycopg2.connect(
-                host="localhost",
-                database="ai_collections",
-                user="postgres",
-                password="password"
-            )
+            _connect_postgres(LOCAL_POSTGRES_DSN).close()
             return 'postgresql'
-        except:
+        except Exception:
             return 'sqlite'
 
+
+def resolve_backend():
+    """データベースバックエンドを解決（プロセス内で一度だけ判定）"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _detect_backend()
+    return _backend
+
+
+def reset_backend():
+    """バックエンド判定結果を破棄"""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def get_db_type():
+    """データベースタイプを取得（postgresql または sqlite）"""
+    return resolve_backend()
+
 def migrate_add_pending_charge():
     """pending_chargeカラムを追加するマイグレーション"""
     try:
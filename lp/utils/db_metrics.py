@@ -0,0 +1,347 @@
+"""
+SQL計測モジュール
+
+全カーソルの execute/executemany を計測し、以下を提供する:
+  - リクエスト（またはイベント）単位のクエリ数・所要時間
+  - プロセス全体の集計とステートメント別の上位統計（行数・呼び出し元つき）
+  - 閾値を超えたクエリのスローログ（パラメータは出力しない）
+
+ステートメントはリテラル（数値・文字列）とユニットオブワークのセーブポイント名を
+? に置き換えてまとめる。セーブポイントの作成・解放・巻き戻しはアプリのクエリではないため数えない。
+呼び出し元は utils/ の外側で最初に見つかったフレーム（ファイル:行 関数名）。
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+import psycopg2.errors
+import psycopg2.extensions
+
+from utils.statement_timeout import statement_cancelled, get_statement_timeout_stats
+
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))
+# ステートメント別統計に保持する種類数の上限
+MAX_TRACKED_STATEMENTS = int(os.getenv('DB_METRICS_MAX_STATEMENTS', '200'))
+# ステートメントごとに保持する呼び出し元の数の上限
+MAX_CALL_SITES = int(os.getenv('DB_METRICS_MAX_CALL_SITES', '5'))
+
+slow_query_logger = logging.getLogger('db.slow_query')
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+# ユニットオブワークが先頭に付与するセーブポイントは統計上除外する
+_SAVEPOINT_PREFIX_RE = re.compile(r'^SAVEPOINT \w+;\s*')
+# セーブポイント名の連番（uow_sp_N）は数値のリテラルの置き換えでは単語の一部として残る
+_SAVEPOINT_NAME_RE = re.compile(r'\buow_sp_\d+\b')
+# 単独で発行されるセーブポイントの操作（SQLiteや明示的な入れ子セーブポイント）
+_SAVEPOINT_STATEMENT_RE = re.compile(r'^(?:SAVEPOINT|RELEASE|ROLLBACK TO)\b', re.IGNORECASE)
+
+
+class QueryStats:
+    """クエリ数と所要時間の集計"""
+
+    __slots__ = ('count', 'total_time', 'slow', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slow = 0
+        self.rows = 0
+
+    def add(self, duration, is_slow, rowcount=None):
+        self.count += 1
+        self.total_time += duration
+        if is_slow:
+            self.slow += 1
+        if rowcount is not None and rowcount > 0:
+            self.rows += rowcount
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_time += other.total_time
+        self.slow += other.slow
+        self.rows += other.rows
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_time * 1000, 2),
+            'slow': self.slow,
+            'rows': self.rows,
+        }
+
+
+class StatementStats(QueryStats):
+    """ステートメント別の集計（呼び出し元ごとの回数を含む）"""
+
+    __slots__ = ('call_sites',)
+
+    def __init__(self):
+        super().__init__()
+        self.call_sites = {}
+
+    def add_call_site(self, call_site):
+        if call_site in self.call_sites:
+            self.call_sites[call_site] += 1
+        elif len(self.call_sites) < MAX_CALL_SITES:
+            self.call_sites[call_site] = 1
+
+    def to_dict(self):
+        result = super().to_dict()
+        result['rows_per_call'] = round(self.rows / self.count, 2) if self.count else 0.0
+        result['call_sites'] = dict(sorted(self.call_sites.items(), key=lambda item: item[1], reverse=True))
+        return result
+
+
+_current_stats = ContextVar('db_query_stats', default=None)
+_lock = threading.Lock()
+_totals = QueryStats()
+_statements = {}
+_endpoints = {}
+
+
+def normalize_sql(sql):
+    """統計用にSQLを正規化（空白の圧縮・リテラルの置き換え・長さ制限）"""
+    if isinstance(sql, bytes):
+        sql = sql[:400].decode('utf-8', 'ignore')
+    return _normalize_text(str(sql))
+
+
+@lru_cache(maxsize=1024)
+def _normalize_text(sql):
+    # 同じ文字列のステートメントは正規化結果を使い回す
+    sql = _WHITESPACE_RE.sub(' ', sql).strip()
+    sql = _SAVEPOINT_PREFIX_RE.sub('', sql)
+    sql = _SAVEPOINT_NAME_RE.sub('uow_sp_?', sql)
+    sql = _STRING_LITERAL_RE.sub('?', sql)
+    sql = _NUMBER_LITERAL_RE.sub('?', sql)
+    return sql[:200]
+
+
+# このディレクトリ（utils/）のフレームは呼び出し元として扱わない
+_UTILS_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+@lru_cache(maxsize=1024)
+def _is_internal_frame(filename):
+    return os.path.abspath(filename).startswith(_UTILS_DIR)
+
+
+def _call_site():
+    """utils/ の外側で最初のフレーム（ファイル:行 関数名）"""
+    frame = sys._getframe(2)
+    while frame is not None and _is_internal_frame(frame.f_code.co_filename):
+        frame = frame.f_back
+    if frame is None:
+        return '-'
+    filename = frame.f_code.co_filename
+    if filename.startswith(_APP_ROOT):
+        filename = filename[len(_APP_ROOT):]
+    return f'{filename}:{frame.f_lineno} {frame.f_code.co_name}'
+
+
+def record_query(sql, duration, rowcount=None):
+    """1ステートメント分の計測結果を記録（rowcount は取得・更新した行数、不明なら None か -1）"""
+    statement = normalize_sql(sql)
+    if _SAVEPOINT_STATEMENT_RE.match(statement):
+        return
+    is_slow = duration * 1000 >= SLOW_QUERY_MS
+    if rowcount is not None and rowcount < 0:
+        rowcount = None
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add(duration, is_slow, rowcount)
+
+    call_site = _call_site()
+    with _lock:
+        _totals.add(duration, is_slow, rowcount)
+        entry = _statements.get(statement)
+        if entry is None and len(_statements) < MAX_TRACKED_STATEMENTS:
+            entry = _statements[statement] = StatementStats()
+        if entry is not None:
+            entry.add(duration, is_slow, rowcount)
+            entry.add_call_site(call_site)
+
+    if is_slow:
+        slow_query_logger.warning('slow query %.1fms rows=%s at %s: %s',
+                                  duration * 1000, '-' if rowcount is None else rowcount, call_site, statement)
+
+
+class _TimedPgCursorMixin:
+    """psycopg2カーソル用の計測ミックスイン（タイムアウトによる取り消しは専用例外に変換）"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except psycopg2.errors.QueryCanceled as e:
+            raise statement_cancelled(e, normalize_sql(query)) from e
+        finally:
+            record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        except psycopg2.errors.QueryCanceled as e:
+            raise statement_cancelled(e, normalize_sql(query)) from e
+        finally:
+            record_query(query, time.perf_counter() - started, self.rowcount)
+
+
+_pg_cursor_classes = {}
+
+
+def _instrumented_pg_cursor_class(base):
+    cls = _pg_cursor_classes.get(base)
+    if cls is None:
+        cls = type(f'Timed{base.__name__}', (_TimedPgCursorMixin, base), {})
+        _pg_cursor_classes[base] = cls
+    return cls
+
+
+class InstrumentedPgConnection(psycopg2.extensions.connection):
+    """cursor_factoryを問わずカーソルを計測付きにするpsycopg2接続"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _instrumented_pg_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+class InstrumentedSQLiteCursor(sqlite3.Cursor):
+    """計測付きSQLiteカーソル"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started, self.rowcount)
+
+
+class InstrumentedSQLiteConnection(sqlite3.Connection):
+    """カーソルと execute ショートカットを計測付きにするSQLite接続"""
+
+    def cursor(self, factory=InstrumentedSQLiteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+@contextmanager
+def query_stats_scope():
+    """ブロック内のクエリ数・時間を集計（ワーカースレッドのイベント処理などで使用）
+
+    外側のリクエスト/スコープの集計にもブロック内の分を加える。
+    """
+    parent = _current_stats.get()
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        if parent is not None:
+            parent.merge(stats)
+
+
+def current_query_stats():
+    """実行中のリクエスト/スコープの集計（なければNone）"""
+    return _current_stats.get()
+
+
+def _record_endpoint(endpoint, stats):
+    with _lock:
+        entry = _endpoints.get(endpoint)
+        if entry is None:
+            entry = _endpoints[endpoint] = {'requests': 0, 'queries': 0, 'total_time': 0.0, 'max_queries': 0}
+        entry['requests'] += 1
+        entry['queries'] += stats.count
+        entry['total_time'] += stats.total_time
+        entry['max_queries'] = max(entry['max_queries'], stats.count)
+
+
+def get_query_metrics(top=20):
+    """プロセス全体のSQL計測結果を取得"""
+    with _lock:
+        totals = _totals.to_dict()
+        statements = sorted(_statements.items(), key=lambda item: item[1].total_time, reverse=True)[:top]
+        statements = [dict(statement=sql, **stats.to_dict()) for sql, stats in statements]
+        endpoints = {
+            name: {
+                'requests': entry['requests'],
+                'queries_per_request': round(entry['queries'] / entry['requests'], 2),
+                'max_queries': entry['max_queries'],
+                'db_ms_per_request': round(entry['total_time'] * 1000 / entry['requests'], 2),
+            }
+            for name, entry in _endpoints.items()
+        }
+    return {
+        'slow_query_ms': SLOW_QUERY_MS,
+        'totals': totals,
+        'top_statements': statements,
+        'endpoints': endpoints,
+        'statement_timeouts': get_statement_timeout_stats(),
+    }
+
+
+def reset_query_metrics():
+    """集計をリセット"""
+    global _totals
+    with _lock:
+        _totals = QueryStats()
+        _statements.clear()
+        _endpoints.clear()
+
+
+def init_app(app):
+    """Flaskアプリにリクエスト単位のSQL計測を組み込む"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_query_stats():
+        g._db_query_stats = QueryStats()
+        g._db_query_stats_token = _current_stats.set(g._db_query_stats)
+
+    @app.after_request
+    def _finish_query_stats(response):
+        stats = g.pop('_db_query_stats', None)
+        if stats is not None:
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Query-Time-Ms'] = f'{stats.total_time * 1000:.2f}'
+            _record_endpoint(request.endpoint or request.path, stats)
+            logger.debug('%s %s: %d queries, %.1fms',
+                         request.method, request.path, stats.count, stats.total_time * 1000)
+        return response
+
+    @app.teardown_request
+    def _reset_query_stats(exc):
+        token = g.pop('_db_query_stats_token', None)
+        if token is not None:
+            try:
+                _current_stats.reset(token)
+            except ValueError:
+                pass
@@ -0,0 +1,140 @@
+"""
+データベース方言（PostgreSQL / SQLite）の差異を吸収するモジュール
+
+バックエンドは初回利用時に一度だけ解決し、以降はプレースホルダーや
+UPSERT構文などをキャッシュ済みの値で返す。
+"""
+
+import re
+import abc
+import threading
+from datetime import datetime
+
+from utils.db import resolve_backend, reset_backend
+
+_PYFORMAT_RE = re.compile(r'%%|%s')
+
+_INTERVAL_UNITS = ('seconds', 'minutes', 'hours', 'days', 'months', 'years')
+
+
+class Dialect(abc.ABC):
+    """SQL方言の基底クラス"""
+
+    name = None
+    placeholder = None
+
+    def __init__(self):
+        self._sql_cache = {}
+        self._upsert_cache = {}
+
+    def sql(self, query):
+        """%s形式で書かれたSQLをこのバックエンド用に変換（結果はキャッシュ）"""
+        cached = self._sql_cache.get(query)
+        if cached is None:
+            cached = self._convert(query)
+            self._sql_cache[query] = cached
+        return cached
+
+    def _convert(self, query):
+        return query
+
+    def placeholders(self, count):
+        """VALUES句などで使うプレースホルダー列を返す"""
+        return ', '.join([self.placeholder] * count)
+
+    def upsert(self, table, columns, conflict_columns, update_columns=None):
+        """INSERT ... ON CONFLICT 構文を返す（update_columns未指定時はDO NOTHING）"""
+        key = (table, tuple(columns), tuple(conflict_columns), tuple(update_columns or ()))
+        cached = self._upsert_cache.get(key)
+        if cached is None:
+            if update_columns:
+                action = 'DO UPDATE SET ' + ', '.join(f'{col} = excluded.{col}' for col in update_columns)
+            else:
+                action = 'DO NOTHING'
+            cached = (
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'VALUES ({self.placeholders(len(columns))}) '
+                f'ON CONFLICT ({", ".join(conflict_columns)}) {action}'
+            )
+            self._upsert_cache[key] = cached
+        return cached
+
+    def now(self):
+        """現在時刻を表すSQL式"""
+        return 'CURRENT_TIMESTAMP'
+
+    @abc.abstractmethod
+    def date_add(self, expr, amount, unit):
+        """日時式に期間を加算したSQL式を返す（amountは負数も可）"""
+
+    def ago(self, amount, unit):
+        """現在時刻から指定期間前を表すSQL式"""
+        return self.date_add(self.now(), -int(amount), unit)
+
+    def timestamp(self, value):
+        """日時値をバインドパラメータ用に変換"""
+        return value
+
+    @staticmethod
+    def _check_interval(amount, unit):
+        if unit not in _INTERVAL_UNITS:
+            raise ValueError(f'未対応の期間単位です: {unit}')
+        return int(amount)
+
+
+class PostgresDialect(Dialect):
+    """PostgreSQL方言"""
+
+    name = 'postgresql'
+    placeholder = '%s'
+
+    def date_add(self, expr, amount, unit):
+        amount = self._check_interval(amount, unit)
+        return f"({expr} + INTERVAL '{amount} {unit}')"
+
+
+class SQLiteDialect(Dialect):
+    """SQLite方言"""
+
+    name = 'sqlite'
+    placeholder = '?'
+
+    def _convert(self, query):
+        return _PYFORMAT_RE.sub(lambda m: '%' if m.group() == '%%' else '?', query)
+
+    def date_add(self, expr, amount, unit):
+        amount = self._check_interval(amount, unit)
+        return f"datetime({expr}, '{amount:+d} {unit}')"
+
+    def timestamp(self, value):
+        # Python 3.12で非推奨になった既定アダプタに頼らずISO形式で保存
+        if isinstance(value, datetime):
+            return value.isoformat(sep=' ')
+        return value
+
+
+_DIALECTS = {
+    'postgresql': PostgresDialect,
+    'sqlite': SQLiteDialect,
+}
+
+_dialect = None
+_dialect_lock = threading.Lock()
+
+
+def get_dialect():
+    """解決済みの方言オブジェクトを取得（初回のみバックエンドを解決）"""
+    global _dialect
+    if _dialect is None:
+        with _dialect_lock:
+            if _dialect is None:
+                _dialect = _DIALECTS[resolve_backend()]()
+    return _dialect
+
+
+def reset_dialect():
+    """方言キャッシュを破棄（環境変数を切り替えるスクリプト・検証用）"""
+    global _dialect
+    with _dialect_lock:
+        _dialect = None
+    reset_backend()
@@ -0,0 +1,265 @@
+"""
+Webhookイベントのバックグラウンド処理キュー
+
+Webhookは署名検証後にイベントをキューへ積んで即座に200を返し、
+ワーカースレッドが順次処理する。キューはワーカーごとに分かれており、
+キー（LINEユーザーIDなど）が同じイベントは常に同じワーカーへ振り分けて
+到着順に処理し、異なるキーのイベントは並行して処理する。
+
+キューは上限付きで、満杯の場合は短時間だけ空きを待ち、それでも積めなければ
+EventQueueFull を送出する（Webhookは503を返してLINEに再送させる）。
+受信したリクエストのスレッドで処理すると、同じキーの後続イベントが
+先にキューへ積まれて追い越すことがあるため行わない。
+
+gunicornの --preload でフォーク前に作られても動くよう、ワーカースレッドは
+最初の投入時にプロセスごとに起動する。
+"""
+
+import os
+import time
+import zlib
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+
+from utils.db_metrics import query_stats_scope
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_WORKERS = int(os.getenv('EVENT_QUEUE_WORKERS', '4'))
+EVENT_QUEUE_MAX_SIZE = int(os.getenv('EVENT_QUEUE_MAX_SIZE', '1000'))
+# 満杯時に空きを待つ秒数（超えたら EventQueueFull）
+EVENT_QUEUE_PUT_TIMEOUT = float(os.getenv('EVENT_QUEUE_PUT_TIMEOUT', '0.2'))
+# 待ち時間がこれを超えたイベントは返信トークン失効の恐れがあるため警告する
+EVENT_QUEUE_STALE_AFTER = float(os.getenv('EVENT_QUEUE_STALE_AFTER', '30'))
+# 待ち時間の分位点計算に使う直近サンプル数
+_WAIT_SAMPLES = 1000
+
+_STOP = object()
+
+
+class EventQueueFull(Exception):
+    """キューが満杯でイベントを積めなかった（呼び出し元は再送を求める）"""
+
+
+class _QueuedEvent:
+    __slots__ = ('event', 'key', 'enqueued_at')
+
+    def __init__(self, event, key):
+        self.event = event
+        self.key = key
+        self.enqueued_at = time.monotonic()
+
+
+class EventWorkerPool:
+    """キー単位で順序を保つ、上限付きのシャーディング処理プール
+
+    key_func はイベントから順序付けのキーを返す関数。キーがNoneのイベントは
+    最も空いているワーカーへ振り分ける。
+    """
+
+    def __init__(self, name, handler, key_func=None, workers=EVENT_QUEUE_WORKERS, max_size=EVENT_QUEUE_MAX_SIZE,
+                 put_timeout=EVENT_QUEUE_PUT_TIMEOUT, stale_after=EVENT_QUEUE_STALE_AFTER):
+        self.name = name
+        self.handler = handler
+        self.key_func = key_func
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self.put_timeout = put_timeout
+        self.stale_after = stale_after
+        self._queues = []
+        self._threads = []
+        # キーごとの未処理イベント数
+        self._pending = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+        self._stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'stale': 0,
+            'max_depth': 0,
+            'wait_time_total': 0.0,
+            'max_wait': 0.0,
+            'process_time_total': 0.0,
+            'queries_total': 0,
+        }
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # フォーク前のキュー・スレッドは子プロセスでは使えないため作り直す
+            shard_size = max(1, self.max_size // self.workers)
+            self._queues = [queue.Queue(maxsize=shard_size) for _ in range(self.workers)]
+            self._threads = []
+            self._pending = {}
+            for i, shard in enumerate(self._queues):
+                thread = threading.Thread(target=self._worker, args=(shard,),
+                                          name=f'{self.name}-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+            logger.info('event queue %s started: workers=%d, max_size=%d', self.name, self.workers, self.max_size)
+
+    def _shard_for(self, key):
+        if key is None:
+            return min(self._queues, key=lambda shard: shard.qsize())
+        # 同じキーは常に同じワーカーへ（プロセス間でも安定したハッシュを使う）
+        return self._queues[zlib.crc32(str(key).encode('utf-8')) % len(self._queues)]
+
+    def submit(self, event):
+        """イベントを投入（put_timeout 秒待っても満杯なら EventQueueFull を送出）"""
+        self._ensure_started()
+        key = self.key_func(event) if self.key_func else None
+        item = _QueuedEvent(event, key)
+        shard = self._shard_for(key)
+        self._track(key, 1)
+        try:
+            shard.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self._track(key, -1)
+            self._count('rejected')
+            logger.warning('event queue %s is full, rejecting event', self.name)
+            raise EventQueueFull(f'event queue {self.name} is full') from None
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._depth())
+        return True
+
+    def _track(self, key, delta):
+        if key is None:
+            return
+        with self._stats_lock:
+            count = self._pending.get(key, 0) + delta
+            if count > 0:
+                self._pending[key] = count
+            else:
+                self._pending.pop(key, None)
+
+    def _depth(self):
+        return sum(shard.qsize() for shard in self._queues)
+
+    def _worker(self, shard):
+        while True:
+            item = shard.get()
+            try:
+                if item is _STOP:
+                    return
+                try:
+                    self._process(item)
+                finally:
+                    self._track(item.key, -1)
+            finally:
+                shard.task_done()
+
+    def _process(self, item):
+        wait = time.monotonic() - item.enqueued_at
+        if wait > self.stale_after:
+            self._count('stale')
+            logger.warning('event waited %.1fs in queue %s (reply token may have expired)', wait, self.name)
+
+        started = time.monotonic()
+        failed = False
+        with query_stats_scope() as query_stats:
+            try:
+                self.handler(item.event)
+            except Exception:
+                failed = True
+                logger.exception('event handler failed in queue %s', self.name)
+        elapsed = time.monotonic() - started
+
+        with self._stats_lock:
+            self._stats['failed' if failed else 'processed'] += 1
+            self._stats['wait_time_total'] += wait
+            self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+            self._stats['process_time_total'] += elapsed
+            self._stats['queries_total'] += query_stats.count
+            self._waits.append(wait)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def drain(self, timeout=None):
+        """キューが空になるまで待つ（待ちきれた場合True）"""
+        if self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(shard.unfinished_tasks for shard in self._queues):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, timeout=10):
+        """処理中のイベントを待ってからワーカーを停止"""
+        if self._pid != os.getpid():
+            return
+        self.drain(timeout)
+        for shard in self._queues:
+            try:
+                shard.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._pid = None
+
+    def stats(self):
+        """キューの統計（待ち時間はミリ秒）"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+        handled = stats['processed'] + stats['failed']
+        running = self._pid == os.getpid()
+        stats.update({
+            'name': self.name,
+            'workers': self.workers,
+            'max_size': self.max_size,
+            'depth': self._depth() if running else 0,
+            'active_keys': len(self._pending) if running else 0,
+            'running': running,
+            'avg_wait_ms': round(stats['wait_time_total'] * 1000 / handled, 2) if handled else 0.0,
+            'p95_wait_ms': round(waits[int(len(waits) * 0.95) - 1] * 1000, 2) if waits else 0.0,
+            'max_wait_ms': round(stats.pop('max_wait') * 1000, 2),
+            'avg_process_ms': round(stats['process_time_total'] * 1000 / handled, 2) if handled else 0.0,
+            'queries_per_event': round(stats['queries_total'] / handled, 2) if handled else 0.0,
+        })
+        del stats['wait_time_total'], stats['process_time_total']
+        return stats
+
+
+_pools = {}
+
+
+def register_pool(pool):
+    """監視対象としてプールを登録"""
+    _pools[pool.name] = pool
+    return pool
+
+
+def get_event_queue_stats():
+    """登録済みプールの統計を取得"""
+    return [pool.stats() for pool in _pools.values()]
+
+
+def drain_pools(timeout=None):
+    """登録済みプールのキューが空になるまで待つ"""
+    return all(pool.drain(timeout) for pool in list(_pools.values()))
+
+
+@atexit.register
+def _shutdown_pools():
+    for pool in list(_pools.values()):
+        try:
+            pool.shutdown(timeout=5)
+        except Exception:
+            pass
@@ -0,0 +1,186 @@
+"""
+Webhookイベントの重複排除
+
+LINEは応答が遅いと同じイベントを再送する（deliveryContext.isRedelivery）。
+webhookEventId をキーに、次の2段階で再送されたイベントをハンドラーの実行前に取り除く。
+
+- 受信時（is_new）: プロセス内の上限付きLRUだけを見る。200応答までにDBの往復を増やさない
+- 処理開始時（claim）: ワーカーが processed_webhook_events テーブルに記録し、
+  他のプロセスが受け付け済みのイベントを捨てる
+
+テーブルの行は保持期間を過ぎたものを定期的に削除する。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from utils.db import get_db_connection
+from utils.dialect import get_dialect
+
+logger = logging.getLogger(__name__)
+
+DEDUP_LRU_SIZE = int(os.getenv('WEBHOOK_DEDUP_LRU_SIZE', '10000'))
+# LINEの再送は最大でも数時間以内のため、余裕を持たせて保持する
+DEDUP_TTL_HOURS = int(os.getenv('WEBHOOK_DEDUP_TTL_HOURS', '72'))
+DEDUP_CLEANUP_INTERVAL = float(os.getenv('WEBHOOK_DEDUP_CLEANUP_INTERVAL', '3600'))
+
+
+def create_processed_events_table(c, dialect):
+    """処理済みイベントIDテーブルを作成（マイグレーション用）"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS processed_webhook_events (
+            event_id VARCHAR(64) PRIMARY KEY,
+            source VARCHAR(32) NOT NULL,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+class _LRUSet:
+    """上限付きのLRU集合"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._items[key] = None
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class EventDeduplicator:
+    """webhookEventIdによる冪等性チェック"""
+
+    def __init__(self, source, lru_size=DEDUP_LRU_SIZE, ttl_hours=DEDUP_TTL_HOURS,
+                 cleanup_interval=DEDUP_CLEANUP_INTERVAL):
+        self.source = source
+        self.ttl_hours = ttl_hours
+        self.cleanup_interval = cleanup_interval
+        self._seen = _LRUSet(lru_size)
+        self._last_cleanup = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {'new': 0, 'duplicate_memory': 0, 'duplicate_db': 0, 'redeliveries': 0,
+                       'errors': 0, 'cleaned': 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _claim(self, event_id):
+        """DBに記録し、初回ならTrue（記録できない場合は処理を優先してTrue）"""
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            # received_atは削除条件と同じDB側の時刻（列の既定値）で記録する
+            c.execute(
+                dialect.upsert('processed_webhook_events', ('event_id', 'source'), ('event_id',)),
+                (event_id, self.source)
+            )
+            claimed = c.rowcount != 0
+            conn.commit()
+            self._maybe_cleanup(c, conn, dialect)
+            return claimed
+        except Exception as e:
+            conn.rollback()
+            self._count('errors')
+            logger.warning('webhook dedup check failed, processing event %s: %s', event_id, e)
+            return True
+        finally:
+            conn.close()
+
+    def _maybe_cleanup(self, c, conn, dialect):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_cleanup < self.cleanup_interval:
+                return
+            self._last_cleanup = now
+        c.execute(
+            f'DELETE FROM processed_webhook_events WHERE received_at < {dialect.ago(self.ttl_hours, "hours")}'
+        )
+        deleted = c.rowcount
+        conn.commit()
+        if deleted:
+            self._count('cleaned', deleted)
+            logger.info('removed %d expired webhook event ids', deleted)
+
+    def is_new(self, event):
+        """受信時の判定: このプロセスで受け付けていなければTrue（DBは見ない）
+
+        webhookEventIdの無いイベントは常にTrue。
+        """
+        event_id = event.get('webhookEventId')
+        if not event_id:
+            return True
+        if (event.get('deliveryContext') or {}).get('isRedelivery'):
+            self._count('redeliveries')
+
+        if event_id in self._seen:
+            self._count('duplicate_memory')
+            return False
+        self._seen.add(event_id)
+        return True
+
+    def filter_new(self, events):
+        """このプロセスで受け付けていないイベントだけを返す"""
+        return [event for event in events if self.is_new(event)]
+
+    def forget(self, event):
+        """受け付けを取り消す（再送されたときに受け付け直せるようにする）"""
+        event_id = event.get('webhookEventId')
+        if event_id:
+            self._seen.discard(event_id)
+
+    def claim(self, event):
+        """処理開始時の判定: DBに記録し、初回ならTrue（ワーカーから呼ぶ）"""
+        event_id = event.get('webhookEventId')
+        if not event_id:
+            return True
+        if not self._claim(event_id):
+            self._count('duplicate_db')
+            return False
+        self._count('new')
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'source': self.source, 'memory_size': len(self._seen), 'ttl_hours': self.ttl_hours})
+        return stats
+
+
+_deduplicators = {}
+
+
+def get_deduplicator(source):
+    """送信元ごとの重複排除オブジェクトを取得"""
+    dedup = _deduplicators.get(source)
+    if dedup is None:
+        dedup = _deduplicators.setdefault(source, EventDeduplicator(source))
+    return dedup
+
+
+def get_dedup_stats():
+    """重複排除の統計を取得"""
+    return [dedup.stats() for dedup in _deduplicators.values()]
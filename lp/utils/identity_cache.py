@@ -0,0 +1,95 @@
+"""
+LINEユーザー → 企業の特定結果のキャッシュ
+
+line_user_id から (company_id, stripe_subscription_id, subscription_status) を
+プロセス内に保持し、メッセージごとの companies / company_monthly_subscriptions の
+検索を省く。結果が変わるのはフォロー・フォロー解除・メールアドレス連携・
+Stripeのサブスクリプション変更のときだけなので、それぞれの処理から
+明示的に無効化する。取りこぼしに備えて短いTTLを持たせ、
+企業が見つからない結果はさらに短く保持する。
+
+無効化のキーは line_user_id、'company:<id>'、'subscription:<id>' のいずれかで、
+他プロセスへはNOTIFYで伝える（utils.local_cache）。
+"""
+
+import os
+
+from utils.local_cache import TTLCache, register_cache, publish_invalidation, broadcast_invalidation
+from utils.unit_of_work import current_unit_of_work
+
+IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', '60'))
+IDENTITY_CACHE_NEGATIVE_TTL = float(os.getenv('IDENTITY_CACHE_NEGATIVE_TTL', '10'))
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', '10000'))
+
+# 契約が有効とみなすステータス（トライアル中を含む）
+VALID_SUBSCRIPTION_STATUSES = ('active', 'trialing')
+
+_COMPANY_PREFIX = 'company:'
+_SUBSCRIPTION_PREFIX = 'subscription:'
+
+
+class IdentityCache(TTLCache):
+    """企業・サブスクリプション単位でも無効化できるキャッシュ"""
+
+    def store(self, line_user_id, identity):
+        """(company_id, stripe_subscription_id, subscription_status) または None を保存"""
+        if identity is None or identity[2] not in VALID_SUBSCRIPTION_STATUSES:
+            self.set(line_user_id, identity, IDENTITY_CACHE_NEGATIVE_TTL)
+        else:
+            self.set(line_user_id, identity)
+
+    def invalidate(self, key, remote=False):
+        key = str(key)
+        if key.startswith(_COMPANY_PREFIX):
+            self._invalidate_where(0, key[len(_COMPANY_PREFIX):], remote)
+        elif key.startswith(_SUBSCRIPTION_PREFIX):
+            self._invalidate_where(1, key[len(_SUBSCRIPTION_PREFIX):], remote)
+        else:
+            super().invalidate(key, remote)
+
+    def _invalidate_where(self, index, value, remote):
+        # 企業・サブスクリプションの変更は稀なため全件走査で探す
+        with self._lock:
+            matched = [line_user_id for line_user_id, (identity, _) in self._data.items()
+                       if identity is not None and str(identity[index]) == value]
+            for line_user_id in matched:
+                del self._data[line_user_id]
+            self._stats['remote_invalidations' if remote else 'invalidations'] += 1
+
+
+identity_cache = register_cache(IdentityCache('line_identity', IDENTITY_CACHE_TTL, IDENTITY_CACHE_SIZE))
+
+
+def _invalidate(key, cursor=None):
+    identity_cache.invalidate(key)
+    if cursor is not None:
+        publish_invalidation(cursor, identity_cache.name, key)
+    else:
+        broadcast_invalidation(identity_cache.name, key)
+    # ユニットオブワーク内では確定前に古い値を読み直した可能性があるため確定後にも消す
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.on_commit(lambda: identity_cache.invalidate(key))
+
+
+def company_cache_key(company_id):
+    """企業に紐づくLINEユーザーをまとめて無効化するキー"""
+    return f'{_COMPANY_PREFIX}{company_id}'
+
+
+def invalidate_line_user(line_user_id, cursor=None):
+    """LINEユーザーの特定結果を無効化（cursor を渡すとその変更と同じトランザクションで通知）"""
+    if line_user_id:
+        _invalidate(line_user_id, cursor)
+
+
+def invalidate_company(company_id, cursor=None):
+    """企業に紐づくLINEユーザーの特定結果を無効化"""
+    if company_id is not None:
+        _invalidate(company_cache_key(company_id), cursor)
+
+
+def invalidate_subscription(stripe_subscription_id, cursor=None):
+    """Stripeサブスクリプションに紐づくLINEユーザーの特定結果を無効化"""
+    if stripe_subscription_id:
+        _invalidate(f'{_SUBSCRIPTION_PREFIX}{stripe_subscription_id}', cursor)
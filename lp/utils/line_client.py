@@ -0,0 +1,220 @@
+"""
+LINE Messaging API の共有HTTPクライアント
+
+api.line.me への呼び出しはすべて line_api を通し、プロセスごとに1つの
+requests.Session（keep-alive・接続プール）を使い回す。返信のたびにTLSの
+ハンドシェイクをやり直さないため、2回目以降の送信はその分だけ速くなる。
+
+タイムアウトは接続と読み取りを分けて指定し、接続エラー・タイムアウト・5xx は
+指数バックオフで再試行する。再試行しても二重送信にならないよう、
+返信は再試行しない（replyToken は1回しか使えず、先の送信が受理済みでも再送は 400 に
+なって失敗に見えるため）。GET はそのまま、プッシュ・マルチキャストは
+X-Line-Retry-Key を付けて再送する（受理済みなら LINE は 409 を返す）。
+
+エンドポイントごとの呼び出し数・ステータス・再試行数・レイテンシは
+get_line_api_stats() で取得する（/api/v1/monitoring/line-api）。
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import deque, defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.unit_of_work import release_for_external_call
+
+logger = logging.getLogger(__name__)
+
+LINE_API_BASE = os.getenv('LINE_API_BASE', 'https://api.line.me')
+LINE_HTTP_CONNECT_TIMEOUT = float(os.getenv('LINE_HTTP_CONNECT_TIMEOUT', '3.05'))
+LINE_HTTP_READ_TIMEOUT = float(os.getenv('LINE_HTTP_READ_TIMEOUT', '10'))
+LINE_HTTP_POOL_SIZE = int(os.getenv('LINE_HTTP_POOL_SIZE', '10'))
+LINE_HTTP_RETRIES = int(os.getenv('LINE_HTTP_RETRIES', '2'))
+LINE_HTTP_BACKOFF = float(os.getenv('LINE_HTTP_BACKOFF', '0.3'))
+# Retry-After に従って待つ上限（秒、リクエスト内で待つため短くする）
+LINE_HTTP_MAX_RETRY_WAIT = float(os.getenv('LINE_HTTP_MAX_RETRY_WAIT', '5'))
+
+RETRY_STATUSES = frozenset((500, 502, 503, 504))
+
+_LATENCY_SAMPLES = 1000
+_USER_ID_RE = re.compile(r'/[UCR][0-9a-f]{32}\b')
+
+
+def endpoint_name(method, path):
+    """統計用のエンドポイント名（ユーザーIDなどは {id} にまとめる）"""
+    return f'{method} {_USER_ID_RE.sub("/{id}", path.split("?", 1)[0])}'
+
+
+class LineApiClient:
+    """keep-alive の接続プールと再試行を持つLINE APIクライアント"""
+
+    def __init__(self, base_url=LINE_API_BASE, pool_size=LINE_HTTP_POOL_SIZE,
+                 connect_timeout=LINE_HTTP_CONNECT_TIMEOUT, read_timeout=LINE_HTTP_READ_TIMEOUT,
+                 retries=LINE_HTTP_RETRIES, backoff=LINE_HTTP_BACKOFF):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._pid = None
+        self._session_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._endpoints = defaultdict(self._new_endpoint_stats)
+
+    @staticmethod
+    def _new_endpoint_stats():
+        return {'calls': 0, 'errors': 0, 'retries': 0, 'statuses': defaultdict(int),
+                'latency_total': 0.0, 'latencies': deque(maxlen=_LATENCY_SAMPLES)}
+
+    @property
+    def session(self):
+        """プロセスごとのセッション（フォーク後の子プロセスでは作り直す）"""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._session_lock:
+                if self._session is None or self._pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session, self._pid = session, pid
+        return self._session
+
+    def request(self, method, path, access_token=None, endpoint=None, retry_key=False, retries=None, **kwargs):
+        """LINE APIを呼び出して requests.Response を返す（再試行しても失敗すれば例外を送出）
+
+        access_token を省略すると LINE_CHANNEL_ACCESS_TOKEN を使う。
+        retry_key=True で X-Line-Retry-Key を付ける（プッシュ系の再送を冪等にする）。
+        retries で再試行回数を上書きする（呼び出し側で再試行を管理する場合は 0）。
+        """
+        url = path if path.startswith('http') else f'{self.base_url}{path}'
+        endpoint = endpoint or endpoint_name(method, requests.utils.urlparse(url).path)
+        token = access_token or os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
+        headers = {'Authorization': f'Bearer {token}', **kwargs.pop('headers', {})}
+        if 'json' in kwargs or 'data' in kwargs:
+            headers.setdefault('Content-Type', 'application/json')
+        if retry_key:
+            headers['X-Line-Retry-Key'] = str(uuid.uuid4())
+        timeout = kwargs.pop('timeout', self.timeout)
+        retries = self.retries if retries is None else retries
+        # イベント処理中のDB変更を確定し、HTTPの待ち時間に接続を持ち越さない
+        release_for_external_call()
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(endpoint, None, time.perf_counter() - started, attempt)
+                if attempt >= retries:
+                    raise
+                logger.warning('LINE API再試行: %s attempt=%s error=%s', endpoint, attempt + 1, e)
+                self._sleep(attempt)
+                attempt += 1
+                continue
+
+            self._record(endpoint, response.status_code, time.perf_counter() - started, attempt)
+            if response.status_code in RETRY_STATUSES and attempt < retries:
+                logger.warning('LINE API再試行: %s attempt=%s status=%s', endpoint, attempt + 1, response.status_code)
+                self._sleep(attempt, response.headers.get('Retry-After'))
+                attempt += 1
+                continue
+            if attempt and retry_key and response.status_code == 409 \
+                    and response.headers.get('x-line-accepted-request-id'):
+                # 先の送信が受理済み（応答だけが失われた）なので成功として扱う
+                logger.info('LINE API送信は受理済み: %s request_id=%s', endpoint,
+                            response.headers.get('x-line-accepted-request-id'))
+                response.status_code = 200
+            return response
+
+    def _sleep(self, attempt, retry_after=None):
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        time.sleep(min(delay, LINE_HTTP_MAX_RETRY_WAIT))
+
+    def _record(self, endpoint, status, elapsed, attempt):
+        with self._stats_lock:
+            stats = self._endpoints[endpoint]
+            stats['calls'] += 1
+            if attempt:
+                stats['retries'] += 1
+            if status is None:
+                stats['errors'] += 1
+            else:
+                stats['statuses'][status] += 1
+            stats['latency_total'] += elapsed
+            stats['latencies'].append(elapsed)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def reply(self, reply_token, messages, access_token=None):
+        """返信メッセージを送信（replyToken は使い切りのため再試行しない）"""
+        return self.post('/v2/bot/message/reply', access_token=access_token, endpoint='POST /v2/bot/message/reply',
+                         retries=0, json={'replyToken': reply_token, 'messages': messages})
+
+    def reply_encoded(self, reply_token, encoded_messages, access_token=None):
+        """JSON化済みのメッセージ（bytes のリスト）をそのまま継ぎ足して返信"""
+        body = b''.join((b'{"replyToken":', json.dumps(reply_token).encode('ascii'),
+                         b',"messages":[', b','.join(encoded_messages), b']}'))
+        return self.post('/v2/bot/message/reply', access_token=access_token, endpoint='POST /v2/bot/message/reply',
+                         retries=0, data=body)
+
+    def push(self, to, messages, access_token=None):
+        """プッシュメッセージを送信"""
+        return self.post('/v2/bot/message/push', access_token=access_token, endpoint='POST /v2/bot/message/push',
+                         retry_key=True, json={'to': to, 'messages': messages})
+
+    def get_profile(self, user_id, access_token=None):
+        """ユーザーのプロフィールを取得"""
+        return self.get(f'/v2/bot/profile/{user_id}', access_token=access_token,
+                        endpoint='GET /v2/bot/profile/{id}')
+
+    def stats(self):
+        """エンドポイントごとの統計（レイテンシはミリ秒、直近の呼び出しの分位点）"""
+        with self._stats_lock:
+            snapshot = {name: (dict(stats, statuses=dict(stats['statuses'])), sorted(stats['latencies']))
+                        for name, stats in self._endpoints.items()}
+        result = {}
+        for name, (stats, latencies) in sorted(snapshot.items()):
+            calls = stats['calls']
+            result[name] = {
+                'calls': calls,
+                'errors': stats['errors'],
+                'retries': stats['retries'],
+                'statuses': stats['statuses'],
+                'avg_ms': round(stats['latency_total'] * 1000 / calls, 2) if calls else 0.0,
+                'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else 0.0,
+                'p95_ms': round(latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000, 2) if latencies else 0.0,
+                'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            }
+        return {
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'retries': self.retries,
+            'endpoints': result,
+        }
+
+
+line_api = LineApiClient()
+
+
+def get_line_api_stats():
+    return line_api.stats()
@@ -0,0 +1,72 @@
+"""
+同じ内容のメッセージをまとめて送るファンアウト
+
+リマインダーのように多数の宛先へ送る場合、宛先ごとにプッシュせず、
+チャネルとメッセージ内容が同じ宛先をまとめてマルチキャスト（1回最大500件）で送る。
+内容が宛先ごとに異なるもの（日付・金額の違いなど）は別のグループになるため、
+個別の内容が必要な宛先だけが別送信になる。
+
+    fanout = LineFanout(source='reminder:trial_ending')
+    for user_id, text in targets:
+        fanout.add(user_id, [{'type': 'text', 'text': text}])
+    summary = fanout.flush()
+
+送信は utils.outbound_queue に積むだけなので、レート制限・再試行・デッドレターは
+通常のプッシュと同じ扱いになる。
+"""
+
+import json
+import logging
+
+from utils.outbound_queue import enqueue_push, enqueue_multicast
+
+logger = logging.getLogger(__name__)
+
+# LINE Messaging API のマルチキャストの宛先上限
+MULTICAST_MAX_RECIPIENTS = 500
+
+
+class LineFanout:
+    """宛先をメッセージ内容ごとにまとめて送信キューに積む"""
+
+    def __init__(self, source=None, batch_size=MULTICAST_MAX_RECIPIENTS):
+        self.source = source
+        self.batch_size = max(1, min(batch_size, MULTICAST_MAX_RECIPIENTS))
+        # (company_id, 内容のキー) -> [messages, 宛先（追加順・重複なし）]
+        self._groups = {}
+
+    def add(self, to, messages, company_id=None):
+        """宛先を追加（company_id を省略すると既定のチャネル）"""
+        if not to:
+            return
+        key = (company_id, json.dumps(messages, ensure_ascii=False, sort_keys=True))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = [messages, {}]
+        group[1][to] = None
+
+    def __len__(self):
+        return sum(len(recipients) for _, recipients in self._groups.values())
+
+    def flush(self):
+        """まとめた送信をキューに積み、件数の集計（積めなかった宛先を含む）を返す"""
+        summary = {'groups': len(self._groups), 'recipients': 0, 'calls': 0, 'queued': 0, 'failed': 0,
+                   'failed_recipients': []}
+        for (company_id, _), (messages, recipients) in self._groups.items():
+            recipients = list(recipients)
+            summary['recipients'] += len(recipients)
+            for start in range(0, len(recipients), self.batch_size):
+                batch = recipients[start:start + self.batch_size]
+                if len(batch) == 1:
+                    # 1件ならプッシュ（同じ宛先への他のプッシュとの順序を保つ）
+                    queued = enqueue_push(batch[0], messages, company_id, self.source)
+                else:
+                    queued = enqueue_multicast(batch, messages, company_id, self.source)
+                summary['calls'] += 1
+                summary['queued' if queued else 'failed'] += len(batch)
+                if not queued:
+                    summary['failed_recipients'].extend(batch)
+        self._groups = {}
+        logger.info('LINEファンアウト: source=%s groups=%d recipients=%d calls=%d',
+                    self.source, summary['groups'], summary['recipients'], summary['calls'])
+        return summary
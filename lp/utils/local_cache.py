@@ -0,0 +1,254 @@
+"""
+プロセス内TTLキャッシュとプロセス間の無効化
+
+Webhookのホットパスで毎メッセージ読む値（会話状態・企業の特定結果など）を
+プロセス内の辞書に保持する。ヒット時は辞書の参照と期限の比較だけで返す。
+
+書き込み側は publish_invalidation() で PostgreSQL の NOTIFY を発行し、
+各プロセスの待ち受けスレッド（LISTEN）が該当キーを破棄する。NOTIFYは
+トランザクションのコミット時に配信されるため、ロールバックした変更は通知されない。
+待ち受け接続が切れた間の通知は受け取れないため、再接続時にキャッシュを全て破棄する。
+SQLite（単一プロセスのローカル環境）では通知は行わず、TTLで鮮度を保つ。
+"""
+
+import os
+import json
+import time
+import uuid
+import select
+import logging
+import threading
+from collections import OrderedDict
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'local_cache_invalidation'
+# 待ち受け接続の再接続間隔の上限（秒）
+_LISTENER_MAX_BACKOFF = 30
+
+_MISSING = object()
+
+# 通知の発行元の識別子（自プロセスの通知を無視するため）。別のコンテナ・レプリカでは
+# PIDが重なり得るためPIDではなく乱数を使い、フォークした子プロセスでは作り直す
+_origin = uuid.uuid4().hex
+
+
+def _regenerate_origin():
+    global _origin
+    _origin = uuid.uuid4().hex
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_regenerate_origin)
+
+
+class TTLCache:
+    """有効期限付きの上限付きキャッシュ（LRU）
+
+    get() はキーが無い・期限切れの場合に MISSING を返す（Noneも値として保持できる）。
+    期限は参照時に確認し、上限を超えたら最も長く参照されていないものから削除する。
+    """
+
+    MISSING = _MISSING
+
+    def __init__(self, name, ttl, max_size=10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0, 'remote_invalidations': 0,
+                       'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                del self._data[key]
+            self._stats['misses'] += 1
+            return _MISSING
+
+    def set(self, key, value, ttl=None):
+        if self.ttl <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+            self._stats['sets'] += 1
+        # 値を入れたプロセスでは他プロセスからの無効化を受け取れるようにする
+        invalidation_listener.ensure_started()
+
+    def invalidate(self, key, remote=False):
+        with self._lock:
+            self._data.pop(key, None)
+            self._stats['remote_invalidations' if remote else 'invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'name': self.name,
+            'size': len(self._data),
+            'ttl': self.ttl,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+        })
+        return stats
+
+
+_caches = {}
+
+
+def register_cache(cache):
+    """無効化通知・監視の対象としてキャッシュを登録"""
+    _caches[cache.name] = cache
+    return cache
+
+
+def get_cache_stats():
+    """登録済みキャッシュの統計を取得"""
+    return {
+        'caches': [cache.stats() for cache in _caches.values()],
+        'listener': invalidation_listener.stats(),
+    }
+
+
+def invalidate_local(cache_name, key):
+    """自プロセスの登録済みキャッシュからキーを破棄"""
+    cache = _caches.get(cache_name)
+    if cache is not None:
+        cache.invalidate(key)
+
+
+def invalidation_payload(cache_name, key):
+    """無効化通知の本文（INVALIDATION_CHANNEL へ pg_notify で送る）"""
+    return json.dumps({'cache': cache_name, 'key': key, 'origin': _origin}, ensure_ascii=False)
+
+
+def publish_invalidation(cursor, cache_name, key):
+    """他プロセスのキャッシュを無効化（変更と同じトランザクションで呼ぶ）"""
+    connection = getattr(cursor, 'connection', None)
+    if not isinstance(connection, psycopg2.extensions.connection):
+        return
+    cursor.execute('SELECT pg_notify(%s, %s)', (INVALIDATION_CHANNEL, invalidation_payload(cache_name, key)))
+
+
+def broadcast_invalidation(cache_name, key):
+    """専用の接続で無効化を通知（ユニットオブワーク内ではその確定時に配信される）"""
+    from utils.db import get_db_connection
+    from utils.dialect import get_dialect
+    if get_dialect().name != 'postgresql':
+        return
+    conn = get_db_connection()
+    try:
+        publish_invalidation(conn.cursor(), cache_name, key)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning('cache invalidation broadcast failed (%s %s): %s', cache_name, key, e)
+    finally:
+        conn.close()
+
+
+def _listener_dsn():
+    database_url = os.getenv('RAILWAY_DATABASE_URL') or os.getenv('DATABASE_URL')
+    if database_url and database_url.startswith('postgresql://'):
+        return database_url
+    if not database_url:
+        from utils.db import resolve_backend, LOCAL_POSTGRES_DSN
+        if resolve_backend() == 'postgresql':
+            return LOCAL_POSTGRES_DSN
+    return None
+
+
+class InvalidationListener:
+    """LISTENで無効化通知を受け取り、登録済みキャッシュから該当キーを破棄する"""
+
+    def __init__(self, channel=INVALIDATION_CHANNEL):
+        self.channel = channel
+        self._pid = None
+        self._connected = False
+        self._lock = threading.Lock()
+        self._stats = {'received': 0, 'connects': 0, 'errors': 0}
+
+    def ensure_started(self):
+        """プロセスごとに1回、待ち受けスレッドを起動（PostgreSQL以外では何もしない）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            dsn = _listener_dsn()
+            if dsn is None:
+                return
+            threading.Thread(target=self._run, args=(dsn,), name='cache-invalidation-listener',
+                             daemon=True).start()
+
+    def _run(self, dsn):
+        backoff = 1
+        while True:
+            try:
+                self._listen(dsn)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.warning('cache invalidation listener disconnected: %s', e)
+            self._connected = False
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _LISTENER_MAX_BACKOFF)
+
+    def _listen(self, dsn):
+        conn = psycopg2.connect(dsn)
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN {self.channel}')
+            # 切断中に届かなかった通知があり得るため全て破棄してから待ち受ける
+            if self._stats['connects']:
+                for cache in list(_caches.values()):
+                    cache.clear()
+            self._stats['connects'] += 1
+            self._connected = True
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._handle(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def _handle(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        self._stats['received'] += 1
+        # 自プロセスの変更は書き込み時に反映済み
+        if message.get('origin') == _origin:
+            return
+        cache = _caches.get(message.get('cache'))
+        if cache is not None:
+            cache.invalidate(message.get('key'), remote=True)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({'running': self._pid == os.getpid(), 'connected': self._connected})
+        return stats
+
+
+invalidation_listener = InvalidationListener()
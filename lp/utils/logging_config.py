@@ -0,0 +1,338 @@
+"""
+構造化ログ（キュー経由の出力・モジュール別レベル・DEBUGの抽出）
+
+ルートロガーには QueueHandler だけを付け、標準出力やファイルへの書き込みは
+QueueListener のスレッドで行う。リクエストのスレッドはレコードをキューに積むだけで、
+メッセージの組み立て（% 形式の引数の展開）も出力スレッドで行うため、
+logger.debug('...: %s', value) のように引数で渡せば出力しないレベルの文字列は作られない。
+キューが満杯のときはレコードを捨てて件数を数える（リクエストを待たせない）。
+
+環境変数:
+    LOG_LEVEL               ルートのレベル（既定 INFO）
+    LOG_LEVELS              モジュール別のレベル（例 'routes.line=DEBUG,services.line_service=DEBUG'）
+    LOG_FORMAT              'text'（既定、key=value 付きの1行）または 'json'（1行1オブジェクト）
+    LOG_DEBUG_SAMPLE_RATE   log_trace() 内のDEBUGを出力する割合（既定 1.0）
+    LOG_QUEUE_SIZE          出力待ちキューの上限（既定 10000）
+    LOG_FILE                指定するとファイルにも出力する
+    ERROR_LOG_FILE          ERROR以上を '時刻 - レベル ロガー メッセージ' の形式で書くファイル
+                            （既定 lp/error.log、監視の check_line_api_errors が読む。空で無効）
+
+log_trace() は1イベント分のログに共通の項目（イベントID・ユーザーIDなど）を付け、
+DEBUGを出力するかどうかをイベント単位で決める（抽出されたイベントは全行、
+それ以外はDEBUGを1行も出さない）。重い値は lazy_json() で包むか、
+debug_enabled() で判定してから作る。
+
+gunicornの --preload でフォーク前に設定された場合も、子プロセスで出力スレッドを作り直す。
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_FILE = os.getenv('LOG_FILE')
+ERROR_LOG_FILE = os.getenv('ERROR_LOG_FILE',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'error.log'))
+
+_trace = contextvars.ContextVar('log_trace', default=None)
+
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+_stats = {'enqueued': 0, 'dropped': 0, 'sampled_out': 0}
+
+
+class _Trace:
+    __slots__ = ('fields', 'sampled')
+
+    def __init__(self, fields, sampled):
+        self.fields = fields
+        self.sampled = sampled
+
+
+@contextmanager
+def log_trace(sample_rate=None, **fields):
+    """ブロック内のログに fields を付け、DEBUGの出力をまとめて抽出する
+
+    入れ子にした場合は外側の抽出結果を引き継ぎ、項目を追加する。
+    """
+    parent = _trace.get()
+    if parent is not None:
+        trace = _Trace({**parent.fields, **fields}, parent.sampled)
+    else:
+        rate = LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate
+        trace = _Trace(fields, rate >= 1.0 or random.random() < rate)
+    token = _trace.set(trace)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+def debug_enabled(logger):
+    """DEBUGを出力するか（ロガーのレベルと log_trace() の抽出の両方を満たすか）"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    trace = _trace.get()
+    return trace is None or trace.sampled
+
+
+class lazy_json:
+    """出力時に初めてJSONにする値（logger.debug('%s', lazy_json(data)) のように渡す）"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        try:
+            return json.dumps(self.value, ensure_ascii=False, default=str)
+        except Exception:
+            return repr(self.value)
+
+
+def redact(value, keep=6):
+    """トークン類をログ用に先頭だけ残して伏せる"""
+    if not value:
+        return value
+    return f'{value[:keep]}***'
+
+
+class _ContextFilter(logging.Filter):
+    """log_trace() の項目を付け、抽出されなかったイベントのDEBUGを捨てる"""
+
+    def filter(self, record):
+        trace = _trace.get()
+        if trace is not None:
+            if record.levelno <= logging.DEBUG and not trace.sampled:
+                _stats['sampled_out'] += 1
+                return False
+            record.trace = trace.fields
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """満杯なら捨てるQueueHandler（メッセージの組み立ては出力スレッドで行う）"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # 例外のトレースバックはフレームが変わる前に文字列にしておく
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            _stats['enqueued'] += 1
+        except queue.Full:
+            _stats['dropped'] += 1
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """出力時点の sys.stdout に書く（差し替え・リダイレクト後に閉じたファイルを掴まない）"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+
+class TextFormatter(logging.Formatter):
+    """'時刻 レベル ロガー メッセージ key=value ...' の1行"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'trace', None)
+        if fields:
+            extra = ' '.join(f'{key}={value}' for key, value in fields.items() if value is not None)
+            if extra:
+                head, sep, tail = line.partition('\n')
+                line = f'{head} {extra}{sep}{tail}'
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1オブジェクトのJSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'trace', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ErrorLogFormatter(logging.Formatter):
+    """error.log 用の 'ISO時刻 - レベル ロガー メッセージ'（監視が ' - ' の前を時刻として読む）"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s %(name)s %(message)s')
+
+    def formatTime(self, record, datefmt=None):
+        return datetime.fromtimestamp(record.created).isoformat(timespec='seconds')
+
+
+def _make_formatter():
+    return JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter()
+
+
+def _parse_level(value, default=logging.INFO):
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).strip().upper())
+    return level if isinstance(level, int) else default
+
+
+def parse_log_levels(spec):
+    """'name=LEVEL,name=LEVEL' をモジュール名とレベルの辞書にする"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip():
+            levels[name.strip()] = _parse_level(level)
+    return levels
+
+
+def set_log_levels(levels):
+    """モジュール別のレベルを設定（{'routes.line': 'DEBUG'} または 'routes.line=DEBUG'）"""
+    if isinstance(levels, str):
+        levels = parse_log_levels(levels)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(_parse_level(level))
+
+
+def _file_handler(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(_make_formatter())
+    return handler
+
+
+def _error_file_handler(path):
+    handler = _file_handler(path)
+    handler.setLevel(logging.ERROR)
+    handler.setFormatter(ErrorLogFormatter())
+    return handler
+
+
+def _has_file_handler(path):
+    target = os.path.abspath(path)
+    return any(isinstance(handler, logging.FileHandler) and handler.baseFilename == target
+               for handler in _listener.handlers)
+
+
+def _load_settings():
+    """環境変数を読み直す（app.py では load_dotenv() の後に呼ばれるため）"""
+    global LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_DEBUG_SAMPLE_RATE, LOG_QUEUE_SIZE, LOG_FILE, ERROR_LOG_FILE
+    LOG_LEVEL = os.getenv('LOG_LEVEL', LOG_LEVEL)
+    LOG_LEVELS = os.getenv('LOG_LEVELS', LOG_LEVELS)
+    LOG_FORMAT = os.getenv('LOG_FORMAT', LOG_FORMAT)
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', LOG_DEBUG_SAMPLE_RATE))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', LOG_QUEUE_SIZE))
+    LOG_FILE = os.getenv('LOG_FILE', LOG_FILE)
+    ERROR_LOG_FILE = os.getenv('ERROR_LOG_FILE', ERROR_LOG_FILE)
+
+
+def configure_logging(log_file=None):
+    """ルートロガーをキュー経由の出力に切り替える（何度呼んでもよい）
+
+    既にルートに付いているハンドラーは出力スレッド側へ移す。
+    log_file を指定するとファイルへの出力を追加する。
+    """
+    global _queue_handler, _listener
+    with _lock:
+        if _listener is None:
+            _load_settings()
+            root = logging.getLogger()
+            root.setLevel(_parse_level(LOG_LEVEL))
+            set_log_levels(LOG_LEVELS)
+
+            outputs = [handler for handler in root.handlers if not isinstance(handler, QueueHandler)]
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            if not outputs:
+                stream = _StdoutHandler()
+                stream.setFormatter(_make_formatter())
+                outputs.append(stream)
+
+            _queue_handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            _queue_handler.addFilter(_ContextFilter())
+            root.addHandler(_queue_handler)
+            if ERROR_LOG_FILE:
+                outputs.append(_error_file_handler(ERROR_LOG_FILE))
+            _listener = QueueListener(_queue_handler.queue, *outputs, respect_handler_level=True)
+            _listener.start()
+
+        for path in (LOG_FILE, log_file):
+            if path and not _has_file_handler(path):
+                _listener.handlers += (_file_handler(path),)
+
+
+def _restart_after_fork():
+    """子プロセスでキューと出力スレッドを作り直す（親のスレッドは引き継がれない）"""
+    global _listener
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_queue_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+@atexit.register
+def shutdown_logging():
+    """キューに残ったレコードを出力して出力スレッドを止める"""
+    global _listener
+    with _lock:
+        if _listener is not None and _listener._thread is not None:
+            _listener.stop()
+
+
+def get_logging_stats():
+    stats = dict(_stats)
+    stats['queue_depth'] = _queue_handler.queue.qsize() if _queue_handler is not None else 0
+    stats['levels'] = {
+        name: logging.getLevelName(logger.level)
+        for name, logger in sorted(logging.Logger.manager.loggerDict.items())
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET
+    }
+    stats['root_level'] = logging.getLevelName(logging.getLogger().level)
+    stats['debug_sample_rate'] = LOG_DEBUG_SAMPLE_RATE
+    return stats
@@ -1,234 +1,134 @@
 # 案内文・メニュー・ヘルプなどのテンプレート
+# 固定の文面は読み込み時に検証・JSON化して登録し、各関数は登録済みのメッセージを返す
+# （呼び出し間で共有されるため変更しないこと、utils.template_registry）
+
+import logging
+
+from utils.template_registry import template_registry
+
+logger = logging.getLogger(__name__)
+
+_MENU_ACTIONS = [
+    {
+        "type": "message",
+        "label": "コンテンツ追加",
+        "text": "追加"
+    },
+    {
+        "type": "message",
+        "label": "利用状況確認",
+        "text": "状態"
+    },
+    {
+        "type": "message",
+        "label": "解約",
+        "text": "解約"
+    },
+    {
+        "type": "message",
+        "label": "ヘルプ",
+        "text": "ヘルプ"
+    }
+]
+
+template_registry.register('menu_navigation_hint', {
+    "type": "text",
+    "text": "📱 「メニュー」と入力すると、メインメニューに戻れます。"
+})
+
+template_registry.register('default', {
+    "type": "template",
+    "altText": "何かお手伝いできることはありますか？",
+    "template": {
+        "type": "buttons",
+        "title": "AIコレクションズ",
+        "text": "何かお手伝いできることはありますか？",
+        "actions": _MENU_ACTIONS
+    }
+})
+
+template_registry.register('menu', {
+    "type": "template",
+    "altText": "メニュー",
+    "template": {
+        "type": "buttons",
+        "title": "メニュー",
+        "text": "ご希望の機能を選択してください。",
+        "actions": _MENU_ACTIONS
+    }
+})
+
+# ヘルプ本文（{services_text} にスプレッドシートのコンテンツ一覧を差し込む）
+template_registry.compile('help', {
+    "type": "text",
+    "text": "📖 AIコレクションズ 使い方ガイド\n\n🎯 基本操作：\n• 「追加」：コンテンツを追加（1個目無料）\n• 「状態」：利用状況と料金を確認\n• 「解約」：解約メニューを表示\n• 「メニュー」：メインメニューに戻る\n• 「ヘルプ」：このガイドを表示\n\n📱 コンテンツ追加の流れ：\n1️⃣ 「追加」を選択\n2️⃣ 追加したいコンテンツを選択（1-3）\n3️⃣ 料金を確認して「はい」で確定\n4️⃣ アクセスURLが送信されます\n\n🔚 解約について：\n• 「サブスクリプション解約」：全てのサービスを解約\n• 「コンテンツ解約」：個別のコンテンツを選択して解約\n\n💰 料金について：\n• 月額基本料金：3,900円\n• 追加コンテンツ：1個目無料\n• 2個目以降：1,500円/件（次回請求時）\n\n✨ 各サービスの特徴：\n{services_text}\n❓ お困りの際は：\n• メニューから各機能をお試しください\n• エラーが発生した場合は時間をおいて再試行してください\n• 何かわからないことがあれば「ヘルプ」と入力してください"
+})
+
+template_registry.compile('help_company', {
+    "type": "text",
+    "text": "🏢 AIコレクションズ 企業向け使い方ガイド\n\n🎯 基本操作：\n• 「追加」：新しいコンテンツを追加\n• 「状態」：企業の利用状況と料金を確認\n• 「解約」：解約メニューを表示\n• 「メニュー」：メインメニューに戻る\n• 「ヘルプ」：このガイドを表示\n\n📱 コンテンツ追加の流れ：\n1️⃣ 「追加」を選択\n2️⃣ 追加したいコンテンツを選択\n3️⃣ 料金を確認して確定\n4️⃣ 新しいLINEアカウントが作成されます\n\n🔚 解約について：\n• 「解約」を選択して解約メニューを表示\n• 「サブスクリプション解約」：全てのサービスを解約\n• 「コンテンツ解約」：個別のコンテンツを選択して解約\n• 解約後は料金が調整されます\n\n💰 料金体系：\n• 基本料金：月額3,900円\n• 追加コンテンツ：1件1,500円/月\n• 例：2件利用の場合 3,900円 + 1,500円 = 5,400円/月\n\n✨ 各サービスの特徴：\n{services_text}\n❓ お困りの際は：\n• メニューから各機能をお試しください\n• エラーが発生した場合は時間をおいて再試行してください\n• 何かわからないことがあれば「ヘルプ」と入力してください"
+})
+
+_DEFAULT_SERVICES_TEXT = "📅 AI予定秘書：スケジュール管理・会議調整\n💰 AI経理秘書：見積書・請求書作成\n📝 AIタスクコンシェルジュ：タスク管理・優先順位設定\n"
+_DEFAULT_SERVICES_TEXT_COMPANY = "📅 AI予定秘書：企業のスケジュール管理・会議調整\n💰 AI経理秘書：経理作業の効率化・書類作成\n📝 AIタスクコンシェルジュ：タスク管理・優先順位設定\n"
+
+def _services_text(default):
+    """スプレッドシートのコンテンツ一覧をヘルプ用の文面にする"""
+    from services.spreadsheet_content_service import spreadsheet_content_service
+    contents_result = spreadsheet_content_service.get_available_contents()
+    
+    if not contents_result['success']:
+        # フォールバック用のデフォルト
+        return default
+    
+    # スプレッドシートから取得したコンテンツ情報を使用
+    services_text = ""
+    for content_id, content_info in contents_result['contents'].items():
+        name = content_info.get('name', '')
+        description = content_info.get('description', '')
+        # 絵文字を追加（コンテンツIDに基づいて）
+        emoji = "📅" if "schedule" in content_id else "💰" if "accounting" in content_id else "📝"
+        services_text += f"{emoji} {name}：{description}\n"
+    return services_text
 
 def get_menu_navigation_hint():
     """処理完了後のメニュー案内メッセージ"""
-    return {
-        "type": "text",
-        "text": "📱 「メニュー」と入力すると、メインメニューに戻れます。"
-    }
+    return template_registry.get('menu_navigation_hint')
 
 def get_default_message():
-    return {
-        "type": "template",
-        "altText": "何かお手伝いできることはありますか？",
-        "template": {
-            "type": "buttons",
-            "title": "AIコレクションズ",
-            "text": "何かお手伝いできることはありますか？",
-            "actions": [
-                {
-                    "type": "message",
-                    "label": "コンテンツ追加",
-                    "text": "追加"
-                },
-                {
-                    "type": "message",
-                    "label": "利用状況確認",
-                    "text": "状態"
-                },
-                {
-                    "type": "message",
-                    "label": "解約",
-                    "text": "解約"
-                },
-                {
-                    "type": "message",
-                    "label": "ヘルプ",
-                    "text": "ヘルプ"
-                }
-            ]
-        }
-    }
+    return template_registry.get('default')
 
 def get_menu_message():
-    return {
-        "type": "template",
-        "altText": "メニュー",
-        "template": {
-            "type": "buttons",
-            "title": "メニュー",
-            "text": "ご希望の機能を選択してください。",
-            "actions": [
-                {
-                    "type": "message",
-                    "label": "コンテンツ追加",
-                    "text": "追加"
-                },
-                {
-                    "type": "message",
-                    "label": "利用状況確認",
-                    "text": "状態"
-                },
-                {
-                    "type": "message",
-                    "label": "解約",
-                    "text": "解約"
-                },
-                {
-                    "type": "message",
-                    "label": "ヘルプ",
-                    "text": "ヘルプ"
-                }
-            ]
-        }
-    }
+    return template_registry.get('menu')
 
 def get_help_message():
     """一般ユーザー向け：ヘルプメッセージ（スプレッドシート連携）"""
-    # スプレッドシートからコンテンツ情報を取得
     try:
-        from services.spreadsheet_content_service import spreadsheet_content_service
-        contents_result = spreadsheet_content_service.get_available_contents()
-        
-        if contents_result['success']:
-            # スプレッドシートから取得したコンテンツ情報を使用
-            contents = contents_result['contents']
-            services_text = ""
-            for content_id, content_info in contents.items():
-                name = content_info.get('name', '')
-                description = content_info.get('description', '')
-                # 絵文字を追加（コンテンツIDに基づいて）
-                emoji = "📅" if "schedule" in content_id else "💰" if "accounting" in content_id else "📝"
-                services_text += f"{emoji} {name}：{description}\n"
-        else:
-            # フォールバック用のデフォルト
-            services_text = "📅 AI予定秘書：スケジュール管理・会議調整\n💰 AI経理秘書：見積書・請求書作成\n📝 AIタスクコンシェルジュ：タスク管理・優先順位設定\n"
+        services_text = _services_text(_DEFAULT_SERVICES_TEXT)
     except Exception as e:
-        print(f"[ERROR] ヘルプメッセージ生成エラー: {e}")
+        logger.exception('ヘルプメッセージ生成エラー: %s', e)
         # エラー時のフォールバック
-        services_text = "📅 AI予定秘書：スケジュール管理・会議調整\n💰 AI経理秘書：見積書・請求書作成\n📝 AIタスクコンシェルジュ：タスク管理・優先順位設定\n"
+        services_text = _DEFAULT_SERVICES_TEXT
     
     return [
-        {
-            "type": "text",
-            "text": f"📖 AIコレクションズ 使い方ガイド\n\n🎯 基本操作：\n• 「追加」：コンテンツを追加（1個目無料）\n• 「状態」：利用状況と料金を確認\n• 「解約」：解約メニューを表示\n• 「メニュー」：メインメニューに戻る\n• 「ヘルプ」：このガイドを表示\n\n📱 コンテンツ追加の流れ：\n1️⃣ 「追加」を選択\n2️⃣ 追加したいコンテンツを選択（1-3）\n3️⃣ 料金を確認して「はい」で確定\n4️⃣ アクセスURLが送信されます\n\n🔚 解約について：\n• 「サブスクリプション解約」：全てのサービスを解約\n• 「コンテンツ解約」：個別のコンテンツを選択して解約\n\n💰 料金について：\n• 月額基本料金：3,900円\n• 追加コンテンツ：1個目無料\n• 2個目以降：1,500円/件（次回請求時）\n\n✨ 各サービスの特徴：\n{services_text}\n❓ お困りの際は：\n• メニューから各機能をお試しください\n• エラーが発生した場合は時間をおいて再試行してください\n• 何かわからないことがあれば「ヘルプ」と入力してください"
-        },
-        {
-            "type": "template",
-            "altText": "メニュー",
-            "template": {
-                "type": "buttons",
-                "title": "メニュー",
-                "text": "ご希望の機能を選択してください。",
-                "actions": [
-                    {
-                        "type": "message",
-                        "label": "コンテンツ追加",
-                        "text": "追加"
-                    },
-                    {
-                        "type": "message",
-                        "label": "利用状況確認",
-                        "text": "状態"
-                    },
-                    {
-                        "type": "message",
-                        "label": "解約",
-                        "text": "解約"
-                    },
-                    {
-                        "type": "message",
-                        "label": "ヘルプ",
-                        "text": "ヘルプ"
-                    }
-                ]
-            }
-        }
+        template_registry.render('help', services_text=services_text),
+        template_registry.get('menu')
     ]
 
 def get_help_message_company():
     """企業ユーザー専用：ヘルプメッセージ（スプレッドシート連携）"""
-    # スプレッドシートからコンテンツ情報を取得
     try:
-        from services.spreadsheet_content_service import spreadsheet_content_service
-        contents_result = spreadsheet_content_service.get_available_contents()
-        
-        if contents_result['success']:
-            # スプレッドシートから取得したコンテンツ情報を使用
-            contents = contents_result['contents']
-            services_text = ""
-            for content_id, content_info in contents.items():
-                name = content_info.get('name', '')
-                description = content_info.get('description', '')
-                # 絵文字を追加（コンテンツIDに基づいて）
-                emoji = "📅" if "schedule" in content_id else "💰" if "accounting" in content_id else "📝"
-                services_text += f"{emoji} {name}：{description}\n"
-        else:
-            # フォールバック用のデフォルト
-            services_text = "📅 AI予定秘書：企業のスケジュール管理・会議調整\n💰 AI経理秘書：経理作業の効率化・書類作成\n📝 AIタスクコンシェルジュ：タスク管理・優先順位設定\n"
+        services_text = _services_text(_DEFAULT_SERVICES_TEXT_COMPANY)
     except Exception as e:
-        print(f"[ERROR] 企業向けヘルプメッセージ生成エラー: {e}")
+        logger.exception('企業向けヘルプメッセージ生成エラー: %s', e)
         # エラー時のフォールバック
-        services_text = "📅 AI予定秘書：企業のスケジュール管理・会議調整\n💰 AI経理秘書：経理作業の効率化・書類作成\n📝 AIタスクコンシェルジュ：タスク管理・優先順位設定\n"
+        services_text = _DEFAULT_SERVICES_TEXT_COMPANY
     
     return [
-        {
-            "type": "text",
-            "text": f"🏢 AIコレクションズ 企業向け使い方ガイド\n\n🎯 基本操作：\n• 「追加」：新しいコンテンツを追加\n• 「状態」：企業の利用状況と料金を確認\n• 「解約」：解約メニューを表示\n• 「メニュー」：メインメニューに戻る\n• 「ヘルプ」：このガイドを表示\n\n📱 コンテンツ追加の流れ：\n1️⃣ 「追加」を選択\n2️⃣ 追加したいコンテンツを選択\n3️⃣ 料金を確認して確定\n4️⃣ 新しいLINEアカウントが作成されます\n\n🔚 解約について：\n• 「解約」を選択して解約メニューを表示\n• 「サブスクリプション解約」：全てのサービスを解約\n• 「コンテンツ解約」：個別のコンテンツを選択して解約\n• 解約後は料金が調整されます\n\n💰 料金体系：\n• 基本料金：月額3,900円\n• 追加コンテンツ：1件1,500円/月\n• 例：2件利用の場合 3,900円 + 1,500円 = 5,400円/月\n\n✨ 各サービスの特徴：\n{services_text}\n❓ お困りの際は：\n• メニューから各機能をお試しください\n• エラーが発生した場合は時間をおいて再試行してください\n• 何かわからないことがあれば「ヘルプ」と入力してください"
-        },
-        {
-            "type": "template",
-            "altText": "メニュー",
-            "template": {
-                "type": "buttons",
-                "title": "メニュー",
-                "text": "ご希望の機能を選択してください。",
-                "actions": [
-                    {
-                        "type": "message",
-                        "label": "コンテンツ追加",
-                        "text": "追加"
-                    },
-                    {
-                        "type": "message",
-                        "label": "利用状況確認",
-                        "text": "状態"
-                    },
-                    {
-                        "type": "message",
-                        "label": "解約",
-                        "text": "解約"
-                    },
-                    {
-                        "type": "message",
-                        "label": "ヘルプ",
-                        "text": "ヘルプ"
-                    }
-                ]
-            }
-        }
+        template_registry.render('help_company', services_text=services_text),
+        template_registry.get('menu')
     ]
 
 def get_menu_message_company():
     """企業ユーザー専用：メニューメッセージ"""
-    return {
-        "type": "template",
-        "altText": "メニュー",
-        "template": {
-            "type": "buttons",
-            "title": "メニュー",
-            "text": "ご希望の機能を選択してください。",
-            "actions": [
-                {
-                    "type": "message",
-                    "label": "コンテンツ追加",
-                    "text": "追加"
-                },
-                {
-                    "type": "message",
-                    "label": "利用状況確認",
-                    "text": "状態"
-                },
-                {
-                    "type": "message",
-                    "label": "解約",
-                    "text": "解約"
-                },
-                {
-                    "type": "message",
-                    "label": "ヘルプ",
-                    "text": "ヘルプ"
-                }
-            ]
-        }
-    } 
\ No newline at end of file
+    return template_registry.get('menu')
@@ -0,0 +1,240 @@
+"""
+バージョン管理付きマイグレーションランナー
+
+適用済みのバージョンは schema_migrations テーブルに記録し、起動時には
+未適用のものだけを実行する。PostgreSQLではインデックスを
+CREATE INDEX CONCURRENTLY で作成し、複数プロセスの同時起動は
+アドバイザリロックで直列化する。
+"""
+
+import time
+import logging
+
+from utils.db import get_db_connection
+from utils.dialect import get_dialect
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock用のキー（任意の固定値）
+MIGRATION_LOCK_KEY = 72031945
+
+
+class Migration:
+    """関数で適用するマイグレーション"""
+
+    def __init__(self, version, name, apply=None):
+        self.version = version
+        self.name = name
+        self._apply = apply
+
+    def is_ready(self, cursor, dialect):
+        """前提（対象テーブル等）が揃っているか"""
+        return True
+
+    def apply(self, conn, dialect):
+        """トランザクション内で適用（commitはランナーが行う）"""
+        cursor = conn.cursor()
+        try:
+            self._apply(cursor, dialect)
+        finally:
+            cursor.close()
+
+
+class IndexMigration(Migration):
+    """インデックス作成マイグレーション（対象テーブル・カラムが無ければ保留）"""
+
+    def __init__(self, version, index_name, table, columns, where=None, unique=False, requires=()):
+        super().__init__(version, f'create index {index_name}')
+        self.index_name = index_name
+        self.table = table
+        self.columns = columns
+        self.where = where
+        self.unique = unique
+        # WHERE句などで参照する追加のカラム
+        self.requires = requires
+
+    def _column_names(self):
+        # "created_at DESC" のような指定からカラム名だけを取り出す
+        return [col.split()[0] for col in self.columns] + list(self.requires)
+
+    def is_ready(self, cursor, dialect):
+        existing = _table_columns(cursor, dialect, self.table)
+        return bool(existing) and all(col in existing for col in self._column_names())
+
+    def create_sql(self, concurrently=False):
+        sql = 'CREATE {unique}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})'.format(
+            unique='UNIQUE ' if self.unique else '',
+            concurrently='CONCURRENTLY ' if concurrently else '',
+            name=self.index_name,
+            table=self.table,
+            columns=', '.join(self.columns),
+        )
+        if self.where:
+            sql += f' WHERE {self.where}'
+        return sql
+
+    def apply(self, conn, dialect):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self.create_sql())
+        finally:
+            cursor.close()
+
+    def apply_concurrently(self, conn):
+        """PostgreSQL: テーブルをロックせずに作成（autocommit接続で実行）"""
+        cursor = conn.cursor()
+        try:
+            # 中断されたCONCURRENTLY作成が残した無効なインデックスは作り直す
+            cursor.execute('''
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND NOT i.indisvalid
+            ''', (self.index_name,))
+            if cursor.fetchone():
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {self.index_name}')
+            try:
+                cursor.execute(self.create_sql(concurrently=True))
+            except Exception:
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {self.index_name}')
+                raise
+        finally:
+            cursor.close()
+
+
+class ColumnMigration(Migration):
+    """カラム追加マイグレーション（対象テーブルが無ければ保留、既にあれば何もしない）"""
+
+    def __init__(self, version, table, column, definition):
+        super().__init__(version, f'add column {table}.{column}')
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def is_ready(self, cursor, dialect):
+        return bool(_table_columns(cursor, dialect, self.table))
+
+    def apply(self, conn, dialect):
+        cursor = conn.cursor()
+        try:
+            if self.column not in _table_columns(cursor, dialect, self.table):
+                cursor.execute(f'ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}')
+        finally:
+            cursor.close()
+
+
+def _table_columns(cursor, dialect, table):
+    """テーブルのカラム名一覧（テーブルが無ければ空）"""
+    if dialect.name == 'postgresql':
+        cursor.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+        ''', (table,))
+        return {row[0] for row in cursor.fetchall()}
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _ensure_schema_migrations(conn, dialect):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(32) PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                execution_ms INTEGER,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def get_applied_versions(conn=None):
+    """適用済みバージョンの集合を取得"""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        _ensure_schema_migrations(conn, get_dialect())
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM schema_migrations')
+        versions = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return versions
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def _record(conn, dialect, migration, elapsed_ms):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            dialect.upsert('schema_migrations', ('version', 'name', 'execution_ms'), ('version',)),
+            (migration.version, migration.name, elapsed_ms)
+        )
+    finally:
+        cursor.close()
+
+
+def run_migrations(migrations):
+    """未適用のマイグレーションを順に適用し、結果を返す"""
+    dialect = get_dialect()
+    conn = get_db_connection()
+    result = {'applied': [], 'pending': [], 'skipped': 0}
+    locked = False
+    try:
+        _ensure_schema_migrations(conn, dialect)
+        if dialect.name == 'postgresql':
+            cursor = conn.cursor()
+            cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_KEY,))
+            cursor.close()
+            conn.commit()
+            locked = True
+
+        applied = get_applied_versions(conn)
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in applied:
+                result['skipped'] += 1
+                continue
+
+            cursor = conn.cursor()
+            ready = migration.is_ready(cursor, dialect)
+            cursor.close()
+            conn.commit()
+            if not ready:
+                # 対象テーブルが後から作られる場合に備え、記録せず次回起動で再確認する
+                result['pending'].append(migration.version)
+                logger.info("⏸️ マイグレーション保留（前提テーブル未作成）: %s %s", migration.version, migration.name)
+                continue
+
+            started = time.perf_counter()
+            try:
+                if dialect.name == 'postgresql' and isinstance(migration, IndexMigration):
+                    conn.autocommit = True
+                    try:
+                        migration.apply_concurrently(conn)
+                    finally:
+                        conn.autocommit = False
+                else:
+                    migration.apply(conn, dialect)
+                elapsed_ms = int((time.perf_counter() - started) * 1000)
+                _record(conn, dialect, migration, elapsed_ms)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error("❌ マイグレーション失敗: %s %s: %s", migration.version, migration.name, e)
+                raise
+            result['applied'].append(migration.version)
+            logger.info("✅ マイグレーション適用: %s %s (%dms)", migration.version, migration.name, elapsed_ms)
+    finally:
+        if locked:
+            try:
+                conn.rollback()
+                cursor = conn.cursor()
+                cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_KEY,))
+                cursor.close()
+                conn.commit()
+            except Exception:
+                pass
+        conn.close()
+    return result
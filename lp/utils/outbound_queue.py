@@ -0,0 +1,559 @@
+"""
+LINEへのプッシュ送信キュー（チャネル別のレート制限・再試行・デッドレター）
+
+リマインダー・通知・案内メッセージのプッシュ送信はキューに積んで即座に戻り、
+送信はワーカースレッドが行う（呼び出し元のリクエストやスケジューラーを待たせない）。
+
+- チャネル（既定のチャネル、または企業ごとのチャネル）単位のトークンバケットで送信間隔を抑える
+- 接続エラー・5xx は指数バックオフ、429 は Retry-After に従って再送する
+  （429 を受けたチャネルは Retry-After の間すべての送信を止める）
+- 同じ宛先への送信は積んだ順に届ける（先の送信が再試行待ちの間は後続も待つ）
+- 再送しても届かないもの（4xx・試行回数超過・月間上限）は line_push_dead_letters に
+  保存し、requeue_dead_letters() で積み直せる。正常な停止時に未送信のものも保存する
+- 上限（LINE_OUTBOUND_MAX_PENDING）に達しているか停止後は積まずに False を返す
+  （呼び出し元が返信など別の手段で送るか、送れなかったことを記録する）
+
+キューはプロセス内のメモリ上にあり永続化していない。プロセスが強制終了した場合
+（kill -9・OOM・デプロイ時のタイムアウト）、積んだだけで未送信のものは失われる。
+つまり配送は最大1回（at-most-once）で、確実に届ける必要がある送信には使わない。
+
+再送には同じ X-Line-Retry-Key を付けるため、応答が失われた送信を再送しても二重には届かない。
+アクセストークンはデッドレターに保存せず、送信時にチャネルから解決する。
+
+gunicornの --preload でフォーク前に作られても動くよう、ワーカーは最初の投入時に
+プロセスごとに起動する。
+"""
+
+import os
+import json
+import time
+import uuid
+import heapq
+import atexit
+import random
+import logging
+import threading
+import itertools
+from collections import deque
+
+import requests
+
+from utils.db import get_db_connection
+from utils.dialect import get_dialect
+from utils.line_client import line_api
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_WORKERS = int(os.getenv('LINE_OUTBOUND_WORKERS', '2'))
+# チャネルごとの送信レート（件/秒）とバースト
+OUTBOUND_RATE = float(os.getenv('LINE_OUTBOUND_RATE', '20'))
+OUTBOUND_BURST = int(os.getenv('LINE_OUTBOUND_BURST', '40'))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv('LINE_OUTBOUND_MAX_ATTEMPTS', '6'))
+OUTBOUND_BASE_DELAY = float(os.getenv('LINE_OUTBOUND_BASE_DELAY', '1'))
+OUTBOUND_MAX_DELAY = float(os.getenv('LINE_OUTBOUND_MAX_DELAY', '300'))
+# 未送信の上限（超えた分は積まずに呼び出し元へ False を返す）
+OUTBOUND_MAX_PENDING = int(os.getenv('LINE_OUTBOUND_MAX_PENDING', '10000'))
+
+DEFAULT_CHANNEL = 'default'
+
+_ENDPOINTS = {
+    'push': '/v2/bot/message/push',
+    'multicast': '/v2/bot/message/multicast',
+}
+
+
+def create_line_push_dead_letters_table(c, dialect):
+    """デッドレターテーブルを作成（マイグレーション用）"""
+    if dialect.name == 'postgresql':
+        id_column = 'id BIGSERIAL PRIMARY KEY'
+    else:
+        id_column = 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS line_push_dead_letters (
+            {id_column},
+            kind VARCHAR(16) NOT NULL,
+            company_id INTEGER,
+            recipients TEXT NOT NULL,
+            messages TEXT NOT NULL,
+            source VARCHAR(64),
+            retry_key VARCHAR(64),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            status_code INTEGER,
+            last_error TEXT,
+            enqueued_at TIMESTAMP,
+            dead_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            requeued_at TIMESTAMP
+        )
+    ''')
+
+
+class OutboundJob:
+    """1回分の送信（multicast の場合 to は宛先のリスト）"""
+
+    __slots__ = ('kind', 'to', 'messages', 'company_id', 'source', 'retry_key', 'attempts',
+                 'enqueued_at', 'ready_at', 'last_error', 'status_code')
+
+    def __init__(self, kind, to, messages, company_id=None, source=None, retry_key=None, enqueued_at=None):
+        self.kind = kind
+        self.to = to
+        self.messages = messages
+        self.company_id = company_id
+        self.source = source
+        self.retry_key = retry_key or str(uuid.uuid4())
+        self.attempts = 0
+        self.enqueued_at = enqueued_at or time.time()
+        self.ready_at = 0.0
+        self.last_error = None
+        self.status_code = None
+
+    @property
+    def channel(self):
+        return f'company:{self.company_id}' if self.company_id is not None else DEFAULT_CHANNEL
+
+    @property
+    def order_key(self):
+        """同じ宛先の送信順を保つキー（multicast は順序を保証しない）"""
+        if self.kind == 'push':
+            return (self.channel, self.to)
+        return None
+
+
+class TokenBucket:
+    """チャネルごとのトークンバケット（429 の Retry-After の間は送信を止める）"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now):
+        """トークンを1つ取る（取れなければ取れるまでの秒数を返す）"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class _Result:
+    SENT = 'sent'
+    RETRY = 'retry'
+    DEAD = 'dead'
+
+
+class OutboundQueue:
+    """送信待ちのジョブを時刻順に取り出して送るワーカー群"""
+
+    def __init__(self, workers=OUTBOUND_WORKERS, rate=OUTBOUND_RATE, burst=OUTBOUND_BURST,
+                 max_attempts=OUTBOUND_MAX_ATTEMPTS, base_delay=OUTBOUND_BASE_DELAY,
+                 max_delay=OUTBOUND_MAX_DELAY, max_pending=OUTBOUND_MAX_PENDING):
+        self.workers = max(1, workers)
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        # 宛先ごとの送信待ち（先頭だけをヒープに入れる）
+        self._chains = {}
+        self._buckets = {}
+        self._pending = 0
+        self._in_flight = 0
+        self._threads = []
+        self._pid = None
+        self._running = False
+        self._closed = False
+        self._stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'retried': 0,
+            'rate_limited': 0,
+            'throttled': 0,
+            'dead_lettered': 0,
+            'rejected': 0,
+            'send_time_total': 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            # フォーク前のスレッドは子プロセスでは動かないため作り直す
+            self._heap, self._chains, self._buckets = [], {}, {}
+            self._pending = self._in_flight = 0
+            self._running = True
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'line-outbound-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+            logger.info('line outbound queue started: workers=%d, rate=%s/s, burst=%d',
+                        self.workers, self.rate, self.burst)
+
+    def push(self, to, messages, company_id=None, source=None):
+        """プッシュ送信を積む（積めた場合True、上限超過・停止後で積めなかった場合False）"""
+        return self.enqueue(OutboundJob('push', to, list(messages), company_id, source))
+
+    def multicast(self, to, messages, company_id=None, source=None):
+        """マルチキャスト送信を積む（宛先は最大500件）"""
+        return self.enqueue(OutboundJob('multicast', list(to), list(messages), company_id, source))
+
+    def enqueue(self, job):
+        if self._closed:
+            logger.error('LINE送信キューは停止済みのため送信しません: kind=%s to=%s source=%s',
+                         job.kind, job.to, job.source)
+            with self._cond:
+                self._stats['rejected'] += 1
+            return False
+        self._ensure_started()
+        with self._cond:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                rejected = True
+            else:
+                rejected = False
+                self._pending += 1
+                self._stats['enqueued'] += 1
+                key = job.order_key
+                if key is None:
+                    self._schedule(job, time.monotonic())
+                else:
+                    chain = self._chains.get(key)
+                    if chain:
+                        chain.append(job)
+                    else:
+                        self._chains[key] = deque([job])
+                        self._schedule(job, time.monotonic())
+        if rejected:
+            # デッドレターには保存しない（呼び出し元が代わりに送った後で再送されると二重に届くため）
+            logger.error('LINE送信キューが上限に達したため送信しません: kind=%s to=%s source=%s',
+                         job.kind, job.to, job.source)
+            return False
+        return True
+
+    def _schedule(self, job, ready_at):
+        job.ready_at = ready_at
+        heapq.heappush(self._heap, (ready_at, next(self._seq), job))
+        self._cond.notify()
+
+    def _bucket(self, channel):
+        bucket = self._buckets.get(channel)
+        if bucket is None:
+            bucket = self._buckets[channel] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _next_job(self):
+        """送信できるジョブを取り出す（停止時は None）"""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                ready_at, _, job = self._heap[0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self._heap)
+                wait = self._bucket(job.channel).reserve(now)
+                if wait > 0:
+                    self._stats['throttled'] += 1
+                    self._schedule(job, now + wait)
+                    continue
+                self._in_flight += 1
+                return job
+            return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            started = time.perf_counter()
+            try:
+                result, delay = self._send(job)
+            except Exception as e:
+                logger.exception('LINE送信ジョブの処理エラー: source=%s', job.source)
+                job.last_error = str(e)
+                result, delay = _Result.RETRY, None
+            elapsed = time.perf_counter() - started
+
+            if result == _Result.RETRY and job.attempts >= self.max_attempts:
+                result = _Result.DEAD
+            if result == _Result.DEAD:
+                self._dead_letter(job)
+            with self._cond:
+                self._in_flight -= 1
+                self._stats['send_time_total'] += elapsed
+                if result == _Result.RETRY:
+                    self._stats['retried'] += 1
+                    self._schedule(job, time.monotonic() + (delay if delay is not None else self._backoff(job)))
+                else:
+                    self._stats['sent' if result == _Result.SENT else 'dead_lettered'] += 1
+                    self._complete(job)
+                self._cond.notify_all()
+
+    def _complete(self, job):
+        """ジョブを終えて同じ宛先の次のジョブを送信可能にする"""
+        self._pending -= 1
+        key = job.order_key
+        if key is None:
+            return
+        chain = self._chains.get(key)
+        if chain and chain[0] is job:
+            chain.popleft()
+            if chain:
+                self._schedule(chain[0], time.monotonic())
+            else:
+                del self._chains[key]
+
+    def _backoff(self, job):
+        delay = self.base_delay * (2 ** max(0, job.attempts - 1))
+        return min(self.max_delay, delay) * (0.5 + random.random() / 2)
+
+    def _access_token(self, job):
+        if job.company_id is None:
+            return os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
+        from utils.channel_credentials import get_channel_credentials
+        credentials = get_channel_credentials(job.company_id)
+        return credentials.access_token if credentials is not None else None
+
+    def _send(self, job):
+        """1回送信して (結果, 再送までの秒数) を返す"""
+        job.attempts += 1
+        token = self._access_token(job)
+        if not token:
+            job.last_error = f'no access token for channel {job.channel}'
+            return _Result.DEAD, None
+        try:
+            response = line_api.request(
+                'POST', _ENDPOINTS[job.kind], access_token=token, retries=0,
+                endpoint=f'POST {_ENDPOINTS[job.kind]}',
+                headers={'X-Line-Retry-Key': job.retry_key},
+                json={'to': job.to, 'messages': job.messages},
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            job.last_error = str(e)
+            return _Result.RETRY, None
+
+        status = job.status_code = response.status_code
+        if status == 200:
+            return _Result.SENT, None
+        if status == 409 and response.headers.get('x-line-accepted-request-id'):
+            # 同じ X-Line-Retry-Key の送信が受理済み
+            return _Result.SENT, None
+        job.last_error = response.text[:500]
+        if status == 429:
+            self._stats['rate_limited'] += 1
+            if 'monthly limit' in job.last_error:
+                # 月間の送信上限は待っても回復しない
+                return _Result.DEAD, None
+            delay = _retry_after(response) or self._backoff(job)
+            with self._cond:
+                self._bucket(job.channel).block(time.monotonic() + delay)
+            logger.warning('LINE APIのレート制限: channel=%s retry_after=%.1fs', job.channel, delay)
+            return _Result.RETRY, delay
+        if status >= 500:
+            return _Result.RETRY, None
+        logger.error('LINE送信失敗（再送しない）: status=%s source=%s error=%s', status, job.source, job.last_error)
+        return _Result.DEAD, None
+
+    def _dead_letter(self, job):
+        """デッドレターに保存（保存できなければログに残す）"""
+        dialect = get_dialect()
+        conn = None
+        try:
+            conn = get_db_connection()
+            c = conn.cursor()
+            c.execute(dialect.sql('''
+                INSERT INTO line_push_dead_letters
+                (kind, company_id, recipients, messages, source, retry_key, attempts,
+                 status_code, last_error, enqueued_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            '''), (job.kind, job.company_id, json.dumps(job.to), json.dumps(job.messages, ensure_ascii=False),
+                   job.source, job.retry_key, job.attempts, job.status_code, job.last_error,
+                   dialect.timestamp(_utc(job.enqueued_at))))
+            conn.commit()
+        except Exception:
+            logger.exception('デッドレターの保存に失敗: kind=%s to=%s source=%s messages=%s',
+                             job.kind, job.to, job.source, json.dumps(job.messages, ensure_ascii=False))
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def requeue_dead_letters(self, ids=None, limit=100):
+        """デッドレターを積み直す（ids を省略すると未再送のものを古い順に limit 件）
+
+        積めたものだけを再送済みにする（同じ X-Line-Retry-Key で送るため、
+        再送済みの記録に失敗して再び積み直しても二重には届かない）。
+        """
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            sql = '''
+                SELECT id, kind, company_id, recipients, messages, source, retry_key
+                FROM line_push_dead_letters
+                WHERE requeued_at IS NULL
+            '''
+            params = []
+            if ids:
+                sql += f' AND id IN ({dialect.placeholders(len(ids))})'
+                params.extend(ids)
+            sql += ' ORDER BY id LIMIT %s'
+            params.append(limit)
+            c.execute(dialect.sql(sql), params)
+            rows = c.fetchall()
+
+            requeued = []
+            for dead_letter_id, kind, company_id, recipients, messages, source, retry_key in rows:
+                # 同じ X-Line-Retry-Key で送り直す（実は届いていた場合に二重送信しない）
+                if self.enqueue(OutboundJob(kind, json.loads(recipients), json.loads(messages), company_id,
+                                            source, retry_key=retry_key)):
+                    requeued.append(dead_letter_id)
+            if requeued:
+                c.execute(dialect.sql(f'''
+                    UPDATE line_push_dead_letters SET requeued_at = {dialect.now()}
+                    WHERE id IN ({dialect.placeholders(len(requeued))})
+                '''), requeued)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(requeued)
+
+    def dead_letters(self, limit=50):
+        """未再送のデッドレター（新しい順）"""
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute(get_dialect().sql('''
+                SELECT id, kind, company_id, recipients, source, attempts, status_code, last_error, dead_at
+                FROM line_push_dead_letters
+                WHERE requeued_at IS NULL
+                ORDER BY id DESC
+                LIMIT %s
+            '''), (limit,))
+            rows = c.fetchall()
+        finally:
+            conn.close()
+        return [{
+            'id': row[0],
+            'kind': row[1],
+            'company_id': row[2],
+            'recipients': len(json.loads(row[3])) if row[1] == 'multicast' else 1,
+            'source': row[4],
+            'attempts': row[5],
+            'status_code': row[6],
+            'last_error': row[7],
+            'dead_at': str(row[8]) if row[8] is not None else None,
+        } for row in rows]
+
+    def drain(self, timeout=None):
+        """送信待ちが無くなるまで待つ（待ちきれた場合True）"""
+        if self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+        return True
+
+    def shutdown(self, timeout=10):
+        """送信待ちを送り切ってから停止（残ったものはデッドレターに保存し、以降は積まない）"""
+        self._closed = True
+        if self._pid != os.getpid():
+            return
+        self.drain(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        with self._cond:
+            leftovers = [job for _, _, job in self._heap]
+            leftovers += [job for chain in self._chains.values() for job in list(chain)[1:]]
+            self._heap, self._chains = [], {}
+            self._pending = 0
+        for job in leftovers:
+            job.last_error = job.last_error or 'not sent before shutdown'
+            self._dead_letter(job)
+        self._pid = None
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pending': self._pending,
+                'in_flight': self._in_flight,
+                'scheduled': len(self._heap),
+                'recipients_waiting': len(self._chains),
+                'channels': {
+                    name: {'tokens': round(bucket.tokens, 2),
+                           'blocked_for_s': round(max(0.0, bucket.blocked_until - time.monotonic()), 2)}
+                    for name, bucket in self._buckets.items()
+                },
+            })
+        handled = stats['sent'] + stats['dead_lettered'] + stats['retried']
+        stats['avg_send_ms'] = round(stats.pop('send_time_total') * 1000 / handled, 2) if handled else 0.0
+        stats.update({'workers': self.workers, 'rate': self.rate, 'burst': self.burst,
+                      'max_attempts': self.max_attempts})
+        return stats
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _utc(epoch):
+    from datetime import datetime, timezone
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+line_outbound = OutboundQueue()
+
+
+def enqueue_push(to, messages, company_id=None, source=None):
+    """プッシュ送信をキューに積んで即座に戻る（積めなければFalse、company_id を省略すると既定のチャネル）"""
+    return line_outbound.push(to, messages, company_id, source)
+
+
+def enqueue_multicast(to, messages, company_id=None, source=None):
+    """マルチキャスト送信をキューに積んで即座に戻る（積めなければFalse）"""
+    return line_outbound.multicast(to, messages, company_id, source)
+
+
+def get_outbound_stats():
+    return line_outbound.stats()
+
+
+@atexit.register
+def _shutdown_outbound():
+    try:
+        line_outbound.shutdown(timeout=5)
+    except Exception:
+        pass
@@ -0,0 +1,136 @@
+"""
+Webhookの固定ホットクエリ用プリペアドステートメントキャッシュ
+
+名前付きのクエリを登録しておき、PostgreSQLでは物理接続ごとに一度だけ
+PREPAREして以降は EXECUTE で実行する（解析・実行計画の作成を省略）。
+プール接続は再利用されるため、2回目以降のイベントでは準備済みとなる。
+接続のリセット等でステートメントが失われた場合は通常のSQLで実行し直す。
+SQLiteでは方言変換したSQLをそのまま実行する（sqlite3側で文キャッシュされる）。
+"""
+
+import os
+import re
+import threading
+
+import psycopg2
+from psycopg2 import extensions as pg_extensions
+
+from utils.dialect import get_dialect
+
+# pgbouncerのトランザクションプーリング等、セッションを共有できない環境では無効化する
+PREPARED_STATEMENTS_ENABLED = os.getenv('DB_PREPARED_STATEMENTS', '1') not in ('0', 'false', 'False', 'FALSE')
+
+_PARAM_RE = re.compile(r'%s')
+
+
+class HotQuery:
+    """名前付きホットクエリ"""
+
+    __slots__ = ('name', 'sql', 'param_count', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.param_count = sql.count('%s')
+        counter = iter(range(1, self.param_count + 1))
+        self.prepare_sql = f'PREPARE {name} AS ' + _PARAM_RE.sub(lambda m: f'${next(counter)}', sql)
+        if self.param_count:
+            self.execute_sql = f'EXECUTE {name} ({", ".join(["%s"] * self.param_count)})'
+        else:
+            self.execute_sql = f'EXECUTE {name}'
+
+
+_registry = {}
+_stats_lock = threading.Lock()
+_stats = {'prepares': 0, 'executions': 0, 'fallbacks': 0}
+
+
+def register_hot_query(name, sql):
+    """ホットクエリを登録（%s形式のSQL）"""
+    _registry[name] = HotQuery(name, sql)
+    return name
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _raw_connection(cursor):
+    conn = cursor.connection
+    # プール接続のラッパーから実接続を取り出す
+    return getattr(conn, 'raw', conn)
+
+
+def execute_hot(cursor, name, params=()):
+    """登録済みホットクエリを実行（結果はcursorからfetchする）"""
+    query = _registry[name]
+    dialect = get_dialect()
+    if dialect.name != 'postgresql' or not PREPARED_STATEMENTS_ENABLED:
+        cursor.execute(dialect.sql(query.sql), params)
+        return cursor
+
+    conn = _raw_connection(cursor)
+    prepared = getattr(conn, '_hot_prepared', None)
+    if prepared is None:
+        prepared = set()
+        conn._hot_prepared = prepared
+
+    status_before = conn.get_transaction_status()
+    try:
+        if name not in prepared:
+            cursor.execute(query.prepare_sql)
+            prepared.add(name)
+            _count('prepares')
+        cursor.execute(query.execute_sql, params)
+        _count('executions')
+        return cursor
+    except psycopg2.errors.InvalidSqlStatementName:
+        # DISCARD ALL やセッション差し替えで準備済みステートメントが失われた
+        prepared.discard(name)
+    except psycopg2.errors.DuplicatePreparedStatement:
+        # 別経路で準備済み（管理情報だけが失われていた）
+        prepared.add(name)
+
+    # トランザクション外で始めた場合のみ安全にrollbackして再実行できる
+    if conn.get_transaction_status() == pg_extensions.TRANSACTION_STATUS_INERROR:
+        if status_before != pg_extensions.TRANSACTION_STATUS_IDLE:
+            raise psycopg2.InternalError(f'プリペアドステートメント {name} の再実行ができません')
+        conn.rollback()
+    _count('fallbacks')
+    cursor.execute(query.sql, params)
+    return cursor
+
+
+def get_prepared_statement_stats():
+    """プリペアドステートメントの利用統計"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['enabled'] = PREPARED_STATEMENTS_ENABLED
+    stats['registered'] = sorted(_registry)
+    return stats
+
+
+# Webhookで毎メッセージ実行される固定クエリ
+COMPANY_BY_LINE_USER = register_hot_query(
+    'hot_company_by_line_user',
+    'SELECT id, company_name FROM companies WHERE line_user_id = %s'
+)
+MONTHLY_SUBSCRIPTION_BY_COMPANY = register_hot_query(
+    'hot_monthly_subscription_by_company',
+    'SELECT stripe_subscription_id, subscription_status FROM company_monthly_subscriptions WHERE company_id = %s'
+)
+COMPANY_BY_EMAIL = register_hot_query(
+    'hot_company_by_email',
+    'SELECT id, company_name, email FROM companies WHERE email = %s'
+)
+USER_STATE_GET = register_hot_query(
+    'hot_user_state_get',
+    'SELECT state, state_data, updated_at FROM user_states WHERE line_user_id = %s'
+)
+USER_STATE_UPSERT = register_hot_query(
+    'hot_user_state_upsert',
+    'INSERT INTO user_states (line_user_id, state, state_data, updated_at) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT (line_user_id) DO UPDATE SET state = excluded.state, state_data = excluded.state_data, '
+    'updated_at = excluded.updated_at'
+)
@@ -0,0 +1,190 @@
+"""
+返信トークン（replyToken）の使用済み台帳
+
+replyToken は1回しか使えないため、同じトークンでの2回目の返信は送らずに止める。
+以前は send_line_message の関数属性（集合と時刻の辞書）で管理していたが、
+送信のたびに全トークンの時刻を走査しており、他のワーカーからは見えなかった。
+
+- プロセス内: 時間バケットごとにトークンをまとめた集合（追加・判定は O(1)、
+  期限切れは古いバケットごと捨てるため全体の走査はしない）
+- プロセス間: used_reply_tokens テーブル（トークンの主キーで INSERT ... ON CONFLICT DO NOTHING）
+  期限切れの行はバケット番号の範囲で削除する（バケットが変わるたびに1回）
+  記録・削除はイベント処理のユニットオブワークの外で、専用の自動コミット接続で行う
+  （イベントのトランザクションに入れると、確定するまで他のワーカーから見えず、
+  同じトークンの記録が一意制約で待たされ、ロールバックで記録も消えるため）
+
+REPLY_TOKEN_LEDGER_BACKEND=memory でプロセス内のみ（単一プロセスの開発環境・ベンチマーク用）。
+DBに記録できない場合は返信を優先して使用可とする（LINE側でも再利用は拒否される）。
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+from utils.db import _acquire_connection
+from utils.dialect import get_dialect
+
+logger = logging.getLogger(__name__)
+
+# replyToken の有効期間より長めに保持する（秒）
+REPLY_TOKEN_TTL = float(os.getenv('REPLY_TOKEN_TTL', '60'))
+REPLY_TOKEN_BUCKET_SECONDS = float(os.getenv('REPLY_TOKEN_BUCKET_SECONDS', '5'))
+# 'db'（既定、全ワーカーで共有）または 'memory'
+REPLY_TOKEN_LEDGER_BACKEND = os.getenv('REPLY_TOKEN_LEDGER_BACKEND', 'db')
+
+
+def create_used_reply_tokens_table(c, dialect):
+    """使用済み返信トークンテーブルを作成（マイグレーション用）"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS used_reply_tokens (
+            token VARCHAR(64) PRIMARY KEY,
+            bucket BIGINT NOT NULL
+        )
+    ''')
+
+
+class TimeBucketedSet:
+    """時間バケットで期限切れを捨てる集合
+
+    トークンは追加時刻のバケット（bucket_seconds 単位）に入り、ttl を過ぎたバケットは
+    先頭から丸ごと捨てる。1回の追加・判定で捨てるのは期限切れの分だけなので、
+    保持件数が増えても1件あたりのコストは変わらない。
+    """
+
+    def __init__(self, ttl=REPLY_TOKEN_TTL, bucket_seconds=REPLY_TOKEN_BUCKET_SECONDS, clock=time.time):
+        self.bucket_seconds = bucket_seconds
+        # ttl を覆うのに必要なバケット数（端数は切り上げ）
+        self.span = max(1, -int(-ttl // bucket_seconds))
+        self.clock = clock
+        self._tokens = {}
+        # (バケット番号, そのバケットのトークン) を古い順に並べる
+        self._buckets = deque()
+        self._lock = threading.Lock()
+
+    def bucket(self, now=None):
+        return int((self.clock() if now is None else now) // self.bucket_seconds)
+
+    def _expire(self, current):
+        oldest = current - self.span
+        buckets, tokens = self._buckets, self._tokens
+        while buckets and buckets[0][0] < oldest:
+            _, expired = buckets.popleft()
+            for token in expired:
+                tokens.pop(token, None)
+        return oldest
+
+    def add(self, token, now=None):
+        """未登録なら登録して True（期限内に登録済みなら False）"""
+        current = self.bucket(now)
+        with self._lock:
+            oldest = self._expire(current)
+            bucket = self._tokens.get(token)
+            if bucket is not None and bucket >= oldest:
+                return False
+            self._tokens[token] = current
+            if self._buckets and self._buckets[-1][0] == current:
+                self._buckets[-1][1].append(token)
+            else:
+                self._buckets.append((current, [token]))
+            return True
+
+    def __contains__(self, token):
+        current = self.bucket()
+        with self._lock:
+            oldest = self._expire(current)
+            bucket = self._tokens.get(token)
+            return bucket is not None and bucket >= oldest
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+class ReplyTokenLedger:
+    """返信トークンの使用済み判定（プロセス内の集合とDBの共有テーブル）"""
+
+    def __init__(self, backend=REPLY_TOKEN_LEDGER_BACKEND, ttl=REPLY_TOKEN_TTL,
+                 bucket_seconds=REPLY_TOKEN_BUCKET_SECONDS, clock=time.time):
+        self.backend = backend
+        self._local = TimeBucketedSet(ttl, bucket_seconds, clock=clock)
+        self._cleaned_bucket = None
+        self._lock = threading.Lock()
+        self._stats = {'claimed': 0, 'duplicate_local': 0, 'duplicate_shared': 0, 'errors': 0, 'cleaned': 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def claim(self, reply_token):
+        """未使用のトークンなら使用済みにして True（既に使われていれば False）"""
+        if not self._local.add(reply_token):
+            self._count('duplicate_local')
+            return False
+        if self.backend == 'db' and not self._claim_shared(reply_token):
+            self._count('duplicate_shared')
+            return False
+        self._count('claimed')
+        return True
+
+    def _claim_shared(self, reply_token):
+        """共有テーブルに記録し、初回なら True（記録できない場合も True）"""
+        dialect = get_dialect()
+        current = self._local.bucket()
+        conn = None
+        try:
+            conn = _connect_autocommit(dialect)
+            c = conn.cursor()
+            c.execute(dialect.upsert('used_reply_tokens', ('token', 'bucket'), ('token',)),
+                      (reply_token, current))
+            claimed = c.rowcount != 0
+            self._maybe_cleanup(c, dialect, current)
+            return claimed
+        except Exception as e:
+            self._count('errors')
+            logger.warning('reply token ledger check failed, allowing reply: %s', e)
+            return True
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _maybe_cleanup(self, c, dialect, current):
+        """バケットが変わったら期限切れのバケットの行を削除"""
+        with self._lock:
+            if self._cleaned_bucket == current:
+                return
+            self._cleaned_bucket = current
+        c.execute(dialect.sql('DELETE FROM used_reply_tokens WHERE bucket < %s'),
+                  (current - self._local.span,))
+        deleted = c.rowcount
+        if deleted > 0:
+            self._count('cleaned', deleted)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'backend': self.backend, 'local_size': len(self._local),
+                      'ttl_buckets': self._local.span, 'bucket_seconds': self._local.bucket_seconds})
+        return stats
+
+
+def _connect_autocommit(dialect):
+    """ユニットオブワークを通さない自動コミットの接続（PostgreSQLはプールへの返却時に戻される）"""
+    conn = _acquire_connection()
+    if dialect.name == 'postgresql':
+        conn.autocommit = True
+    else:
+        conn.isolation_level = None
+    return conn
+
+
+reply_token_ledger = ReplyTokenLedger()
+
+
+def claim_reply_token(reply_token):
+    """返信に使ってよいトークンなら True"""
+    return reply_token_ledger.claim(reply_token)
+
+
+def get_reply_token_stats():
+    return reply_token_ledger.stats()
@@ -0,0 +1,187 @@
+"""
+エンドポイント別のステートメントタイムアウト
+
+Blueprintごとにタイムアウトクラス（webhook / admin / batch）を宣言しておくと、
+そのリクエスト中に取得したPostgreSQL接続に statement_timeout を設定する。
+重い集計が接続を占有し続けてWebhookの応答を遅らせることを防ぐ。
+
+設定はセッション単位（SET statement_timeout）で、途中の commit() 後も有効。
+接続に設定済みの値を記録しておき、プールから取得した接続の値が現在のクラスと
+異なる場合だけ SET（クラスがなければ RESET）して確定するため、同じクラスの
+リクエストが続く間は取得時の往復が発生しない。
+
+タイムアウトで取り消されたクエリは StatementTimeoutError として通知され、
+クラス・エンドポイント別に件数を集計する。
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import psycopg2.errors
+
+logger = logging.getLogger(__name__)
+
+# タイムアウトクラスごとの上限（ミリ秒、0は無制限）
+TIMEOUT_CLASSES = {
+    'webhook': int(os.getenv('DB_TIMEOUT_WEBHOOK_MS', '2000')),
+    'admin': int(os.getenv('DB_TIMEOUT_ADMIN_MS', '15000')),
+    'batch': int(os.getenv('DB_TIMEOUT_BATCH_MS', '0')),
+}
+
+# 宣言のないエンドポイントのクラス（未設定ならサーバー既定値のまま）
+DEFAULT_TIMEOUT_CLASS = os.getenv('DB_TIMEOUT_DEFAULT_CLASS') or None
+
+_blueprint_classes = {}
+_current_class = ContextVar('statement_timeout_class', default=None)
+
+_lock = threading.Lock()
+_stats = {}
+
+
+class StatementTimeoutError(psycopg2.errors.QueryCanceled):
+    """statement_timeoutによりクエリが取り消された"""
+
+    def __init__(self, message, timeout_class=None, timeout_ms=None):
+        super().__init__(message)
+        self.timeout_class = timeout_class
+        self.timeout_ms = timeout_ms
+
+
+def declare_statement_timeout(blueprint, timeout_class):
+    """Blueprint配下のリクエストに適用するタイムアウトクラスを宣言"""
+    if timeout_class not in TIMEOUT_CLASSES:
+        raise ValueError(f'未定義のタイムアウトクラスです: {timeout_class}')
+    _blueprint_classes[blueprint.name] = timeout_class
+    return blueprint
+
+
+def current_timeout_class():
+    """実行中のタイムアウトクラス（なければNone）"""
+    return _current_class.get()
+
+
+@contextmanager
+def statement_timeout_class(timeout_class):
+    """ブロック内で取得する接続にタイムアウトクラスを適用（ワーカースレッド・バッチ用）"""
+    if timeout_class is not None and timeout_class not in TIMEOUT_CLASSES:
+        raise ValueError(f'未定義のタイムアウトクラスです: {timeout_class}')
+    token = _current_class.set(timeout_class)
+    try:
+        yield
+    finally:
+        _current_class.reset(token)
+
+
+def _entry(timeout_class):
+    entry = _stats.get(timeout_class)
+    if entry is None:
+        entry = _stats[timeout_class] = {'applied': 0, 'cancelled': 0, 'endpoints': {}}
+    return entry
+
+
+def apply_statement_timeout(conn):
+    """接続の取得時に現在のタイムアウトクラスをセッションに適用（値が変わる場合だけ発行）
+
+    取得直後の接続にはトランザクションが無いため、設定の確定（commit）は他の変更を含まない。
+    確定しておかないと、呼び出し元が rollback() したときに設定も取り消される。
+    """
+    if isinstance(conn, sqlite3.Connection):
+        return conn
+    timeout_class = _current_class.get()
+    timeout_ms = TIMEOUT_CLASSES[timeout_class] if timeout_class is not None else None
+    # プールの貸し出しラッパーではなく実接続に記録する（返却後も値は接続に残る）
+    raw = getattr(conn, 'raw', conn)
+    if getattr(raw, '_statement_timeout_ms', None) != timeout_ms:
+        cursor = conn.cursor()
+        try:
+            if timeout_ms is None:
+                cursor.execute('RESET statement_timeout')
+            else:
+                cursor.execute('SET statement_timeout = %s', (timeout_ms,))
+        finally:
+            cursor.close()
+        conn.commit()
+        raw._statement_timeout_ms = timeout_ms
+    if timeout_class is not None:
+        with _lock:
+            _entry(timeout_class)['applied'] += 1
+    return conn
+
+
+def _current_endpoint():
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or request.path
+    except Exception:
+        pass
+    return None
+
+
+def statement_cancelled(error, statement):
+    """取り消されたクエリを記録し、呼び出し元へ返す例外を作成"""
+    timeout_class = _current_class.get()
+    timeout_ms = TIMEOUT_CLASSES.get(timeout_class)
+    endpoint = _current_endpoint() or '-'
+    with _lock:
+        entry = _entry(timeout_class or 'none')
+        entry['cancelled'] += 1
+        entry['endpoints'][endpoint] = entry['endpoints'].get(endpoint, 0) + 1
+    logger.warning('statement cancelled (class=%s, timeout=%sms, endpoint=%s): %s',
+                   timeout_class, timeout_ms, endpoint, statement)
+    return StatementTimeoutError(
+        f'クエリがタイムアウトしました（{timeout_class or "server"}: {timeout_ms}ms）: {error}',
+        timeout_class, timeout_ms
+    )
+
+
+def get_statement_timeout_stats():
+    """タイムアウトクラスの設定と適用・取り消し件数を取得"""
+    with _lock:
+        stats = {
+            name: {
+                'applied': entry['applied'],
+                'cancelled': entry['cancelled'],
+                'endpoints': dict(entry['endpoints']),
+            }
+            for name, entry in _stats.items()
+        }
+    return {
+        'classes': dict(TIMEOUT_CLASSES),
+        'default_class': DEFAULT_TIMEOUT_CLASS,
+        'blueprints': dict(_blueprint_classes),
+        'stats': stats,
+    }
+
+
+def init_app(app):
+    """Blueprintの宣言に従ってリクエストごとにタイムアウトクラスを設定"""
+    from flask import g, request, jsonify
+
+    @app.before_request
+    def _set_statement_timeout_class():
+        timeout_class = _blueprint_classes.get(request.blueprint, DEFAULT_TIMEOUT_CLASS)
+        g._statement_timeout_token = _current_class.set(timeout_class)
+
+    @app.teardown_request
+    def _reset_statement_timeout_class(exc):
+        token = g.pop('_statement_timeout_token', None)
+        if token is not None:
+            try:
+                _current_class.reset(token)
+            except ValueError:
+                pass
+
+    @app.errorhandler(StatementTimeoutError)
+    def _handle_statement_timeout(error):
+        response = jsonify({
+            'success': False,
+            'error': '処理がタイムアウトしました。時間をおいて再度お試しください。'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
@@ -0,0 +1,175 @@
+"""
+検証・JSON化済みのLINEメッセージテンプレート
+
+メニュー・ヘルプ・案内のような決まった文面は、起動時（モジュールの読み込み時）に
+一度だけ検証（文字数・ボタン数の制限）してJSONのバイト列にしておき、
+send_line_message は送信ボディにそのバイト列を継ぎ足すだけにする。
+返信のたびに辞書を作り直したり、検証・JSON化をやり直したりしない。
+
+差し込み項目のある文面は compile() で {name} の位置で分けたJSONの断片にしておき、
+値だけをエスケープして継ぎ足す。同じ値での描画結果は保持して使い回す。
+
+登録したメッセージ（PreparedMessage）は dict としても読めるが、共有されるため変更しないこと。
+"""
+
+import re
+import copy
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# LINEに送る前に切り詰める上限（send_line_message の従来の制限と同じ）
+TEXT_MAX_LENGTH = 2000
+BUTTONS_MAX_ACTIONS = 4
+BUTTONS_TEXT_MAX_LENGTH = 120
+
+_SLOT_RE = re.compile(r'\{(\w+)\}')
+
+
+def validate_message(msg):
+    """LINEの制限に合わせてメッセージをその場で切り詰め、変更したら True を返す"""
+    changed = False
+    if msg.get('type') == 'text':
+        # テキストメッセージの文字数制限（2000文字）
+        text = msg.get('text', '')
+        if len(text) > TEXT_MAX_LENGTH:
+            logger.warning('テキストが長すぎます（%s文字）。2000文字に制限します。', len(text))
+            msg['text'] = text[:TEXT_MAX_LENGTH - 3] + '...'
+            changed = True
+    elif msg.get('type') == 'template' and 'template' in msg:
+        tmpl = msg['template']
+        if tmpl.get('type') == 'buttons':
+            # actionsが5つ以上のボタンテンプレートがあれば4つまでに制限
+            if 'actions' in tmpl and len(tmpl['actions']) > BUTTONS_MAX_ACTIONS:
+                logger.warning('actionsが5つ以上のため4つまでに自動制限します')
+                tmpl['actions'] = tmpl['actions'][:BUTTONS_MAX_ACTIONS]
+                changed = True
+            # テキストの文字数制限（120文字）
+            if 'text' in tmpl and len(tmpl['text']) > BUTTONS_TEXT_MAX_LENGTH:
+                logger.warning('ボタンテンプレートのテキストが長すぎます（%s文字）。120文字に制限します。', len(tmpl["text"]))
+                tmpl['text'] = tmpl['text'][:BUTTONS_TEXT_MAX_LENGTH - 3] + '...'
+                changed = True
+    return changed
+
+
+def encode_message(msg):
+    """送信ボディに継ぎ足すJSONのバイト列"""
+    return json.dumps(msg, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class PreparedMessage(dict):
+    """検証・JSON化済みのメッセージ（encoded が送信ボディに入るバイト列）"""
+
+    __slots__ = ('name', 'encoded')
+
+    def __init__(self, name, message, encoded=None):
+        super().__init__(message)
+        self.name = name
+        self.encoded = encoded if encoded is not None else encode_message(self)
+
+    @classmethod
+    def build(cls, name, message):
+        """メッセージを複製して検証・JSON化する"""
+        message = copy.deepcopy(message)
+        validate_message(message)
+        return cls(name, message)
+
+
+def _fill(value, values):
+    if isinstance(value, str):
+        return _SLOT_RE.sub(lambda m: values[m.group(1)], value)
+    if isinstance(value, dict):
+        return {key: _fill(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, values) for item in value]
+    return value
+
+
+class CompiledTemplate:
+    """差し込み項目（{name}）の位置で分けたJSONの断片"""
+
+    def __init__(self, name, message, cache_size=32):
+        self.name = name
+        self.message = copy.deepcopy(message)
+        parts = _SLOT_RE.split(encode_message(self.message).decode('utf-8'))
+        self._literals = [part.encode('utf-8') for part in parts[0::2]]
+        self.slots = tuple(parts[1::2])
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.cache_hits = 0
+
+    def render(self, **values):
+        """値を差し込んだ PreparedMessage（同じ値なら前回の結果を返す）
+
+        値は str.format と同じく str() で文字列にしてから差し込む。
+        """
+        values = {slot: str(values[slot]) for slot in set(self.slots)}
+        key = tuple(values[slot] for slot in self.slots)
+        with self._lock:
+            prepared = self._cache.get(key)
+            if prepared is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return prepared
+
+        message = _fill(self.message, values)
+        if validate_message(message):
+            # 切り詰めた場合は断片が使えないため全体をJSON化する
+            encoded = None
+        else:
+            chunks = [self._literals[0]]
+            for value, literal in zip(key, self._literals[1:]):
+                chunks.append(json.dumps(value, ensure_ascii=False)[1:-1].encode('utf-8'))
+                chunks.append(literal)
+            encoded = b''.join(chunks)
+        prepared = PreparedMessage(self.name, message, encoded)
+
+        with self._lock:
+            self.renders += 1
+            self._cache[key] = prepared
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return prepared
+
+
+class TemplateRegistry:
+    """名前付きの固定メッセージと差し込み付きテンプレート"""
+
+    def __init__(self):
+        self._static = {}
+        self._compiled = {}
+
+    def register(self, name, message):
+        """固定メッセージを検証・JSON化して登録"""
+        prepared = self._static[name] = PreparedMessage.build(name, message)
+        return prepared
+
+    def compile(self, name, message):
+        """差し込み項目のあるメッセージを登録"""
+        compiled = self._compiled[name] = CompiledTemplate(name, message)
+        return compiled
+
+    def get(self, name):
+        return self._static[name]
+
+    def compiled(self, name):
+        return self._compiled[name]
+
+    def render(self, name, **values):
+        return self._compiled[name].render(**values)
+
+    def stats(self):
+        return {
+            'static': {name: len(prepared.encoded) for name, prepared in self._static.items()},
+            'compiled': {name: {'slots': list(compiled.slots), 'renders': compiled.renders,
+                                'cache_hits': compiled.cache_hits}
+                         for name, compiled in self._compiled.items()},
+        }
+
+
+template_registry = TemplateRegistry()
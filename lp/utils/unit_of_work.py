@@ -0,0 +1,331 @@
+"""
+リクエスト/イベント単位のユニットオブワーク
+
+unit_of_work() の内側で get_db_connection() を呼ぶと、実接続の代わりに
+共有接続を貸し出すハンドルが返る。接続は最初の利用時に一度だけ取得し、
+ブロック終了時にまとめてcommitする（例外時はrollback）。
+
+各ハンドルは共有トランザクション内のセーブポイントとして振る舞うため、
+既存コードの commit()/rollback()/close() の意味は変わらない:
+  - commit(): 変更を保持（実際のCOMMITはユニットオブワーク終了時）
+  - rollback(): そのハンドルで行った変更だけを取り消す
+  - close(): commitされていない変更を取り消す
+
+外部API（LINE・Stripe）を呼ぶ前には release_for_external_call() で
+それまでの変更を確定して接続をプールへ返す。HTTPの待ち時間に接続と
+statement_timeout を持ち越さず、課金や返信の後に失敗しても
+その前のDB変更が取り消されないようにする。以降のDBアクセスは新しい接続で行う。
+"""
+
+import sqlite3
+from contextlib import contextmanager
+
+from utils.db import _acquire_connection, _current_uow
+
+# セーブポイントを必要としない読み取り系ステートメント
+_READ_PREFIXES = ('SELECT', 'SHOW', 'PRAGMA', 'EXPLAIN', 'PREPARE')
+
+
+def _is_read(sql):
+    if isinstance(sql, bytes):
+        sql = sql[:16].decode('utf-8', 'ignore')
+    return sql.lstrip()[:7].upper().startswith(_READ_PREFIXES)
+
+
+class _UowCursor:
+    """ハンドル経由のカーソル（初回実行時にセーブポイントを張る）"""
+
+    def __init__(self, handle, cursor, args=(), kwargs=None):
+        self._handle = handle
+        self._cursor = cursor
+        self._args = args
+        self._kwargs = kwargs or {}
+        self._generation = handle._uow.generation
+
+    def _current(self):
+        # 外部API呼び出しで接続を返却した後は新しい接続のカーソルを使う
+        uow = self._handle._uow
+        if self._generation != uow.generation:
+            self._cursor = uow.connection.cursor(*self._args, **self._kwargs)
+            self._generation = uow.generation
+        return self._cursor
+
+    def execute(self, sql, params=None):
+        return self._handle._run(self._current(), 'execute', sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._handle._run(self._current(), 'executemany', sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+        return False
+
+
+class BorrowedConnection:
+    """ユニットオブワークの共有接続を貸し出すハンドル"""
+
+    def __init__(self, uow):
+        self._uow = uow
+        self._savepoint = None
+        self._generation = uow.generation
+        self._dirty = False
+        self._closed = False
+
+    def cursor(self, *args, **kwargs):
+        return _UowCursor(self, self._uow.connection.cursor(*args, **kwargs), args, kwargs)
+
+    def execute(self, sql, params=None):
+        """sqlite3.Connection.execute互換"""
+        cursor = self.cursor()
+        cursor.execute(sql, params)
+        return cursor
+
+    def _run(self, cursor, method, sql, params):
+        if self._generation != self._uow.generation:
+            # 確定済みのトランザクションのセーブポイントは使わない
+            self._generation = self._uow.generation
+            self._savepoint = None
+            self._dirty = False
+        if not self._dirty and not _is_read(sql):
+            self._dirty = True
+        if self._savepoint is None:
+            self._savepoint = self._uow._next_savepoint_name()
+            sql = self._uow._with_savepoint(cursor, self._savepoint, sql, inline=(method == 'execute'))
+        try:
+            if params is None and method == 'execute':
+                return cursor.execute(sql)
+            return getattr(cursor, method)(sql, params)
+        except Exception:
+            # 失敗したステートメントで共有トランザクションを中断状態にしない
+            self._rollback_to_savepoint()
+            raise
+
+    def _rollback_to_savepoint(self):
+        if (self._savepoint is not None and self._uow.active
+                and self._generation == self._uow.generation):
+            self._uow.rollback_to(self._savepoint)
+        self._dirty = False
+
+    def commit(self):
+        # 実際のCOMMITはユニットオブワーク終了時にまとめて行う
+        # 以降の変更は新しいセーブポイントから取り消せるようにする
+        self._dirty = False
+        self._savepoint = None
+
+    def rollback(self):
+        if self._dirty:
+            self._rollback_to_savepoint()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._dirty:
+            self._rollback_to_savepoint()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __getattr__(self, name):
+        return getattr(self._uow.connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class UnitOfWork:
+    """1リクエスト/1イベント分の接続とトランザクションを管理"""
+
+    def __init__(self):
+        self._conn = None
+        self._savepoint_seq = 0
+        self._is_postgres = False
+        self.active = True
+        self.failed = False
+        self.borrows = 0
+        # 外部API呼び出し前に確定した回数（セーブポイント・カーソルの有効範囲）
+        self.generation = 0
+        self.releases = 0
+        self._rollback_callbacks = []
+        self._commit_callbacks = []
+
+    @property
+    def connection(self):
+        """共有接続（初回アクセス時に取得）"""
+        if self._conn is None:
+            self._conn = _acquire_connection()
+            self._is_postgres = not isinstance(self._conn, sqlite3.Connection)
+        return self._conn
+
+    def borrow(self):
+        """get_db_connection()から呼ばれ、共有接続のハンドルを返す"""
+        self.borrows += 1
+        return BorrowedConnection(self)
+
+    def _next_savepoint_name(self):
+        self._savepoint_seq += 1
+        return f'uow_sp_{self._savepoint_seq}'
+
+    def _with_savepoint(self, cursor, name, sql, inline=True):
+        """セーブポイント作成をステートメントと同じ往復にまとめる"""
+        if self._is_postgres and inline:
+            # psycopg2は複数ステートメントを1回の往復で送信できる
+            if isinstance(sql, bytes):
+                return f'SAVEPOINT {name}; '.encode() + sql
+            return f'SAVEPOINT {name}; ' + sql
+        cursor.execute(f'SAVEPOINT {name}')
+        return sql
+
+    def rollback_to(self, name):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f'ROLLBACK TO SAVEPOINT {name}')
+        except Exception:
+            # セーブポイントごと失われた場合は終了時に全体をrollbackする
+            self.failed = True
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def savepoint(self):
+        """明示的な入れ子セーブポイント（例外時はその範囲だけ取り消す）
+
+        ブロック内で外部API呼び出しのために確定した場合、それ以前の変更は取り消さない。
+        """
+        name = self._next_savepoint_name()
+        generation = self.generation
+        cursor = self.connection.cursor()
+        cursor.execute(f'SAVEPOINT {name}')
+        cursor.close()
+        try:
+            yield name
+        except Exception:
+            if self.generation == generation:
+                self.rollback_to(name)
+            raise
+        else:
+            if self.generation == generation:
+                cursor = self.connection.cursor()
+                try:
+                    cursor.execute(f'RELEASE SAVEPOINT {name}')
+                finally:
+                    cursor.close()
+
+    def on_rollback(self, callback):
+        """トランザクションが確定しなかった場合に呼ぶ関数を登録（キャッシュの取り消し等）"""
+        self._rollback_callbacks.append(callback)
+
+    def on_commit(self, callback):
+        """トランザクションの確定後に呼ぶ関数を登録（キャッシュの無効化等）"""
+        self._commit_callbacks.append(callback)
+
+    def _run_callbacks(self, committed):
+        callbacks = self._commit_callbacks if committed else self._rollback_callbacks
+        self._commit_callbacks = []
+        self._rollback_callbacks = []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def release(self):
+        """ここまでの変更を確定し、PostgreSQLの接続をプールへ返却（外部API呼び出しの前に使う）
+
+        SQLiteはプールがないため確定のみ行い、接続は持ち続ける。
+        """
+        conn = self._conn
+        if conn is None:
+            return
+        committed = False
+        try:
+            if not self.failed:
+                conn.commit()
+                committed = True
+            else:
+                conn.rollback()
+        finally:
+            self.failed = False
+            self.generation += 1
+            self.releases += 1
+            if self._is_postgres:
+                self._conn = None
+                conn.close()
+            self._run_callbacks(committed)
+
+    def finish(self, success):
+        """共有トランザクションを確定（またはrollback）して接続を返却"""
+        self.active = False
+        conn = self._conn
+        self._conn = None
+        if conn is None:
+            self._run_callbacks(committed=success)
+            return
+        committed = False
+        try:
+            if success and not self.failed:
+                conn.commit()
+                committed = True
+            else:
+                conn.rollback()
+        finally:
+            conn.close()
+            self._run_callbacks(committed)
+
+
+def current_unit_of_work():
+    """実行中のユニットオブワークを取得（なければNone）"""
+    return _current_uow.get()
+
+
+def release_for_external_call():
+    """外部API（LINE・Stripe）を呼ぶ前に、実行中のユニットオブワークの変更を確定する"""
+    uow = _current_uow.get()
+    if uow is not None and uow.active:
+        uow.release()
+
+
+@contextmanager
+def unit_of_work():
+    """ブロック内のDBアクセスを1接続・1トランザクションにまとめる
+
+    既にユニットオブワーク内にいる場合は入れ子のセーブポイントになる。
+    """
+    outer = _current_uow.get()
+    if outer is not None:
+        with outer.savepoint():
+            yield outer
+        return
+
+    uow = UnitOfWork()
+    token = _current_uow.set(uow)
+    success = False
+    try:
+        yield uow
+        success = True
+    finally:
+        _current_uow.reset(token)
+        uow.finish(success)
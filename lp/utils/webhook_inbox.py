@@ -0,0 +1,447 @@
+"""
+Webhookの受信箱（ライトアヘッドログ）
+
+受信したイベントを処理前に webhook_inbox テーブルへ追記し、処理状況
+（pending → processing → done / failed / dead）、試行回数、最後のエラーを記録する。
+重複排除（utils.idempotency）を登録した送信元は、処理開始時に他のプロセスが
+受け付け済みのイベントを duplicate として処理せずに終える。
+処理キューが満杯で受け付けられなかったイベントは rejected とし、送信元の再送を待つ。
+ワーカーが再起動しても、一定時間更新のない pending / processing のイベントは
+定期スイープで取り戻して再処理する。スイープはアプリの起動時に開始し
+（start_sweeper()、gunicorn の --preload でフォークした子プロセスでは作り直す）、
+新しいリクエストが届くのを待たずに前回の停止で残ったイベントを回収する。ハンドラーには課金・返信など取り消せない
+副作用があるため、failed になったイベントは自動では再処理せず、リプレイで手動で再実行する。
+
+処理の開始は条件付きUPDATEで行い、複数プロセスが同じイベントを
+同時に処理しないようにする。時間範囲を指定した再実行（リプレイ）も提供する。
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+from utils.db import get_db_connection
+from utils.dialect import get_dialect
+from utils.event_queue import EventQueueFull
+
+logger = logging.getLogger(__name__)
+
+# 最大試行回数（停止したワーカーからの取り戻しを含む。超えたものは dead として再処理しない）
+INBOX_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_INBOX_MAX_ATTEMPTS', '3'))
+# この秒数更新のない pending / processing は停止したワーカーのものとみなす
+INBOX_STALE_SECONDS = int(os.getenv('WEBHOOK_INBOX_STALE_SECONDS', '120'))
+INBOX_SWEEP_INTERVAL = float(os.getenv('WEBHOOK_INBOX_SWEEP_INTERVAL', '60'))
+INBOX_RETENTION_DAYS = int(os.getenv('WEBHOOK_INBOX_RETENTION_DAYS', '14'))
+# 1回のスイープで取り戻す件数の上限
+INBOX_SWEEP_BATCH = 500
+
+STATUSES = ('pending', 'processing', 'done', 'failed', 'dead', 'duplicate', 'rejected')
+
+
+def create_webhook_inbox_table(c, dialect):
+    """受信箱テーブルを作成（マイグレーション用）"""
+    if dialect.name == 'postgresql':
+        id_column = 'id BIGSERIAL PRIMARY KEY'
+    else:
+        id_column = 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS webhook_inbox (
+            {id_column},
+            source VARCHAR(32) NOT NULL,
+            company_id INTEGER,
+            event_id VARCHAR(64),
+            event_type VARCHAR(32),
+            payload TEXT NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            processed_at TIMESTAMP
+        )
+    ''')
+
+
+class InboxEntry:
+    """受信箱の1イベント
+
+    recovered は停止したワーカーから取り戻したもの（attempts は取り戻す前の試行回数）、
+    replayed はリプレイで追記し直したもの。リプレイと、以前に処理を開始していた
+    （attempts > 0）取り戻しは重複排除の対象外。
+    """
+
+    __slots__ = ('id', 'source', 'company_id', 'event', 'recovered', 'replayed', 'attempts')
+
+    def __init__(self, entry_id, source, company_id, event, recovered=False, replayed=False, attempts=0):
+        self.id = entry_id
+        self.source = source
+        self.company_id = company_id
+        self.event = event
+        self.recovered = recovered
+        self.replayed = replayed
+        self.attempts = attempts
+
+    @property
+    def skips_dedup(self):
+        """重複排除を行わないか（処理開始時に重複排除を済ませているものと、リプレイ）
+
+        pending のまま残っていた行（attempts=0）は一度も処理を開始しておらず、
+        その間に送信元の再送を他のプロセスが処理している可能性があるため通常どおり判定する。
+        """
+        return self.replayed or (self.recovered and self.attempts > 0)
+
+
+class WebhookInbox:
+    """受信箱への追記・状態更新・スイープ・リプレイ"""
+
+    def __init__(self, max_attempts=INBOX_MAX_ATTEMPTS, stale_seconds=INBOX_STALE_SECONDS,
+                 sweep_interval=INBOX_SWEEP_INTERVAL):
+        self.max_attempts = max_attempts
+        self.stale_seconds = stale_seconds
+        self.sweep_interval = sweep_interval
+        self._handlers = {}
+        self._submitters = {}
+        self._deduplicators = {}
+        self._sweeper_pid = None
+        self._lock = threading.Lock()
+        self._stats = {'appended': 0, 'done': 0, 'failed': 0, 'dead': 0, 'recovered': 0,
+                       'replayed': 0, 'append_errors': 0, 'skipped': 0, 'duplicate': 0,
+                       'rejected': 0, 'bypassed': 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def register(self, source, handler, submit=None, deduplicator=None):
+        """送信元ごとの処理関数 handler(event, company_id) と、投入関数 submit(entry) を登録
+
+        submit 未指定の場合は呼び出したスレッドで処理する。
+        deduplicator（EventDeduplicator）を指定すると処理開始時に claim() で重複を判定する。
+        """
+        self._handlers[source] = handler
+        if submit is not None:
+            self._submitters[source] = submit
+        if deduplicator is not None:
+            self._deduplicators[source] = deduplicator
+
+    # --- 追記 ---
+
+    def append(self, source, events, company_id=None, replayed=False):
+        """イベントを追記して InboxEntry のリストを返す（追記できない場合はid=Noneのエントリ）"""
+        if not events:
+            return []
+        rows = [
+            (source, company_id, event.get('webhookEventId'), event.get('type'),
+             json.dumps(event, ensure_ascii=False))
+            for event in events
+        ]
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            columns = 'source, company_id, event_id, event_type, payload'
+            if dialect.name == 'postgresql':
+                ids = [row[0] for row in execute_values(
+                    c, f'INSERT INTO webhook_inbox ({columns}) VALUES %s RETURNING id', rows, fetch=True
+                )]
+            else:
+                ids = []
+                for row in rows:
+                    c.execute(f'INSERT INTO webhook_inbox ({columns}) VALUES ({dialect.placeholders(5)})', row)
+                    ids.append(c.lastrowid)
+            conn.commit()
+            self._count('appended', len(ids))
+        except Exception as e:
+            conn.rollback()
+            # 受信箱に書けなくてもイベント自体は処理する（回収・リプレイの対象外になる）
+            self._count('append_errors')
+            self._count('bypassed', len(events))
+            logger.exception('webhook inbox append failed, processing %d %s events without the inbox (ids=%s): %s',
+                             len(events), source, [event.get('webhookEventId') for event in events], e)
+            ids = [None] * len(events)
+        finally:
+            conn.close()
+        return [InboxEntry(entry_id, source, company_id, event, replayed=replayed)
+                for entry_id, event in zip(ids, events)]
+
+    # --- 処理 ---
+
+    def _stale_condition(self, dialect):
+        return f'COALESCE(processed_at, started_at, received_at) < {dialect.ago(self.stale_seconds, "seconds")}'
+
+    def _claim(self, entry):
+        """処理開始を記録（他のワーカーが処理中・処理済みならFalse）"""
+        dialect = get_dialect()
+        params = [entry.id, self.max_attempts]
+        if entry.recovered:
+            # 一定時間更新のないものだけを取り戻す（処理中の他ワーカーと競合しない）。
+            # 読み込んだ時点の試行回数と一致する場合だけにし、重複排除の要否を確定させる
+            condition = f"status IN ('pending', 'processing') AND attempts = %s AND {self._stale_condition(dialect)}"
+            params.append(entry.attempts)
+        else:
+            condition = "status = 'pending'"
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute(dialect.sql(f'''
+                UPDATE webhook_inbox
+                SET status = 'processing', attempts = attempts + 1, started_at = {dialect.now()}
+                WHERE id = %s AND attempts < %s AND {condition}
+            '''), params)
+            claimed = c.rowcount == 1
+            conn.commit()
+            return claimed
+        finally:
+            conn.close()
+
+    def _finish(self, entry_id, error=None, status='done'):
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            if error is None:
+                c.execute(dialect.sql(f'''
+                    UPDATE webhook_inbox
+                    SET status = %s, last_error = NULL, processed_at = {dialect.now()}
+                    WHERE id = %s
+                '''), (status, entry_id))
+            else:
+                # 試行回数が上限に達したものは dead として以降のスイープ対象から外す
+                c.execute(dialect.sql(f'''
+                    UPDATE webhook_inbox
+                    SET status = CASE WHEN attempts >= %s THEN 'dead' ELSE 'failed' END,
+                        last_error = %s, processed_at = {dialect.now()}
+                    WHERE id = %s
+                '''), (self.max_attempts, error[:2000], entry_id))
+                c.execute(dialect.sql('SELECT status FROM webhook_inbox WHERE id = %s'), (entry_id,))
+                row = c.fetchone()
+                status = row[0] if row else 'failed'
+            conn.commit()
+            return status
+        finally:
+            conn.close()
+
+    def process(self, entry):
+        """エントリを処理して状態を記録（ワーカーから呼ばれる）"""
+        handler = self._handlers[entry.source]
+        if entry.id is not None:
+            try:
+                if not self._claim(entry):
+                    self._count('skipped')
+                    return
+            except Exception as e:
+                # 受信箱が使えない場合も処理は続ける（状態は記録されない）
+                self._count('bypassed')
+                logger.error('webhook inbox claim failed for %s, processing without the inbox: %s', entry.id, e)
+                entry = InboxEntry(None, entry.source, entry.company_id, entry.event,
+                                   entry.recovered, entry.replayed, entry.attempts)
+
+        deduplicator = self._deduplicators.get(entry.source)
+        if deduplicator is not None and not entry.skips_dedup and not deduplicator.claim(entry.event):
+            # 他のプロセスが受け付け済みの再送
+            self._count('duplicate')
+            if entry.id is not None:
+                try:
+                    self._finish(entry.id, status='duplicate')
+                except Exception as e:
+                    logger.warning('webhook inbox status update failed for %s: %s', entry.id, e)
+            return
+
+        error = None
+        try:
+            handler(entry.event, entry.company_id)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            logger.exception('webhook inbox event %s failed', entry.id)
+
+        if entry.id is None:
+            return
+        try:
+            status = self._finish(entry.id, error)
+            self._count(status)
+        except Exception as e:
+            logger.warning('webhook inbox status update failed for %s: %s', entry.id, e)
+
+    def reject(self, entries, reason):
+        """受け付けられなかったエントリを rejected にする（スイープで取り戻さず、送信元の再送を待つ）"""
+        ids = [entry.id for entry in entries if entry.id is not None]
+        self._count('rejected', len(entries))
+        if not ids:
+            return
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute(dialect.sql(f'''
+                UPDATE webhook_inbox
+                SET status = 'rejected', last_error = %s, processed_at = {dialect.now()}
+                WHERE status = 'pending' AND id IN ({", ".join(["%s"] * len(ids))})
+            '''), (reason[:2000], *ids))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.warning('webhook inbox reject failed for %s: %s', ids, e)
+        finally:
+            conn.close()
+
+    def dispatch(self, entry):
+        """登録された投入関数（ワーカープール）へ渡す。未登録ならこのスレッドで処理
+
+        投入先が満杯の場合は EventQueueFull を送出する（エントリは pending のまま）。
+        """
+        submit = self._submitters.get(entry.source)
+        if submit is not None:
+            submit(entry)
+        else:
+            self.process(entry)
+
+    # --- 再起動後の回収 ---
+
+    def _load(self, where, params, limit=None, recovered=False):
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            sql = f'SELECT id, source, company_id, payload, attempts FROM webhook_inbox WHERE {where} ORDER BY id'
+            if limit:
+                sql += f' LIMIT {int(limit)}'
+            c.execute(dialect.sql(sql), params)
+            rows = c.fetchall()
+        finally:
+            conn.close()
+        return [InboxEntry(row[0], row[1], row[2], json.loads(row[3]), recovered, attempts=row[4]) for row in rows]
+
+    def recover(self):
+        """停止したワーカーが残したイベントを取り戻して再投入し、件数を返す
+
+        対象は一定時間更新のない pending / processing だけ。failed はハンドラーが
+        例外で終わったもので、副作用が途中まで実行されている可能性があるため取り戻さない。
+        """
+        dialect = get_dialect()
+        entries = self._load(
+            f"status IN ('pending', 'processing') AND attempts < %s AND {self._stale_condition(dialect)}",
+            (self.max_attempts,), limit=INBOX_SWEEP_BATCH, recovered=True
+        )
+        recovered = 0
+        for entry in entries:
+            if entry.source not in self._handlers:
+                continue
+            # 取り戻しの確定は処理開始時の条件付きUPDATEで行う（同じ行を二重に処理しない）
+            try:
+                self.dispatch(entry)
+            except EventQueueFull:
+                # 残りは次のスイープで取り戻す
+                logger.warning('webhook inbox recovery paused: event queue is full')
+                break
+            recovered += 1
+        if recovered:
+            self._count('recovered', recovered)
+            logger.info('recovered %d webhook inbox events', recovered)
+        return recovered
+
+    def cleanup(self, days=INBOX_RETENTION_DAYS):
+        """保持期間を過ぎた処理済みイベントを削除"""
+        dialect = get_dialect()
+        conn = get_db_connection()
+        try:
+            c = conn.cursor()
+            c.execute(f"DELETE FROM webhook_inbox WHERE status IN ('done', 'duplicate', 'rejected') "
+                      f"AND received_at < {dialect.ago(days, 'days')}")
+            deleted = c.rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.recover()
+                self.cleanup()
+            except Exception as e:
+                logger.warning('webhook inbox sweep failed: %s', e)
+            time.sleep(self.sweep_interval)
+
+    def start_sweeper(self):
+        """プロセスごとに1回、回収スイープのスレッドを起動（アプリの初期化時に呼ぶ）"""
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_loop, name='webhook-inbox-sweeper', daemon=True).start()
+
+    def _restart_after_fork(self):
+        """フォーク前に起動していたスイープを子プロセスで起動し直す（親のスレッドは引き継がれない）"""
+        self._lock = threading.Lock()
+        if self._sweeper_pid is not None:
+            self.start_sweeper()
+
+    # --- リプレイ ---
+
+    def find(self, since, until, source=None, statuses=None):
+        """受信日時の範囲でイベントを取得"""
+        dialect = get_dialect()
+        where = 'received_at >= %s AND received_at < %s'
+        params = [dialect.timestamp(since), dialect.timestamp(until)]
+        if source:
+            where += ' AND source = %s'
+            params.append(source)
+        if statuses:
+            where += f' AND status IN ({", ".join(["%s"] * len(statuses))})'
+            params.extend(statuses)
+        return self._load(where, tuple(params))
+
+    def replay(self, since, until, source=None, statuses=None, dry_run=False):
+        """時間範囲のイベントを現在のコードで再実行し、件数を返す
+
+        リプレイは受信箱の行を新しいイベントとして追記し直して処理する
+        （元の行の履歴は残す）。処理キューが満杯の場合は EventQueueFull を送出し、
+        追記済みの行は pending のままスイープで処理される。
+        """
+        entries = self.find(since, until, source, statuses)
+        if dry_run:
+            return len(entries)
+        replayed = 0
+        for entry in entries:
+            if entry.source not in self._handlers:
+                continue
+            for new_entry in self.append(entry.source, [entry.event], entry.company_id, replayed=True):
+                self.dispatch(new_entry)
+                replayed += 1
+        self._count('replayed', replayed)
+        return replayed
+
+    def stats(self):
+        """状態別件数と処理統計"""
+        with self._lock:
+            stats = dict(self._stats)
+        counts = {}
+        try:
+            conn = get_db_connection()
+            try:
+                c = conn.cursor()
+                c.execute('SELECT status, COUNT(*) FROM webhook_inbox GROUP BY status')
+                counts = {row[0]: row[1] for row in c.fetchall()}
+            finally:
+                conn.close()
+        except Exception as e:
+            counts = {'error': str(e)}
+        return {'counters': stats, 'statuses': counts, 'sources': sorted(self._handlers)}
+
+
+def parse_time(value):
+    """リプレイ範囲指定用の日時文字列（ISO形式）を変換"""
+    return datetime.fromisoformat(value)
+
+
+webhook_inbox = WebhookInbox()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=webhook_inbox._restart_after_fork)